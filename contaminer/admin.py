@@ -26,6 +26,12 @@ from .models.contabase import Pack
 from .models.contabase import Model
 from .models.contabase import Reference
 from .models.contabase import Suggestion
+from .models.cache import CachedJob
+from .models.mail import OutboxMail
+from .models.runtime import RuntimeStatistics
+from .models.cluster import ClusterState
+from .models.admission import QueuedSubmission
+from .models.upload import UploadSession
 from .models.contaminer import Job
 from .models.contaminer import Task
 
@@ -36,8 +42,24 @@ admin.site.register(Model)
 
 class JobAdmin(admin.ModelAdmin):
     readonly_fields = ("submission_date",)
+    list_filter = ("cluster",)
 
 admin.site.register(Job, JobAdmin)
 admin.site.register(Task)
 admin.site.register(Reference)
 admin.site.register(Suggestion)
+admin.site.register(CachedJob)
+admin.site.register(OutboxMail)
+admin.site.register(RuntimeStatistics)
+admin.site.register(ClusterState)
+
+class QueuedSubmissionAdmin(admin.ModelAdmin):
+    list_display = ("job", "owner", "interactive", "finish_tag", "created")
+    list_filter = ("interactive",)
+
+admin.site.register(QueuedSubmission, QueuedSubmissionAdmin)
+
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ("token", "filename", "received", "size", "updated")
+
+admin.site.register(UploadSession, UploadSessionAdmin)
@@ -0,0 +1,204 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Helper process running on the cluster, answering the requests of the website.
+
+This script is uploaded in the ContaMiner work directory and started once,
+in a login shell, through one SSH channel (see ssh_tools.RemoteAgent). It
+then reads the requests on stdin and writes the responses on stdout, so the
+website does not open a new channel and load a new login shell for each
+command.
+
+Each request and response is a frame: the length of the message on 4 bytes
+(big endian), followed by the message, a JSON object. A request gives the
+operation in "op":
+- ping: answer {"pong": true}
+- run: run "command" in bash, in the directory "cwd" (optional), and answer
+  {"stdout": ..., "stderr": ..., "status": exit status}
+- read: answer {"content": ...} with the content of the file "path"
+- stat: answer {"stats": {path: [size, mtime] or null}} for the files
+  listed in "paths"
+- solve: run "contaminer solve" on the files "input" and "contaminants", in
+  the directory "cwd", and answer as run
+- status: run "contaminer job_status" on the job directory "job", and
+  answer as run
+- cancel: run "contaminer cancel" on the tasks listed in "tasks" of the job
+  directory "job", and answer as run
+The ContaMiner operations give the path of the contaminer script in
+"contaminer", and run it without a shell, so the names are not quoted.
+- quit: stop the agent
+An unexpected error gives {"error": message}.
+
+Only the standard library is used, so the script runs with the Python of the
+cluster (2.6 or later, or 3).
+"""
+
+import json
+import os
+import struct
+import subprocess
+import sys
+
+# Format of the length of a frame
+HEADER = struct.Struct('>I')
+
+
+class ProtocolError(Exception):
+    """The stream is closed or does not contain a valid frame."""
+    pass
+
+
+def read_exactly(stream, size):
+    """Read size bytes from stream, or raise ProtocolError."""
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ProtocolError("Stream closed")
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """Read a frame from stream, and return the decoded message."""
+    (length,) = HEADER.unpack(read_exactly(stream, HEADER.size))
+    try:
+        return json.loads(read_exactly(stream, length).decode('utf-8'))
+    except ValueError as excep:
+        raise ProtocolError("Invalid message: " + str(excep))
+
+
+def write_frame(stream, message):
+    """Encode message and write it as a frame on stream."""
+    data = json.dumps(message).encode('utf-8')
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def decode(data):
+    """Return data as text, whatever the encoding of the file."""
+    if isinstance(data, bytes):
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+def execute(args, cwd=None, shell=False):
+    """
+    Run the command given by args, and return its outputs and exit status.
+
+    The stdin of the agent carries the requests, so the command gets its own
+    stdin, closed at once by communicate.
+    """
+    process = subprocess.Popen(
+        args,
+        shell=shell,
+        executable='/bin/bash' if shell else None,
+        cwd=cwd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return {
+        'stdout': decode(stdout),
+        'stderr': decode(stderr),
+        'status': process.returncode,
+        }
+
+
+def run(request):
+    """Run the command of the request, as exec_command_in_shell."""
+    return execute(request['command'], request.get('cwd'), shell=True)
+
+
+def solve(request):
+    """Submit the job of the request to ContaMiner."""
+    return execute(
+        [request['contaminer'], 'solve',
+         request['input'], request['contaminants']],
+        request.get('cwd'))
+
+
+def status(request):
+    """Return the status of the job of the request."""
+    return execute([request['contaminer'], 'job_status', request['job']])
+
+
+def cancel(request):
+    """Cancel the tasks of the request."""
+    return execute(
+        [request['contaminer'], 'cancel', request['job']]
+        + list(request['tasks']))
+
+
+def read(request):
+    """Return the content of the file of the request."""
+    with open(request['path'], 'rb') as remote_file:
+        return {'content': decode(remote_file.read())}
+
+
+def stat(request):
+    """Return the size and modification time of the files of the request."""
+    stats = {}
+    for path in request['paths']:
+        try:
+            attributes = os.stat(path)
+            stats[path] = [attributes.st_size, attributes.st_mtime]
+        except OSError:
+            stats[path] = None
+    return {'stats': stats}
+
+
+OPERATIONS = {
+    'ping': lambda request: {'pong': True},
+    'run': run,
+    'read': read,
+    'stat': stat,
+    'solve': solve,
+    'status': status,
+    'cancel': cancel,
+    }
+
+
+def answer(request):
+    """Return the response to request."""
+    operation = OPERATIONS.get(request.get('op'))
+    if operation is None:
+        return {'error': "Unknown operation: " + str(request.get('op'))}
+    try:
+        return operation(request)
+    except Exception as excep: # pylint: disable=broad-except
+        return {'error': str(excep)}
+
+
+def main():
+    """Answer the requests read on stdin until quit or end of stream."""
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    while True:
+        try:
+            request = read_frame(stdin)
+        except ProtocolError:
+            break
+        if request.get('op') == 'quit':
+            break
+        write_frame(stdout, answer(request))
+
+
+if __name__ == '__main__':
+    main()
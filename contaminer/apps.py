@@ -29,6 +29,9 @@ import logging
 
 from django.apps import AppConfig
 
+from . import metrics
+from .clusters import read_clusters
+
 
 class ContaminerConfig(AppConfig):
     """Configuration of contaminer application."""
@@ -54,6 +57,36 @@ class ContaminerConfig(AppConfig):
         self.ssh_contaminer_location = None
         self.ssh_work_directory = None
         self.tmp_dir = None
+        self.keep_time = None
+        self.cache_quota = None
+        self.sendfile = None
+        self.sendfile_url = None
+        self.metrics_enabled = None
+        self.metrics_directory = None
+        self.early_stop = None
+        self.slots = None
+        self.agent_enabled = None
+        self.agent_python = None
+        self.backend = None
+        self.local_workers = None
+        self.max_jobs = None
+        self.max_tasks = None
+        self.connect_timeout = None
+        self.command_timeout = None
+        self.transfer_timeout = None
+        self.pool_connections = None
+        self.update_workers = None
+        self.status_interval = None
+        self.upload_max_size = None
+        self.upload_max_sessions = None
+        self.upload_expiry = None
+        self.clusters = None
+        self.queue_weights = None
+        self.queue_default_weight = None
+        self.queue_interactive_priority = None
+        self.mail_retry_delay = None
+        self.mail_max_attempts = None
+        self.mail_digest_interval = None
 
     def ready(self):
         """Populate the configuration from config.ini."""
@@ -86,7 +119,86 @@ class ContaminerConfig(AppConfig):
             "CLUSTER",
             "contaminer_location")
         self.ssh_work_directory = config.get("CLUSTER", "work_directory")
+        self.early_stop = self.get_option(
+            config, "CLUSTER", "early_stop", "false").lower() == "true"
+        self.slots = int(self.get_option(config, "CLUSTER", "slots", 100))
+        self.agent_enabled = self.get_option(
+            config, "CLUSTER", "agent", "false").lower() == "true"
+        self.agent_python = self.get_option(
+            config, "CLUSTER", "agent_python", "python")
+        self.backend = self.get_option(config, "CLUSTER", "backend", "ssh")
+        self.local_workers = int(self.get_option(
+            config, "CLUSTER", "local_workers", 2))
+        self.max_jobs = int(self.get_option(config, "CLUSTER", "max_jobs", 0))
+        self.max_tasks = int(self.get_option(
+            config, "CLUSTER", "max_tasks", 0))
+        self.connect_timeout = float(self.get_option(
+            config, "CLUSTER", "connect_timeout", 30))
+        self.command_timeout = float(self.get_option(
+            config, "CLUSTER", "command_timeout", 600))
+        self.transfer_timeout = float(self.get_option(
+            config, "CLUSTER", "transfer_timeout", 300))
+        self.pool_connections = int(self.get_option(
+            config, "CLUSTER", "pool_connections", 0))
+        self.clusters = read_clusters(config, self)
+        self.queue_weights = self.get_weights(
+            self.get_option(config, "QUEUE", "weights", ""))
+        self.queue_default_weight = float(self.get_option(
+            config, "QUEUE", "default_weight", 1))
+        self.queue_interactive_priority = self.get_option(
+            config, "QUEUE", "interactive_priority", "true").lower() == "true"
         self.tmp_dir = config.get("LOCAL", "tmp_dir")
         self.keep_time = int(config.get("LOCAL", "keep_time"))
+        self.cache_quota = int(self.get_option(
+            config, "LOCAL", "cache_quota", 0))
+        self.sendfile = self.get_option(config, "LOCAL", "sendfile", "none")
+        self.update_workers = int(self.get_option(
+            config, "LOCAL", "update_workers", 1))
+        self.sendfile_url = self.get_option(
+            config, "LOCAL", "sendfile_url", "/protected/")
+        self.status_interval = int(self.get_option(
+            config, "LOCAL", "status_interval", 1800))
+        self.upload_max_size = int(self.get_option(
+            config, "LOCAL", "upload_max_size", 1073741824))
+        self.upload_max_sessions = int(self.get_option(
+            config, "LOCAL", "upload_max_sessions", 100))
+        self.upload_expiry = int(self.get_option(
+            config, "LOCAL", "upload_expiry", 1))
+        self.metrics_enabled = self.get_option(
+            config, "METRICS", "enabled", "false").lower() == "true"
+        self.metrics_directory = self.get_option(
+            config, "METRICS", "textfile_directory", "")
+        metrics.enable(self.metrics_enabled)
+        self.mail_retry_delay = int(self.get_option(
+            config, "MAIL", "retry_delay", 60))
+        self.mail_max_attempts = int(self.get_option(
+            config, "MAIL", "max_attempts", 8))
+        self.mail_digest_interval = int(self.get_option(
+            config, "MAIL", "digest_interval", 3600))
 
         log.debug("Exit")
+
+    @staticmethod
+    def get_option(config, section, option, default):
+        """Return the option from config.ini, or default if not given."""
+        if not config.has_option(section, option):
+            return default
+        return config.get(section, option)
+
+    @staticmethod
+    def get_weights(value):
+        """
+        Return the weights given as "owner:weight, owner:weight".
+
+        :raises ValueError: if a weight is not a positive number.
+        """
+        weights = {}
+        for item in value.split(","):
+            if not item.strip():
+                continue
+            owner, weight = item.rsplit(":", 1)
+            owner = owner.strip().lower()
+            weights[owner] = float(weight)
+            if weights[owner] <= 0:
+                raise ValueError("Weight of " + owner + " must be positive.")
+        return weights
@@ -0,0 +1,491 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Execution backends running the ContaMiner commands.
+
+The models do not talk to the cluster directly, but to the backend given by
+get_backend for the cluster of the job, selected by the backend option of
+config.ini:
+- ssh (default): ContaMiner is on a cluster, reached through SSH and SFTP
+  (see ssh_tools). With pool_connections, the operations share a few
+  connections kept open (see ConnectionPool).
+- local: ContaMiner is installed on the webserver. The commands are run in
+  a bounded pool of processes, and the files are copied on the local disk.
+  contaminer_location and work_directory are then local paths.
+
+A backend provides the operations used by Job, Task and ContaBase: sending
+and writing the input files, running a command and waiting for its output,
+launching long commands, submitting, checking and cancelling the jobs,
+reading, checking and getting the result files, and reading the ContaBase.
+When the agent is enabled, SSHBackend gives the ContaMiner commands to its
+solve, status and cancel operations (see agent.py).
+"""
+
+import os
+import logging
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.conf import settings
+
+from .clusters import get_cluster
+from .ssh_tools import AgentUnavailable
+from .ssh_tools import SFTPChannel
+from .ssh_tools import SSHChannel
+from .ssh_tools import CHUNK_SIZE
+from .ssh_tools import get_agent
+from .ssh_tools import get_connection_pool
+from .ssh_tools import get_pdb_headers_command
+from .ssh_tools import parse_pdb_headers
+from .ssh_tools import shorten
+
+# Written by the batch of SSHBackend.launch_batch for each failed command
+LAUNCH_FAILED = "Launch failed: "
+
+
+def get_contaminer_path(cluster=None):
+    """Return the path of the contaminer script of cluster."""
+    return os.path.join(
+        get_cluster(cluster).ssh_contaminer_location,
+        "contaminer")
+
+
+def get_solve_command(cluster, input_filename, contaminants_filename):
+    """Return the command submitting a job, run in the work directory."""
+    return get_contaminer_path(cluster) + " solve "\
+        + '"' + input_filename + '" "' + contaminants_filename + '"'
+
+
+def get_job_status_command(cluster, job_directory):
+    """Return the command giving the status of a job."""
+    return get_contaminer_path(cluster) + " job_status " + job_directory
+
+
+def get_cancel_command(cluster, job_directory, task_names):
+    """Return the command cancelling the given tasks of a job."""
+    return get_contaminer_path(cluster) + " cancel " + job_directory \
+        + " " + " ".join(['"' + name + '"' for name in task_names])
+
+
+class SSHBackend(object):
+    """Run ContaMiner on the cluster, through SSH and SFTP."""
+
+    def __init__(self, cluster=None):
+        """Create a backend for cluster (the default one if None)."""
+        self.cluster = cluster
+
+    def get_pool(self):
+        """Return the connection pool of the cluster, or None if disabled."""
+        if get_cluster(self.cluster).pool_connections > 0:
+            return get_connection_pool(self.cluster)
+        return None
+
+    def send_file(self, filename, directory):
+        """Send filename in directory on the cluster."""
+        pool = self.get_pool()
+        if pool is not None:
+            pool.send_files([filename], directory)
+        else:
+            SFTPChannel(self.cluster).send_file(filename, directory)
+
+    def send_files(self, filenames, directory, contents=None):
+        """Send several files and contents in one SFTP session."""
+        pool = self.get_pool()
+        if pool is not None:
+            pool.send_files(filenames, directory, contents)
+        else:
+            SFTPChannel(self.cluster).send_files(
+                filenames,
+                directory,
+                contents)
+
+    def write_file(self, filename, content):
+        """Write content in filename on the cluster."""
+        pool = self.get_pool()
+        if pool is not None:
+            pool.send_files([], None, [(filename, content)])
+        else:
+            SFTPChannel(self.cluster).write_file(filename, content)
+
+    def download_from_contaminer(self, filename, local_filename):
+        """Get filename from ContaMiner work directory to local_filename."""
+        pool = self.get_pool()
+        if pool is not None:
+            pool.get_file(
+                os.path.join(
+                    get_cluster(self.cluster).ssh_work_directory,
+                    filename),
+                local_filename)
+        else:
+            SFTPChannel(self.cluster).download_from_contaminer(
+                filename,
+                local_filename)
+
+    def exec_command_in_shell(self, command):
+        """Run command in a login shell, and return its output."""
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.exec_command_in_shell(command)
+        return SSHChannel(self.cluster).exec_command_in_shell(command)
+
+    def launch(self, command):
+        """
+        Run a command submitting jobs.
+
+        ContaMiner gives the tasks to the scheduler of the cluster, so the
+        command returns quickly and is waited for.
+        """
+        return self.exec_command_in_shell(command)
+
+    def launch_batch(self, commands):
+        """
+        Run several commands submitting jobs, with one remote command.
+
+        The batch goes on after a failed command, and writes LAUNCH_FAILED
+        followed by its index. The errors of the commands are written on
+        stdout, as an output on stderr stops the whole batch.
+        :returns: (stdout, set of the indexes of the failed commands)
+        """
+        batch = "; ".join([
+            command + ' 2>&1 || echo "' + LAUNCH_FAILED + str(index) + '"'
+            for index, command in enumerate(commands)])
+        stdout = self.launch(batch)
+        failed_indexes = set([
+            int(line[len(LAUNCH_FAILED):])
+            for line in stdout.splitlines()
+            if line.startswith(LAUNCH_FAILED)
+            and line[len(LAUNCH_FAILED):].isdigit()])
+        return (stdout, failed_indexes)
+
+    def solve(self, directory, input_filename, contaminants_filename):
+        """Submit a job to ContaMiner, from its files in directory."""
+        log = logging.getLogger(__name__)
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                return get_agent(self.cluster).solve(
+                    directory,
+                    input_filename,
+                    contaminants_filename)
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new shell: " \
+                    + str(excep))
+        return self.launch('cd "' + directory + '" && ' + get_solve_command(
+            self.cluster,
+            input_filename,
+            contaminants_filename))
+
+    def job_status(self, job_directory):
+        """Return the output of contaminer job_status for the job."""
+        log = logging.getLogger(__name__)
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                return get_agent(self.cluster).job_status(job_directory)
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new shell: " \
+                    + str(excep))
+        return self.exec_command_in_shell(
+            get_job_status_command(self.cluster, job_directory))
+
+    def cancel_tasks(self, job_directory, task_names):
+        """Cancel the given tasks of the job."""
+        log = logging.getLogger(__name__)
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                return get_agent(self.cluster).cancel(
+                    job_directory,
+                    task_names)
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new shell: " \
+                    + str(excep))
+        return self.exec_command_in_shell(
+            get_cancel_command(self.cluster, job_directory, task_names))
+
+    def read_file(self, filename):
+        """Return the content of filename on the cluster."""
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.read_file(filename)
+        return SSHChannel(self.cluster).read_file(filename)
+
+    def get_pdb_headers(self, paths):
+        """Return the REMARK 3 records of the PDB files on the cluster."""
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.get_pdb_headers(paths)
+        return SSHChannel(self.cluster).get_pdb_headers(paths)
+
+    def stat_files(self, paths):
+        """Return (size, mtime) or None for each file, in one command."""
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.stat_files(paths)
+        return SSHChannel(self.cluster).stat_files(paths)
+
+    def iter_contabase(self):
+        """Yield the XML of the ContaBase by chunks."""
+        return SSHChannel(self.cluster).iter_contabase()
+
+
+def run_command(command, cwd=None):
+    """
+    Run command in a login shell.
+
+    Defined at module level, so the process pool can pickle it.
+    :returns: (stdout, stderr, returncode)
+    """
+    process = subprocess.Popen(
+        ["bash", "-lc", command],
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return (stdout, stderr, process.returncode)
+
+
+# Process pool of LocalBackend, created when first needed
+POOL = None
+POOL_LOCK = threading.Lock()
+
+
+def get_pool(workers):
+    """Return the process pool, created with workers processes."""
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            # Backport "futures" on Python 2
+            from concurrent.futures import ProcessPoolExecutor
+            POOL = ProcessPoolExecutor(max_workers=workers)
+        return POOL
+
+
+def log_launched_command(future):
+    """Log the end of a command started by LocalBackend.launch."""
+    log = logging.getLogger(__name__)
+    try:
+        stdout, stderr, returncode = future.result()
+    except Exception as excep:
+        log.error("Unable to run the command: " + str(excep))
+        return
+    if stderr or returncode:
+        log.error("Command failed with status " + str(returncode) + ": " \
+            + shorten(stderr))
+    else:
+        log.debug("Command complete: " + shorten(stdout))
+
+
+class LocalBackend(object):
+    """
+    Run ContaMiner on the webserver.
+
+    The jobs are launched in a bounded pool of processes, the queries are
+    run at once.
+    """
+
+    def __init__(self, cluster=None):
+        """Create a backend for cluster (the default one if None)."""
+        self.cluster = cluster
+
+    def get_pool(self):
+        """Return the process pool running the commands."""
+        return get_pool(get_cluster(self.cluster).local_workers)
+
+    def send_file(self, filename, directory):
+        """Copy filename in directory."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filename) + " " + str(directory))
+
+        log.info("Copy " + str(filename) + " to " + str(directory))
+        try:
+            shutil.copy(filename, directory)
+        except IOError as exception:
+            log.error("Unable to copy file: " + str(exception))
+            log.error("Save files in media root.")
+            shutil.copy2(filename, settings.MEDIA_ROOT)
+            raise
+
+        log.debug("Exit")
+
+    def send_files(self, filenames, directory, contents=None):
+        """Copy several files in directory, and write the contents."""
+        for filename in filenames:
+            self.send_file(filename, directory)
+        for filename, content in contents or []:
+            self.write_file(filename, content)
+
+    def write_file(self, filename, content):
+        """Write content in filename."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filename) + " " \
+            + shorten(content))
+
+        with open(filename, 'w') as local_file:
+            local_file.write(content)
+
+        log.debug("Exit")
+
+    def download_from_contaminer(self, filename, local_filename):
+        """Copy filename from ContaMiner work directory to local_filename."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filename) + " " \
+            + str(local_filename))
+
+        work_directory = get_cluster(self.cluster).ssh_work_directory
+        try:
+            shutil.copyfile(
+                os.path.join(work_directory, filename),
+                local_filename)
+        except IOError:
+            log.error("Missing: " + filename)
+            raise
+
+        log.debug("Exit")
+
+    def exec_command_in_shell(self, command):
+        """
+        Run command in a login shell, and return its output.
+
+        The queries are short, so they are run at once out of the pool:
+        they do not wait for the end of the launched jobs.
+        Raise RuntimeError if the command writes on stderr, as
+        SSHChannel.exec_command.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(command))
+
+        stdout, stderr, _ = run_command(command)
+        if stderr:
+            log.error("Command writes on stderr: " + shorten(stderr))
+            raise RuntimeError(stderr)
+
+        log.debug("Exit with arg: " + shorten(stdout))
+        return stdout
+
+    def launch(self, command):
+        """
+        Start command in the pool, without waiting for its end.
+
+        Without a scheduler, "contaminer solve" runs the tasks itself, so the
+        webserver does not wait for it. The number of commands running at the
+        same time is bounded by local_workers, the others wait in the pool.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(command))
+
+        future = self.get_pool().submit(run_command, command)
+        future.add_done_callback(log_launched_command)
+
+        log.debug("Exit")
+        return ""
+
+    def launch_batch(self, commands):
+        """
+        Start several commands in the pool, as launch.
+
+        Each command takes its own process of the pool. A failed command is
+        only logged when it ends.
+        :returns: (stdout, set of the indexes of the failed commands)
+        """
+        for command in commands:
+            self.launch(command)
+        return ("", set())
+
+    def solve(self, directory, input_filename, contaminants_filename):
+        """Start ContaMiner on the files of a job in directory, as launch."""
+        return self.launch('cd "' + directory + '" && ' + get_solve_command(
+            self.cluster,
+            input_filename,
+            contaminants_filename))
+
+    def job_status(self, job_directory):
+        """Return the output of contaminer job_status for the job."""
+        return self.exec_command_in_shell(
+            get_job_status_command(self.cluster, job_directory))
+
+    def cancel_tasks(self, job_directory, task_names):
+        """Cancel the given tasks of the job."""
+        return self.exec_command_in_shell(
+            get_cancel_command(self.cluster, job_directory, task_names))
+
+    def read_file(self, filename):
+        """Return the content of filename."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(filename))
+
+        try:
+            with open(filename, 'r') as local_file:
+                content = local_file.read()
+        except IOError as excep:
+            raise RuntimeError(str(excep))
+
+        log.debug("Exit with arg: " + shorten(content))
+        return content
+
+    def get_pdb_headers(self, paths):
+        """Return the REMARK 3 records of the PDB files."""
+        if not paths:
+            return {}
+        stdout = self.exec_command_in_shell(get_pdb_headers_command(paths))
+        return parse_pdb_headers(stdout, paths)
+
+    def stat_files(self, paths):
+        """Return (size, mtime) or None for each file."""
+        stats = {}
+        for path in paths:
+            try:
+                attributes = os.stat(path)
+                stats[path] = (attributes.st_size, attributes.st_mtime)
+            except OSError:
+                stats[path] = None
+        return stats
+
+    def iter_contabase(self):
+        """Yield the XML of the ContaBase by chunks, as it is written."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        # stderr goes to a file, so it cannot block the process while stdout
+        # is read
+        with tempfile.TemporaryFile() as stderr_file:
+            command = SSHChannel.get_contabase_command(self.cluster)
+            process = subprocess.Popen(
+                ["bash", "-lc", command],
+                stdout=subprocess.PIPE,
+                stderr=stderr_file)
+            for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                yield chunk
+            process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read()
+        if stderr:
+            log.error("Command writes on stderr: " + shorten(stderr))
+            raise RuntimeError(stderr)
+
+        log.debug("Exit")
+
+
+def get_backend(cluster=None):
+    """Return the backend of cluster selected in config.ini."""
+    if get_cluster(cluster).backend == 'local':
+        return LocalBackend(cluster)
+    return SSHBackend(cluster)
@@ -0,0 +1,130 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Configuration of the clusters running ContaMiner.
+
+The [SSH] and [CLUSTER] sections of config.ini give the default cluster.
+Other clusters are given by [CLUSTER:<name>] sections, with the options of
+both sections. A missing option takes the value of the default cluster:
+
+[CLUSTER:second]
+hostname = second.example.com
+work_directory = /scratch/contaminer
+slots = 50
+
+Each job records the name of its cluster, and the configuration of this
+cluster is given by get_cluster. The default cluster is the application
+configuration itself, which has the same attributes.
+"""
+
+from django.apps import apps
+
+# Name of the cluster given by the [SSH] and [CLUSTER] sections
+DEFAULT_CLUSTER = "default"
+
+# Prefix of the sections of the other clusters
+SECTION_PREFIX = "CLUSTER:"
+
+
+class ClusterConfig(object):
+    """Options of a cluster given by a [CLUSTER:<name>] section."""
+
+    def __init__(self, name, config, default):
+        """
+        Read the section of the cluster name.
+
+        :param config: ConfigParser of config.ini.
+        :param default: ContaminerConfig, giving the missing options.
+        """
+        section = SECTION_PREFIX + name
+
+        def get(option, default_value):
+            """Return the option of the section, or default_value."""
+            if config.has_option(section, option):
+                return config.get(section, option)
+            return default_value
+
+        self.cluster_name = name
+        self.ssh_hostname = get("hostname", default.ssh_hostname)
+        self.ssh_port = int(get("port", default.ssh_port))
+        self.ssh_username = get("username", default.ssh_username)
+        self.ssh_password = get("password", default.ssh_password)
+        self.ssh_identityfile = get("identityfile", default.ssh_identityfile)
+        self.ssh_contaminer_location = get(
+            "contaminer_location",
+            default.ssh_contaminer_location)
+        self.ssh_work_directory = get(
+            "work_directory",
+            default.ssh_work_directory)
+        self.slots = int(get("slots", default.slots))
+        self.agent_enabled = str(get("agent", default.agent_enabled))\
+            .lower() == "true"
+        self.agent_python = get("agent_python", default.agent_python)
+        self.backend = get("backend", default.backend)
+        self.local_workers = int(get("local_workers", default.local_workers))
+        self.max_jobs = int(get("max_jobs", default.max_jobs))
+        self.max_tasks = int(get("max_tasks", default.max_tasks))
+        self.connect_timeout = float(get(
+            "connect_timeout",
+            default.connect_timeout))
+        self.command_timeout = float(get(
+            "command_timeout",
+            default.command_timeout))
+        self.transfer_timeout = float(get(
+            "transfer_timeout",
+            default.transfer_timeout))
+        self.pool_connections = int(get(
+            "pool_connections",
+            default.pool_connections))
+
+    def __str__(self):
+        """Write the name and the host of the cluster."""
+        return self.cluster_name + " (" + str(self.ssh_hostname) + ")"
+
+
+def read_clusters(config, default):
+    """Return a dictionary giving the ClusterConfig of each other cluster."""
+    clusters = {}
+    for section in config.sections():
+        if section.startswith(SECTION_PREFIX):
+            name = section[len(SECTION_PREFIX):]
+            clusters[name] = ClusterConfig(name, config, default)
+    return clusters
+
+
+def get_cluster_names():
+    """Return the names of all the clusters, the default one first."""
+    app_config = apps.get_app_config('contaminer')
+    return [DEFAULT_CLUSTER] + sorted(app_config.clusters or [])
+
+
+def get_cluster(name=None):
+    """
+    Return the configuration of the cluster name.
+
+    The default cluster is given if name is None or empty.
+    :raises RuntimeError: if the cluster is not in config.ini.
+    """
+    app_config = apps.get_app_config('contaminer')
+    if not name or name == DEFAULT_CLUSTER:
+        return app_config
+    try:
+        return app_config.clusters[name]
+    except KeyError:
+        raise RuntimeError("Unknown cluster: " + str(name))
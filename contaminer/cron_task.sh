@@ -17,9 +17,10 @@
 ##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 # Switch to virtual environment stored in ven, then update all non-archived and
-# submitted jobs.
+# submitted jobs, and send the queued mails.
 
 BASE_DIR="$(dirname "$(readlink -f "$0")")"/../../StruBE-website
 . "$BASE_DIR"/venv/bin/activate
 python "$BASE_DIR/manage.py" update_jobs
+python "$BASE_DIR/manage.py" send_mails
 python "$BASE_DIR/manage.py" remove_old_jobs
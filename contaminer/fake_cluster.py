@@ -0,0 +1,846 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+A fake cluster, to test the communication without ContaMiner.
+
+FakeCluster runs an SSH and SFTP server in the current process. It emulates
+the commands sent by ssh_tools (contaminer display, solve, job_status and
+cancel, cat, echo, the lists of commands separated by ;, && and ||, and
+the reading of the PDB headers) and the requests of the
+remote agent (including its solve, status and cancel operations), and stores the remote files in a local directory. The results
+of a job evolve with time: the tasks are queued, run, then complete, and the
+final files of the positive tasks are generated. The network latency and
+bandwidth can be set to measure the submission, update and download
+pipelines offline.
+
+Use the fake_cluster management command to run it alone, or start it from a
+test with FakeCluster().start().
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shlex
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import numpy as np
+import paramiko
+
+from . import agent
+from .ssh_tools import AGENT_FILENAME
+from .ssh_tools import PDB_HEADER_SEPARATOR
+from .ssh_tools import STAT_SEPARATOR
+
+CHUNK_SIZE = 32 * 1024
+DEFAULT_SPACE_GROUPS = ["P-1-2-1", "P-1-21-1"]
+
+# contaminer command run by each ContaMiner operation of the agent
+AGENT_CONTAMINER_OPERATIONS = {
+    'solve': "solve",
+    'status': "job_status",
+    'cancel': "cancel",
+    }
+
+
+class FakeCluster(object):
+    """
+    State of the fake cluster, and SSH server giving access to it.
+
+    :param root: local directory where the remote files are stored. A
+    temporary directory is used if not given.
+    :param latency: delay in seconds before answering a command or an SFTP
+    request.
+    :param bandwidth: maximum transfer rate in bytes per second (no limit if
+    None).
+    :param queue_time: time in seconds a job stays submitted before running.
+    :param task_duration: time in seconds to run a task.
+    :param slots: number of tasks of a job running at the same time.
+    :param file_size: approximative size in bytes of each final file.
+    :param positive_ratio: part of the tasks giving a positive result.
+    :param size: number of categories, contaminants per category and packs
+    per contaminant in the ContaBase.
+    :param space_groups: space groups tested for each pack.
+    :param clock: function giving the current time in seconds.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, root=None, latency=0, bandwidth=None, queue_time=0,
+                 task_duration=60, slots=10, file_size=1024 * 1024,
+                 positive_ratio=0.1, size=(2, 5, 2),
+                 space_groups=None, clock=time.time):
+        """Create a new cluster. Call start to accept connections."""
+        self.root = root or tempfile.mkdtemp()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.queue_time = queue_time
+        self.task_duration = task_duration
+        self.slots = slots
+        self.file_size = file_size
+        self.positive_ratio = positive_ratio
+        self.size = size
+        self.space_groups = space_groups or DEFAULT_SPACE_GROUPS
+        self.clock = clock
+
+        self.contaminer_location = "/opt/ContaMiner"
+        self.work_directory = "/data/contaminer"
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.host_key = None
+        self.server_socket = None
+        self.transports = []
+        self.port = None
+        self.nb_channels = 0
+
+    def get_ssh_config(self):
+        """Return the attributes of ContaminerConfig to connect to this."""
+        return {
+            'ssh_hostname': "127.0.0.1",
+            'ssh_port': self.port,
+            'ssh_username': "contaminer",
+            'ssh_password': "contaminer",
+            'ssh_identityfile': None,
+            'ssh_contaminer_location': self.contaminer_location,
+            'ssh_work_directory': self.work_directory,
+            }
+
+    def start(self, port=0):
+        """Listen on localhost:port, and return the port."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        if self.host_key is None:
+            self.host_key = paramiko.RSAKey.generate(1024)
+        os.makedirs(self.local_path(self.work_directory))
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(
+            socket.SOL_SOCKET,
+            socket.SO_REUSEADDR,
+            1)
+        self.server_socket.bind(("127.0.0.1", port))
+        self.server_socket.listen(100)
+        self.port = self.server_socket.getsockname()[1]
+
+        thread = threading.Thread(target=self.accept_connections)
+        thread.daemon = True
+        thread.start()
+
+        log.info("Fake cluster listening on port " + str(self.port))
+        log.debug("Exit")
+        return self.port
+
+    def stop(self, remove_files=True):
+        """Close the connections, and remove the files if asked."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+        with self.lock:
+            transports, self.transports = self.transports, []
+        for transport in transports:
+            transport.close()
+        if remove_files:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+        log.debug("Exit")
+
+    def accept_connections(self):
+        """Start an SSH transport for each new connection."""
+        while self.server_socket is not None:
+            try:
+                client_socket, _ = self.server_socket.accept()
+            except (socket.error, AttributeError):
+                break
+            # The negotiation blocks, and should not delay the next client
+            thread = threading.Thread(
+                target=self.start_transport,
+                args=(client_socket,))
+            thread.daemon = True
+            thread.start()
+
+    def start_transport(self, client_socket):
+        """Negotiate the SSH session on client_socket."""
+        log = logging.getLogger(__name__)
+        transport = paramiko.Transport(client_socket)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler(
+            'sftp',
+            paramiko.SFTPServer,
+            FakeSFTPServer,
+            self)
+        with self.lock:
+            self.transports.append(transport)
+        try:
+            transport.start_server(server=FakeSSHServer(self))
+        except (paramiko.SSHException, EOFError) as excep:
+            log.warning("SSH negotiation failed: " + str(excep))
+
+    def local_path(self, remote_path):
+        """Return the local path storing remote_path."""
+        return os.path.join(
+            self.root,
+            os.path.normpath(remote_path).lstrip('/'))
+
+    def wait(self, size=0):
+        """Sleep for the latency and the transfer of size bytes."""
+        delay = self.latency
+        if self.bandwidth:
+            delay += float(size) / self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def throttle(self, size):
+        """Sleep for the transfer of size bytes."""
+        if self.bandwidth:
+            time.sleep(float(size) / self.bandwidth)
+
+    def get_contaminants(self):
+        """Return the (category, uniprot_id, packs) of the ContaBase."""
+        nb_categories, nb_contaminants, nb_packs = self.size
+        return [
+            (category, "F" + str(category) + "C" + str(contaminant), nb_packs)
+            for category in range(1, nb_categories + 1)
+            for contaminant in range(1, nb_contaminants + 1)]
+
+    def get_contabase(self):
+        """Return the ContaBase as given by contaminer display."""
+        categories = {}
+        for category, uniprot_id, nb_packs in self.get_contaminants():
+            packs = "".join([
+                "<pack><quat_structure>1-mer</quat_structure><model>"\
+                + "<template>1ABC</template><chain>A</chain>"\
+                + "<domain>1</domain><n_res>120</n_res>"\
+                + "<identity>0.98</identity></model></pack>"
+                for _ in range(nb_packs)])
+            contaminant = "<contaminant>"\
+                + "<uniprot_id>" + uniprot_id + "</uniprot_id>"\
+                + "<short_name>FAKE_" + uniprot_id + "</short_name>"\
+                + "<long_name>Fake contaminant</long_name>"\
+                + "<sequence>" + "ABCDEFGHIKLMNPQRSTVWY" * 6 + "</sequence>"\
+                + "<organism>Escherichia coli</organism>"\
+                + packs\
+                + "<reference><pubmed_id>1</pubmed_id></reference>"\
+                + "</contaminant>"
+            categories.setdefault(category, []).append(contaminant)
+
+        return "<contabase>" + "".join([
+            "<category><id>" + str(category) + "</id>"\
+            + "<name>Fake category " + str(category) + "</name>"\
+            + "<default>" + ("true" if category == 1 else "false")\
+            + "</default>" + "".join(contaminants) + "</category>"
+            for category, contaminants in sorted(categories.items())])\
+            + "</contabase>\n"
+
+    def run_command(self, command):
+        """
+        Run command as a shell on the cluster.
+
+        :returns: (stdout, stderr, exit_status)
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(command))
+
+        if command.startswith("bash -lc '") and command.endswith("'"):
+            command = command[len("bash -lc '"):-1]
+
+        if command.startswith("for f in "):
+            return (self.get_pdb_headers(command), "", 0)
+        if command.startswith("stat -c "):
+            return (self.get_stats(command), "", 0)
+
+        cwd = ["/"]
+        stdout = ""
+        stderr = ""
+        exit_status = 0
+        for sequence in command.split("; "):
+            # The next alternative only runs if the previous one failed
+            for alternative in sequence.split(" || "):
+                out, err, exit_status = self.run_and_list(alternative, cwd)
+                stdout += out
+                stderr += err
+                if exit_status == 0:
+                    break
+
+        log.debug("Exit")
+        return (stdout, stderr, exit_status)
+
+    def run_and_list(self, command, cwd):
+        """
+        Run the commands separated by &&, until one fails.
+
+        :param cwd: list holding the current directory, changed by cd.
+        :returns: (stdout, stderr, exit_status)
+        """
+        stdout = ""
+        for part in command.split(" && "):
+            argv = shlex.split(part)
+            if argv and argv[0] == "sh":
+                argv = argv[1:]
+            merge_stderr = argv[-1:] == ["2>&1"]
+            if merge_stderr:
+                argv = argv[:-1]
+            if not argv:
+                continue
+
+            out, err, exit_status = self.run_simple_command(argv, cwd)
+            stdout += out
+            if merge_stderr:
+                stdout += err
+                err = ""
+            if exit_status != 0:
+                return (stdout, err, exit_status)
+
+        return (stdout, "", 0)
+
+    def run_simple_command(self, argv, cwd):
+        """
+        Run the command given by its arguments.
+
+        :param cwd: list holding the current directory, changed by cd.
+        :returns: (stdout, stderr, exit_status)
+        """
+        if argv[0] == "cd":
+            cwd[0] = os.path.join(cwd[0], argv[1])
+        elif argv[0] == "echo":
+            return (" ".join(argv[1:]) + "\n", "", 0)
+        elif argv[0] == "cat":
+            try:
+                return (self.read_file(os.path.join(cwd[0], argv[1])), "", 0)
+            except IOError:
+                return ("", "cat: " + argv[1] \
+                    + ": No such file or directory\n", 1)
+        elif os.path.basename(argv[0]) == "contaminer" \
+                and len(argv) > 1:
+            if argv[1] == "display":
+                return (self.get_contabase(), "", 0)
+            elif argv[1] == "solve" and len(argv) == 4:
+                try:
+                    return (self.solve(
+                        os.path.join(cwd[0], argv[2]),
+                        os.path.join(cwd[0], argv[3])), "", 0)
+                except IOError as excep:
+                    return ("", "contaminer: " + str(excep) + "\n", 1)
+            elif argv[1] == "job_status" and len(argv) == 3:
+                return (
+                    self.get_job_status(os.path.join(cwd[0], argv[2])),
+                    "",
+                    0)
+            elif argv[1] == "cancel" and len(argv) > 3:
+                return (
+                    self.cancel(os.path.join(cwd[0], argv[2]), argv[3:]),
+                    "",
+                    0)
+            return ("", "Usage: contaminer display|solve|"\
+                + "job_status|cancel\n", 1)
+        else:
+            return ("", argv[0] + ": command not found\n", 127)
+        return ("", "", 0)
+
+    def answer_agent(self, request):
+        """Return the response of the remote agent to request."""
+        operation = request.get('op')
+        if operation == 'ping':
+            return {'pong': True}
+        if operation == 'run':
+            command = request['command']
+            if request.get('cwd'):
+                command = 'cd "' + request['cwd'] + '" && ' + command
+            stdout, stderr, exit_status = self.run_command(command)
+            return {'stdout': stdout, 'stderr': stderr, 'status': exit_status}
+        if operation == 'read':
+            try:
+                return {'content': self.read_file(request['path'])}
+            except IOError as excep:
+                return {'error': str(excep)}
+        if operation == 'stat':
+            stats = {}
+            for path in request['paths']:
+                if os.path.basename(path) == "results.txt":
+                    self.update_job(os.path.dirname(path))
+                try:
+                    attributes = os.stat(self.local_path(path))
+                    stats[path] = [attributes.st_size, attributes.st_mtime]
+                except OSError:
+                    stats[path] = None
+            return {'stats': stats}
+        if operation in AGENT_CONTAMINER_OPERATIONS:
+            argv = [request['contaminer'],
+                    AGENT_CONTAMINER_OPERATIONS[operation]]
+            if operation == 'solve':
+                argv += [request['input'], request['contaminants']]
+            else:
+                argv += [request['job']] + request.get('tasks', [])
+            stdout, stderr, exit_status = self.run_simple_command(
+                argv,
+                [request.get('cwd') or "/"])
+            return {'stdout': stdout, 'stderr': stderr, 'status': exit_status}
+        return {'error': "Unknown operation: " + str(operation)}
+
+    def read_file(self, remote_path):
+        """Return the content of remote_path."""
+        if os.path.basename(remote_path) == "results.txt":
+            self.update_job(os.path.dirname(remote_path))
+        with open(self.local_path(remote_path)) as remote_file:
+            return remote_file.read()
+
+    def get_stats(self, command):
+        """Answer the command sent by SSHChannel.stat_files."""
+        argv = shlex.split(command[:command.index(" 2>/dev/null")])
+        stdout = ""
+        for path in argv[3:]:
+            if os.path.basename(path) == "results.txt":
+                self.update_job(os.path.dirname(path))
+            try:
+                attributes = os.stat(self.local_path(path))
+            except OSError:
+                continue
+            stdout += STAT_SEPARATOR.join([
+                path,
+                str(attributes.st_size),
+                str(int(attributes.st_mtime))]) + "\n"
+        return stdout
+
+    def get_pdb_headers(self, command):
+        """Answer the command sent by SSHChannel.get_pdb_headers."""
+        paths = shlex.split(command[len("for f in "):command.index("; do")])
+        stdout = ""
+        for path in paths:
+            stdout += PDB_HEADER_SEPARATOR + path + "\n"
+            try:
+                with open(self.local_path(path)) as pdb_file:
+                    for line in pdb_file:
+                        if line.startswith(("ATOM  ", "HETATM")):
+                            break
+                        if line.startswith("REMARK   3"):
+                            stdout += line
+            except IOError:
+                pass
+        return stdout
+
+    def solve(self, input_path, contaminants_path):
+        """Register a new job, as contaminer solve."""
+        job_directory = os.path.splitext(input_path)[0]
+        with open(self.local_path(contaminants_path)) as contaminants_file:
+            requested = [line.strip() for line in contaminants_file
+                         if line.strip()]
+
+        packs = dict([
+            (uniprot_id, nb_packs)
+            for _, uniprot_id, nb_packs in self.get_contaminants()])
+        tasks = []
+        for uniprot_id in requested:
+            if uniprot_id.startswith("./"):
+                # Custom contaminant
+                uniprot_id = "c_" \
+                    + os.path.splitext(os.path.basename(uniprot_id))[0]
+                nb_packs = 1
+            else:
+                nb_packs = packs.get(uniprot_id, 0)
+            tasks += [
+                (uniprot_id, pack, space_group)
+                for pack in range(1, nb_packs + 1)
+                for space_group in self.space_groups]
+
+        with self.lock:
+            self.jobs[os.path.normpath(job_directory)] = {
+                'start': self.clock(),
+                'tasks': tasks,
+                'final_files': set(),
+                'cancelled': {},
+                }
+        try:
+            os.makedirs(self.local_path(job_directory))
+        except OSError as excep:
+            if excep.errno != errno.EEXIST:
+                raise
+        self.update_job(job_directory)
+
+        return "Job submitted\n"
+
+    def get_job_status(self, job_directory):
+        """Return the status of the job, as contaminer job_status."""
+        job = self.jobs.get(os.path.normpath(job_directory))
+        if job is None:
+            return "error\n"
+
+        elapsed = self.clock() - job['start'] - self.queue_time
+        if elapsed < 0:
+            return "submitted\n"
+        nb_rounds = (len(job['tasks']) + self.slots - 1) // self.slots
+        if elapsed < nb_rounds * self.task_duration:
+            return "running\n"
+        return "complete\n"
+
+    def cancel(self, job_directory, task_names):
+        """Stop the given tasks of the job, as contaminer cancel."""
+        job = self.jobs.get(os.path.normpath(job_directory))
+        if job is None:
+            return "error\n"
+
+        elapsed = self.clock() - job['start'] - self.queue_time
+        with self.lock:
+            for index, task in enumerate(job['tasks']):
+                if "_".join([str(field) for field in task]) in task_names \
+                        and task not in job['cancelled']:
+                    task_elapsed = elapsed \
+                        - (index // self.slots) * self.task_duration
+                    job['cancelled'][task] = \
+                        int(min(max(task_elapsed, 0), self.task_duration))
+        return "Tasks cancelled\n"
+
+    def get_task_result(self, task, index, elapsed):
+        """Return the line of results.txt for task at the given time."""
+        uniprot_id, pack, space_group = task
+        digest = hashlib.md5(uniprot_id + str(pack) + space_group).digest()
+        draw = ord(digest[0]) / 256.
+
+        task_elapsed = elapsed - (index // self.slots) * self.task_duration
+        if task_elapsed < 0:
+            status, q_factor, percent, seconds = "new", 0, 0, 0
+        elif task_elapsed < self.task_duration:
+            status, q_factor, percent = "running", 0, 0
+            seconds = int(task_elapsed)
+        else:
+            seconds = int(self.task_duration)
+            if draw < self.positive_ratio:
+                status, q_factor, percent = "completed", 0.8, 99
+            else:
+                status, q_factor = "completed", round(0.2 + draw / 4, 3)
+                percent = int(draw * 50)
+
+        elapsed_time = "%dh %2dm %2ds" % (
+            seconds // 3600, (seconds // 60) % 60, seconds % 60)
+        return ",".join([
+            uniprot_id, str(pack), space_group, status, str(q_factor),
+            str(percent), elapsed_time])
+
+    def update_job(self, job_directory):
+        """Write results.txt and the new final files of the job."""
+        job_directory = os.path.normpath(job_directory)
+        job = self.jobs.get(job_directory)
+        if job is None:
+            return
+
+        elapsed = self.clock() - job['start'] - self.queue_time
+        lines = []
+        for index, task in enumerate(job['tasks']):
+            if task in job['cancelled']:
+                seconds = job['cancelled'][task]
+                lines.append(",".join([
+                    task[0], str(task[1]), task[2], "cancelled", "0", "0",
+                    "%dh %2dm %2ds" % (seconds // 3600,
+                                       (seconds // 60) % 60,
+                                       seconds % 60)]))
+                continue
+            line = self.get_task_result(task, index, elapsed)
+            lines.append(line)
+            if ",completed," in line and ",99," in line \
+                    and task not in job['final_files']:
+                self.write_final_files(job_directory, task)
+                job['final_files'].add(task)
+
+        # Keep the mtime of results.txt while nothing changes, as ContaMiner
+        content = "\n".join(lines) + "\n" if lines else ""
+        results_path = self.local_path(
+            os.path.join(job_directory, "results.txt"))
+        if os.path.isfile(results_path):
+            with open(results_path) as results_file:
+                if results_file.read() == content:
+                    return
+        with open(results_path, 'w') as results_file:
+            results_file.write(content)
+
+    def write_final_files(self, job_directory, task):
+        """Write the final PDB, MTZ and maps of a positive task."""
+        uniprot_id, pack, space_group = task
+        results_directory = self.local_path(os.path.join(
+            job_directory,
+            uniprot_id + "_" + str(pack) + "_" + space_group,
+            "results_solve"))
+        try:
+            os.makedirs(results_directory)
+        except OSError as excep:
+            if excep.errno != errno.EEXIST:
+                raise
+
+        # Final model: a header, then atoms in a 20 A box
+        nb_atoms = max(1, self.file_size // 81)
+        positions = np.random.RandomState(pack).uniform(2, 18, (nb_atoms, 3))
+        with open(os.path.join(results_directory, "final.pdb"), 'w') \
+                as pdb_file:
+            pdb_file.write(
+                "REMARK   3   PROGRAM     : FAKE CLUSTER\n"
+                "REMARK   3   RESOLUTION RANGE HIGH (ANGSTROMS) : 2.00\n"
+                "REMARK   3   R VALUE            (WORKING SET) : 0.210\n"
+                "REMARK   3   FREE R VALUE                     : 0.250\n"
+                "CRYST1   20.000   20.000   20.000  90.00  90.00  90.00 "
+                "P 1           1\n")
+            for number, (x, y, z) in enumerate(positions, 1):
+                pdb_file.write(
+                    "ATOM  %5d  CA  ALA A%4d    %8.3f%8.3f%8.3f"
+                    "  1.00 20.00           C\n"
+                    % (number % 100000, number % 10000, x, y, z))
+
+        with open(os.path.join(results_directory, "final.mtz"), 'wb') \
+                as mtz_file:
+            mtz_file.write(os.urandom(self.file_size))
+
+        # Full cell maps of mode 2, with an even grid
+        grid = max(4, int(round((self.file_size / 4.) ** (1 / 3.) / 2)) * 2)
+        for map_name in ["final.map", "final.diff.map"]:
+            int_header = np.zeros(256, dtype='<i4')
+            float_header = int_header.view('<f4')
+            int_header[0:3] = grid
+            int_header[3] = 2
+            int_header[7:10] = grid
+            float_header[10:16] = [20, 20, 20, 90, 90, 90]
+            int_header[16:19] = [1, 2, 3]
+            int_header[52] = 0x2050414d # 'MAP '
+            data = np.random.RandomState(pack).normal(
+                size=(grid, grid, grid)).astype('<f4')
+            with open(os.path.join(results_directory, map_name), 'wb') \
+                    as map_file:
+                map_file.write(int_header.tobytes())
+                map_file.write(data.tobytes())
+
+
+class FakeSSHServer(paramiko.ServerInterface):
+    """Accept any user, and run the commands on the fake cluster."""
+
+    def __init__(self, cluster):
+        """Create a server for cluster."""
+        self.cluster = cluster
+
+    def get_allowed_auths(self, username):
+        """Password and public key authentications are accepted."""
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        """Accept any password."""
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        """Accept any key."""
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        """Accept the sessions."""
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        """Run command in a new thread."""
+        with self.cluster.lock:
+            self.cluster.nb_channels += 1
+        target = self.exec_command
+        if command.endswith(AGENT_FILENAME + "'"):
+            target = self.serve_agent
+        thread = threading.Thread(
+            target=target,
+            args=(channel, command))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def exec_command(self, channel, command):
+        """Run command, and send the output through channel."""
+        log = logging.getLogger(__name__)
+        try:
+            stdout, stderr, exit_status = self.cluster.run_command(command)
+        except Exception as excep: # pylint: disable=broad-except
+            log.error("Fake cluster error: " + str(excep))
+            stdout, stderr, exit_status = "", str(excep) + "\n", 1
+
+        self.cluster.wait()
+        for start in range(0, len(stdout), CHUNK_SIZE):
+            chunk = stdout[start:start + CHUNK_SIZE]
+            self.cluster.throttle(len(chunk))
+            channel.sendall(chunk)
+        if stderr:
+            channel.sendall_stderr(stderr)
+        channel.send_exit_status(exit_status)
+        channel.shutdown_write()
+
+        # Closing before the exec request is acknowledged would make the
+        # request fail, so the client closes first
+        try:
+            while channel.recv(CHUNK_SIZE):
+                pass
+        except socket.error:
+            pass
+        channel.close()
+
+
+    def serve_agent(self, channel, command):
+        """Answer the requests sent to the remote agent through channel."""
+        log = logging.getLogger(__name__)
+        log.debug("Start agent: " + str(command))
+        stream = channel.makefile('rwb')
+        while True:
+            try:
+                request = agent.read_frame(stream)
+            except (agent.ProtocolError, socket.error):
+                break
+            if request.get('op') == 'quit':
+                break
+            self.cluster.wait()
+            try:
+                response = self.cluster.answer_agent(request)
+            except Exception as excep: # pylint: disable=broad-except
+                log.error("Fake cluster error: " + str(excep))
+                response = {'error': str(excep)}
+            agent.write_frame(stream, response)
+        channel.send_exit_status(0)
+        channel.close()
+
+
+class FakeSFTPHandle(paramiko.SFTPHandle):
+    """An open file, with the transfers limited by the bandwidth."""
+
+    def __init__(self, cluster, *args, **kwargs):
+        """Create a handle for a file of cluster."""
+        super(FakeSFTPHandle, self).__init__(*args, **kwargs)
+        self.cluster = cluster
+
+    def read(self, offset, length):
+        """Read length bytes at offset."""
+        data = super(FakeSFTPHandle, self).read(offset, length)
+        if isinstance(data, str):
+            self.cluster.throttle(len(data))
+        return data
+
+    def write(self, offset, data):
+        """Write data at offset."""
+        self.cluster.throttle(len(data))
+        return super(FakeSFTPHandle, self).write(offset, data)
+
+    def stat(self):
+        """Return the attributes of the file."""
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.fstat(self.readfile.fileno()))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+
+
+class FakeSFTPServer(paramiko.SFTPServerInterface):
+    """Give access to the files of the fake cluster."""
+
+    def __init__(self, server, cluster, *args, **kwargs):
+        """Create an SFTP server for cluster."""
+        super(FakeSFTPServer, self).__init__(server, *args, **kwargs)
+        self.cluster = cluster
+
+    def stat(self, path):
+        """Return the attributes of path."""
+        self.cluster.wait()
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.stat(self.cluster.local_path(path)))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        """Return the attributes of the files in path."""
+        self.cluster.wait()
+        local_path = self.cluster.local_path(path)
+        try:
+            files = []
+            for filename in os.listdir(local_path):
+                attributes = paramiko.SFTPAttributes.from_stat(
+                    os.stat(os.path.join(local_path, filename)))
+                attributes.filename = filename
+                files.append(attributes)
+            return files
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+
+    def open(self, path, flags, attr):
+        """Open path."""
+        self.cluster.wait()
+        if os.path.basename(path) == "results.txt":
+            self.cluster.update_job(os.path.dirname(path))
+
+        local_path = self.cluster.local_path(path)
+        try:
+            binary_flag = getattr(os, 'O_BINARY', 0)
+            fd = os.open(local_path, flags | binary_flag, 0o644)
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        try:
+            file_obj = os.fdopen(fd, mode)
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+
+        handle = FakeSFTPHandle(self.cluster, flags)
+        handle.filename = local_path
+        handle.readfile = file_obj
+        handle.writefile = file_obj
+        return handle
+
+    def remove(self, path):
+        """Remove path."""
+        try:
+            os.remove(self.cluster.local_path(path))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        """Rename oldpath as newpath."""
+        try:
+            os.rename(
+                self.cluster.local_path(oldpath),
+                self.cluster.local_path(newpath))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        """Create the directory path."""
+        try:
+            os.mkdir(self.cluster.local_path(path))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        """Remove the directory path."""
+        try:
+            os.rmdir(self.cluster.local_path(path))
+        except OSError as excep:
+            return paramiko.SFTPServer.convert_errno(excep.errno)
+        return paramiko.SFTP_OK
@@ -0,0 +1,95 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Run a fake cluster, to test the website without ContaMiner."""
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from contaminer.fake_cluster import FakeCluster
+
+
+class Command(BaseCommand):
+    """Run an SSH server emulating ContaMiner until interrupted."""
+
+    help = 'Run an SSH and SFTP server on localhost emulating ContaMiner. '\
+           'Set the [SSH] and [CLUSTER] sections of config.ini with the '\
+           'printed values to use it.'
+
+    def add_arguments(self, parser):
+        """Add the options of the fake cluster."""
+        parser.add_argument(
+            '--port', type=int, default=2222,
+            help='Port to listen on (default: 2222).')
+        parser.add_argument(
+            '--root', default=None,
+            help='Directory storing the remote files (default: a new '\
+                 'temporary directory).')
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help='Delay before each answer, in seconds.')
+        parser.add_argument(
+            '--bandwidth', type=int, default=None,
+            help='Transfer rate, in bytes per second (default: no limit).')
+        parser.add_argument(
+            '--queue-time', type=float, default=0,
+            help='Time a job stays submitted before running, in seconds.')
+        parser.add_argument(
+            '--task-duration', type=float, default=60,
+            help='Time to run a task, in seconds (default: 60).')
+        parser.add_argument(
+            '--file-size', type=int, default=1024 * 1024,
+            help='Size of each final file, in bytes (default: 1 MB).')
+
+    def handle(self, *args, **options):
+        """Start the fake cluster and wait."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        cluster = FakeCluster(
+            root=options['root'],
+            latency=options['latency'],
+            bandwidth=options['bandwidth'],
+            queue_time=options['queue_time'],
+            task_duration=options['task_duration'],
+            file_size=options['file_size'])
+        cluster.start(port=options['port'])
+
+        config = cluster.get_ssh_config()
+        self.stdout.write("[SSH]")
+        self.stdout.write("hostname = " + config['ssh_hostname'])
+        self.stdout.write("port = " + str(config['ssh_port']))
+        self.stdout.write("username = " + config['ssh_username'])
+        self.stdout.write("password = " + config['ssh_password'])
+        self.stdout.write("[CLUSTER]")
+        self.stdout.write(
+            "contaminer_location = " + config['ssh_contaminer_location'])
+        self.stdout.write("work_directory = " + config['ssh_work_directory'])
+        self.stdout.write("Files stored in: " + cluster.root)
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            cluster.stop(remove_files=options['root'] is None)
+
+        log.debug("Exit")
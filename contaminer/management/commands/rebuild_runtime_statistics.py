@@ -0,0 +1,41 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compute again the runtime statistics from all the complete tasks."""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from contaminer.models.runtime import RuntimeStatistics
+
+class Command(BaseCommand):
+    """Compute again the runtime statistics from all the complete tasks."""
+
+    help = 'Compute again the statistics used to estimate the end of the ' \
+        + 'jobs, from all the complete tasks'
+
+    def handle(self, *args, **options):
+        """Call RuntimeStatistics.rebuild."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        RuntimeStatistics.rebuild()
+
+        log.debug("Exit")
+        self.stdout.write('The runtime statistics have been computed.')
@@ -16,42 +16,59 @@
 ##    with this program; if not, write to the Free Software Foundation, Inc.,
 ##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-"""Remove old jobs. Delay is set in config file."""
+"""
+Remove old job files from MEDIA_ROOT.
+
+The least recently used job directories are removed first, until the cache
+is below config.ini -> cache_quota. The directories not accessed for more
+than config.ini -> keep_time days are removed as well, with the unfinished
+uploads not continued for config.ini -> upload_expiry days.
+"""
 
 import logging
-import os
-import shutil
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from django.core.management.base import BaseCommand
-from django.conf import settings
 from django.apps import apps
 
+from contaminer.models.cache import CachedJob
 from contaminer.models.contaminer import Job
+from contaminer.models.upload import UploadSession
 
 
 class Command(BaseCommand):
-    """Remove web_task directories older than settings.delay."""
+    """Evict the least recently used job directories from MEDIA_ROOT."""
+
+    help = 'Remove the least recently used job directories until the cache '\
+           'is below config.ini -> cache_quota (in bytes), and the ones not '\
+           'accessed for config.ini -> keep_time (in days).'
 
-    help = 'Remove static folders for job older than config.ini -> keep_time '\
-           '(in days).'
+    def add_arguments(self, parser):
+        """Add optional argument --index-existing."""
+        parser.add_argument(
+            '--index-existing',
+            action='store_true',
+            dest='index_existing',
+            default=False,
+            help='Index the job directories created before the cache index '\
+                 'existed. Needed only once.')
 
     def handle(self, *args, **options):
         """Remove old static directories."""
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        # Get delay
-        delay = apps.get_app_config('contaminer').keep_time
-        min_date = datetime.today() - timedelta(days = delay + 1)
-        max_date = datetime.today() - timedelta(days = delay)
+        if options['index_existing']:
+            CachedJob.index_existing(Job.objects.all())
+
+        app_config = apps.get_app_config('contaminer')
+        removed = CachedJob.evict(
+            quota=app_config.cache_quota,
+            max_age=timedelta(days=app_config.keep_time))
 
-        to_clean = Job.objects.filter(
-            submission_date__range=[min_date, max_date])
+        log.info("Removed directories: " + str(removed))
 
-        for job in to_clean:
-            to_rm_dir = os.path.join(settings.MEDIA_ROOT, job.get_filename())
-            log.info("Remove directory: " + str(to_rm_dir))
-            shutil.rmtree(to_rm_dir)
-        
+        expired = UploadSession.remove_expired(
+            timedelta(days=app_config.upload_expiry))
+        log.info("Removed uploads: " + str(expired))
         log.debug("Exit")
@@ -0,0 +1,52 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Send the mails queued in the outbox.
+
+The notifications are sent through one connection to the mail server, and
+the error reports are sent to the admins as a digest. The mails sent for
+longer than config.ini -> keep_time days are removed from the outbox.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.apps import apps
+
+from contaminer.models.mail import OutboxMail
+
+
+class Command(BaseCommand):
+    """Send the pending mails of the outbox."""
+
+    help = 'Send the queued notifications and the digest of the error '\
+           'reports. The mails which cannot be sent are tried again later.'
+
+    def handle(self, *args, **options):
+        """Send the pending mails, and remove the old ones."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        delivered = OutboxMail.send_pending()
+        OutboxMail.remove_old(timedelta(
+            days=apps.get_app_config('contaminer').keep_time))
+
+        log.info("Delivered mails: " + str(delivered))
+        log.debug("Exit")
@@ -24,12 +24,21 @@ from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
 
 from contaminer.models.contabase import ContaBase
+from contaminer import metrics
 
 class Command(BaseCommand):
     """Update the ContaBase."""
 
     help = 'Synchronize the ContaBase with the remote ContaMiner installation'
 
+    def add_arguments(self, parser):
+        """Add optional argument --cluster."""
+        parser.add_argument(
+            '--cluster',
+            default=None,
+            help='Name of the cluster to read the ContaBase from (default: '\
+                 'the [SSH] and [CLUSTER] sections of config.ini).')
+
     def handle(self, *args, **options):
         """Call ContaBase.update."""
         log = logging.getLogger(__name__)
@@ -38,10 +47,12 @@ class Command(BaseCommand):
         self.stdout.write("Update ContaBase. Please wait a minute...")
 
         try:
-            ContaBase.update()
+            ContaBase.update(options.get('cluster'))
         except Exception as excep:
             raise CommandError(
                 'Update failed. Here is the reason: ' + str(excep))
+        finally:
+            metrics.write_command_metrics("update_contabase")
 
         log.debug("Exit")
         self.stdout.write('The ContaBase has been updated.')
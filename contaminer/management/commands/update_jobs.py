@@ -23,6 +23,8 @@ import logging
 from django.core.management.base import BaseCommand
 
 from contaminer.models.contaminer import Job
+from contaminer.models.admission import QueuedSubmission
+from contaminer import metrics
 
 
 class Command(BaseCommand):
@@ -33,10 +35,12 @@ class Command(BaseCommand):
             + 'archived jobs.'
 
     def handle(self, *args, **options):
-        """Update all the non-archived and submitted jobs."""
+        """Update the submitted jobs, then submit the held ones."""
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
         Job.update_all()
+        QueuedSubmission.release()
+        metrics.write_command_metrics("update_jobs")
 
         log.debug("Exit")
@@ -0,0 +1,243 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Module to manage CCP4 map files.
+
+The maps generated by MoRDa cover the whole unit cell with a fine grid, and
+are slow to load in the browser. This module prepares lighter versions for
+the viewer: a map cropped around the placed model with a coarser grid, and
+gzip compressed copies.
+"""
+
+import gzip
+import math
+import shutil
+
+import numpy as np
+
+# See http://www.ccpem.ac.uk/mrc_format/mrc2014.php
+HEADER_SIZE = 1024
+MODE_FLOAT32 = 2
+# Margin around the model kept in the cropped map, in Angstroms
+MAP_MARGIN = 5.0
+# The grid of the cropped map is DOWNSAMPLING times coarser
+DOWNSAMPLING = 2
+GRID_TOLERANCE = 1e-6
+
+
+class CCP4Map(object):
+    """A CCP4 map file (mode 2, 32 bits floats) loaded in memory."""
+
+    def __init__(self, map_filename):
+        """
+        Load map_filename.
+
+        Raise a `ValueError` if the file is not a map of 32 bits floats.
+        """
+        with open(map_filename, 'rb') as map_file:
+            header = map_file.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise ValueError("Truncated map header: " + map_filename)
+
+            # The mode is small, so it tells the endianness of the file
+            self.byteorder = '<'
+            if not 0 <= np.frombuffer(header, dtype='<i4')[3] < 100:
+                self.byteorder = '>'
+
+            # Both views share the same buffer
+            self.int_header = np.frombuffer(
+                header,
+                dtype=self.byteorder + 'i4').copy()
+            self.float_header = self.int_header.view(self.byteorder + 'f4')
+
+            if self.int_header[3] != MODE_FLOAT32:
+                raise ValueError("Unsupported map mode: " \
+                    + str(self.int_header[3]))
+
+            self.symmetry = map_file.read(self.int_header[23])
+
+            n_col, n_row, n_sec = self.int_header[0:3]
+            self.data = np.fromfile(
+                map_file,
+                dtype=self.byteorder + 'f4',
+                count=n_col * n_row * n_sec)
+            if self.data.size != n_col * n_row * n_sec:
+                raise ValueError("Truncated map data: " + map_filename)
+            self.data = self.data.reshape((n_sec, n_row, n_col))
+
+    @property
+    def cell(self):
+        """Unit cell lengths and angles (a, b, c, alpha, beta, gamma)."""
+        return [float(value) for value in self.float_header[10:16]]
+
+    @property
+    def sampling(self):
+        """Number of grid intervals along the X, Y and Z cell edges."""
+        return [int(value) for value in self.int_header[7:10]]
+
+    def get_data_axes(self):
+        """Return the crystal axis (0, 1 or 2) of each dimension of data."""
+        # data is indexed by (section, row, column)
+        map_s, map_r, map_c = self.int_header[18], self.int_header[17], \
+            self.int_header[16]
+        return [map_s - 1, map_r - 1, map_c - 1]
+
+    def get_data_start(self):
+        """Return the grid index of the first point of each data dimension."""
+        return [
+            int(self.int_header[6]),
+            int(self.int_header[5]),
+            int(self.int_header[4])]
+
+    def set_data_start(self, start):
+        """Set the grid index of the first point of each data dimension."""
+        self.int_header[6], self.int_header[5], self.int_header[4] = start
+
+    def to_fractional(self, coordinates):
+        """Convert orthogonal coordinates (n x 3 array) to fractional."""
+        a, b, c, alpha, beta, gamma = self.cell
+        alpha, beta, gamma = [
+            math.radians(angle) for angle in [alpha, beta, gamma]]
+        volume = math.sqrt(
+            1 - math.cos(alpha) ** 2 - math.cos(beta) ** 2 \
+            - math.cos(gamma) ** 2 \
+            + 2 * math.cos(alpha) * math.cos(beta) * math.cos(gamma))
+        orthogonalization = np.array([
+            [a, b * math.cos(gamma), c * math.cos(beta)],
+            [0, b * math.sin(gamma),
+             c * (math.cos(alpha) - math.cos(beta) * math.cos(gamma)) \
+                / math.sin(gamma)],
+            [0, 0, c * volume / math.sin(gamma)]])
+        return np.dot(
+            np.asarray(coordinates, dtype=float),
+            np.linalg.inv(orthogonalization).T)
+
+    def crop(self, coordinates, margin=MAP_MARGIN):
+        """
+        Keep only the region around the given orthogonal coordinates.
+
+        If the map covers the whole unit cell, the region can go across the
+        cell edges.
+        Raise a `ValueError` if the coordinates are outside the map.
+        """
+        grid = self.to_fractional(coordinates) * self.sampling
+        cell_lengths = self.cell[0:3]
+        start = self.get_data_start()
+
+        indices = []
+        new_start = []
+        for dim, axis in enumerate(self.get_data_axes()):
+            sampling = self.sampling[axis]
+            grid_margin = margin * sampling / cell_lengths[axis]
+            # Tolerance for the coordinates on the grid points
+            low = int(math.floor(
+                grid[:, axis].min() - grid_margin + GRID_TOLERANCE))
+            high = int(math.ceil(
+                grid[:, axis].max() + grid_margin - GRID_TOLERANCE)) + 1
+            size = self.data.shape[dim]
+
+            if size >= sampling:
+                dim_indices = (np.arange(low, high) - start[dim]) % sampling
+            else:
+                low = max(low, start[dim])
+                high = min(high, start[dim] + size)
+                if low >= high:
+                    raise ValueError("Coordinates are outside the map")
+                dim_indices = np.arange(low, high) - start[dim]
+
+            indices.append(dim_indices)
+            new_start.append(low)
+
+        self.data = self.data[np.ix_(*indices)]
+        self.set_data_start(new_start)
+
+    def downsample(self, factor=DOWNSAMPLING):
+        """
+        Make the grid factor times coarser.
+
+        The map is smoothed before sampling to avoid aliasing. Nothing is done
+        if the grid cannot be divided by factor.
+        :return: True if the map has been downsampled
+        """
+        if factor != 2 or any([sampling % factor \
+                               for sampling in self.sampling]):
+            return False
+
+        start = self.get_data_start()
+        new_start = []
+        for dim in range(3):
+            # Smooth with a (1, 2, 1) / 4 kernel
+            padded = np.concatenate([
+                np.take(self.data, [0], axis=dim),
+                self.data,
+                np.take(self.data, [-1], axis=dim)],
+                axis=dim)
+            length = self.data.shape[dim]
+            smoothed = (
+                np.take(padded, range(0, length), axis=dim) \
+                + 2 * self.data \
+                + np.take(padded, range(2, length + 2), axis=dim)) / 4
+
+            # Keep the points on the coarse grid
+            offset = (-start[dim]) % factor
+            self.data = np.take(
+                smoothed,
+                range(offset, length, factor),
+                axis=dim)
+            new_start.append((start[dim] + offset) // factor)
+
+        self.set_data_start(new_start)
+        self.int_header[7:10] = [
+            sampling // factor for sampling in self.sampling]
+        return True
+
+    def write(self, map_filename):
+        """Write the map in map_filename."""
+        n_sec, n_row, n_col = self.data.shape
+        self.int_header[0:3] = [n_col, n_row, n_sec]
+        self.float_header[19] = self.data.min()
+        self.float_header[20] = self.data.max()
+        self.float_header[21] = self.data.mean()
+        self.float_header[54] = self.data.std()
+
+        with open(map_filename, 'wb') as map_file:
+            map_file.write(self.int_header.tobytes())
+            map_file.write(self.symmetry)
+            map_file.write(
+                self.data.astype(self.byteorder + 'f4').tobytes())
+
+
+def make_small_map(map_filename, coordinates, small_map_filename):
+    """Write a cropped and downsampled copy of map_filename."""
+    ccp4_map = CCP4Map(map_filename)
+    ccp4_map.crop(coordinates)
+    ccp4_map.downsample()
+    ccp4_map.write(small_map_filename)
+
+
+def gzip_file(filename):
+    """Write a gzip compressed copy of filename, and return its name."""
+    gzip_filename = filename + ".gz"
+    with open(filename, 'rb') as source:
+        gzip_file_obj = gzip.open(gzip_filename, 'wb', 6)
+        try:
+            shutil.copyfileobj(source, gzip_file_obj)
+        finally:
+            gzip_file_obj.close()
+    return gzip_filename
@@ -0,0 +1,321 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Counters and timers of the communication with the cluster and of the views.
+
+The metrics are kept in memory, in the current process, and exported in the
+Prometheus text format by render. The website serves them on /metrics, and
+the management commands write them in the textfile given in config.ini.
+
+Nothing is recorded until enable is called (done in apps.py when [METRICS]
+enabled is true). A disabled metric only costs a test of a global variable.
+"""
+
+import functools
+import os
+import tempfile
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300)
+
+# Upper bounds of the buckets of the time spent in the submission queue
+QUEUE_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+ENABLED = False
+LOCK = threading.Lock()
+REGISTRY = []
+
+
+def enable(enabled=True):
+    """Start (or stop) recording the metrics."""
+    global ENABLED
+    ENABLED = enabled
+
+
+def is_enabled():
+    """Return True if the metrics are recorded."""
+    return ENABLED
+
+
+def get_labels_key(labels):
+    """Return a hashable and sorted version of the labels dictionary."""
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(labels_key, extra=None):
+    """Return the labels in the Prometheus text format."""
+    labels = list(labels_key)
+    if extra is not None:
+        labels.append(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        [name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+         + '"' for name, value in labels]) + "}"
+
+
+def format_value(value):
+    """Return value in the Prometheus text format."""
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class NullTimer(object):
+    """Timer doing nothing, given when the metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+    """Observe the time spent in a 'with' statement in a histogram."""
+
+    def __init__(self, histogram, labels):
+        """Create a timer for histogram with the given labels."""
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+        return False
+
+
+class Metric(object):
+    """Named and documented set of values, one for each set of labels."""
+
+    kind = None
+
+    def __init__(self, name, description):
+        """Create a metric and add it to the registry."""
+        self.name = name
+        self.description = description
+        self.values = {}
+        REGISTRY.append(self)
+
+    def reset(self):
+        """Forget all the values."""
+        with LOCK:
+            self.values = {}
+
+    def render(self):
+        """Return the lines of the metric in the Prometheus text format."""
+        lines = [
+            "# HELP " + self.name + " " + self.description,
+            "# TYPE " + self.name + " " + self.kind,
+            ]
+        with LOCK:
+            values = sorted(self.values.items())
+        for labels_key, value in values:
+            lines.extend(self.render_value(labels_key, value))
+        return lines
+
+    def render_value(self, labels_key, value):
+        """Return the lines giving value in the Prometheus text format."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Value which can only increase."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the counter."""
+        if not ENABLED:
+            return
+        labels_key = get_labels_key(labels)
+        with LOCK:
+            self.values[labels_key] = self.values.get(labels_key, 0) + amount
+
+    def get(self, **labels):
+        """Return the current value of the counter."""
+        return self.values.get(get_labels_key(labels), 0)
+
+    def render_value(self, labels_key, value):
+        return [self.name + format_labels(labels_key) + " "
+                + format_value(value)]
+
+
+class Histogram(Metric):
+    """Distribution of durations, counted in buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        """Create a histogram with the given bucket upper bounds."""
+        super(Histogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Add value to the distribution."""
+        if not ENABLED:
+            return
+        labels_key = get_labels_key(labels)
+        with LOCK:
+            if labels_key not in self.values:
+                self.values[labels_key] = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0,
+                    }
+            data = self.values[labels_key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data['buckets'][index] += 1
+                    break
+            data['sum'] += value
+            data['count'] += 1
+
+    def time(self, **labels):
+        """Return a context manager observing the time spent inside."""
+        if not ENABLED:
+            return NULL_TIMER
+        return Timer(self, labels)
+
+    def timed(self, func):
+        """Decorate func to observe the time spent in each call."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            """Call func, and observe the time spent."""
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Timer(self, {}):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def get_count(self, **labels):
+        """Return the number of observations."""
+        data = self.values.get(get_labels_key(labels))
+        if data is None:
+            return 0
+        return data['count']
+
+    def render_value(self, labels_key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value['buckets']):
+            cumulative += count
+            lines.append(
+                self.name + "_bucket"
+                + format_labels(labels_key, ('le', format_value(bound)))
+                + " " + str(cumulative))
+        lines.append(self.name + "_sum" + format_labels(labels_key)
+                     + " " + format_value(value['sum']))
+        lines.append(self.name + "_count" + format_labels(labels_key)
+                     + " " + str(value['count']))
+        return lines
+
+
+def render():
+    """Return all the metrics in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def write(filename):
+    """
+    Write all the metrics in filename, in the Prometheus text format.
+
+    The file is replaced atomically, so it can be read at any time by the
+    textfile collector of the node exporter.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, tmp_filename = tempfile.mkstemp(dir=directory)
+    with os.fdopen(file_descriptor, 'w') as metrics_file:
+        metrics_file.write(render())
+    os.chmod(tmp_filename, 0o644)
+    os.rename(tmp_filename, filename)
+
+
+def write_command_metrics(command):
+    """
+    Write the metrics of a management command in the textfile directory.
+
+    Nothing is done if the metrics are disabled, or if no directory is given
+    in config.ini.
+    """
+    # Imported here to keep this module free of Django when only timing
+    from django.apps import apps
+    directory = apps.get_app_config('contaminer').metrics_directory
+    if not ENABLED or not directory:
+        return
+    write(os.path.join(directory, "contaminer_" + command + ".prom"))
+
+
+def reset():
+    """Forget the values of all the metrics."""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+SSH_CONNECT = Histogram(
+    "contaminer_ssh_connect_seconds",
+    "Time to open an SSH connection to the cluster.")
+SSH_COMMAND = Histogram(
+    "contaminer_ssh_command_seconds",
+    "Time to run a command on the cluster, connection included.")
+SSH_COMMAND_ERRORS = Counter(
+    "contaminer_ssh_command_errors_total",
+    "Number of commands writing on stderr.")
+SFTP_TRANSFER = Histogram(
+    "contaminer_sftp_transfer_seconds",
+    "Time to send (put) or get (get) a file, connection included.")
+SFTP_BYTES = Counter(
+    "contaminer_sftp_bytes_total",
+    "Number of bytes sent (put) or received (get) by SFTP.")
+AGENT_REQUEST = Histogram(
+    "contaminer_agent_request_seconds",
+    "Time to answer a request sent to the remote agent, by operation.")
+JOB_UPDATE = Histogram(
+    "contaminer_job_update_seconds",
+    "Time to update a job (tasks and status).")
+JOB_UPDATE_TASKS = Histogram(
+    "contaminer_job_update_tasks_seconds",
+    "Time to read and ingest results.txt of a job.")
+TASK_UPDATE = Histogram(
+    "contaminer_task_update_seconds",
+    "Time to update a task from one line of results.txt.")
+CONTABASE_UPDATE = Histogram(
+    "contaminer_contabase_update_seconds",
+    "Time to update the ContaBase from the cluster.")
+VIEW = Histogram(
+    "contaminer_view_seconds",
+    "Time to answer a request, serialization included.")
+QUEUE_WAIT = Histogram(
+    "contaminer_queue_wait_seconds",
+    "Time spent by a job in the submission queue, by owner and lane. "
+    "The owners without weight in config.ini are labelled default.",
+    buckets=QUEUE_BUCKETS)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0006_change_uniprot_id_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.BigIntegerField(default=0)),
+                ('last_access', models.DateTimeField(db_index=True)),
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='contaminer.Job')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0007_cachedjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='r_work',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='resolution',
+            field=models.FloatField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def merge_duplicates(model, fields, children):
+    """
+    Keep only the last row of model for each value of fields.
+
+    The rows referencing a removed duplicate are moved to the kept row.
+    :param children: list of (model, foreign key) referencing model.
+    """
+    duplicates = model.objects.values(*fields)\
+        .annotate(count=models.Count('id'), last_id=models.Max('id'))\
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        removed_ids = list(model.objects.filter(
+            **dict([(field, duplicate[field]) for field in fields]))\
+            .exclude(id=duplicate['last_id'])\
+            .values_list('id', flat=True))
+        for child_model, foreign_key in children:
+            child_model.objects.filter(
+                **{foreign_key + '__in': removed_ids})\
+                .update(**{foreign_key: duplicate['last_id']})
+        model.objects.filter(id__in=removed_ids).delete()
+
+
+def remove_duplicate_contabase_entries(apps, schema_editor):
+    """
+    Merge the duplicated categories, contaminants and packs.
+
+    The contaminants of a removed category, the packs, references and
+    suggestions of a removed contaminant, and the tasks of a removed pack are
+    moved to the kept entry. The models of a removed pack are dropped: the
+    kept pack already describes them.
+    """
+    Category = apps.get_model('contaminer', 'Category')
+    Contaminant = apps.get_model('contaminer', 'Contaminant')
+    Pack = apps.get_model('contaminer', 'Pack')
+    merge_duplicates(
+        Category,
+        ['contabase', 'number'],
+        [(Contaminant, 'category')])
+    merge_duplicates(
+        Contaminant,
+        ['category', 'uniprot_id'],
+        [(Pack, 'contaminant'),
+         (apps.get_model('contaminer', 'Reference'), 'contaminant'),
+         (apps.get_model('contaminer', 'Suggestion'), 'contaminant')])
+    merge_duplicates(
+        Pack,
+        ['contaminant', 'number'],
+        [(apps.get_model('contaminer', 'Task'), 'pack')])
+
+
+def remove_duplicate_tasks(apps, schema_editor):
+    """Keep only the last task for each (job, pack, space_group)."""
+    Task = apps.get_model('contaminer', 'Task')
+    duplicates = Task.objects.values('job', 'pack', 'space_group')\
+        .annotate(count=models.Count('id'), last_id=models.Max('id'))\
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        Task.objects.filter(
+            job=duplicate['job'],
+            pack=duplicate['pack'],
+            space_group=duplicate['space_group'],
+            ).exclude(id=duplicate['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0008_task_refinement_statistics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='submission_date',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(
+            remove_duplicate_contabase_entries,
+            migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together=set([('contabase', 'number')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contaminant',
+            unique_together=set([('category', 'uniprot_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pack',
+            unique_together=set([('contaminant', 'number')]),
+        ),
+        migrations.RunPython(
+            remove_duplicate_tasks,
+            migrations.RunPython.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='task',
+            unique_together=set([('job', 'pack', 'space_group')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('status_archived', 'status_submitted')]),
+        ),
+    ]
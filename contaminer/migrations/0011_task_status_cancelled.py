@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0010_outboxmail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='status_cancelled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
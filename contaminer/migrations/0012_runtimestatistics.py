@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0011_task_status_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuntimeStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('residues_class', models.IntegerField()),
+                ('space_group', models.CharField(max_length=15)),
+                ('data_class', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_squares', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'runtime statistics',
+            },
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='data_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='runtimestatistics',
+            unique_together=set([('residues_class', 'space_group', 'data_class')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0012_runtimestatistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('window_start', models.DateTimeField(default=django.utils.timezone.now)),
+                ('window_tasks', models.IntegerField(default=0)),
+                ('throughput', models.FloatField(default=0)),
+                ('consecutive_failures', models.IntegerField(default=0)),
+                ('last_failure', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='cluster',
+            field=models.CharField(default=b'default', max_length=50),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0014_queuedsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedsubmission',
+            name='finish_tag',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='queuedsubmission',
+            name='interactive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='queuedsubmission',
+            name='owner',
+            field=models.CharField(default=b'anonymous', max_length=254),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0015_queue_fair_share'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clusterstate',
+            name='probe_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0016_cluster_circuit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='results_mtime',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='results_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0018_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='reserved',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0019_job_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedsubmission',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contaminer', '0020_queued_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='status_checked',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,286 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Admission control of the new jobs.
+
+max_jobs and max_tasks in config.ini limit the jobs and tasks in flight on
+each cluster (submitted and not finished, counted in the Job and Task
+tables). When no cluster is below its limits, a new submission is held in
+the database with the path of its saved files, and keeps the "New" status.
+The held submissions are sent by the update_jobs command, as soon as a
+cluster is below its limits again. An admitted submission reserves its
+cluster at once, so the submissions arriving while it is sent see it.
+
+The queue is shared fairly between its owners (the user if logged in, the
+e-mail address otherwise) by weighted fair queuing: each submission gets a
+finish tag, one 1/weight step after the last queued submission of its owner,
+or after the smallest tag in the queue if the owner is not queued. The
+submissions are sent by increasing tags, so an owner holding hundreds of
+jobs gets its share, but does not delay the others more than its weight.
+The weights are given in the [QUEUE] section of config.ini.
+
+The submissions from the web form are in an interactive lane, sent before
+the ones from the API, unless interactive_priority is false.
+"""
+
+import os
+import logging
+import threading
+
+from django.apps import apps
+from django.db import models
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
+from django.utils import timezone
+
+from .. import metrics
+from ..ssh_tools import ClusterUnavailable
+from .cluster import ClusterState
+from .mail import OutboxMail
+
+# Owner of the submissions without user nor e-mail address
+ANONYMOUS = "anonymous"
+
+# Failed submissions of a held job before it is put in error
+MAX_SUBMIT_ATTEMPTS = 3
+
+# Makes the admission of a submission and the reservation of its cluster
+# atomic between the threads of the webserver
+ADMISSION_LOCK = threading.Lock()
+
+
+class QueuedSubmission(models.Model):
+    """
+    Submission held until a cluster can take it.
+
+    :job: The job to submit.
+    :filepath: Local path of the diffraction data file.
+    :contaminants: List of contaminants, as given to Job.submit.
+    :custom_contaminants: Local paths of the custom models, one per line.
+    :created: When the submission has been held.
+    :owner: Username of the author, or e-mail address, sharing the queue.
+    :interactive: True if submitted with the web form.
+    :finish_tag: Virtual finish time, giving the order of the submissions.
+    :attempts: Number of failed submissions.
+    """
+
+    job = models.OneToOneField('Job')
+    filepath = models.CharField(max_length=255)
+    contaminants = models.TextField()
+    custom_contaminants = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    owner = models.CharField(max_length=254, default=ANONYMOUS)
+    interactive = models.BooleanField(default=False)
+    finish_tag = models.FloatField(default=0)
+    attempts = models.IntegerField(default=0)
+
+    def __str__(self):
+        """Write the job and the date."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write the job and the date."""
+        return str(self.job_id) + " - " + str(self.created)
+
+    @classmethod
+    def must_hold(cls):
+        """Return True if a new submission has to wait in the queue."""
+        if not ClusterState.is_admission_enabled():
+            return False
+        # Keep the order of the submissions
+        if cls.objects.exists():
+            return True
+        return not ClusterState.get_open_clusters()
+
+    @classmethod
+    def admit(cls, jobs):
+        """
+        Return True if jobs can be submitted now, reserving their cluster.
+
+        The decision and the reservation are made under ADMISSION_LOCK, so a
+        burst of submissions cannot all pass before the first one is
+        submitted. Across processes, only the time of a few queries is left
+        between them.
+        """
+        with ADMISSION_LOCK:
+            if cls.must_hold():
+                return False
+            if ClusterState.is_admission_enabled():
+                ClusterState.reserve(jobs)
+            return True
+
+    @staticmethod
+    def get_owner(job):
+        """Return the owner of job: the username, or the e-mail address."""
+        if job.author is not None:
+            return job.author.get_username()
+        if job.email:
+            return job.email.lower()
+        return ANONYMOUS
+
+    @staticmethod
+    def get_weight(owner):
+        """Return the weight of owner given in config.ini."""
+        app_config = apps.get_app_config('contaminer')
+        return float(app_config.queue_weights.get(
+            owner.lower(),
+            app_config.queue_default_weight))
+
+    @staticmethod
+    def get_owner_class(owner):
+        """
+        Return the owner as given in the metrics: the owner if it has a
+        weight in config.ini, "default" otherwise.
+
+        The metrics are public: the e-mail addresses of the other owners are
+        not shown, and the number of labels stays bounded.
+        """
+        if owner.lower() in apps.get_app_config('contaminer').queue_weights:
+            return owner.lower()
+        return "default"
+
+    @staticmethod
+    def get_order():
+        """Return the fields giving the order of the queue."""
+        app_config = apps.get_app_config('contaminer')
+        if app_config.queue_interactive_priority:
+            return ['-interactive', 'finish_tag', 'id']
+        return ['finish_tag', 'id']
+
+    @classmethod
+    def hold(cls, job, filepath, contaminants, custom_contaminants=[],
+             interactive=False):
+        """
+        Put the submission of job in the queue.
+
+        :param interactive: True if submitted with the web form.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(job))
+
+        owner = cls.get_owner(job)
+        # The virtual time is the smallest tag still queued
+        virtual_time = cls.objects.aggregate(
+            Min('finish_tag'))['finish_tag__min'] or 0
+        last_tag = cls.objects.filter(owner=owner).aggregate(
+            Max('finish_tag'))['finish_tag__max'] or 0
+        finish_tag = max(virtual_time, last_tag) + 1 / cls.get_weight(owner)
+
+        queued = cls.objects.create(
+            job=job,
+            filepath=filepath,
+            contaminants=contaminants,
+            custom_contaminants='\n'.join(custom_contaminants),
+            owner=owner,
+            interactive=interactive,
+            finish_tag=finish_tag)
+        log.info("Job " + str(job.id) + " of " + owner \
+            + " held in the submission queue")
+
+        log.debug("Exit")
+        return queued
+
+    def get_custom_contaminants(self):
+        """Return the list of the custom models."""
+        return [path for path in self.custom_contaminants.split('\n')
+                if path]
+
+    @classmethod
+    def get_position(cls, job):
+        """Return the position of job in the queue (from 1), or None."""
+        try:
+            queued = cls.objects.get(job=job)
+        except cls.DoesNotExist:
+            return None
+        before = Q(finish_tag__lt=queued.finish_tag) \
+            | Q(finish_tag=queued.finish_tag, id__lt=queued.id)
+        if apps.get_app_config('contaminer').queue_interactive_priority:
+            if queued.interactive:
+                before &= Q(interactive=True)
+            else:
+                before |= Q(interactive=True)
+        return cls.objects.filter(before).count() + 1
+
+    @classmethod
+    def release(cls):
+        """
+        Submit the held jobs, fairly, while a cluster is below its limits.
+
+        A submission failing because the cluster is unavailable stays in the
+        queue, and the next ones wait for the next call. A submission failing
+        otherwise is tried again at the next calls, after the other ones. It
+        is put in error after MAX_SUBMIT_ATTEMPTS failures.
+        :returns: the number of submitted jobs.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        released = 0
+        failed_ids = []
+        while ClusterState.get_open_clusters():
+            queued = cls.objects.select_related('job')\
+                .exclude(id__in=failed_ids)\
+                .order_by(*cls.get_order()).first()
+            if queued is None:
+                break
+
+            if not os.path.isfile(queued.filepath):
+                log.error("Missing file of held job " + str(queued.job_id) \
+                    + ": " + queued.filepath)
+                queued.job.status_error = True
+                queued.job.save()
+                queued.delete()
+                continue
+
+            try:
+                queued.job.submit(
+                    queued.filepath,
+                    queued.contaminants,
+                    custom_contaminants=queued.get_custom_contaminants())
+            except ClusterUnavailable as excep:
+                log.warning("Cluster unavailable for held job " \
+                    + str(queued.job_id) + ": " + str(excep))
+                break
+            except Exception as excep:
+                log.error("Unable to submit held job " \
+                    + str(queued.job_id) + ": " + str(excep))
+                queued.attempts += 1
+                if queued.attempts < MAX_SUBMIT_ATTEMPTS:
+                    queued.save()
+                    failed_ids.append(queued.id)
+                    continue
+                queued.job.status_error = True
+                queued.job.save()
+                queued.delete()
+                OutboxMail.queue_report(
+                    "Submission error",
+                    "Held job put in error after " \
+                        + str(MAX_SUBMIT_ATTEMPTS) + " attempts: " \
+                        + str(queued.job) + "\n" + str(excep))
+                continue
+            metrics.QUEUE_WAIT.observe(
+                (timezone.now() - queued.created).total_seconds(),
+                owner=cls.get_owner_class(queued.owner),
+                lane="interactive" if queued.interactive else "api")
+            queued.delete()
+            released += 1
+
+        log.debug("Exit with: " + str(released))
+        return released
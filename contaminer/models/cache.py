@@ -0,0 +1,175 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Cache of the result files stored in MEDIA_ROOT.
+
+The final files downloaded from the cluster are kept in one directory per
+job in MEDIA_ROOT. This module keeps an index of these directories (size and
+last access) so the least recently used ones can be removed when the cache
+grows over its quota, without walking through MEDIA_ROOT.
+The files of an evicted job are still on the cluster, and are downloaded
+again the next time they are requested.
+"""
+
+import os
+import errno
+import shutil
+import logging
+
+from django.db import models
+from django.db.models import F
+from django.db.models import Sum
+from django.conf import settings
+from django.utils import timezone
+
+
+class CachedJob(models.Model):
+    """
+    Index entry for the files of one job stored in MEDIA_ROOT.
+
+    :job: The job owning the directory.
+    :size: Total size in bytes of the files downloaded for this job.
+    :last_access: Last time a file of this job has been downloaded or served.
+    """
+
+    job = models.OneToOneField('Job')
+    size = models.BigIntegerField(default=0)
+    last_access = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        """Write job id and size."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write job id and size."""
+        return str(self.job_id) + " - " + str(self.size) + " bytes"
+
+    def get_directory(self):
+        """Return the absolute path of the cached directory."""
+        return os.path.join(settings.MEDIA_ROOT, self.job.get_filename())
+
+    @classmethod
+    def add(cls, job, size):
+        """
+        Add size bytes to the cache entry of job, and mark it as accessed.
+
+        The entry is created if it does not exist yet.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(job) + " " + str(size))
+
+        now = timezone.now()
+        entry, created = cls.objects.get_or_create(
+            job=job,
+            defaults={'size': size, 'last_access': now})
+        if not created:
+            cls.objects.filter(pk=entry.pk).update(
+                size=F('size') + size,
+                last_access=now)
+
+        log.debug("Exit")
+
+    @classmethod
+    def touch(cls, job):
+        """Mark the files of job as accessed now."""
+        cls.objects.filter(job=job).update(last_access=timezone.now())
+
+    @classmethod
+    def total_size(cls):
+        """Return the total size in bytes of the cached files."""
+        total = cls.objects.aggregate(total=Sum('size'))['total']
+        return total or 0
+
+    def remove(self):
+        """Remove the cached directory from MEDIA_ROOT and this entry."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        directory = self.get_directory()
+        log.info("Remove directory: " + str(directory))
+        try:
+            shutil.rmtree(directory)
+        except OSError as excep:
+            if excep.errno != errno.ENOENT:
+                raise
+            log.warning("Directory already removed: " + str(directory))
+
+        self.delete()
+
+        log.debug("Exit")
+
+    @classmethod
+    def evict(cls, quota=None, max_age=None):
+        """
+        Remove the least recently used directories.
+
+        :param quota: maximum total size in bytes of the cache. If given, the
+        least recently used directories are removed until the total size is
+        below the quota.
+        :param max_age: timedelta. If given, the directories not accessed for
+        longer than max_age are removed.
+        :return: the number of removed directories.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        removed = 0
+
+        if max_age is not None:
+            min_date = timezone.now() - max_age
+            for entry in cls.objects.filter(last_access__lt=min_date)\
+                    .select_related('job'):
+                entry.remove()
+                removed += 1
+
+        if quota:
+            total = cls.total_size()
+            entries = cls.objects.order_by('last_access')\
+                .select_related('job').iterator()
+            for entry in entries:
+                if total <= quota:
+                    break
+                total -= entry.size
+                entry.remove()
+                removed += 1
+
+        log.debug("Exit with: " + str(removed))
+        return removed
+
+    @classmethod
+    def index_existing(cls, jobs):
+        """
+        Create the missing entries for the directories of jobs.
+
+        Only needed once for the files downloaded before the index existed.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        indexed = cls.objects.values_list('job_id', flat=True)
+        for job in jobs.exclude(id__in=indexed):
+            directory = os.path.join(settings.MEDIA_ROOT, job.get_filename())
+            if not os.path.isdir(directory):
+                continue
+            size = sum([
+                os.path.getsize(os.path.join(directory, filename))
+                for filename in os.listdir(directory)])
+            cls.add(job, size)
+
+        log.debug("Exit")
@@ -0,0 +1,360 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+State of the clusters, to choose where the new jobs are submitted.
+
+When several clusters are given in config.ini, a new job is placed on the
+healthy cluster which should drain its queue first: the number of jobs
+waiting or running on the cluster, divided by its recent throughput (tasks
+complete per hour). A cluster is unhealthy after several consecutive
+failures, until a delay passed since the last one.
+
+When max_jobs or max_tasks are given for a cluster, the jobs are only
+placed on the clusters below their limits (see admission.py). A job admitted
+is reserved on its cluster, and counts in flight while it is sent, before
+being submitted.
+
+The health of a cluster is also a circuit breaker for the connections
+opened by ssh_tools. The circuit is closed while the cluster works. After
+MAX_FAILURES consecutive failures (connection errors and timeouts included),
+it is open: the connections fail at once, without waiting for the cluster.
+Once HEALTH_RETRY_DELAY passed, it is half-open: one connection at a time is
+allowed to probe the cluster, and closes the circuit if it succeeds.
+
+The state is kept in the database, so the website and the update_jobs
+command share it.
+"""
+
+import logging
+import datetime
+
+from django.db import models
+from django.db.models import Count
+from django.db.models import Q
+from django.utils import timezone
+
+from ..clusters import get_cluster
+from ..clusters import get_cluster_names
+
+# Duration of the windows measuring the throughput (in seconds)
+THROUGHPUT_WINDOW = 3600
+
+# Weight of the last window in the throughput
+THROUGHPUT_SMOOTHING = 0.5
+
+# Consecutive failures making a cluster unhealthy
+MAX_FAILURES = 3
+
+# Seconds before an unhealthy cluster is tried again
+HEALTH_RETRY_DELAY = 600
+
+# Seconds a job admitted on a cluster counts in flight before being submitted
+RESERVATION_TIMEOUT = 3600
+
+# States of the circuit breaker of a cluster
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ClusterState(models.Model):
+    """
+    Health and throughput of a cluster.
+
+    :name: Name of the cluster in config.ini.
+    :window_start: Start of the current throughput window.
+    :window_tasks: Number of tasks complete since window_start.
+    :throughput: Smoothed number of tasks complete per hour, 0 if unknown.
+    :consecutive_failures: Failed submissions or updates since the last
+    success.
+    :last_failure: Date of the last failure.
+    :probe_time: Start of the connection probing the cluster, when the
+    circuit is half-open.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    window_start = models.DateTimeField(default=timezone.now)
+    window_tasks = models.IntegerField(default=0)
+    throughput = models.FloatField(default=0)
+    consecutive_failures = models.IntegerField(default=0)
+    last_failure = models.DateTimeField(null=True, blank=True)
+    probe_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """Write the name and the throughput."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write the name and the throughput."""
+        return str(self.name) + ": " + str(round(self.throughput, 1)) \
+            + " tasks/h, " + str(self.consecutive_failures) + " failures"
+
+    def is_healthy(self, now=None):
+        """Return False if the cluster failed too many times recently."""
+        if self.consecutive_failures < MAX_FAILURES:
+            return True
+        now = now or timezone.now()
+        return (now - self.last_failure).total_seconds() \
+            >= HEALTH_RETRY_DELAY
+
+    def get_circuit_state(self, now=None):
+        """Return the state of the circuit: CLOSED, OPEN or HALF_OPEN."""
+        if self.consecutive_failures < MAX_FAILURES:
+            return CLOSED
+        if not self.is_healthy(now):
+            return OPEN
+        return HALF_OPEN
+
+    @classmethod
+    def get_circuit(cls, name):
+        """Return the state of the circuit breaker of the cluster name."""
+        state = cls.objects.filter(name=name).first()
+        if state is None:
+            return CLOSED
+        return state.get_circuit_state()
+
+    @classmethod
+    def allow_request(cls, name):
+        """
+        Return True if a connection to the cluster name can be opened.
+
+        When the circuit is half-open, only the first caller gets True, until
+        the probe succeeds or fails. A probe older than HEALTH_RETRY_DELAY is
+        considered lost, and replaced.
+        """
+        state = cls.objects.filter(name=name).first()
+        if state is None:
+            return True
+        now = timezone.now()
+        circuit = state.get_circuit_state(now)
+        if circuit != HALF_OPEN:
+            return circuit == CLOSED
+
+        lost_probe = now - datetime.timedelta(seconds=HEALTH_RETRY_DELAY)
+        claimed = cls.objects\
+            .filter(id=state.id)\
+            .filter(Q(probe_time__isnull=True)
+                    | Q(probe_time__lt=lost_probe))\
+            .update(probe_time=now)
+        if claimed:
+            logging.getLogger(__name__).info(
+                "Probe half-open cluster: " + str(name))
+        return claimed == 1
+
+    @classmethod
+    def record_completion(cls, name, nb_tasks):
+        """Count nb_tasks newly complete tasks in the throughput of name."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(name) + " " + str(nb_tasks))
+
+        state, _ = cls.objects.get_or_create(name=name)
+        now = timezone.now()
+        elapsed = (now - state.window_start).total_seconds()
+        if elapsed >= THROUGHPUT_WINDOW:
+            # A longer window means the cluster was idle, which says nothing
+            # about its throughput
+            if elapsed < 2 * THROUGHPUT_WINDOW and state.window_tasks:
+                rate = state.window_tasks * 3600.0 / elapsed
+                if state.throughput:
+                    rate = THROUGHPUT_SMOOTHING * rate \
+                        + (1 - THROUGHPUT_SMOOTHING) * state.throughput
+                state.throughput = rate
+            state.window_start = now
+            state.window_tasks = 0
+        state.window_tasks += nb_tasks
+        state.save()
+
+        log.debug("Exit")
+
+    @classmethod
+    def record_failure(cls, name):
+        """Count a failure of the cluster name."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(name))
+
+        state, _ = cls.objects.get_or_create(name=name)
+        state.consecutive_failures += 1
+        state.last_failure = timezone.now()
+        state.probe_time = None
+        state.save()
+        if state.consecutive_failures == MAX_FAILURES:
+            log.error("Cluster " + str(name) + " is unhealthy after " \
+                + str(MAX_FAILURES) + " failures.")
+
+        log.debug("Exit")
+
+    @classmethod
+    def record_success(cls, name):
+        """Reset the failures of the cluster name, closing its circuit."""
+        cls.objects.filter(name=name, consecutive_failures__gt=0)\
+            .update(consecutive_failures=0, probe_time=None)
+
+    @classmethod
+    def get_queue_depths(cls):
+        """Return the number of unfinished jobs placed on each cluster."""
+        # contaminer.py imports this module
+        from .contaminer import Job
+        depths = Job.objects\
+            .filter(status_archived=False, status_error=False)\
+            .order_by()\
+            .values('cluster')\
+            .annotate(jobs=Count('id'))
+        return dict([(depth['cluster'], depth['jobs']) for depth in depths])
+
+    @staticmethod
+    def is_admission_enabled():
+        """Return True if a cluster limits its jobs or tasks in flight."""
+        for name in get_cluster_names():
+            cluster_config = get_cluster(name)
+            if cluster_config.max_jobs or cluster_config.max_tasks:
+                return True
+        return False
+
+    @staticmethod
+    def get_in_flight():
+        """
+        Return the jobs and the tasks in flight on each cluster.
+
+        A job is in flight once reserved on its cluster (for at most
+        RESERVATION_TIMEOUT) or submitted, until it is complete or in error.
+        Its tasks are in flight until they are complete, in error or
+        cancelled.
+        :returns: (jobs, tasks), two dictionaries giving a number for each
+        cluster name.
+        """
+        # contaminer.py imports this module
+        from .contaminer import Job
+        from .contaminer import Task
+        reserved_since = timezone.now() \
+            - datetime.timedelta(seconds=RESERVATION_TIMEOUT)
+        jobs = Job.objects.filter(
+            Q(status_submitted=True) | Q(reserved__gte=reserved_since),
+            status_complete=False,
+            status_error=False,
+            status_archived=False)
+        tasks = Task.objects.filter(
+            job__in=jobs,
+            status_complete=False,
+            status_error=False,
+            status_cancelled=False)
+        jobs_per_cluster = jobs.order_by().values('cluster')\
+            .annotate(count=Count('id'))
+        tasks_per_cluster = tasks.order_by().values('job__cluster')\
+            .annotate(count=Count('id'))
+        return (
+            dict([(row['cluster'], row['count'])
+                  for row in jobs_per_cluster]),
+            dict([(row['job__cluster'], row['count'])
+                  for row in tasks_per_cluster]))
+
+    @classmethod
+    def reserve(cls, jobs):
+        """
+        Place jobs on one cluster before submitting them.
+
+        The jobs count in flight on this cluster from now on, so the next
+        submissions see them even before they are submitted.
+        :returns: the name of the cluster.
+        """
+        cluster = cls.choose_cluster()
+        now = timezone.now()
+        for job in jobs:
+            job.cluster = cluster
+            job.reserved = now
+            job.save()
+        return cluster
+
+    @classmethod
+    def get_open_clusters(cls):
+        """
+        Return the names of the clusters which can take a new job.
+
+        Without limits in config.ini, all the clusters are open. Otherwise,
+        the healthy clusters below their max_jobs and max_tasks are open.
+        """
+        names = get_cluster_names()
+        if not cls.is_admission_enabled():
+            return names
+
+        now = timezone.now()
+        unhealthy = set([
+            state.name
+            for state in cls.objects.filter(name__in=names)
+            if not state.is_healthy(now)])
+        jobs, tasks = cls.get_in_flight()
+        open_names = []
+        for name in names:
+            cluster_config = get_cluster(name)
+            if name in unhealthy:
+                continue
+            if cluster_config.max_jobs \
+                    and jobs.get(name, 0) >= cluster_config.max_jobs:
+                continue
+            if cluster_config.max_tasks \
+                    and tasks.get(name, 0) >= cluster_config.max_tasks:
+                continue
+            open_names.append(name)
+        return open_names
+
+    @classmethod
+    def choose_cluster(cls):
+        """
+        Return the name of the cluster where a new job should be placed.
+
+        The healthy cluster with the lowest (jobs + 1) / throughput is
+        chosen, among the clusters below their limits if any. Without a
+        measured throughput, the number of slots of the cluster is used, as
+        if each task took one hour. The default cluster is chosen if all the
+        clusters are unhealthy.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        names = get_cluster_names()
+        if len(names) == 1:
+            log.debug("Exit")
+            return names[0]
+        names = cls.get_open_clusters() or names
+
+        now = timezone.now()
+        states = dict([
+            (state.name, state)
+            for state in cls.objects.filter(name__in=names)])
+        depths = cls.get_queue_depths()
+        best_name = None
+        best_score = None
+        for name in names:
+            state = states.get(name)
+            if state is not None and not state.is_healthy(now):
+                log.info("Skip unhealthy cluster: " + str(state))
+                continue
+            rate = state.throughput if state is not None else 0
+            if not rate:
+                rate = max(get_cluster(name).slots, 1)
+            score = (depths.get(name, 0) + 1) / float(rate)
+            if best_score is None or score < best_score:
+                best_name = name
+                best_score = score
+
+        if best_name is None:
+            log.warning("No healthy cluster, use the default one.")
+            best_name = names[0]
+
+        log.debug("Exit with: " + str(best_name))
+        return best_name
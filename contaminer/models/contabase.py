@@ -35,7 +35,8 @@ from django.core.exceptions import ValidationError
 
 from .tools import UpperCaseCharField
 from .tools import PercentageField
-from ..ssh_tools import SSHChannel
+from ..backends import get_backend
+from .. import metrics
 
 class ContaBase(models.Model):
     """
@@ -83,18 +84,31 @@ class ContaBase(models.Model):
         log.debug("Exit")
 
     @classmethod
-    def update(cls):
-        """Update the ContaBase based on the data on the remote cluster."""
+    @metrics.CONTABASE_UPDATE.timed
+    def update(cls, cluster=None):
+        """
+        Update the ContaBase based on the data on the remote cluster.
+
+        The ContaBase is read on cluster, the default one if None. All the
+        clusters are expected to have the same ContaBase.
+        """
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
+        # The XML is parsed as it arrives. Only its beginning is kept, to
+        # give the message of ContaMiner if it is not XML.
         parser = ET.XMLParser(remove_blank_text=True)
-        contabase_raw = SSHChannel().get_contabase()
+        contabase_head = ""
         try:
-            contabase = ET.XML(contabase_raw, parser)
+            for chunk in get_backend(cluster).iter_contabase():
+                if len(contabase_head) < 1024:
+                    contabase_head += chunk
+                parser.feed(chunk)
+            contabase = parser.close()
         except ET.XMLSyntaxError:
-            if "not ready" in contabase_raw:
-                raise RuntimeError(contabase_raw)
+            if "not ready" in contabase_head:
+                raise RuntimeError(contabase_head)
+            raise
 
         cls.make_all_obsolete()
 
@@ -133,6 +147,9 @@ class Category(models.Model):
     name = models.CharField(max_length=60)
     selected_by_default = models.BooleanField(default=False)
 
+    class Meta:
+        unique_together = ('contabase', 'number')
+
     def __str__(self):
         """Write name, selected by default, and (obsolete) if needed."""
         return unicode(self).encode('utf-8')
@@ -142,26 +159,13 @@ class Category(models.Model):
         obsolete_str = (" (obsolete)" if self.contabase.obsolete else "")
         return self.name + " - " + str(self.selected_by_default) + obsolete_str
 
-    def clean(self, *args, **kwargs):
-        """Clean the fields before saving in the database."""
-        log = logging.getLogger(__name__)
-        log.debug("Enter")
-
-        category = Category.objects.filter(
-            contabase=self.contabase,
-            number=self.number)
-        if len(category) != 0 or (len(category) == 1 and category[0].pk != self.pk):
-            raise ValidationError("Category already registered in ContaBase")
-
-        super(Category, self).clean(*args, **kwargs)
-        log.debug("Exit")
-
     def save(self, *args, **kwargs):
         """Save object in DB."""
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        self.full_clean()
+        # (contabase, number) is unique in the database
+        self.full_clean(validate_unique=False)
         super(Category, self).save(*args, **kwargs)
 
         log.debug("Exit")
@@ -173,17 +177,14 @@ class Category(models.Model):
         log.debug("Enter")
 
         number = int(category_dict.find('id').text)
-        new_category = Category()
-        new_category.contabase = parent_contabase
-        new_category.number = number # Unique per contabase
-        new_category.name = category_dict.find('name').text
         default = (category_dict.find('default').text in ['true', 'True'])
-        new_category.selected_by_default = default
-        new_category.save()
-
-        new_category = Category.objects.get(
+        new_category, _ = Category.objects.update_or_create(
             contabase=parent_contabase,
-            number=number)
+            number=number, # Unique per contabase
+            defaults={
+                'name': category_dict.find('name').text,
+                'selected_by_default': default,
+                })
 
         for contaminant in category_dict.iter('contaminant'):
             log.debug("Contaminant found")
@@ -241,6 +242,9 @@ class Contaminant(models.Model):
     sequence = models.TextField()
     organism = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        unique_together = ('category', 'uniprot_id')
+
     def __str__(self):
         """Write uniprot_id + short_name."""
         return unicode(self).encode('utf-8')
@@ -255,19 +259,15 @@ class Contaminant(models.Model):
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        uniprot_id = contaminant_dict.find('uniprot_id').text
-        new_contaminant = Contaminant()
-        new_contaminant.uniprot_id = uniprot_id
-        new_contaminant.category = parent_category
-        new_contaminant.short_name = contaminant_dict.find('short_name').text
-        new_contaminant.long_name = contaminant_dict.find('long_name').text
-        new_contaminant.sequence = contaminant_dict.find('sequence').text
-        new_contaminant.organism = contaminant_dict.find('organism').text
-        new_contaminant.save()
-
-        new_contaminant = Contaminant.objects.get(
+        new_contaminant, _ = Contaminant.objects.update_or_create(
             category=parent_category,
-            uniprot_id=uniprot_id)
+            uniprot_id=contaminant_dict.find('uniprot_id').text,
+            defaults={
+                'short_name': contaminant_dict.find('short_name').text,
+                'long_name': contaminant_dict.find('long_name').text,
+                'sequence': contaminant_dict.find('sequence').text,
+                'organism': contaminant_dict.find('organism').text,
+                })
 
         for pack in contaminant_dict.iter('pack'):
             log.debug("Pack found")
@@ -356,6 +356,9 @@ class Pack(models.Model):
                                     # per contaminant
     structure = models.CharField(max_length=15) # dimer, domain, ...
 
+    class Meta:
+        unique_together = ('contaminant', 'number')
+
     def __str__(self):
         """Write uniprot_id, short_name, number, and quaternary structure."""
         return unicode(self).encode('utf-8')
@@ -396,16 +399,12 @@ class Pack(models.Model):
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        number = len(Pack.objects.filter(contaminant=parent_contaminant)) + 1
-        new_pack = Pack()
-        new_pack.contaminant = parent_contaminant
-        new_pack.number = number # Unique per model
-        new_pack.structure = pack_dict.find('quat_structure').text
-        new_pack.save()
-
-        new_pack = Pack.objects.get(
+        number = Pack.objects.filter(contaminant=parent_contaminant).count() \
+            + 1
+        new_pack, _ = Pack.objects.update_or_create(
             contaminant=parent_contaminant,
-            number=number,)
+            number=number, # Unique per contaminant
+            defaults={'structure': pack_dict.find('quat_structure').text})
 
         for model in pack_dict.iter('model'):
             log.debug("Model found")
@@ -423,24 +422,14 @@ class Pack(models.Model):
                     + "(domain, domains, or X-mer with X a number)")
             raise ValidationError("structure is not valid")
 
-        # (contaminant, number) pair must be unique
-        similar_packs = Pack.objects.filter(
-            contaminant=self.contaminant,
-            number=self.number,
-            ).exclude(
-                pk=self.pk
-            )
-        if similar_packs:
-            log.error("This pack number already exists for this contaminant")
-            raise ValidationError("Pack already registered in database")
-
         super(Pack, self).clean(*args, **kwargs)
 
         log.debug("Exit")
 
     def save(self, *args, **kwargs):
         """Save the object in DB."""
-        self.full_clean()
+        # (contaminant, number) is unique in the database
+        self.full_clean(validate_unique=False)
         super(Pack, self).save(*args, **kwargs)
 
     def to_dict(self):
@@ -31,27 +31,54 @@ import datetime
 import logging
 import errno
 
+import numpy as np
+
 from django.apps import apps
+from django.db import connection
 from django.db import models
 from django.conf import settings
-from django.core.mail import send_mail
-from django.core.mail import mail_admins
 from django.template.loader import render_to_string
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import MultipleObjectsReturned
+from django.utils import timezone
 
 from .contabase import Category
 from .contabase import ContaBase
 from .contabase import Contaminant
 from .contabase import Model
 from .contabase import Pack
+from .cache import CachedJob
+from .mail import OutboxMail
+from .runtime import RuntimeStatistics
+from .cluster import ClusterState
 from ..pdb_tools import PDBHandler
-from ..ssh_tools import SFTPChannel
-from ..ssh_tools import SSHChannel
+from ..pdb_tools import parse_refinement_remarks
+from ..map_tools import make_small_map
+from ..map_tools import gzip_file
+from ..backends import get_backend
+from ..backends import get_solve_command
+from ..ssh_tools import ClusterUnavailable
+from ..clusters import DEFAULT_CLUSTER
+from ..clusters import get_cluster
+from .. import metrics
 from .tools import PercentageField
 
+# Separator of the elapsed time fields in results.txt
+SPACES_REGEX = re.compile(' +')
+
+# Lighter versions of the maps written for the viewer (see Task.prepare_maps)
+MAP_VARIANTS = [
+    "map.gz",
+    "diff.map.gz",
+    "small.map",
+    "small.diff.map",
+    "small.map.gz",
+    "small.diff.map.gz",
+    ]
+
+
 # pylint: disable=too-many-instance-attributes
 class Job(models.Model):
     """
@@ -66,13 +93,21 @@ class Job(models.Model):
     :status_archived: When true, the cron task will not try to make a future
     modification to the job.
     :submission_date: date of the form submission
-    :mail_sent: True if notification mail has been sent. Mainly used for
-    debugging purpose as the mail server looks unstable
+    :mail_sent: True if the notification mail of the complete job has been
+    delivered to the mail server.
     :name: Displayed name of the job on the end-user side.
     :author: User who submitted the job if he's logged in. Blank if anonymous.
     :email: E-mail address used to send any notification
     :confidential: If true, only the logged in author can see the results of
     the job.
+    :data_size: Size in bytes of the submitted diffraction data file, used to
+    estimate the execution time of the tasks.
+    :cluster: Name of the cluster running the job (see clusters.py).
+    :results_size: Size of results.txt at the last update.
+    :results_mtime: Modification time of results.txt at the last update.
+    :reserved: When the job has been admitted on its cluster, before being
+    submitted (see ClusterState.reserve).
+    :status_checked: When the status has last been read from the cluster.
     """
     # Status
     status_submitted = models.BooleanField(default=False)
@@ -83,7 +118,7 @@ class Job(models.Model):
     mail_sent = models.BooleanField(default=False)
     
     # Form fields
-    submission_date = models.DateField(auto_now_add=True)
+    submission_date = models.DateField(auto_now_add=True, db_index=True)
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         blank=True,
@@ -91,6 +126,16 @@ class Job(models.Model):
     name = models.CharField(max_length=50, blank=True, null=True)
     email = models.EmailField(blank=True, null=True)
     confidential = models.BooleanField(default=False)
+    data_size = models.BigIntegerField(blank=True, null=True)
+    cluster = models.CharField(max_length=50, default=DEFAULT_CLUSTER)
+    results_size = models.BigIntegerField(blank=True, null=True)
+    results_mtime = models.FloatField(blank=True, null=True)
+    reserved = models.DateTimeField(blank=True, null=True)
+    status_checked = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        # Used by update_all to find the jobs to update
+        index_together = ('status_archived', 'status_submitted')
 
     def __str__(self):
         """Return id (email) status."""
@@ -174,6 +219,10 @@ class Job(models.Model):
 
         return result
 
+    def get_cluster(self):
+        """Return the configuration of the cluster running the job."""
+        return get_cluster(self.cluster)
+
     def submit(self, filepath, contaminants, custom_contaminants=[]):
         """Send the files to the cluster, then launch ContaMiner."""
         # TODO: Divide in send, then launch
@@ -183,42 +232,48 @@ class Job(models.Model):
                 filepath: " + str(filepath) + "\n\
                 contaminants: " + str(contaminants))
 
+        if self.reserved is None:
+            self.cluster = ClusterState.choose_cluster()
+            self.save()
+        log.info("Job " + str(self.id) + " placed on cluster " + self.cluster)
+
         # Send files to cluster
-        remote_work_directory = \
-                apps.get_app_config('contaminer').ssh_work_directory
+        remote_work_directory = self.get_cluster().ssh_work_directory
         # Input file
         input_file_ext = os.path.splitext(filepath)[1]
-        remote_filepath = os.path.join(
-            remote_work_directory,
-            self.get_filename(suffix=input_file_ext))
-        client = SFTPChannel()
-        client.send_file(filepath, remote_work_directory)
-        # Contaminants list
-        remote_contaminants = os.path.join(
-            remote_work_directory,
-            self.get_filename(suffix='txt'))
-        client.write_file(remote_contaminants, contaminants)
-        # Custom contaminants
-        for custom_model in custom_contaminants:
-            client.send_file(custom_model, remote_work_directory)
+        backend = get_backend(self.cluster)
+        try:
+            backend.send_file(filepath, remote_work_directory)
+            # Contaminants list
+            remote_contaminants = os.path.join(
+                remote_work_directory,
+                self.get_filename(suffix='txt'))
+            backend.write_file(remote_contaminants, contaminants)
+            # Custom contaminants
+            for custom_model in custom_contaminants:
+                backend.send_file(custom_model, remote_work_directory)
+        except ClusterUnavailable:
+            raise
+        except Exception:
+            ClusterState.record_failure(self.cluster)
+            raise
 
         # Remove local file
+        self.data_size = os.path.getsize(filepath)
         os.remove(filepath)
         log.debug("Files deleted from MEDIA_ROOT: " + filepath)
 
         # Run contaminer command
-        contaminer_solve_command = os.path.join(
-            apps.get_app_config('contaminer').ssh_contaminer_location,
-            "contaminer") + " solve"
-        cd_command = 'cd "' + remote_work_directory + '"'
-
-        command = cd_command + " && "\
-            + contaminer_solve_command + " "\
-            + '"' + str(os.path.basename(remote_filepath)) + '" "'\
-            + str(os.path.basename(remote_contaminants)) + '"'
-
-        log.debug("Execute command on remote host:\n" + command)
-        stdout = SSHChannel().exec_command_in_shell(command)
+        try:
+            stdout = backend.solve(
+                remote_work_directory,
+                self.get_filename(suffix=input_file_ext),
+                self.get_filename(suffix='txt'))
+        except ClusterUnavailable:
+            raise
+        except Exception:
+            ClusterState.record_failure(self.cluster)
+            raise
 
         log.debug("stdout: " + str(stdout))
 
@@ -231,6 +286,107 @@ class Job(models.Model):
         log.debug("Job " + str(self.id) + " submitted")
         log.debug("Exiting function")
 
+    def get_solve_command(self, input_file_ext):
+        """
+        Return the command running ContaMiner on the files of self.
+
+        The command is run in the remote work directory, where the input file
+        and the list of contaminants are.
+        """
+        return get_solve_command(
+            self.cluster,
+            str(self.get_filename(suffix=input_file_ext)),
+            str(self.get_filename(suffix='txt')))
+
+    @classmethod
+    def submit_batch(cls, submissions, custom_contaminants=[]):
+        """
+        Send the files of several jobs to the cluster, then launch ContaMiner.
+
+        The files are sent in one SFTP session, and the jobs are launched
+        together (see launch_batch in backends.py). A failed launch only puts
+        its job in error. If the whole launch fails, all the jobs are put in
+        error.
+        :param submissions: list of (job, filepath, contaminants), as given to
+        submit.
+        :param custom_contaminants: PDB files shared by all the jobs.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with " + str(len(submissions)) + " jobs")
+
+        # The jobs are sent together, so they are placed on the same cluster
+        if submissions[0][0].reserved is not None:
+            cluster = submissions[0][0].cluster
+        else:
+            cluster = ClusterState.choose_cluster()
+            for (job, _, _) in submissions:
+                job.cluster = cluster
+                job.save()
+        log.info(str(len(submissions)) + " jobs placed on cluster " + cluster)
+
+        remote_work_directory = get_cluster(cluster).ssh_work_directory
+        filepaths = [filepath for (_, filepath, _) in submissions]
+        contents = [
+            (os.path.join(
+                remote_work_directory,
+                job.get_filename(suffix='txt')),
+             contaminants)
+            for (job, _, contaminants) in submissions]
+        backend = get_backend(cluster)
+        try:
+            backend.send_files(
+                filepaths + list(custom_contaminants),
+                remote_work_directory,
+                contents)
+        except ClusterUnavailable:
+            raise
+        except Exception:
+            ClusterState.record_failure(cluster)
+            raise
+
+        for (job, filepath, _) in submissions:
+            job.data_size = os.path.getsize(filepath)
+            os.remove(filepath)
+            log.debug("Files deleted from MEDIA_ROOT: " + filepath)
+
+        commands = [
+            'cd "' + remote_work_directory + '" && ' \
+                + job.get_solve_command(os.path.splitext(filepath)[1])
+            for (job, filepath, _) in submissions]
+        log.debug("Execute commands on remote host:\n" + "\n".join(commands))
+        try:
+            stdout, failed_indexes = backend.launch_batch(commands)
+        except Exception as excep:
+            if not isinstance(excep, ClusterUnavailable):
+                ClusterState.record_failure(cluster)
+            log.error("Unable to launch the jobs: " + str(excep))
+            stdout = str(excep)
+            failed_indexes = set(range(len(submissions)))
+        log.debug("stdout: " + str(stdout))
+
+        failed_jobs = []
+        for index, (job, _, _) in enumerate(submissions):
+            if index in failed_indexes:
+                log.error("Unable to launch job " + str(job.id))
+                job.status_error = True
+                job.save()
+                failed_jobs.append(job)
+                continue
+
+            job.status_submitted = True
+            job.save()
+            job.send_submitted_mail()
+            log.debug("Job " + str(job.id) + " submitted")
+
+        if failed_jobs:
+            OutboxMail.queue_report(
+                "Submission error",
+                "Error when launching the jobs: " \
+                    + ", ".join([str(job) for job in failed_jobs]) \
+                    + "\n" + str(stdout))
+
+        log.debug("Exit")
+
     def update_status(self):
         """Retrieve the status from the cluster and update it in DB."""
         log = logging.getLogger(__name__)
@@ -240,20 +396,12 @@ class Job(models.Model):
             log.warning("Archived. No modification will be recorded.")
             return
 
-        remote_work_directory = \
-                apps.get_app_config('contaminer').ssh_work_directory
-        remote_contaminer_command = os.path.join(
-            apps.get_app_config('contaminer').ssh_contaminer_location,
-            "contaminer") + " job_status"
         remote_filename = os.path.join(
-            remote_work_directory,
+            self.get_cluster().ssh_work_directory,
             self.get_filename(suffix=''))
 
-        command = remote_contaminer_command + " " + remote_filename
-
-        client = SSHChannel()
-        log.debug("Execute command on remote host:\n" + command)
-        stdout = client.exec_command_in_shell(command)
+        log.debug("Get status of remote job: " + remote_filename)
+        stdout = get_backend(self.cluster).job_status(remote_filename)
 
         log.debug("stdout: " + str(stdout))
 
@@ -277,10 +425,19 @@ class Job(models.Model):
             self.status_error = True
             log.warning("Job is in error with id: " + str(self.id))
 
+        self.status_checked = timezone.now()
         self.save()
 
         log.debug("Exit")
 
+    def get_results_path(self):
+        """Return the path of results.txt on the cluster."""
+        return os.path.join(
+            self.get_cluster().ssh_work_directory,
+            self.get_filename(suffix=''),
+            "results.txt")
+
+    @metrics.JOB_UPDATE_TASKS.timed
     def update_tasks(self):
         """Create the tasks for the job."""
         log = logging.getLogger(__name__)
@@ -293,22 +450,166 @@ class Job(models.Model):
         if not self.status_submitted:
             raise RuntimeError("Job should be submitted first.")
 
-        remote_work_dirname = os.path.join(
-            apps.get_app_config('contaminer').ssh_work_directory,
-            self.get_filename(suffix=''))
-        remote_results_filename = os.path.join(
-            remote_work_dirname,
-            "results.txt")
-        results_content = SSHChannel().read_file(remote_results_filename)
+        results_content = get_backend(self.cluster).read_file(
+            self.get_results_path())
+
+        results, malformed_lines = Task.parse_results(results_content)
+        for line_number, line in malformed_lines:
+            log.warning("Invalid line " + str(line_number) \
+                + " in results of job " + str(self.id) + ": " + str(line))
+
+        complete_tasks = set(self.task_set.filter(status_complete=True)\
+            .values_list('id', flat=True))
+        new_complete_tasks = []
+        for index in range(len(results['uniprot_id'])):
+            task = Task.update_parsed(
+                self,
+                Task.get_parsed_line(results, index))
+            if task.id in complete_tasks:
+                continue
+            if task.status_complete:
+                new_complete_tasks.append(task)
+
+        if new_complete_tasks:
+            RuntimeStatistics.record(new_complete_tasks, self.data_size)
+            ClusterState.record_completion(
+                self.cluster,
+                len(new_complete_tasks))
+        self.update_missing_statistics()
+
+        if apps.get_app_config('contaminer').early_stop:
+            self.cancel_redundant_tasks()
 
-        for line in results_content.split('\n'):
-            if line is not "":
-                Task.update(self, line)
+        log.debug("Exit")
+
+    def update_missing_statistics(self):
+        """
+        Read the refinement statistics of the positive tasks missing them.
+
+        The tasks whose statistics could not be read (cluster unavailable,
+        final file not written yet) are tried again at the next update.
+        """
+        tasks = list(self.task_set.filter(
+            status_complete=True,
+            status_error=False,
+            percent__gt=90,
+            r_free__isnull=True))
+        Task.update_refinement_statistics(tasks)
+
+    def cancel_redundant_tasks(self):
+        """
+        Cancel the unfinished tasks of the contaminants already found.
+
+        A contaminant is found when one of its tasks is complete with a
+        percent above the positive threshold. The other tasks of this
+        contaminant are cancelled on the cluster with one command.
+        :returns: the list of cancelled tasks.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        found_contaminants = set(Task.objects.filter(
+            job=self,
+            status_complete=True,
+            status_error=False,
+            percent__gt=apps.get_app_config('contaminer').threshold)\
+            .values_list('pack__contaminant_id', flat=True))
+        if not found_contaminants:
+            log.debug("Exit")
+            return []
+
+        redundant_tasks = list(Task.objects.filter(
+            job=self,
+            pack__contaminant_id__in=found_contaminants,
+            status_complete=False,
+            status_error=False,
+            status_cancelled=False)\
+            .select_related('pack__contaminant'))
+        if not redundant_tasks:
+            log.debug("Exit")
+            return []
+
+        remote_job_directory = os.path.join(
+            self.get_cluster().ssh_work_directory,
+            self.get_filename(suffix=''))
+        log.debug("Cancel tasks of remote job: " + remote_job_directory)
+        try:
+            get_backend(self.cluster).cancel_tasks(
+                remote_job_directory,
+                [task.name() for task in redundant_tasks])
+        except RuntimeError as excep:
+            log.warning("Unable to cancel the tasks of job " + str(self.id) \
+                + ": " + str(excep))
+            return []
+
+        Task.objects.filter(id__in=[task.id for task in redundant_tasks])\
+            .update(status_cancelled=True, status_running=False)
+        log.info("Cancelled " + str(len(redundant_tasks)) \
+            + " tasks of job " + str(self.id))
 
         log.debug("Exit")
+        return redundant_tasks
+
+    @staticmethod
+    def get_saved_time(tasks):
+        """
+        Return the estimated cluster time saved by the cancelled tasks.
+
+        A cancelled task would have run as long as the average complete task
+        of the list.
+        :param tasks: tasks of a job.
+        :returns: timedelta, or None if no task is cancelled.
+        """
+        cancelled = [task for task in tasks if task.status_cancelled]
+        if not cancelled:
+            return None
+        durations = [task.exec_time.total_seconds() for task in tasks
+                     if task.status_complete and not task.status_error]
+        if not durations:
+            return datetime.timedelta(0)
+        average = sum(durations) / len(durations)
+        saved = sum([max(0, average - task.exec_time.total_seconds())
+                     for task in cancelled])
+        return datetime.timedelta(seconds=int(saved))
+
+    def get_remaining_time(self, estimator=None):
+        """
+        Return the estimated time before the end of the job.
+
+        The execution time of the unfinished tasks is estimated from the
+        tasks previously completed (see RuntimeStatistics).
+        :param estimator: RuntimeEstimator to use, read from the database if
+        not given.
+        :returns: timedelta, or None if the job is not submitted, in error, or
+        if its tasks are not known yet.
+        """
+        if self.status_complete:
+            return datetime.timedelta(0)
+        if not self.status_submitted or self.status_error:
+            return None
+        tasks = self.task_set.all()
+        if not tasks:
+            return None
+        if estimator is None:
+            estimator = RuntimeStatistics.get_estimator()
+
+        unfinished_tasks = [
+            task for task in tasks
+            if not (task.status_complete or task.status_error
+                    or task.status_cancelled)]
+        return estimator.get_remaining_time(
+            unfinished_tasks,
+            self.data_size,
+            self.get_cluster().slots)
+
+    @metrics.JOB_UPDATE.timed
+    def update(self, with_tasks=True):
+        """
+        If self is not archived, update status and tasks.
 
-    def update(self):
-        """If self is not archived, update status and tasks."""
+        :param with_tasks: False to only update the status, when results.txt
+        did not change since the last update.
+        """
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
@@ -316,7 +617,10 @@ class Job(models.Model):
             log.warning("Archived. No modification will be recorded.")
             return
 
-        self.update_tasks()
+        if with_tasks:
+            self.update_tasks()
+        else:
+            self.update_missing_statistics()
         self.update_status()
 
         if self.status_complete:
@@ -326,27 +630,136 @@ class Job(models.Model):
 
         log.debug("Exit")
 
+    @staticmethod
+    def get_results_stats(jobs):
+        """
+        Return the size and mtime of results.txt of the jobs, by job id.
+
+        The files of each cluster are checked with one command. A missing
+        file gets None. The jobs of a cluster which cannot be checked are
+        missing from the result.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with " + str(len(jobs)) + " jobs")
+
+        jobs_by_cluster = {}
+        for job in jobs:
+            jobs_by_cluster.setdefault(job.cluster, []).append(job)
+
+        stats = {}
+        for cluster, cluster_jobs in jobs_by_cluster.items():
+            paths = [job.get_results_path() for job in cluster_jobs]
+            try:
+                cluster_stats = get_backend(cluster).stat_files(paths)
+            except RuntimeError as excep:
+                log.warning("Unable to check the results on " \
+                    + str(cluster) + ": " + str(excep))
+                continue
+            for job, path in zip(cluster_jobs, paths):
+                stats[job.id] = cluster_stats.get(path)
+
+        log.debug("Exit")
+        return stats
+
+    def is_unchanged(self, stat):
+        """Return True if results.txt is still as at the last update."""
+        return stat is not None \
+            and self.results_size == stat[0] \
+            and self.results_mtime == stat[1]
+
     @classmethod
     def update_all(cls):
-        """Update all the non-archived and submitted jobs."""
+        """
+        Update all the non-archived and submitted jobs.
+
+        The size and mtime of results.txt of all the jobs are checked first,
+        and only the jobs whose results changed since their last update are
+        updated. The status of the other jobs is still read every
+        status_interval seconds of config.ini, so a job finishing without a
+        new line in results.txt is archived. With
+        update_workers in config.ini, several jobs are updated
+        at the same time by a pool of threads. The jobs of a cluster found
+        unavailable are skipped.
+        """
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        jobs = Job.objects.filter(
+        jobs = list(Job.objects.filter(
             status_archived=False,
-            status_submitted=True)
-        for job in jobs:
+            status_submitted=True))
+        stats = cls.get_results_stats(jobs)
+        unchanged_ids = set([
+            job.id for job in jobs if job.is_unchanged(stats.get(job.id))])
+        checked_since = timezone.now() - datetime.timedelta(
+            seconds=apps.get_app_config('contaminer').status_interval)
+        log.info(str(len(jobs)) + " jobs to update, " \
+            + str(len(unchanged_ids)) + " with unchanged results")
+        jobs = [
+            job for job in jobs
+            if job.id not in unchanged_ids
+            or job.status_checked is None
+            or job.status_checked < checked_since]
+        workers = max(int(get_cluster().update_workers), 1)
+        unavailable_clusters = set()
+        skipped = object()
+
+        def update(job):
+            """Update job, and return the exception stopping it, if any."""
+            if job.cluster in unavailable_clusters:
+                log.debug("Skip job on unavailable cluster: " + str(job))
+                return skipped
             log.debug("Update job: " + str(job))
             try:
-                job.update()
+                job.update(with_tasks=job.id not in unchanged_ids)
             except RuntimeError as excep:
-                log.error("Job update interrupted with exception: " \
-                    + str(excep))
-                message = "Error when updating job: " + str(job) \
-                    + "\n" + str(excep)
-                mail_admins(
-                    "Update error",
-                    message)
+                if isinstance(excep, ClusterUnavailable):
+                    # The next jobs would fail the same way
+                    unavailable_clusters.add(job.cluster)
+                return excep
+            finally:
+                if workers > 1:
+                    # Each thread has its own connection to the database
+                    connection.close()
+            return None
+
+        if workers > 1:
+            # Backport "futures" on Python 2
+            from concurrent.futures import ThreadPoolExecutor
+            log.info("Update " + str(len(jobs)) + " jobs with " \
+                + str(workers) + " threads")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(update, jobs))
+        else:
+            results = [update(job) for job in jobs]
+
+        failed_clusters = set()
+        updated_clusters = set()
+        for job, result in zip(jobs, results):
+            if result is skipped:
+                continue
+            if result is None:
+                updated_clusters.add(job.cluster)
+                # Read before the update, a later change is seen next time
+                stat = stats.get(job.id)
+                if stat is not None:
+                    Job.objects.filter(id=job.id).update(
+                        results_size=stat[0],
+                        results_mtime=stat[1])
+                continue
+            # ClusterUnavailable is already counted by the circuit breaker
+            if not isinstance(result, ClusterUnavailable):
+                ClusterState.record_failure(job.cluster)
+            failed_clusters.add(job.cluster)
+            log.error("Job update interrupted with exception: " \
+                + str(result))
+            message = "Error when updating job: " + str(job) \
+                + "\n" + str(result)
+            OutboxMail.queue_report(
+                "Update error",
+                message)
+
+        for cluster in updated_clusters - failed_clusters:
+            ClusterState.record_success(cluster)
 
         log.debug("Exit")
 
@@ -361,15 +774,24 @@ class Job(models.Model):
 
         return response_data
 
-    def to_simple_dict(self):
-        """Return the results compiled per contaminant."""
+    def to_simple_dict(self, tasks=None):
+        """
+        Return the results compiled per contaminant.
+
+        :param tasks: tasks of the job, with their pack and contaminant
+        selected. Read from the database if not given.
+        """
         response_data = {}
         response_data['id'] = self.id
         messages = {}
 
-        tasks = Task.objects.filter(job=self)
-        uniprot_ids = [task.pack.contaminant.uniprot_id for task in tasks]
-        unique_uniprot_ids = list(set(uniprot_ids))
+        if tasks is None:
+            tasks = self.task_set.select_related('pack__contaminant')
+        tasks = list(tasks)
+        tasks_per_uniprot_id = {}
+        for task in tasks:
+            tasks_per_uniprot_id.setdefault(
+                task.pack.contaminant.uniprot_id, []).append(task)
 
         results = []
         app_config = apps.get_app_config('contaminer')
@@ -377,24 +799,24 @@ class Job(models.Model):
         identity_threshold = app_config.bad_model_identity_threshold
         percent_threshold = app_config.threshold
 
-        for uniprot_id in unique_uniprot_ids:
+        for uniprot_id, contaminant_tasks in tasks_per_uniprot_id.items():
             result_data = {}
             result_data['uniprot_id'] = uniprot_id
 
-            tasks = Task.objects.filter(
-                job=self,
-                pack__contaminant__uniprot_id=uniprot_id)
-
             error = True # All tasks are in error
             complete = True # All tasks are complete
+            cancelled = False # At least one task is cancelled
             best_task = None
 
-            for task in tasks:
+            for task in contaminant_tasks:
                 status = task.get_status()
                 if status in ['New', 'Running']:
                     complete = False # At least one is not in error
                     error = False # At least one is not complete
                     continue
+                if status == 'Cancelled':
+                    cancelled = True
+                    continue
                 if status == 'Error':
                     continue
                 if status == 'Complete':
@@ -402,7 +824,9 @@ class Job(models.Model):
                     if task.is_better_than(best_task):
                         best_task = task
 
-            if error: # All in error, or no task
+            if error and cancelled: # Stopped without a complete task
+                result_data['status'] = "Cancelled"
+            elif error: # All in error, or no task
                 result_data['status'] = "Error"
             else:
                 if best_task:
@@ -411,13 +835,12 @@ class Job(models.Model):
                     result_data['pack_number'] = best_task.pack.number
                     result_data['space_group'] = best_task.space_group
 
-                    final_files_path = os.path.join(\
-                        settings.MEDIA_ROOT,
-                        best_task.get_final_filename("pdb"))
-                    files_available = os.path.exists(final_files_path)
+                    files_available = best_task.files_available()
                     result_data['files_available'] = str(files_available)
                     if files_available:
                         result_data['r_free'] = best_task.r_free
+                        result_data['r_work'] = best_task.r_work
+                        result_data['resolution'] = best_task.resolution
 
                     if best_task.percent > percent_threshold:
                         coverage = best_task.pack.coverage
@@ -437,6 +860,14 @@ class Job(models.Model):
 
             results.append(result_data)
 
+        saved_time = self.get_saved_time(tasks)
+        if saved_time is not None:
+            response_data['saved_time'] = int(saved_time.total_seconds())
+            messages['early_stop'] = \
+                "The tasks of the contaminants already found have been "\
+                + "cancelled, saving about " + str(saved_time) \
+                + " of computing time."
+
         if messages:
             response_data['messages'] = messages
 
@@ -487,13 +918,18 @@ class Job(models.Model):
         self.send_mail_notification("submitted")
                 
     def send_complete_mail(self):
+        """
+        If an address is available, send a notification.
+
+        mail_sent is set once the mail is delivered by OutboxMail.
+        """
         self.send_mail_notification("complete")
-        self.mail_sent = True
-        self.save()
         
     def send_mail_notification(self, notification):
         """
-        If an address is available, send an email.
+        If an address is available, queue an email in the outbox.
+
+        The mail is sent later by the send_mails command.
         :notification: can be "complete" or "submitted"
         """
         log = logging.getLogger(__name__)
@@ -503,6 +939,20 @@ class Job(models.Model):
             log.warning("No mail for this job: " + str(self))
             return
 
+        OutboxMail.queue_notification(self, notification)
+        log.info("E-Mail queued for " + str(self.email))
+
+        log.debug("Exiting function")
+
+    def get_mail_notification(self, notification):
+        """
+        Return the subject and the HTML message of the notification.
+
+        :notification: can be "complete" or "submitted"
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
         current_site = Site.objects.get_current()
         logo_url = "{0}://{1}{2}{3}".format(
             "https",
@@ -521,8 +971,6 @@ class Job(models.Model):
             'result_link': result_url,
             'site_name': "ContaMiner"}
 
-        exp_mail = settings.DEFAULT_MAIL_FROM
-
         if notification == "complete":
             message = render_to_string(
                 "ContaMiner/email/complete_message.html",
@@ -536,16 +984,9 @@ class Job(models.Model):
         else:
             raise ValueError("Bad argument. notification can only be " \
                              + "\"complete\" or \"submitted\".")
-        
-        send_mail(
-            title,
-            "",
-            exp_mail,
-            [self.email],
-            html_message=message)
-        log.info("E-Mail sent to " + str(self.email))
 
-        log.debug("Exiting function")
+        log.debug("Exit")
+        return title, message
 
 
 class Task(models.Model):
@@ -561,9 +1002,13 @@ class Task(models.Model):
     :status_complete: True if the task is complete.
     :status_running: True if the task is running on the cluster.
     :status_error: True if the task encountered an error.
+    :status_cancelled: True if the task has been cancelled because another
+    task already found its contaminant (early stop).
     :percent: The percent score given by MoRDa (0 if not available).
     :q_factor: The Q_factor given by MoRDa (0 if not available).
     :r_free: The R free value of the final PDB file generated by MoRDa.
+    :r_work: The R work value of the final PDB file generated by MoRDa.
+    :resolution: The high resolution limit of the refinement.
     :exec_time: Time of execution (running state) on the cluster.
     """
 
@@ -576,13 +1021,19 @@ class Task(models.Model):
     status_complete = models.BooleanField(default=False)
     status_running = models.BooleanField(default=False)
     status_error = models.BooleanField(default=False)
+    status_cancelled = models.BooleanField(default=False)
 
     # Result
     percent = PercentageField(null=True, default=None)
     q_factor = models.FloatField(null=True, default=None)
     r_free = models.FloatField(null=True, default=None)
+    r_work = models.FloatField(null=True, default=None)
+    resolution = models.FloatField(null=True, default=None)
     exec_time = models.DurationField(default=datetime.timedelta(0))
 
+    class Meta:
+        unique_together = ('job', 'pack', 'space_group')
+
     def __str__(self):
         """Write job - pack - space group."""
         return unicode(self).encode('utf-8')
@@ -637,10 +1088,13 @@ class Task(models.Model):
         """
         Return the status as a string.
         
-        :return: Status (string) can be Error, Complete, Running, or New
+        :return: Status (string) can be Error, Cancelled, Complete, Running,
+        or New
         """
         if self.status_error:
             return "Error"
+        if self.status_cancelled:
+            return "Cancelled"
         if self.status_complete:
             return "Complete"
         if self.status_running:
@@ -682,7 +1136,8 @@ class Task(models.Model):
         uniprot_id: any string without comma or new line
         pack_number: integer
         space group: full space group name, dash '-' separated
-        status: can be 'new', 'running', 'completed', 'aborted' or 'error'
+        status: can be 'new', 'running', 'completed', 'aborted', 'cancelled'
+        or 'error'
         q_factor: decimal, dot '.' separated
         percent: integer
         elapsed_time: following the regexp '\d+h [\d ]\dm [\d ]\ds'
@@ -698,18 +1153,7 @@ class Task(models.Model):
         """
         # Split line in fields
         line_bites = line.split(',')
-        elapsed_time = line_bites[6]
-        
-        # Parse time
-        try:
-            hours, minutes, seconds = re.split(' +', elapsed_time)
-        except ValueError:
-            elapsed_seconds = 0
-        else:
-            hours = int(hours[:-1])
-            minutes = int(minutes[:-1])
-            seconds = int(seconds[:-1])
-            elapsed_seconds = ((hours * 60) + minutes) * 60 + seconds
+        elapsed_seconds = Task.parse_elapsed_time(line_bites[6])
 
         # Build results dictionary
         result = {
@@ -724,6 +1168,109 @@ class Task(models.Model):
 
         return result
 
+    @staticmethod
+    def parse_elapsed_time(elapsed_time):
+        """
+        Return the number of seconds in elapsed_time.
+
+        elapsed_time follows the format given in parse_line. Return 0 if
+        elapsed_time does not have 3 parts. Raise a `ValueError` if one of the
+        parts is not a number.
+        """
+        try:
+            hours, minutes, seconds = SPACES_REGEX.split(elapsed_time)
+        except ValueError:
+            return 0
+        return ((int(hours[:-1]) * 60) + int(minutes[:-1])) * 60 \
+            + int(seconds[:-1])
+
+    @classmethod
+    def parse_results(cls, content):
+        """
+        Parse the whole content of results.txt.
+
+        :param content: content of results.txt, one task per line, with the
+        format given in parse_line
+        :returns: (results, malformed_lines)
+
+        results is a dictionary of columns with the same keys as parse_line,
+        and line_number. uniprot_id, space_group and status are lists of
+        strings. pack_number, percent and elapsed_seconds are NumPy arrays of
+        integers, and q_factor a NumPy array of floats.
+        malformed_lines is a list of (line_number, line) for the lines which
+        cannot be parsed. They are not in results.
+        """
+        rows = []
+        malformed_lines = []
+        for line_number, line in enumerate(content.split('\n'), 1):
+            if not line:
+                continue
+            line_bites = line.split(',')
+            try:
+                elapsed_seconds = cls.parse_elapsed_time(line_bites[6])
+            except (ValueError, IndexError):
+                malformed_lines.append((line_number, line))
+                continue
+            rows.append((line_number, line, line_bites, elapsed_seconds))
+
+        try:
+            columns = cls.get_numeric_columns(rows)
+        except ValueError:
+            # Find the lines which cannot be converted, then try again
+            valid_rows = []
+            for row in rows:
+                try:
+                    cls.get_numeric_columns([row])
+                except ValueError:
+                    malformed_lines.append(row[0:2])
+                else:
+                    valid_rows.append(row)
+            rows = valid_rows
+            malformed_lines.sort()
+            columns = cls.get_numeric_columns(rows)
+
+        results = {
+            'line_number': [row[0] for row in rows],
+            'uniprot_id': [row[2][0] for row in rows],
+            'space_group': [row[2][2] for row in rows],
+            'status': [row[2][3] for row in rows],
+            'elapsed_seconds': np.array(
+                [row[3] for row in rows],
+                dtype=np.int64),
+            }
+        results.update(columns)
+
+        return (results, malformed_lines)
+
+    @staticmethod
+    def get_numeric_columns(rows):
+        """
+        Convert the numeric fields of the rows given by parse_results.
+
+        Raise a `ValueError` if one of the fields is not a number.
+        """
+        pack_numbers = [row[2][1] for row in rows]
+        q_factors = [row[2][4] for row in rows]
+        percents = [row[2][5] for row in rows]
+        return {
+            'pack_number': np.array(pack_numbers, dtype=str).astype(np.int64),
+            'q_factor': np.array(q_factors, dtype=str).astype(np.float64),
+            'percent': np.array(percents, dtype=str).astype(np.int64),
+            }
+
+    @staticmethod
+    def get_parsed_line(results, index):
+        """Return the line index of results as given by parse_line."""
+        return {
+            'uniprot_id': results['uniprot_id'][index],
+            'pack_number': int(results['pack_number'][index]),
+            'space_group': results['space_group'][index],
+            'status': results['status'][index],
+            'q_factor': float(results['q_factor'][index]),
+            'percent': int(results['percent'][index]),
+            'elapsed_seconds': int(results['elapsed_seconds'][index]),
+            }
+
     @classmethod
     def update(cls, job, line):
         """
@@ -740,7 +1287,8 @@ class Task(models.Model):
         uniprot_id: any string without comma or new line
         pack_number: integer
         space group: full space group name, dash '-' separated
-        status: can be 'new', 'running', 'completed', 'aborted', or 'error'
+        status: can be 'new', 'running', 'completed', 'aborted', 'cancelled',
+        or 'error'
         q_factor: decimal, dot '.' separated
         percent: integer
         elapsed_time: following the regexp '\d+h [\d ]\dm [\d ]\ds'
@@ -758,6 +1306,27 @@ class Task(models.Model):
             log.warning("Invalid line to parse: " + str(line))
             raise ValueError("Invalid line to parse: " + str(line))
 
+        task = cls.update_parsed(job, parsed_line)
+        if task.is_retrievable() and task.r_free is None:
+            cls.update_refinement_statistics([task])
+
+        log.debug("Exit")
+        return task
+
+    @classmethod
+    @metrics.TASK_UPDATE.timed
+    def update_parsed(cls, job, parsed_line):
+        """
+        Create or update the task attached to job.
+
+        :param job: Job instance the task is attached to.
+        :param parsed_line: dictionary describing the task, as given by
+        parse_line.
+        :returns: the created or updated task
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
         try:
             contaminant = Contaminant.objects.get(
                 uniprot_id=parsed_line['uniprot_id'],
@@ -802,18 +1371,12 @@ class Task(models.Model):
             log.error("Database is not consistent.")
             raise e
 
-        try:
-            task = Task.objects.get(
-                job=job,
-                pack=pack,
-                space_group=parsed_line['space_group'])
-        except ObjectDoesNotExist:
-            task = Task()
-            task.job = job
-            task.pack = pack
-            task.space_group = parsed_line['space_group']
+        task, _ = Task.objects.get_or_create(
+            job=job,
+            pack=pack,
+            space_group=parsed_line['space_group'])
 
-        if task.status_complete:
+        if task.status_complete or task.status_cancelled:
             log.info("Trying to update a complete task. Skipping...")
             return task
         
@@ -821,18 +1384,11 @@ class Task(models.Model):
             (parsed_line['status'] in ["completed", "aborted"])
         task.status_running = (parsed_line['status'] == "running")
         task.status_error = (parsed_line['status'] == "error")
+        task.status_cancelled = (parsed_line['status'] == "cancelled")
 
         task.percent = parsed_line['percent']
         task.q_factor = parsed_line['q_factor']
 
-        if task.percent > 90:
-            task.get_final_files()
-            # Save R free value
-            final_PDB_location = os.path.join(settings.MEDIA_ROOT,
-                task.get_final_filename('pdb'))
-            final_PDB = PDBHandler(final_PDB_location)
-            task.r_free = final_PDB.get_r_free()
-
         task.exec_time = \
             datetime.timedelta(seconds=parsed_line['elapsed_seconds'])
 
@@ -840,6 +1396,52 @@ class Task(models.Model):
         log.debug("Exit")
         return task
 
+    @classmethod
+    def update_refinement_statistics(cls, tasks):
+        """
+        Save the refinement statistics of the final PDB files of tasks.
+
+        The statistics are read on the cluster in one command, so the final
+        files are not downloaded. The tasks belong to the same job.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        if not tasks:
+            log.debug("Exit")
+            return
+
+        cluster = tasks[0].job.cluster
+        remote_directory = get_cluster(cluster).ssh_work_directory
+        remote_pdbs = [
+            (task, os.path.join(
+                remote_directory,
+                task.get_final_filename(),
+                "results_solve/final.pdb"))
+            for task in tasks]
+
+        try:
+            headers = get_backend(cluster).get_pdb_headers(
+                [remote_pdb for _, remote_pdb in remote_pdbs])
+        except RuntimeError as excep:
+            log.warning("Unable to read the final PDB files: " + str(excep))
+            log.debug("Exit")
+            return
+
+        for task, remote_pdb in remote_pdbs:
+            try:
+                statistics = parse_refinement_remarks(headers[remote_pdb])
+            except ValueError as excep:
+                log.warning("Unable to read the statistics of task " \
+                    + str(task) + ": " + str(excep))
+                continue
+            task.r_free = statistics.get('r_free')
+            task.r_work = statistics.get('r_work')
+            task.resolution = statistics.get('resolution_high')
+            task.save()
+
+        log.debug("Exit")
+
     def get_final_filename(self, suffix=''):
         """Return the filename of the final files followed by the suffix."""
         filename = self.pack.contaminant.uniprot_id + "_" \
@@ -895,19 +1497,118 @@ class Task(models.Model):
             else:
                 raise
 
-        client = SFTPChannel()
+        local_files = [local_mtz, local_pdb, local_map, local_map_diff] \
+            + [
+                os.path.join(
+                    settings.MEDIA_ROOT,
+                    self.get_final_filename(suffix=suffix))
+                for suffix in MAP_VARIANTS]
+        previous_size = sum([
+            os.path.getsize(local_file) for local_file in local_files
+            if os.path.isfile(local_file)])
+
+        backend = get_backend(self.job.cluster)
         try:
-            client.download_from_contaminer(remote_mtz, local_mtz)
-            client.download_from_contaminer(remote_pdb, local_pdb)
-            client.download_from_contaminer(remote_map, local_map)
-            client.download_from_contaminer(remote_map_diff, local_map_diff)
+            backend.download_from_contaminer(remote_mtz, local_mtz)
+            backend.download_from_contaminer(remote_pdb, local_pdb)
+            backend.download_from_contaminer(remote_map, local_map)
+            backend.download_from_contaminer(remote_map_diff, local_map_diff)
+            self.prepare_maps()
         except (OSError, IOError) as excep:
             log.error("Error when downloading files from cluster: " \
                 + str(excep))
             raise
+        finally:
+            size = sum([
+                os.path.getsize(local_file) for local_file in local_files
+                if os.path.isfile(local_file)])
+            CachedJob.add(self.job, size - previous_size)
 
         log.debug("Exit")
 
+    def prepare_maps(self):
+        """
+        Write the lighter versions of the final maps for the viewer.
+
+        For final.map and final.diff.map, write a copy cropped around the
+        final model with a coarser grid (small.map and small.diff.map), and
+        the gzip compressed copies of the four maps.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        local_pdb = os.path.join(
+            settings.MEDIA_ROOT,
+            self.get_final_filename(suffix="pdb"))
+        try:
+            coordinates = PDBHandler(local_pdb).get_coordinates()
+        except (IOError, ValueError) as excep:
+            log.warning("Unable to read the final model: " + str(excep))
+            coordinates = []
+
+        for suffix in ["map", "diff.map"]:
+            local_map = os.path.join(
+                settings.MEDIA_ROOT,
+                self.get_final_filename(suffix=suffix))
+            local_small_map = os.path.join(
+                settings.MEDIA_ROOT,
+                self.get_final_filename(suffix="small." + suffix))
+            try:
+                if coordinates:
+                    make_small_map(local_map, coordinates, local_small_map)
+                    gzip_file(local_small_map)
+                gzip_file(local_map)
+            except (IOError, ValueError) as excep:
+                log.warning("Unable to prepare the map " + str(local_map) \
+                    + ": " + str(excep))
+
+        log.debug("Exit")
+
+    def is_retrievable(self):
+        """Return True if the final files can be downloaded from the cluster."""
+        return self.status_complete and not self.status_error \
+            and self.percent > 90
+
+    def files_available(self):
+        """
+        Return True if the final files are in MEDIA_ROOT, or can be
+        downloaded again from the cluster.
+        """
+        final_files_path = os.path.join(
+            settings.MEDIA_ROOT,
+            self.get_final_filename("pdb"))
+        return os.path.exists(final_files_path) or self.is_retrievable()
+
+    def get_local_final_file(self, suffix):
+        """
+        Return the absolute path of the final file with the given suffix.
+
+        If the file has been evicted from MEDIA_ROOT, download again the final
+        files from the cluster. Return None if the file is not available.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(suffix))
+
+        local_file = os.path.join(
+            settings.MEDIA_ROOT,
+            self.get_final_filename(suffix=suffix))
+
+        if not os.path.isfile(local_file) and self.is_retrievable():
+            log.info("Retrieve evicted files for task: " + str(self))
+            try:
+                self.get_final_files()
+            except (OSError, IOError, RuntimeError):
+                log.warning("Unable to retrieve files for task: " + str(self))
+
+        if not os.path.isfile(local_file):
+            log.debug("Exit with: None")
+            return None
+
+        CachedJob.touch(self.job)
+
+        log.debug("Exit with: " + str(local_file))
+        return local_file
+
     def to_dict(self):
         """Return a dictionary of the fields."""
         response_data = {}
@@ -919,10 +1620,6 @@ class Task(models.Model):
             response_data['percent'] = self.percent
             response_data['q_factor'] = self.q_factor
 
-        final_files_path = os.path.join(\
-            settings.MEDIA_ROOT,
-            self.get_final_filename("pdb"))
-        response_data['files_available'] = \
-            str(os.path.exists(final_files_path))
+        response_data['files_available'] = str(self.files_available())
 
         return response_data
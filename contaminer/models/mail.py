@@ -0,0 +1,262 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Outbox of the emails sent by ContaMiner.
+
+The notifications and the error reports are queued in the database instead
+of being sent in the submission thread or in the update loop. The
+send_mails management command renders and sends them later, through one
+SMTP connection. A mail which cannot be sent is tried again with an
+exponential backoff, and the error reports are grouped in one digest sent
+to the admins.
+"""
+
+import datetime
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail import get_connection
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxMail(models.Model):
+    """
+    Email waiting to be sent.
+
+    :job: The job notified, if any.
+    :notification: "submitted" or "complete" for a job notification, empty
+    for an error report.
+    :subject: Subject of an error report.
+    :message: Body of an error report.
+    :created: When the mail has been queued.
+    :next_attempt: When the mail can be sent (again).
+    :attempts: Number of failed attempts.
+    :last_error: Error given by the last failed attempt.
+    :sent: When the mail has been delivered to the mail server, or None.
+    :failed: True if the mail has been given up after too many attempts.
+    """
+
+    job = models.ForeignKey('Job', null=True, blank=True)
+    notification = models.CharField(max_length=20, blank=True)
+    subject = models.CharField(max_length=255, blank=True)
+    message = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        index_together = (('sent', 'failed', 'next_attempt'),)
+
+    def __str__(self):
+        """Write notification and recipient."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write notification and recipient."""
+        if self.is_report():
+            return "Report: " + self.subject
+        return str(self.notification) + " - " + str(self.job_id)
+
+    def is_report(self):
+        """Return True if self is an error report for the admins."""
+        return not self.notification
+
+    @classmethod
+    def queue_notification(cls, job, notification):
+        """Queue the notification of job, sent when send_pending is called."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(job) + " " + str(notification))
+
+        if notification not in ["submitted", "complete"]:
+            raise ValueError("Bad argument. notification can only be " \
+                             + "\"complete\" or \"submitted\".")
+        mail = cls.objects.create(job=job, notification=notification)
+
+        log.debug("Exit")
+        return mail
+
+    @classmethod
+    def queue_report(cls, subject, message):
+        """Queue an error report, sent to the admins in the next digest."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(subject))
+
+        mail = cls.objects.create(subject=subject, message=message)
+
+        log.debug("Exit")
+        return mail
+
+    def get_email(self, connection):
+        """Return the EmailMessage of the notification."""
+        subject, message = self.job.get_mail_notification(self.notification)
+        email = EmailMultiAlternatives(
+            subject,
+            "",
+            settings.DEFAULT_MAIL_FROM,
+            [self.job.email],
+            connection=connection)
+        email.attach_alternative(message, "text/html")
+        return email
+
+    def mark_sent(self):
+        """Record the delivery, and update mail_sent of the job."""
+        self.sent = timezone.now()
+        self.save()
+        if self.notification == "complete":
+            self.job.mail_sent = True
+            self.job.save()
+
+    def mark_error(self, error, now):
+        """Record a failed attempt, and delay the next one."""
+        log = logging.getLogger(__name__)
+        app_config = apps.get_app_config('contaminer')
+
+        self.attempts += 1
+        self.last_error = str(error)
+        if self.attempts >= app_config.mail_max_attempts:
+            log.error("Give up mail " + str(self) + " after " \
+                + str(self.attempts) + " attempts: " + str(error))
+            self.failed = True
+        else:
+            delay = app_config.mail_retry_delay * 2 ** (self.attempts - 1)
+            self.next_attempt = now + datetime.timedelta(seconds=delay)
+            log.warning("Unable to send mail " + str(self) + ", try again " \
+                + "in " + str(delay) + " seconds: " + str(error))
+        self.save()
+
+    @classmethod
+    def get_pending(cls, now):
+        """Return the mails to send now."""
+        return cls.objects.filter(
+            sent__isnull=True,
+            failed=False,
+            next_attempt__lte=now)
+
+    @classmethod
+    def send_pending(cls, connection=None):
+        """
+        Send the pending notifications and the digest of the error reports.
+
+        All the mails are sent through the same connection. The error reports
+        are sent once the oldest one waited for mail_digest_interval.
+        :return: the number of delivered mails.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        now = timezone.now()
+        notifications = list(cls.get_pending(now)\
+            .exclude(notification='')\
+            .select_related('job')\
+            .order_by('next_attempt'))
+        reports = list(cls.get_pending(now)\
+            .filter(notification='')\
+            .order_by('created'))
+
+        digest_interval = datetime.timedelta(
+            seconds=apps.get_app_config('contaminer').mail_digest_interval)
+        if reports and now - reports[0].created < digest_interval:
+            reports = []
+
+        if not notifications and not reports:
+            log.debug("Exit")
+            return 0
+
+        if connection is None:
+            connection = get_connection()
+        try:
+            connection.open()
+        except Exception as excep:
+            log.error("Unable to connect to the mail server: " + str(excep))
+            for mail in notifications + reports:
+                mail.mark_error(excep, now)
+            return 0
+
+        delivered = 0
+        try:
+            for mail in notifications:
+                if not mail.job.email:
+                    log.warning("No mail for this job: " + str(mail.job))
+                    mail.delete()
+                    continue
+                try:
+                    mail.get_email(connection).send()
+                except Exception as excep:
+                    mail.mark_error(excep, now)
+                    continue
+                mail.mark_sent()
+                delivered += 1
+                log.info("E-Mail sent to " + str(mail.job.email))
+
+            if reports:
+                delivered += cls.send_digest(reports, connection, now)
+        finally:
+            connection.close()
+
+        log.debug("Exit with: " + str(delivered))
+        return delivered
+
+    @classmethod
+    def send_digest(cls, reports, connection, now):
+        """Send the reports to the admins in one mail."""
+        log = logging.getLogger(__name__)
+
+        if not settings.ADMINS:
+            log.warning("No admin to send the reports to.")
+            cls.objects.filter(id__in=[report.id for report in reports])\
+                .update(failed=True)
+            return 0
+
+        subject = settings.EMAIL_SUBJECT_PREFIX \
+            + str(len(reports)) + " error report(s)"
+        message = "\n\n".join([
+            str(report.created) + " - " + report.subject + "\n" \
+            + report.message
+            for report in reports])
+        email = EmailMultiAlternatives(
+            subject,
+            message,
+            settings.SERVER_EMAIL,
+            [admin[1] for admin in settings.ADMINS],
+            connection=connection)
+        try:
+            email.send()
+        except Exception as excep:
+            for report in reports:
+                report.mark_error(excep, now)
+            return 0
+
+        cls.objects.filter(id__in=[report.id for report in reports])\
+            .update(sent=timezone.now())
+        log.info("Digest of " + str(len(reports)) + " reports sent")
+        return 1
+
+    @classmethod
+    def remove_old(cls, max_age):
+        """Remove the mails sent or given up for longer than max_age."""
+        min_date = timezone.now() - max_age
+        cls.objects.filter(created__lt=min_date)\
+            .filter(models.Q(sent__isnull=False) | models.Q(failed=True))\
+            .delete()
@@ -0,0 +1,246 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Statistics of the execution time of the tasks, to predict the end of a job.
+
+The execution time of a task mostly depends on the size of the pack (number
+of residues of its models), on the space group, and on the size of the
+diffraction data. The complete tasks are added to an aggregate table, one
+row for each class of pack size, space group and class of data size, when
+they are seen complete by Job.update_tasks. The sizes are grouped in powers
+of 2, so the table stays small and is read in one query to estimate the
+remaining time of a job.
+"""
+
+import math
+import datetime
+import logging
+
+from django.apps import apps
+from django.db import models
+from django.db.models import F
+from django.db.models import Sum
+
+from .contabase import Pack
+
+
+def get_size_class(size):
+    """Return the power of 2 class of size (0 if size is unknown)."""
+    if not size:
+        return 0
+    return int(size).bit_length()
+
+
+class RuntimeStatistics(models.Model):
+    """
+    Distribution of the execution time of the tasks of one class.
+
+    :residues_class: Size class of the pack (see get_size_class), from the
+    total number of residues of its models.
+    :space_group: Space group tested, dash separated.
+    :data_class: Size class of the diffraction data file.
+    :count: Number of complete tasks recorded.
+    :total: Sum of the execution times, in seconds.
+    :total_squares: Sum of the squares of the execution times.
+    """
+
+    residues_class = models.IntegerField()
+    space_group = models.CharField(max_length=15)
+    data_class = models.IntegerField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    total_squares = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('residues_class', 'space_group', 'data_class')
+        verbose_name_plural = "runtime statistics"
+
+    def __str__(self):
+        """Write the key and the mean."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write the key and the mean."""
+        return str(self.residues_class) + " - " + str(self.space_group) \
+            + " - " + str(self.data_class) + ": " + str(self.get_mean()) \
+            + " s (" + str(self.count) + " tasks)"
+
+    def get_mean(self):
+        """Return the mean execution time in seconds."""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def get_deviation(self):
+        """Return the standard deviation of the execution time in seconds."""
+        if not self.count:
+            return None
+        variance = self.total_squares / self.count - self.get_mean() ** 2
+        return math.sqrt(max(variance, 0))
+
+    @staticmethod
+    def get_residues_classes(pack_ids):
+        """Return a dictionary giving the residues class of each pack."""
+        packs = Pack.objects.filter(id__in=set(pack_ids))\
+            .annotate(residues=Sum('model__nb_residues'))\
+            .values_list('id', 'residues')
+        return dict([
+            (pack_id, get_size_class(nb_residues))
+            for pack_id, nb_residues in packs])
+
+    @classmethod
+    def record(cls, tasks, data_size):
+        """
+        Add the execution times of the complete tasks of a job.
+
+        :param tasks: tasks of the same job, seen complete for the first time.
+        :param data_size: size in bytes of the diffraction data of the job.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with " + str(len(tasks)) + " tasks")
+
+        tasks = [task for task in tasks
+                 if task.status_complete and not task.status_error
+                 and task.exec_time.total_seconds() > 0]
+        if not tasks:
+            log.debug("Exit")
+            return
+
+        residues_classes = cls.get_residues_classes(
+            [task.pack_id for task in tasks])
+        data_class = get_size_class(data_size)
+        times_per_key = {}
+        for task in tasks:
+            key = (residues_classes.get(task.pack_id, 0), task.space_group)
+            times_per_key.setdefault(key, []).append(
+                task.exec_time.total_seconds())
+
+        for (residues_class, space_group), times in times_per_key.items():
+            cls.objects.get_or_create(
+                residues_class=residues_class,
+                space_group=space_group,
+                data_class=data_class)
+            cls.objects.filter(
+                residues_class=residues_class,
+                space_group=space_group,
+                data_class=data_class).update(
+                    count=F('count') + len(times),
+                    total=F('total') + sum(times),
+                    total_squares=F('total_squares') \
+                        + sum([time ** 2 for time in times]))
+
+        log.debug("Exit")
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Compute again the whole table from the complete tasks.
+
+        Only needed once, to take into account the tasks completed before
+        the table existed.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        cls.objects.all().delete()
+        # Job is defined in contaminer.py, which imports this module
+        job_model = apps.get_model('contaminer', 'Job')
+        jobs = job_model.objects.filter(task__status_complete=True).distinct()
+        for job in jobs.iterator():
+            cls.record(
+                list(job.task_set.filter(status_complete=True)),
+                job.data_size)
+
+        log.debug("Exit")
+
+    @classmethod
+    def get_estimator(cls):
+        """Return a RuntimeEstimator knowing the whole table."""
+        return RuntimeEstimator(cls.objects.all())
+
+
+class RuntimeEstimator(object):
+    """
+    Estimate the execution time of the tasks from the statistics.
+
+    When no task of the exact class is known, the estimation falls back on
+    the tasks of the same pack size and space group, then of the same pack
+    size, then on all the tasks.
+    """
+
+    def __init__(self, statistics):
+        """Index the rows of RuntimeStatistics at each level."""
+        self.levels = [{}, {}, {}, {}]
+        for row in statistics:
+            keys = [
+                (row.residues_class, row.space_group, row.data_class),
+                (row.residues_class, row.space_group),
+                (row.residues_class,),
+                (),
+                ]
+            for level, key in zip(self.levels, keys):
+                count, total = level.get(key, (0, 0.0))
+                level[key] = (count + row.count, total + row.total)
+
+    def get_mean(self, residues_class, space_group, data_class):
+        """Return the expected execution time in seconds, or None."""
+        keys = [
+            (residues_class, space_group, data_class),
+            (residues_class, space_group),
+            (residues_class,),
+            (),
+            ]
+        for level, key in zip(self.levels, keys):
+            count, total = level.get(key, (0, 0.0))
+            if count:
+                return total / count
+        return None
+
+    def get_remaining_time(self, tasks, data_size, slots):
+        """
+        Return the estimated time before the end of the tasks, or None.
+
+        :param tasks: unfinished tasks of a job.
+        :param data_size: size in bytes of the diffraction data of the job.
+        :param slots: number of tasks the cluster runs at the same time.
+        :returns: timedelta
+        """
+        if not tasks:
+            return datetime.timedelta(0)
+        residues_classes = RuntimeStatistics.get_residues_classes(
+            [task.pack_id for task in tasks])
+        data_class = get_size_class(data_size)
+
+        remaining_times = []
+        for task in tasks:
+            mean = self.get_mean(
+                residues_classes.get(task.pack_id, 0),
+                task.space_group,
+                data_class)
+            if mean is None:
+                return None
+            elapsed = task.exec_time.total_seconds()
+            remaining_times.append(max(mean - elapsed, 0))
+
+        # The tasks are run by batches of slots tasks, but no task can end
+        # before its own remaining time
+        remaining = max(
+            max(remaining_times),
+            sum(remaining_times) / max(slots, 1))
+        return datetime.timedelta(seconds=int(remaining))
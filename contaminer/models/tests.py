@@ -24,15 +24,24 @@
 """
 
 from django.test import TestCase
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError
+from django.core import mail
+from django.test import override_settings
+from django.utils import timezone
+from django.apps import apps
 import mock
 import timeout_decorator
 
 import lxml.etree as ET
 import datetime
+import os
+import shutil
+import tempfile
+from io import BytesIO
 
 from .contabase import ContaBase
 from .contabase import Category
@@ -44,6 +53,21 @@ from .contabase import Suggestion
 
 from .contaminer import Job
 from .contaminer import Task
+from .cache import CachedJob
+from .mail import OutboxMail
+from .runtime import RuntimeStatistics
+from .runtime import get_size_class
+from .cluster import ClusterState
+from .cluster import HEALTH_RETRY_DELAY
+from .cluster import MAX_FAILURES
+from .cluster import CLOSED
+from .cluster import OPEN
+from .cluster import HALF_OPEN
+from .admission import QueuedSubmission
+from .admission import MAX_SUBMIT_ATTEMPTS
+from .upload import UploadSession
+from .. import metrics
+from ..ssh_tools import ClusterUnavailable
 
 
 # TODO: UpperCaseCharField testing
@@ -90,10 +114,10 @@ class ContaBaseTestCase(TestCase):
             self.fail(e)
 
     @mock.patch('contaminer.models.contabase.Category')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
-    def test_update_makes_only_one_none_obsolete(self, mock_get_contabase,
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
+    def test_update_makes_only_one_none_obsolete(self, mock_iter_contabase,
             mock_category):
-        mock_get_contabase.return_value = "<contabase></contabase>"
+        mock_iter_contabase.return_value = ["<contabase></contabase>"]
         new_contabase = ContaBase.update()
         try:
             ContaBase.objects.get(obsolete = False)
@@ -101,26 +125,26 @@ class ContaBaseTestCase(TestCase):
             self.fail(e)
 
     @mock.patch('contaminer.models.contabase.Category')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
-    def test_update_creates_new_contabase(self, mock_get_contabase,
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
+    def test_update_creates_new_contabase(self, mock_iter_contabase,
             mock_category):
         old_contabase_count = len(ContaBase.objects.all())
-        mock_get_contabase.return_value = "<contabase></contabase>"
+        mock_iter_contabase.return_value = ["<contabase></contabase>"]
         new_contabase = ContaBase.update()
         new_contabase_count = len(ContaBase.objects.all())
         self.assertEqual(new_contabase_count, old_contabase_count + 1)
 
     @mock.patch('contaminer.models.contabase.Category.update')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
-    def test_update_updates_good_parameters_category(self, mock_get_contabase,
-            mock_category_update):
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
+    def test_update_updates_good_parameters_category(self,
+            mock_iter_contabase, mock_category_update):
         xml_example = "" \
             + "<contabase>\n" \
             + "    <category>\n" \
             + "        <id>1</id>\n" \
             + "    </category>\n" \
             + "</contabase>"
-        mock_get_contabase.return_value = xml_example
+        mock_iter_contabase.return_value = [xml_example]
         ContaBase.update()
         contabase = ContaBase.get_current()
         _, args, _ = mock_category_update.mock_calls[0]
@@ -132,9 +156,9 @@ class ContaBaseTestCase(TestCase):
         self.assertEqual(ET.tostring(category_dict), ET.tostring(args[1]))
 
     @mock.patch('contaminer.models.contabase.Category.update')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
-    def test_update_updates_good_number_categories(self, mock_get_contabase,
-            mock_category_update):
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
+    def test_update_updates_good_number_categories(self,
+            mock_iter_contabase, mock_category_update):
         xml_example = "" \
             + "<contabase>\n" \
             + "    <category>\n" \
@@ -142,26 +166,39 @@ class ContaBaseTestCase(TestCase):
             + "    <category>\n" \
             + "    </category>\n" \
             + "</contabase>"
-        mock_get_contabase.return_value = xml_example
+        mock_iter_contabase.return_value = [xml_example]
         ContaBase.update()
         self.assertEqual(len(mock_category_update.mock_calls), 2)
 
     @mock.patch('contaminer.models.contabase.Category.update')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
+    def test_update_parses_xml_split_in_chunks(self,
+            mock_iter_contabase, mock_category_update):
+        mock_iter_contabase.return_value = [
+            "<contabase>\n    <cate",
+            "gory>\n    </category>\n    <category>\n",
+            "    </category>\n</contab",
+            "ase>",
+            ]
+        ContaBase.update()
+        self.assertEqual(len(mock_category_update.mock_calls), 2)
+
+    @mock.patch('contaminer.models.contabase.Category.update')
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
     def test_update_updates_raises_error_on_not_ready_CB(self,
-            mock_get_contabase, mock_category_update):
+            mock_iter_contabase, mock_category_update):
         get_response = 'ContaBase is not ready\n'
-        mock_get_contabase.return_value = get_response
+        mock_iter_contabase.return_value = [get_response]
         with self.assertRaises(RuntimeError):
             ContaBase.update()
 
     @mock.patch('contaminer.models.contabase.Category.update')
-    @mock.patch('contaminer.models.contabase.SSHChannel.get_contabase')
+    @mock.patch('contaminer.backends.SSHChannel.iter_contabase')
     def test_update_updates_does_not_make_obsolete_on_not_ready_CB(self,
-            mock_get_contabase, mock_category_update):
+            mock_iter_contabase, mock_category_update):
         get_response = 'ContaBase is not ready\n'
         ContaBase.objects.create()
-        mock_get_contabase.return_value = get_response
+        mock_iter_contabase.return_value = [get_response]
         try:
             ContaBase.objects.get(obsolete=False)
         except Exception as e:
@@ -278,7 +315,7 @@ class CategoryTestCase(TestCase):
         self.assertEqual(str(self.category3), 'Obsolete protein - False (obsolete)')
 
     def test_Category_number_is_unique_per_contabase(self):
-        with self.assertRaises(ValidationError):
+        with self.assertRaises(IntegrityError):
             Category.objects.create(
                     number = 1,
                     name = "Another name",
@@ -566,6 +603,18 @@ class ContaminantTestCase(TestCase):
                 )
         self.assertEqual(str(contaminant), 'P0ACJ8 - CRP_ECOLI')
 
+    def test_Contaminant_uniprot_id_is_unique_per_category(self):
+        category = Category.objects.get(
+                name = "Protein in E.Coli",
+                )
+        with self.assertRaises(IntegrityError):
+            Contaminant.objects.create(
+                    uniprot_id = "P0ACJ8",
+                    category = category,
+                    short_name = "CRP_ecoli",
+                    sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                    )
+
     def test_Contaminant_short_name_is_uppercase(self):
         contaminant = Contaminant.objects.get(
                 uniprot_id = "P0ACJ8",
@@ -927,7 +976,7 @@ class PackTestCase(TestCase):
         contaminant = Contaminant.objects.get(
                 uniprot_id = 'P0ACJ8',
                 )
-        with self.assertRaises(ValidationError):
+        with self.assertRaises(IntegrityError):
             Pack.objects.create(
                     contaminant = contaminant,
                     number = 1,
@@ -1871,6 +1920,89 @@ class JobTestCase(TestCase):
         }
         self.assertEqual(response_dict, response_expected)
 
+    def test_to_simple_dict_gives_cancelled_tasks_cancelled(self):
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            status_cancelled = True,
+            ).save()
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-1-2-1",
+            status_cancelled = True,
+            ).save()
+
+        response_dict = self.job.to_simple_dict()
+        self.assertEqual(response_dict['results'], [
+            {
+                'uniprot_id': "P0ACJ8",
+                'status': 'Cancelled',
+            },
+        ])
+
+    def test_to_simple_dict_gives_saved_time_tasks_cancelled(self):
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            percent = 40,
+            q_factor = 0.70,
+            status_complete = True,
+            exec_time = datetime.timedelta(seconds=200),
+            )
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-1-2-1",
+            status_cancelled = True,
+            exec_time = datetime.timedelta(seconds=50),
+            )
+
+        response_dict = self.job.to_simple_dict()
+        self.assertEqual(response_dict['saved_time'], 150)
+        self.assertIn('early_stop', response_dict['messages'])
+        self.assertEqual(len(response_dict['results']), 1)
+        self.assertEqual(response_dict['results'][0]['status'], 'Complete')
+
+    def test_to_simple_dict_gives_saved_time_of_all_contaminants(self):
+        contaminant = Contaminant.objects.create(
+            uniprot_id = "P0AA25",
+            category = self.category,
+            short_name = "THIO_ECOLI",
+            long_name = "Thioredoxin 1",
+            sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            organism = "Escherichia coli",
+            )
+        pack = Pack.objects.create(
+            contaminant = contaminant,
+            number = 1,
+            structure = '1-mer',
+            )
+        # The cancelled task belongs to the first contaminant iterated
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            status_cancelled = True,
+            exec_time = datetime.timedelta(seconds=50),
+            )
+        Task.objects.create(
+            job = self.job,
+            pack = pack,
+            space_group = "P-1-2-1",
+            percent = 40,
+            q_factor = 0.70,
+            status_complete = True,
+            exec_time = datetime.timedelta(seconds=200),
+            )
+
+        response_dict = self.job.to_simple_dict()
+        self.assertEqual(response_dict['saved_time'], 150)
+        self.assertIn('early_stop', response_dict['messages'])
+        self.assertEqual(len(response_dict['results']), 2)
+
     @mock.patch('contaminer.models.contaminer.os.path.exists')
     def test_to_simple_dict_gives_available_files(self, mock_exists):
         task1 = Task.objects.create(
@@ -1880,6 +2012,8 @@ class JobTestCase(TestCase):
             percent=50,
             q_factor=0.60,
             r_free=0.2,
+            r_work=0.18,
+            resolution=1.8,
             status_complete=True,
             )
 
@@ -1894,6 +2028,8 @@ class JobTestCase(TestCase):
                     'percent': 50,
                     'q_factor': 0.60,
                     'r_free': 0.2,
+                    'r_work': 0.18,
+                    'resolution': 1.8,
                     'pack_number': 1,
                     'space_group': "P-1-2-1",
                     'files_available': "True",
@@ -1927,15 +2063,18 @@ class JobTestCase(TestCase):
                 job.get_filename(),
                 "web_task_" + str(job.id))
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.os.remove')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_submit_send_input_file(self, mock_sshchannel, mock_sftpchannel,
-            mock_remove, mock_CMConfig):
+            mock_remove, mock_CMConfig, mock_getsize):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("", "")
@@ -1952,15 +2091,18 @@ class JobTestCase(TestCase):
             "/local/dir/file.mtz",
             "/remote/dir")
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.os.remove')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_submit_write_contaminants_list(self, mock_sshchannel,
-            mock_sftpchannel, mock_remove, mock_CMConfig):
+            mock_sftpchannel, mock_remove, mock_CMConfig, mock_getsize):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("", "")
@@ -1976,15 +2118,18 @@ class JobTestCase(TestCase):
         mock_client.write_file("/remote/dir/web_task_" + str(job.id) + ".txt",
             "cont1\ncont2\n")
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.os.remove')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_submit_runs_contaminer(self, mock_sshchannel, mock_sftpchannel,
-            mock_remove, mock_CMConfig):
+            mock_remove, mock_CMConfig, mock_getsize):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("", "")
@@ -2002,15 +2147,18 @@ class JobTestCase(TestCase):
             + '"web_task_' + str(job.id) + '.mtz" ' \
             + '"web_task_' + str(job.id) + '.txt"')
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.os.remove')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_submit_remove_local_file(self, mock_sshchannel, mock_sftpchannel,
-            mock_remove, mock_CMConfig):
+            mock_remove, mock_CMConfig, mock_getsize):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("", "")
@@ -2021,19 +2169,24 @@ class JobTestCase(TestCase):
                 name = "New job 3",
                 email = "me@example.com,",
                 )
+        mock_getsize.return_value = 2048
         job = Job.objects.get(name = "New job 3")
         job.submit("/local/dir/file.mtz", "cont1\ncont2\n")
         mock_remove.assert_called_with("/local/dir/file.mtz")
+        self.assertEqual(Job.objects.get(id=job.id).data_size, 2048)
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.os.remove')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_submit_change_status_to_submitted(self, mock_sshchannel,
-            mock_sftpchannel, mock_remove, mock_CMConfig):
+            mock_sftpchannel, mock_remove, mock_CMConfig, mock_getsize):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("", "")
@@ -2048,13 +2201,133 @@ class JobTestCase(TestCase):
         job.submit("/local/dir/file.mtz", "cont1\ncont2\n")
         self.assertEqual(job.status_submitted, True)
 
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.models.contaminer.os.remove')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_submit_batch_sends_files_in_one_session(self, mock_sshchannel,
+            mock_sftpchannel, mock_remove, mock_CMConfig, mock_getsize):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_CMConfig.return_value = mock_config
+        mock_client = mock.MagicMock()
+        mock_sftpchannel.return_value = mock_client
+        mock_sshchannel.return_value = mock_client
+        job1 = Job.create(name = "Job 1", email = "me@example.com")
+        job2 = Job.create(name = "Job 2", email = "me@example.com")
+        Job.submit_batch(
+            [(job1, "/local/dir/file1.mtz", "cont1\n"),
+             (job2, "/local/dir/file2.cif", "cont2\n")],
+            custom_contaminants=["/local/dir/model.pdb"])
+        mock_client.send_files.assert_called_once_with(
+            ["/local/dir/file1.mtz", "/local/dir/file2.cif",
+             "/local/dir/model.pdb"],
+            "/remote/dir",
+            [("/remote/dir/web_task_" + str(job1.id) + ".txt", "cont1\n"),
+             ("/remote/dir/web_task_" + str(job2.id) + ".txt", "cont2\n")])
+        self.assertEqual(mock_remove.call_count, 2)
+
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.models.contaminer.os.remove')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_submit_batch_launches_jobs_in_one_command(self, mock_sshchannel,
+            mock_sftpchannel, mock_remove, mock_CMConfig, mock_getsize):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_CMConfig.return_value = mock_config
+        mock_client = mock.MagicMock()
+        mock_sftpchannel.return_value = mock_client
+        mock_sshchannel.return_value = mock_client
+        job1 = Job.create(name = "Job 1", email = "me@example.com")
+        job2 = Job.create(name = "Job 2", email = "me@example.com")
+        Job.submit_batch(
+            [(job1, "/local/dir/file1.mtz", "cont1\n"),
+             (job2, "/local/dir/file2.cif", "cont2\n")])
+        mock_client.exec_command_in_shell.assert_called_once_with(
+            'cd "/remote/dir" && /remote/CM/contaminer solve ' \
+            + '"web_task_' + str(job1.id) + '.mtz" ' \
+            + '"web_task_' + str(job1.id) + '.txt" 2>&1 ' \
+            + '|| echo "Launch failed: 0"; ' \
+            + 'cd "/remote/dir" && /remote/CM/contaminer solve ' \
+            + '"web_task_' + str(job2.id) + '.cif" ' \
+            + '"web_task_' + str(job2.id) + '.txt" 2>&1 ' \
+            + '|| echo "Launch failed: 1"')
+        self.assertTrue(Job.objects.get(id=job1.id).status_submitted)
+        self.assertTrue(Job.objects.get(id=job2.id).status_submitted)
+
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.models.contaminer.os.remove')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_submit_batch_puts_failed_launch_in_error(self, mock_sshchannel,
+            mock_sftpchannel, mock_remove, mock_CMConfig, mock_getsize):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_CMConfig.return_value = mock_config
+        mock_client = mock.MagicMock()
+        mock_client.exec_command_in_shell.return_value = \
+            "contaminer: bad file\nLaunch failed: 0\n"
+        mock_sftpchannel.return_value = mock_client
+        mock_sshchannel.return_value = mock_client
+        job1 = Job.create(name = "Job 1", email = "me@example.com")
+        job2 = Job.create(name = "Job 2", email = "me@example.com")
+        Job.submit_batch(
+            [(job1, "/local/dir/file1.mtz", "cont1\n"),
+             (job2, "/local/dir/file2.cif", "cont2\n")])
+        job1 = Job.objects.get(id=job1.id)
+        self.assertTrue(job1.status_error)
+        self.assertFalse(job1.status_submitted)
+        self.assertTrue(Job.objects.get(id=job2.id).status_submitted)
+        self.assertEqual(
+            OutboxMail.objects.filter(notification="").count(),
+            1)
+
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.os.remove')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_submit_batch_puts_all_jobs_in_error_if_launch_fails(self,
+            mock_sshchannel, mock_sftpchannel, mock_remove, mock_CMConfig,
+            mock_getsize):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_CMConfig.return_value = mock_config
+        mock_client = mock.MagicMock()
+        mock_client.exec_command_in_shell.side_effect = \
+            RuntimeError("cd: /remote/dir: No such file or directory")
+        mock_sftpchannel.return_value = mock_client
+        mock_sshchannel.return_value = mock_client
+        job1 = Job.create(name = "Job 1", email = "me@example.com")
+        job2 = Job.create(name = "Job 2", email = "me@example.com")
+        Job.submit_batch(
+            [(job1, "/local/dir/file1.mtz", "cont1\n"),
+             (job2, "/local/dir/file2.cif", "cont2\n")])
+        for job in [job1, job2]:
+            job = Job.objects.get(id=job.id)
+            self.assertTrue(job.status_error)
+            self.assertFalse(job.status_submitted)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_update_status_call_good_command(self, mock_sshchannel,
             mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_client.exec_command.return_value = ("submitted", "")
@@ -2071,12 +2344,13 @@ class JobTestCase(TestCase):
                         + str(job.id))
 
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_update_status_change_status(self, mock_sshchannel,
             mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock()
         mock_sshchannel.return_value = mock_client
@@ -2113,12 +2387,13 @@ class JobTestCase(TestCase):
         self.assertEqual(job.get_status(), "Error")
 
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_update_status_raise_exception_on_stderr(self, mock_sshchannel,
             mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
         mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.agent_enabled = False
         mock_CMConfig.return_value = mock_config
         mock_client = mock.MagicMock(side_effect = RuntimeError())
         property_mock = mock.PropertyMock(side_effect = RuntimeError)
@@ -2131,6 +2406,8 @@ class JobTestCase(TestCase):
         with self.assertRaises(RuntimeError):
             job.update_status()
 
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
     @mock.patch('contaminer.models.contaminer.Job.update')
     def test_update_all_updates_job(self, mock_update):
         job = Job.create(
@@ -2142,6 +2419,8 @@ class JobTestCase(TestCase):
         Job.update_all()
         self.assertTrue(mock_update.called)
 
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
     @mock.patch('contaminer.models.contaminer.Job.update')
     def test_update_all_not_update_archived(self, mock_update):
         job = Job.create(
@@ -2154,6 +2433,8 @@ class JobTestCase(TestCase):
         Job.update_all()
         self.assertFalse(mock_update.called)
 
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
     @mock.patch('contaminer.models.contaminer.Job.update')
     def test_update_all_not_update_not_submitted(self, mock_update):
         job = Job.create(
@@ -2165,8 +2446,102 @@ class JobTestCase(TestCase):
         Job.update_all()
         self.assertFalse(mock_update.called)
 
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Job.update')
+    def test_update_all_skips_unchanged_results(self, mock_update,
+            mock_sshchannel):
+        changed = Job.create(name="changed", email="me@example.com")
+        unchanged = Job.create(name="unchanged", email="me@example.com")
+        for job in [changed, unchanged]:
+            job.status_submitted = True
+            job.results_size = 100
+            job.results_mtime = 1000
+            job.save()
+        mock_sshchannel.return_value.stat_files.return_value = {
+            changed.get_results_path(): (150, 1010),
+            unchanged.get_results_path(): (100, 1000),
+            }
+
+        Job.update_all()
+        self.assertEqual(
+            sorted([call[1]['with_tasks']
+                    for call in mock_update.call_args_list]),
+            [False, True])
+        self.assertEqual(
+            mock_sshchannel.return_value.stat_files.call_count,
+            1)
+        changed = Job.objects.get(id=changed.id)
+        self.assertEqual(changed.results_size, 150)
+        self.assertEqual(changed.results_mtime, 1010)
+
+        mock_update.reset_mock()
+        Job.update_all()
+        self.assertEqual(
+            [call[1]['with_tasks'] for call in mock_update.call_args_list],
+            [False, False])
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Job.update', autospec=True)
+    def test_update_all_checks_status_of_unchanged_jobs_at_interval(self,
+            mock_update, mock_sshchannel):
+        recent = Job.create(name="recent", email="me@example.com")
+        old = Job.create(name="old", email="me@example.com")
+        for job, checked in [(recent, 60), (old, 7200)]:
+            job.status_submitted = True
+            job.results_size = 100
+            job.results_mtime = 1000
+            job.status_checked = timezone.now() \
+                - datetime.timedelta(seconds=checked)
+            job.save()
+        mock_sshchannel.return_value.stat_files.return_value = {
+            recent.get_results_path(): (100, 1000),
+            old.get_results_path(): (100, 1000),
+            }
+
+        with mock.patch.object(apps.get_app_config('contaminer'),
+                               'status_interval', 1800):
+            Job.update_all()
+        self.assertEqual(
+            mock_update.call_args_list,
+            [mock.call(old, with_tasks=False)])
+        mock_sshchannel.return_value.exec_command_in_shell.assert_not_called()
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_update_all_archives_complete_job_with_unchanged_results(self,
+            mock_sshchannel):
+        job = Job.create(name="finished", email="me@example.com")
+        job.status_submitted = True
+        job.status_running = True
+        job.results_size = 100
+        job.results_mtime = 1000
+        job.save()
+        mock_sshchannel.return_value.stat_files.return_value = {
+            job.get_results_path(): (100, 1000)}
+        mock_sshchannel.return_value.exec_command_in_shell.return_value = \
+            "complete"
+
+        Job.update_all()
+        mock_sshchannel.return_value.read_file.assert_not_called()
+        job = Job.objects.get(id=job.id)
+        self.assertTrue(job.status_complete)
+        self.assertTrue(job.status_archived)
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Job.update')
+    def test_update_all_updates_when_results_are_missing(self, mock_update,
+            mock_sshchannel):
+        job = Job.create(name="new", email="me@example.com")
+        job.status_submitted = True
+        job.save()
+        mock_sshchannel.return_value.stat_files.return_value = {
+            job.get_results_path(): None}
+        Job.update_all()
+        self.assertTrue(mock_update.called)
+
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
     @mock.patch('contaminer.models.contaminer.Job.update')
-    @mock.patch('contaminer.models.contaminer.mail_admins')
+    @mock.patch('contaminer.models.contaminer.OutboxMail.queue_report')
     def test_update_send_mail_if_exception(self, mock_mail, mock_update):
         mock_update.side_effect = RuntimeError
         job = Job.create(
@@ -2219,10 +2594,11 @@ class JobTestCase(TestCase):
         self.assertFalse(mock_mail.called)
 
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
     def test_update_tasks_read_good_file(self, mock_ssh, mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
         mock_CMConfig.return_value = mock_config
         mock_channel = mock.MagicMock()
         mock_channel.read_file.return_value = ""
@@ -2239,15 +2615,17 @@ class JobTestCase(TestCase):
         mock_channel.read_file.assert_called_once_with(expect_call)
 
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
-    @mock.patch('contaminer.models.contaminer.Task')
-    def test_update_tasks_create_good_task(self, mock_task, mock_ssh,
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Task.update_parsed')
+    def test_update_tasks_create_good_task(self, mock_update, mock_ssh,
             mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
         mock_CMConfig.return_value = mock_config
         mock_channel = mock.MagicMock()
-        mock_channel.read_file.return_value = "line1"
+        mock_channel.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,completed,0.53,100,0h 4m 5s"
         mock_ssh.return_value = mock_channel
         job = Job()
         job.create(
@@ -2257,18 +2635,29 @@ class JobTestCase(TestCase):
         job.status_submitted = True
         job.save()
         job.update_tasks()
-        mock_task.update.assert_called_once_with(job, "line1")
+        mock_update.assert_called_once_with(job, {
+            'uniprot_id': "P0ACJ8",
+            'pack_number': 1,
+            'space_group': "P-1-2-1",
+            'status': "completed",
+            'q_factor': 0.53,
+            'percent': 100,
+            'elapsed_seconds': 245,
+            })
 
     @mock.patch('contaminer.models.contaminer.apps.get_app_config')
-    @mock.patch('contaminer.models.contaminer.SSHChannel')
-    @mock.patch('contaminer.models.contaminer.Task')
-    def test_update_tasks_create_enough_tasks(self, mock_task, mock_ssh,
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Task.update_parsed')
+    def test_update_tasks_create_enough_tasks(self, mock_update, mock_ssh,
             mock_CMConfig):
         mock_config = mock.MagicMock()
         mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
         mock_CMConfig.return_value = mock_config
         mock_channel = mock.MagicMock()
-        mock_channel.read_file.return_value = "line1\nline2"
+        mock_channel.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,completed,0.53,100,0h 4m 5s\n" \
+            + "P0ACJ8,2,P-1-2-1,new,0,0,0h 0m 0s\n"
         mock_ssh.return_value = mock_channel
         job = Job()
         job.create(
@@ -2278,7 +2667,216 @@ class JobTestCase(TestCase):
         job.status_submitted = True
         job.save()
         job.update_tasks()
-        self.assertEqual(mock_task.update.call_count, 2)
+        self.assertEqual(mock_update.call_count, 2)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Task.update_parsed')
+    def test_update_tasks_skip_malformed_lines(self, mock_update, mock_ssh,
+            mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
+        mock_CMConfig.return_value = mock_config
+        mock_channel = mock.MagicMock()
+        mock_channel.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,completed,0.53,100,0h 4m 5s\n" \
+            + "P0ACJ8,2,P-1-2-1,new,abc,0,0h 0m 0s\n" \
+            + "P0ACJ8,3\n" \
+            + "P0ACJ8,4,P-1-2-1,new,0,0,0h 0m 0s\n"
+        mock_ssh.return_value = mock_channel
+        job = Job()
+        job.create(
+                name = "test",
+                email = "me@example.com",
+                )
+        job.status_submitted = True
+        job.save()
+        job.update_tasks()
+        self.assertEqual(mock_update.call_count, 2)
+        self.assertEqual(mock_update.call_args[0][1]['pack_number'], 4)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Task.' \
+        + 'update_refinement_statistics')
+    def test_update_tasks_gets_statistics_of_new_positive(self,
+            mock_statistics, mock_ssh, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
+        mock_CMConfig.return_value = mock_config
+        mock_channel = mock.MagicMock()
+        mock_channel.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,completed,0.53,99,0h 4m 5s\n" \
+            + "P0ACJ8,2,P-1-2-1,completed,0.53,20,0h 4m 5s\n"
+        mock_ssh.return_value = mock_channel
+        self.job.status_submitted = True
+        self.job.save()
+        self.job.update_tasks()
+        positive_task = Task.objects.get(job=self.job, pack=self.pack1)
+        mock_statistics.assert_called_once_with([positive_task])
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_update_tasks_retries_missing_statistics(self, mock_ssh,
+            mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.early_stop = False
+        mock_CMConfig.return_value = mock_config
+        mock_channel = mock.MagicMock()
+        mock_channel.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,completed,0.53,99,0h 4m 5s\n"
+        mock_channel.get_pdb_headers.side_effect = \
+            ClusterUnavailable("Circuit open")
+        mock_ssh.return_value = mock_channel
+        self.job.status_submitted = True
+        self.job.save()
+        self.job.update_tasks()
+        task = Task.objects.get(job=self.job, pack=self.pack1)
+        self.assertEqual(task.r_free, None)
+
+        remote_pdb = "/remote/dir/" + task.get_final_filename() \
+            + "/results_solve/final.pdb"
+        mock_channel.get_pdb_headers.side_effect = None
+        mock_channel.get_pdb_headers.return_value = {
+            remote_pdb:
+                "REMARK   3   RESOLUTION RANGE HIGH (ANGSTROMS) : 1.80\n" \
+                + "REMARK   3   R VALUE            (WORKING SET) : 0.19\n" \
+                + "REMARK   3   FREE R VALUE                     : 0.23\n",
+            }
+        self.job.update_tasks()
+        self.assertEqual(Task.objects.get(id=task.id).r_free, 0.23)
+
+        self.job.update_tasks()
+        self.assertEqual(mock_channel.get_pdb_headers.call_count, 2)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_cancel_redundant_tasks_cancels_found_contaminant(self,
+            mock_ssh, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.threshold = 90
+        mock_config.ssh_contaminer_location = "/remote/CM"
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_config.agent_enabled = False
+        mock_CMConfig.return_value = mock_config
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            percent = 99,
+            status_complete = True,
+            )
+        running_task = Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-1-2-1",
+            status_running = True,
+            )
+        new_task = Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-2-2-2",
+            )
+        cancelled = self.job.cancel_redundant_tasks()
+        self.assertEqual(set(cancelled), set([running_task, new_task]))
+        command = mock_ssh.return_value.exec_command_in_shell.call_args[0][0]
+        self.assertTrue(command.startswith("/remote/CM/contaminer cancel " \
+            + "/remote/dir/web_task_" + str(self.job.id) + " "))
+        self.assertIn('"P0ACJ8_2_P-1-2-1"', command)
+        self.assertIn('"P0ACJ8_2_P-2-2-2"', command)
+        self.assertEqual(
+            Task.objects.get(id=running_task.id).get_status(),
+            "Cancelled")
+        self.assertEqual(
+            Task.objects.get(id=new_task.id).get_status(),
+            "Cancelled")
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_cancel_redundant_tasks_does_nothing_without_positive(self,
+            mock_ssh, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.threshold = 90
+        mock_CMConfig.return_value = mock_config
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            percent = 40,
+            status_complete = True,
+            )
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-1-2-1",
+            )
+        self.assertEqual(self.job.cancel_redundant_tasks(), [])
+        self.assertFalse(mock_ssh.called)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_cancel_redundant_tasks_keeps_tasks_on_ssh_error(self,
+            mock_ssh, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.threshold = 90
+        mock_config.agent_enabled = False
+        mock_CMConfig.return_value = mock_config
+        mock_ssh.return_value.exec_command_in_shell.side_effect = \
+            RuntimeError("Usage")
+        Task.objects.create(
+            job = self.job,
+            pack = self.pack1,
+            space_group = "P-1-2-1",
+            percent = 99,
+            status_complete = True,
+            )
+        task = Task.objects.create(
+            job = self.job,
+            pack = self.pack2,
+            space_group = "P-1-2-1",
+            )
+        self.assertEqual(self.job.cancel_redundant_tasks(), [])
+        self.assertEqual(Task.objects.get(id=task.id).get_status(), "New")
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    @mock.patch('contaminer.models.contaminer.Job.cancel_redundant_tasks')
+    def test_update_tasks_cancels_only_if_early_stop(self, mock_cancel,
+            mock_ssh, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.early_stop = False
+        mock_CMConfig.return_value = mock_config
+        mock_ssh.return_value.read_file.return_value = ""
+        self.job.status_submitted = True
+        self.job.save()
+        self.job.update_tasks()
+        self.assertFalse(mock_cancel.called)
+        mock_config.early_stop = True
+        self.job.update_tasks()
+        mock_cancel.assert_called_once_with()
+
+    def test_get_saved_time_gives_none_without_cancelled_task(self):
+        task = Task(exec_time=datetime.timedelta(seconds=100),
+                    status_complete=True)
+        self.assertEqual(Job.get_saved_time([task]), None)
+
+    def test_get_saved_time_gives_remaining_average_time(self):
+        tasks = [
+            Task(exec_time=datetime.timedelta(seconds=100),
+                 status_complete=True),
+            Task(exec_time=datetime.timedelta(seconds=300),
+                 status_complete=True),
+            Task(exec_time=datetime.timedelta(seconds=50),
+                 status_cancelled=True),
+            Task(exec_time=datetime.timedelta(seconds=0),
+                 status_cancelled=True),
+            ]
+        self.assertEqual(
+            Job.get_saved_time(tasks),
+            datetime.timedelta(seconds=350))
 
     def create_pack(self):
         job = Job.objects.create(
@@ -2615,23 +3213,33 @@ class JobTestCase(TestCase):
         mock_task.assert_any_call(pack2.contaminant)
         mock_task.assert_any_call(contaminant2)
 
-    @mock.patch('contaminer.models.contaminer.send_mail')
-    def test_send_email_to_good_address(self, mock_send_mail):
+    def test_send_email_queues_notification(self):
         job = Job.create(
                 name = "test",
                 email = "me@example.com",
                 )
         job.send_complete_mail()
-        self.assertTrue(mock_send_mail.called)
-        self.assertEqual(mock_send_mail.call_args[0][3], ['me@example.com'])
+        mail = OutboxMail.objects.get(job=job)
+        self.assertEqual(mail.notification, "complete")
+        self.assertFalse(Job.objects.get(id=job.id).mail_sent)
 
-    @mock.patch('contaminer.models.contaminer.send_mail')
-    def test_do_not_send_email_if_no_address(self, mock_send_mail):
+    def test_do_not_send_email_if_no_address(self):
         job = Job.create(
                 name = "test",
                 )
         job.send_complete_mail()
-        self.assertFalse(mock_send_mail.called)
+        self.assertFalse(OutboxMail.objects.exists())
+
+    def test_get_mail_notification_renders_template(self):
+        job = Job.create(
+                name = "My crystal",
+                email = "me@example.com",
+                )
+        title, message = job.get_mail_notification("submitted")
+        self.assertEqual(title, "ContaMiner job submitted")
+        self.assertIn("My crystal", message)
+        with self.assertRaises(ValueError):
+            job.get_mail_notification("other")
 
 
 class TaskTestCase(TestCase):
@@ -2834,6 +3442,8 @@ class TaskTestCase(TestCase):
         self.assertEqual(task.get_status(), "New")
         task.status_complete = True
         self.assertEqual(task.get_status(), "Complete")
+        task.status_cancelled = True
+        self.assertEqual(task.get_status(), "Cancelled")
         task.status_error = True
         self.assertEqual(task.get_status(), "Error")
 
@@ -2850,6 +3460,19 @@ class TaskTestCase(TestCase):
                 + " (me@example.com) New / P0ACJ8 - CRP_ECOLI - 5 (5-mer)"\
                 + " / P-2-2-2 / New")
 
+    def test_Task_is_unique_per_job_pack_space_group(self):
+        Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-2-2-2",
+                )
+        with self.assertRaises(IntegrityError):
+            Task.objects.create(
+                    job = self.job,
+                    pack = self.pack,
+                    space_group = "P-2-2-2",
+                    )
+
     def test_Task_percent_is_valid_percentage(self):
         with self.assertRaises(ValidationError):
             task = Task.objects.create(
@@ -2912,6 +3535,46 @@ class TaskTestCase(TestCase):
         with self.assertRaises(ValueError):
             task = Task.update(self.job, "1,2,3")
 
+    def test_parse_results_same_as_parse_line(self):
+        lines = [
+            "P0ACJ8,5,P-1-1-1,completed,0.414,52,1h 26m  9s",
+            "P0ACJ8,5,P-1-1-2,completed,0,0,2h 26m  9s",
+            "P0ACJ8,5,P-1-2-1,running,0,0,0h  0m  0s",
+            "P0ACJ8,6,P-2-1-1,error,0,0,1h  1m  1s",
+            "P0ACJ9,1,P-2-1-1,new,0.5,90,",
+            ]
+        results, malformed_lines = Task.parse_results("\n".join(lines))
+        self.assertEqual(malformed_lines, [])
+        self.assertEqual(results['line_number'], [1, 2, 3, 4, 5])
+        for index, line in enumerate(lines):
+            self.assertEqual(
+                Task.get_parsed_line(results, index),
+                Task.parse_line(line))
+
+    def test_parse_results_returns_malformed_lines(self):
+        content = "P0ACJ8,5,P-1-1-1,completed,0.414,52,1h 26m  9s\n" \
+            + "Tata yoyo\n" \
+            + "\n" \
+            + "P0ACJ8,a,P-1-1-1,completed,0.414,52,1h 26m  9s\n" \
+            + "P0ACJ8,5,P-1-1-1,completed,0.414,52,1h a 9s\n" \
+            + "P0ACJ8,6,P-1-1-1,completed,0.414,52,1h 26m  9s\n"
+        results, malformed_lines = Task.parse_results(content)
+        self.assertEqual(
+            malformed_lines,
+            [
+                (2, "Tata yoyo"),
+                (4, "P0ACJ8,a,P-1-1-1,completed,0.414,52,1h 26m  9s"),
+                (5, "P0ACJ8,5,P-1-1-1,completed,0.414,52,1h a 9s"),
+            ])
+        self.assertEqual(results['line_number'], [1, 6])
+        self.assertEqual(list(results['pack_number']), [5, 6])
+
+    def test_parse_results_empty_content(self):
+        results, malformed_lines = Task.parse_results("")
+        self.assertEqual(malformed_lines, [])
+        self.assertEqual(len(results['uniprot_id']), 0)
+        self.assertEqual(len(results['percent']), 0)
+
     def test_update_creates_good_task(self):
         task = Task.update(self.job,
             "P0ACJ8,5,P-1-1-1,completed,0.414,52,1h 26m  9s")
@@ -2989,21 +3652,69 @@ class TaskTestCase(TestCase):
         self.assertEqual(task.percent, 0)
         self.assertEqual(task.q_factor, 0)
 
-    @mock.patch('contaminer.models.contaminer.PDBHandler.get_r_free')
+    @mock.patch('contaminer.models.contaminer.Task.' \
+        + 'update_refinement_statistics')
     @mock.patch('contaminer.models.contaminer.Task.get_final_files')
-    def test_update_gets_final_on_high_percentage(self, mock_get, mock_r_free):
-        mock_r_free.return_value = 0.2
+    def test_update_gets_statistics_on_high_percentage(self, mock_get,
+            mock_statistics):
         task = Task.update(self.job,
             "P0ACJ8,5,P-1-2-1,completed,0.414,89,1h 26m  9s")
-        self.assertFalse(mock_get.called)
+        self.assertFalse(mock_statistics.called)
         task = Task.update(self.job,
             "P0ACJ8,5,P-1-2-2,completed,0.414,91,1h 26m  9s")
-        self.assertTrue(mock_get.called)
+        mock_statistics.assert_called_once_with([task])
+        self.assertFalse(mock_get.called)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_update_refinement_statistics_saves_values(self, mock_ssh,
+            mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_CMConfig.return_value = mock_config
+        task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                )
+        remote_pdb = "/remote/dir/" + task.get_final_filename() \
+            + "/results_solve/final.pdb"
+        mock_ssh.return_value.get_pdb_headers.return_value = {
+            remote_pdb:
+                "REMARK   3   RESOLUTION RANGE HIGH (ANGSTROMS) : 1.80\n" \
+                + "REMARK   3   R VALUE            (WORKING SET) : 0.19\n" \
+                + "REMARK   3   FREE R VALUE                     : 0.23\n",
+            }
+        Task.update_refinement_statistics([task])
+        mock_ssh.return_value.get_pdb_headers.assert_called_once_with(
+            [remote_pdb])
+        task = Task.objects.get(id=task.id)
+        self.assertEqual(task.r_free, 0.23)
+        self.assertEqual(task.r_work, 0.19)
+        self.assertEqual(task.resolution, 1.80)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_update_refinement_statistics_ignores_ssh_error(self, mock_ssh,
+            mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.ssh_work_directory = "/remote/dir"
+        mock_CMConfig.return_value = mock_config
+        task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                )
+        mock_ssh.return_value.get_pdb_headers.side_effect = \
+            RuntimeError("No such file")
+        Task.update_refinement_statistics([task])
+        task = Task.objects.get(id=task.id)
+        self.assertEqual(task.r_free, None)
 
     @mock.patch('contaminer.models.contaminer.os.makedirs')
     @mock.patch('contaminer.ssh_tools.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.settings')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
     def test_get_final_files_get_good_files_writes_MEDIA(self, mock_channel, mock_settings,
             mock_CMConfig, mock_makedirs):
         mock_config = mock.MagicMock()
@@ -3062,7 +3773,7 @@ class TaskTestCase(TestCase):
     @mock.patch('contaminer.models.contaminer.os.makedirs')
     @mock.patch('contaminer.ssh_tools.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.settings')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
     def test_get_final_files_error_on_dir_is_file(self, mock_channel,
             mock_settings, mock_CMConfig, mock_makedirs, mock_isdir):
         mock_config = mock.MagicMock()
@@ -3116,7 +3827,7 @@ class TaskTestCase(TestCase):
     @mock.patch('contaminer.models.contaminer.os.makedirs')
     @mock.patch('contaminer.ssh_tools.apps.get_app_config')
     @mock.patch('contaminer.models.contaminer.settings')
-    @mock.patch('contaminer.models.contaminer.SFTPChannel')
+    @mock.patch('contaminer.backends.SFTPChannel')
     def test_get_final_files_pass_on_existing_local_dir(self, mock_channel,
             mock_settings, mock_CMConfig, mock_makedirs, mock_isdir):
         mock_config = mock.MagicMock()
@@ -3214,3 +3925,903 @@ class TaskTestCase(TestCase):
                 'files_available': "False",
             }
         self.assertEqual(response_dict, response_expected)
+
+
+    @mock.patch('contaminer.models.contaminer.os.path.isfile')
+    @mock.patch('contaminer.models.contaminer.Task.get_final_files')
+    def test_get_local_final_file_retrieves_evicted_files(self, mock_get,
+            mock_isfile):
+        mock_isfile.side_effect = [False, True]
+        task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                percent = 95,
+                q_factor = 0.53,
+                status_complete = True,
+                )
+        local_file = task.get_local_final_file('pdb')
+        self.assertTrue(mock_get.called)
+        self.assertTrue(local_file.endswith(
+            "web_task_" + str(self.job.id) + "/P0ACJ8_5_P-1-2-1.pdb"))
+
+    @mock.patch('contaminer.models.contaminer.os.path.isfile')
+    @mock.patch('contaminer.models.contaminer.Task.get_final_files')
+    def test_get_local_final_file_gives_none_on_low_percent(self, mock_get,
+            mock_isfile):
+        mock_isfile.return_value = False
+        task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                percent = 40,
+                q_factor = 0.53,
+                status_complete = True,
+                )
+        self.assertIsNone(task.get_local_final_file('pdb'))
+        self.assertFalse(mock_get.called)
+
+    def test_files_available_if_retrievable(self):
+        task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                percent = 95,
+                q_factor = 0.53,
+                status_complete = True,
+                )
+        self.assertTrue(task.files_available())
+        task.status_error = True
+        self.assertFalse(task.files_available())
+
+class CachedJobTestCase(TestCase):
+    """
+        Test the CachedJob model
+    """
+    def setUp(self):
+        self.job1 = Job.create(name="test1")
+        self.job2 = Job.create(name="test2")
+        self.job3 = Job.create(name="test3")
+
+    def test_add_creates_entry(self):
+        CachedJob.add(self.job1, 100)
+        entry = CachedJob.objects.get(job=self.job1)
+        self.assertEqual(entry.size, 100)
+
+    def test_add_increments_size(self):
+        CachedJob.add(self.job1, 100)
+        CachedJob.add(self.job1, 50)
+        entry = CachedJob.objects.get(job=self.job1)
+        self.assertEqual(entry.size, 150)
+        self.assertEqual(CachedJob.total_size(), 150)
+
+    def test_total_size_gives_0_on_empty_cache(self):
+        self.assertEqual(CachedJob.total_size(), 0)
+
+    @mock.patch('contaminer.models.cache.shutil.rmtree')
+    def test_evict_removes_least_recently_used(self, mock_rmtree):
+        now = datetime.datetime.now()
+        CachedJob.objects.create(job=self.job1, size=100,
+            last_access=now - datetime.timedelta(hours=3))
+        CachedJob.objects.create(job=self.job2, size=100,
+            last_access=now - datetime.timedelta(hours=1))
+        CachedJob.objects.create(job=self.job3, size=100,
+            last_access=now - datetime.timedelta(hours=2))
+
+        removed = CachedJob.evict(quota=150)
+
+        self.assertEqual(removed, 2)
+        self.assertEqual(
+            list(CachedJob.objects.values_list('job', flat=True)),
+            [self.job2.id])
+        self.assertEqual(mock_rmtree.call_count, 2)
+
+    @mock.patch('contaminer.models.cache.shutil.rmtree')
+    def test_evict_does_nothing_under_quota(self, mock_rmtree):
+        CachedJob.add(self.job1, 100)
+        self.assertEqual(CachedJob.evict(quota=1000), 0)
+        self.assertFalse(mock_rmtree.called)
+
+    @mock.patch('contaminer.models.cache.shutil.rmtree')
+    def test_evict_removes_old_entries(self, mock_rmtree):
+        now = datetime.datetime.now()
+        CachedJob.objects.create(job=self.job1, size=100,
+            last_access=now - datetime.timedelta(days=10))
+        CachedJob.objects.create(job=self.job2, size=100,
+            last_access=now - datetime.timedelta(days=1))
+
+        removed = CachedJob.evict(max_age=datetime.timedelta(days=7))
+
+        self.assertEqual(removed, 1)
+        self.assertFalse(CachedJob.objects.filter(job=self.job1).exists())
+        self.assertTrue(mock_rmtree.call_args[0][0].endswith(
+            "web_task_" + str(self.job1.id)))
+
+    @mock.patch('contaminer.models.cache.shutil.rmtree')
+    def test_evict_ignores_missing_directory(self, mock_rmtree):
+        mock_rmtree.side_effect = OSError(2, 'No such file or directory')
+        CachedJob.add(self.job1, 100)
+        CachedJob.evict(quota=10)
+        self.assertFalse(CachedJob.objects.exists())
+
+    def test_touch_updates_last_access(self):
+        old_date = datetime.datetime.now() - datetime.timedelta(days=3)
+        CachedJob.objects.create(job=self.job1, size=1, last_access=old_date)
+        CachedJob.touch(self.job1)
+        entry = CachedJob.objects.get(job=self.job1)
+        self.assertTrue(entry.last_access > old_date)
+
+
+class OutboxMailTestCase(TestCase):
+    """
+        Test the OutboxMail model
+    """
+    def setUp(self):
+        self.job = Job.create(name="test", email="me@example.com")
+
+    def test_send_pending_sends_notifications(self):
+        self.job.send_submitted_mail()
+        self.job.send_complete_mail()
+        self.assertEqual(OutboxMail.send_pending(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ["me@example.com"])
+        self.assertTrue(Job.objects.get(id=self.job.id).mail_sent)
+        self.assertFalse(OutboxMail.objects.filter(sent__isnull=True).exists())
+        self.assertEqual(OutboxMail.send_pending(), 0)
+
+    def test_send_pending_uses_one_connection(self):
+        for _ in range(3):
+            self.job.send_submitted_mail()
+        connection = mock.MagicMock()
+        with mock.patch('contaminer.models.mail.EmailMultiAlternatives') \
+                as mock_email:
+            OutboxMail.send_pending(connection=connection)
+        connection.open.assert_called_once_with()
+        connection.close.assert_called_once_with()
+        self.assertEqual(mock_email.return_value.send.call_count, 3)
+
+    def test_send_pending_retries_with_backoff(self):
+        self.job.send_complete_mail()
+        with mock.patch('contaminer.models.mail.EmailMultiAlternatives.send')\
+                as mock_send:
+            mock_send.side_effect = IOError("Server unavailable")
+            self.assertEqual(OutboxMail.send_pending(), 0)
+        outbox_mail = OutboxMail.objects.get()
+        self.assertEqual(outbox_mail.attempts, 1)
+        self.assertTrue(outbox_mail.next_attempt > timezone.now())
+        self.assertFalse(Job.objects.get(id=self.job.id).mail_sent)
+
+        # Not sent before the next attempt
+        self.assertEqual(OutboxMail.send_pending(), 0)
+        OutboxMail.objects.update(next_attempt=timezone.now())
+        self.assertEqual(OutboxMail.send_pending(), 1)
+        self.assertTrue(Job.objects.get(id=self.job.id).mail_sent)
+
+    def test_send_pending_gives_up_after_max_attempts(self):
+        self.job.send_complete_mail()
+        OutboxMail.objects.update(attempts=7)
+        with mock.patch('contaminer.models.mail.EmailMultiAlternatives.send')\
+                as mock_send:
+            mock_send.side_effect = IOError("Server unavailable")
+            OutboxMail.send_pending()
+        self.assertTrue(OutboxMail.objects.get().failed)
+
+    @override_settings(ADMINS=[("Admin", "admin@example.com")])
+    def test_send_pending_sends_reports_as_digest(self):
+        OutboxMail.queue_report("Update error", "First error")
+        OutboxMail.queue_report("Update error", "Second error")
+        self.assertEqual(OutboxMail.send_pending(), 0)
+
+        old_date = timezone.now() - datetime.timedelta(hours=2)
+        OutboxMail.objects.filter(message="First error")\
+            .update(created=old_date)
+        self.assertEqual(OutboxMail.send_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["admin@example.com"])
+        self.assertIn("First error", mail.outbox[0].body)
+        self.assertIn("Second error", mail.outbox[0].body)
+
+    def test_remove_old_keeps_pending_mails(self):
+        self.job.send_submitted_mail()
+        self.job.send_complete_mail()
+        OutboxMail.objects.filter(notification="submitted")\
+            .update(sent=timezone.now())
+        OutboxMail.objects.update(
+            created=timezone.now() - datetime.timedelta(days=10))
+        OutboxMail.remove_old(datetime.timedelta(days=7))
+        self.assertEqual(OutboxMail.objects.get().notification, "complete")
+
+
+class RuntimeStatisticsTestCase(TestCase):
+    """
+        Test the RuntimeStatistics model and the estimation of the end of jobs
+    """
+    def setUp(self):
+        contabase = ContaBase.objects.create()
+        category = Category.objects.create(
+            contabase = contabase,
+            number = 1,
+            name = "Protein in E.Coli",
+            )
+        contaminant = Contaminant.objects.create(
+            uniprot_id = "P0ACJ8",
+            category = category,
+            short_name = "CRP_ECOLI",
+            long_name = "cAMP-activated global transcriptional regulator",
+            sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            organism = "Escherichia coli",
+            )
+        self.pack = Pack.objects.create(
+            contaminant = contaminant,
+            number = 1,
+            structure = '1-mer',
+            )
+        Model.objects.create(
+            pdb_code = "ABCD",
+            chain = "A",
+            domain = 1,
+            nb_residues = 26,
+            identity = 100,
+            pack = self.pack,
+            )
+        self.job = Job.objects.create(
+            name = "test",
+            email = "me@example.com",
+            status_submitted = True,
+            data_size = 1000,
+            )
+
+    def create_task(self, space_group, seconds, **status):
+        return Task.objects.create(
+            job = self.job,
+            pack = self.pack,
+            space_group = space_group,
+            exec_time = datetime.timedelta(seconds=seconds),
+            **status)
+
+    def test_get_size_class_gives_power_of_2(self):
+        self.assertEqual(get_size_class(None), 0)
+        self.assertEqual(get_size_class(1), 1)
+        self.assertEqual(get_size_class(26), 5)
+        self.assertEqual(get_size_class(1000), 10)
+
+    def test_record_adds_complete_tasks(self):
+        RuntimeStatistics.record([
+            self.create_task("P-1-2-1", 100, status_complete=True),
+            self.create_task("P-1-21-1", 300, status_complete=True),
+            self.create_task("P-2-2-2", 500, status_complete=True,
+                             status_error=True),
+            self.create_task("P-2-2-21", 50, status_running=True),
+            ], self.job.data_size)
+        statistics = RuntimeStatistics.objects.get(space_group="P-1-2-1")
+        self.assertEqual(statistics.residues_class, 5)
+        self.assertEqual(statistics.data_class, 10)
+        self.assertEqual(statistics.count, 1)
+        self.assertEqual(RuntimeStatistics.objects.count(), 2)
+
+        self.job = Job.objects.create(name = "test", data_size = 1000)
+        RuntimeStatistics.record([
+            self.create_task("P-1-2-1", 300, status_complete=True),
+            ], self.job.data_size)
+        statistics = RuntimeStatistics.objects.get(space_group="P-1-2-1")
+        self.assertEqual(statistics.count, 2)
+        self.assertEqual(statistics.get_mean(), 200)
+        self.assertEqual(statistics.get_deviation(), 100)
+
+    def test_rebuild_reads_all_complete_tasks(self):
+        self.create_task("P-1-2-1", 100, status_complete=True)
+        self.create_task("P-1-21-1", 300, status_complete=True)
+        self.create_task("P-2-2-2", 50, status_running=True)
+        RuntimeStatistics.objects.create(
+            residues_class = 1,
+            space_group = "P-1-2-1",
+            data_class = 1,
+            count = 10,
+            )
+        RuntimeStatistics.rebuild()
+        self.assertEqual(RuntimeStatistics.objects.count(), 2)
+        statistics = RuntimeStatistics.objects.get(space_group="P-1-21-1")
+        self.assertEqual(statistics.count, 1)
+        self.assertEqual(statistics.total, 300)
+
+    def test_estimator_falls_back_on_larger_classes(self):
+        RuntimeStatistics.objects.create(
+            residues_class = 5,
+            space_group = "P-1-2-1",
+            data_class = 10,
+            count = 2,
+            total = 200,
+            )
+        RuntimeStatistics.objects.create(
+            residues_class = 5,
+            space_group = "P-1-21-1",
+            data_class = 12,
+            count = 2,
+            total = 600,
+            )
+        estimator = RuntimeStatistics.get_estimator()
+        self.assertEqual(estimator.get_mean(5, "P-1-2-1", 10), 100)
+        self.assertEqual(estimator.get_mean(5, "P-1-21-1", 10), 300)
+        self.assertEqual(estimator.get_mean(5, "P-2-2-2", 10), 200)
+        self.assertEqual(estimator.get_mean(7, "P-2-2-2", 10), 200)
+
+        RuntimeStatistics.objects.all().delete()
+        estimator = RuntimeStatistics.get_estimator()
+        self.assertEqual(estimator.get_mean(5, "P-1-2-1", 10), None)
+
+    @mock.patch('contaminer.models.contaminer.apps.get_app_config')
+    def test_get_remaining_time_counts_unfinished_tasks(self, mock_CMConfig):
+        mock_config = mock.MagicMock()
+        mock_config.slots = 1
+        mock_CMConfig.return_value = mock_config
+        RuntimeStatistics.objects.create(
+            residues_class = 5,
+            space_group = "P-1-2-1",
+            data_class = 10,
+            count = 1,
+            total = 200,
+            )
+        self.assertEqual(self.job.get_remaining_time(), None)
+
+        self.create_task("P-1-2-1", 200, status_complete=True)
+        self.create_task("P-1-21-1", 0, status_cancelled=True)
+        self.create_task("P-2-2-2", 50, status_running=True)
+        self.create_task("P-2-2-21", 0)
+        self.assertEqual(
+            self.job.get_remaining_time(),
+            datetime.timedelta(seconds=350))
+
+        mock_config.slots = 10
+        self.assertEqual(
+            self.job.get_remaining_time(),
+            datetime.timedelta(seconds=200))
+
+        self.job.status_complete = True
+        self.assertEqual(
+            self.job.get_remaining_time(),
+            datetime.timedelta(0))
+
+
+class ClusterStateTestCase(TestCase):
+    """
+        Test the placement of the jobs on several clusters
+    """
+    def setUp(self):
+        patcher = mock.patch('contaminer.clusters.apps.get_app_config')
+        mock_CMConfig = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config = mock.MagicMock()
+        self.mock_config.slots = 100
+        self.mock_config.backend = 'ssh'
+        self.mock_config.ssh_work_directory = "/remote/dir"
+        self.mock_config.ssh_contaminer_location = "/remote/CM"
+        self.mock_config.max_jobs = 0
+        self.mock_config.max_tasks = 0
+        self.mock_config.update_workers = 1
+        self.mock_config.status_interval = 1800
+        self.mock_config.agent_enabled = False
+        second = mock.MagicMock()
+        second.slots = 100
+        second.backend = 'ssh'
+        second.max_jobs = 0
+        second.max_tasks = 0
+        second.ssh_work_directory = "/second/dir"
+        second.ssh_contaminer_location = "/second/CM"
+        second.agent_enabled = False
+        self.mock_config.clusters = {'second': second}
+        mock_CMConfig.return_value = self.mock_config
+
+    def test_single_cluster_is_default(self):
+        self.mock_config.clusters = {}
+        self.assertEqual(ClusterState.choose_cluster(), "default")
+
+    def test_choose_least_loaded_cluster(self):
+        Job.objects.create(name="busy", cluster="default")
+        self.assertEqual(ClusterState.choose_cluster(), "second")
+        Job.objects.create(name="busy", cluster="second")
+        Job.objects.create(name="busy", cluster="second")
+        self.assertEqual(ClusterState.choose_cluster(), "default")
+
+    def test_archived_jobs_are_not_counted(self):
+        Job.objects.create(name="old", cluster="default",
+                           status_archived=True)
+        self.assertEqual(ClusterState.choose_cluster(), "default")
+
+    def test_choose_cluster_with_higher_throughput(self):
+        Job.objects.create(name="busy", cluster="default")
+        Job.objects.create(name="busy", cluster="second")
+        ClusterState.objects.create(name="default", throughput=50)
+        ClusterState.objects.create(name="second", throughput=200)
+        self.assertEqual(ClusterState.choose_cluster(), "second")
+
+    def test_skip_unhealthy_cluster(self):
+        Job.objects.create(name="busy", cluster="default")
+        for _ in range(MAX_FAILURES):
+            ClusterState.record_failure("second")
+        self.assertEqual(ClusterState.choose_cluster(), "default")
+
+        state = ClusterState.objects.get(name="second")
+        state.last_failure = timezone.now() \
+            - datetime.timedelta(seconds=HEALTH_RETRY_DELAY)
+        state.save()
+        self.assertEqual(ClusterState.choose_cluster(), "second")
+
+        ClusterState.record_failure("second")
+        ClusterState.record_success("second")
+        self.assertEqual(
+            ClusterState.objects.get(name="second").consecutive_failures,
+            0)
+
+    def test_circuit_opens_after_failures(self):
+        self.assertEqual(ClusterState.get_circuit("second"), CLOSED)
+        self.assertTrue(ClusterState.allow_request("second"))
+        for _ in range(MAX_FAILURES):
+            ClusterState.record_failure("second")
+        self.assertEqual(ClusterState.get_circuit("second"), OPEN)
+        self.assertFalse(ClusterState.allow_request("second"))
+
+    def test_half_open_circuit_allows_one_probe(self):
+        ClusterState.objects.create(
+            name="second",
+            consecutive_failures=MAX_FAILURES,
+            last_failure=timezone.now() \
+                - datetime.timedelta(seconds=HEALTH_RETRY_DELAY))
+        self.assertEqual(ClusterState.get_circuit("second"), HALF_OPEN)
+        self.assertTrue(ClusterState.allow_request("second"))
+        self.assertFalse(ClusterState.allow_request("second"))
+
+        ClusterState.record_success("second")
+        self.assertEqual(ClusterState.get_circuit("second"), CLOSED)
+        self.assertTrue(ClusterState.allow_request("second"))
+
+    def test_failed_probe_opens_circuit(self):
+        ClusterState.objects.create(
+            name="second",
+            consecutive_failures=MAX_FAILURES,
+            last_failure=timezone.now() \
+                - datetime.timedelta(seconds=HEALTH_RETRY_DELAY))
+        self.assertTrue(ClusterState.allow_request("second"))
+        ClusterState.record_failure("second")
+        self.assertEqual(ClusterState.get_circuit("second"), OPEN)
+        self.assertIsNone(ClusterState.objects.get(name="second").probe_time)
+
+    def test_record_completion_measures_throughput(self):
+        ClusterState.objects.create(
+            name="second",
+            window_start=timezone.now() - datetime.timedelta(hours=1),
+            window_tasks=100)
+        ClusterState.record_completion("second", 10)
+        state = ClusterState.objects.get(name="second")
+        self.assertAlmostEqual(state.throughput, 100, delta=1)
+        self.assertEqual(state.window_tasks, 10)
+
+    def test_idle_window_does_not_change_throughput(self):
+        ClusterState.objects.create(
+            name="second",
+            window_start=timezone.now() - datetime.timedelta(hours=5),
+            window_tasks=10,
+            throughput=80)
+        ClusterState.record_completion("second", 3)
+        state = ClusterState.objects.get(name="second")
+        self.assertEqual(state.throughput, 80)
+        self.assertEqual(state.window_tasks, 3)
+
+    @mock.patch('contaminer.models.contaminer.os.path.getsize',
+        return_value=1024)
+    @mock.patch('contaminer.models.contaminer.os.remove')
+    @mock.patch('contaminer.backends.SFTPChannel')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_submit_places_job(self, mock_sshchannel, mock_sftpchannel,
+            mock_remove, mock_getsize):
+        Job.objects.create(name="busy", cluster="default")
+        job = Job.create(name="new", email="me@example.com")
+        job.submit("/local/dir/file.mtz", "cont1\ncont2\n")
+
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.cluster, "second")
+        mock_sftpchannel.assert_called_with("second")
+        mock_sftpchannel.return_value.send_file.assert_called_with(
+            "/local/dir/file.mtz",
+            "/second/dir")
+        mock_sshchannel.return_value.exec_command_in_shell\
+            .assert_called_once_with(
+                'cd "/second/dir" && /second/CM/contaminer solve '
+                '"web_task_' + str(job.id) + '.mtz" '
+                '"web_task_' + str(job.id) + '.txt"')
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_update_status_follows_job_cluster(self, mock_sshchannel):
+        mock_sshchannel.return_value.exec_command_in_shell.return_value = \
+            "running"
+        job = Job.objects.create(
+            name="placed",
+            cluster="second",
+            status_submitted=True)
+        job.update_status()
+        mock_sshchannel.assert_called_with("second")
+        mock_sshchannel.return_value.exec_command_in_shell\
+            .assert_called_once_with(
+                "/second/CM/contaminer job_status /second/dir/web_task_" \
+                + str(job.id))
+
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
+    @mock.patch('contaminer.models.contaminer.Job.update')
+    def test_update_all_records_failures(self, mock_update):
+        mock_update.side_effect = RuntimeError("Unreachable")
+        Job.objects.create(name="placed", cluster="second",
+                           status_submitted=True)
+        Job.update_all()
+        self.assertEqual(
+            ClusterState.objects.get(name="second").consecutive_failures,
+            1)
+
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
+    @mock.patch('contaminer.models.contaminer.Job.update')
+    def test_update_all_with_threads(self, mock_update):
+        self.mock_config.update_workers = 4
+        mock_update.side_effect = [None, RuntimeError("Error"), None, None]
+        for _ in range(4):
+            Job.objects.create(name="placed", cluster="second",
+                               status_submitted=True)
+        Job.update_all()
+        self.assertEqual(mock_update.call_count, 4)
+        self.assertEqual(
+            ClusterState.objects.get(name="second").consecutive_failures,
+            1)
+
+    @mock.patch('contaminer.models.contaminer.Job.get_results_stats',
+        new=mock.Mock(return_value={}))
+    @mock.patch('contaminer.models.contaminer.Job.update')
+    def test_update_all_skips_unavailable_cluster(self, mock_update):
+        mock_update.side_effect = ClusterUnavailable("Circuit open")
+        for _ in range(3):
+            Job.objects.create(name="placed", cluster="second",
+                               status_submitted=True)
+        Job.update_all()
+        self.assertEqual(mock_update.call_count, 1)
+        self.assertFalse(ClusterState.objects.filter(name="second").exists())
+
+
+class QueuedSubmissionTestCase(TestCase):
+    """
+        Test the admission control of the new jobs
+    """
+    def setUp(self):
+        patcher = mock.patch('contaminer.clusters.apps.get_app_config')
+        mock_CMConfig = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_config = mock.MagicMock()
+        self.mock_config.clusters = {}
+        self.mock_config.max_jobs = 1
+        self.mock_config.max_tasks = 0
+        self.mock_config.queue_weights = {}
+        self.mock_config.queue_default_weight = 1
+        self.mock_config.queue_interactive_priority = True
+        mock_CMConfig.return_value = self.mock_config
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_file(self, name):
+        filepath = os.path.join(self.directory, name)
+        with open(filepath, 'w') as data_file:
+            data_file.write("data")
+        return filepath
+
+    def test_no_limit_never_holds(self):
+        self.mock_config.max_jobs = 0
+        Job.objects.create(name="running", status_submitted=True)
+        self.assertFalse(QueuedSubmission.must_hold())
+
+    def test_hold_when_cluster_is_full(self):
+        self.assertFalse(QueuedSubmission.must_hold())
+        Job.objects.create(name="running", status_submitted=True)
+        self.assertTrue(QueuedSubmission.must_hold())
+
+    def test_hold_when_tasks_limit_is_reached(self):
+        self.mock_config.max_jobs = 0
+        self.mock_config.max_tasks = 2
+        job = Job.objects.create(name="running", status_submitted=True)
+        contabase = ContaBase.objects.create()
+        category = Category.objects.create(
+            contabase = contabase,
+            number = 1,
+            name = "Protein in E.Coli",
+            )
+        contaminant = Contaminant.objects.create(
+            uniprot_id = "P0ACJ8",
+            category = category,
+            short_name = "CRP_ECOLI",
+            long_name = "cAMP-activated global transcriptional regulator",
+            sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            organism = "Escherichia coli",
+            )
+        pack = Pack.objects.create(
+            contaminant = contaminant,
+            number = 1,
+            structure = '1-mer',
+            )
+        Task.objects.create(job=job, pack=pack, space_group="P-1-2-1",
+                            status_complete=True)
+        Task.objects.create(job=job, pack=pack, space_group="P-1-21-1")
+        self.assertFalse(QueuedSubmission.must_hold())
+        Task.objects.create(job=job, pack=pack, space_group="P-2-2-2")
+        self.assertTrue(QueuedSubmission.must_hold())
+
+    def test_admit_reserves_cluster(self):
+        self.mock_config.max_jobs = 2
+        jobs = [Job.objects.create(name="burst " + str(index))
+                for index in range(3)]
+        self.assertTrue(QueuedSubmission.admit([jobs[0]]))
+        self.assertTrue(QueuedSubmission.admit([jobs[1]]))
+        self.assertFalse(QueuedSubmission.admit([jobs[2]]))
+        job = Job.objects.get(id=jobs[0].id)
+        self.assertEqual(job.cluster, "default")
+        self.assertIsNotNone(job.reserved)
+        self.assertIsNone(Job.objects.get(id=jobs[2].id).reserved)
+
+    def test_old_reservation_is_not_in_flight(self):
+        job = Job.objects.create(name="lost")
+        self.assertTrue(QueuedSubmission.admit([job]))
+        self.assertTrue(QueuedSubmission.must_hold())
+        Job.objects.filter(id=job.id).update(
+            reserved=timezone.now() - datetime.timedelta(hours=2))
+        self.assertFalse(QueuedSubmission.must_hold())
+
+    def test_hold_keeps_order(self):
+        job = Job.objects.create(name="held")
+        QueuedSubmission.hold(job, "/local/file.mtz", "P0ACJ8\n")
+        self.assertTrue(QueuedSubmission.must_hold())
+
+    def test_get_position(self):
+        first = Job.objects.create(name="first")
+        second = Job.objects.create(name="second")
+        other = Job.objects.create(name="other")
+        QueuedSubmission.hold(first, "/local/first.mtz", "P0ACJ8\n")
+        QueuedSubmission.hold(second, "/local/second.mtz", "P0ACJ8\n")
+        self.assertEqual(QueuedSubmission.get_position(first), 1)
+        self.assertEqual(QueuedSubmission.get_position(second), 2)
+        self.assertEqual(QueuedSubmission.get_position(other), None)
+
+    @mock.patch('contaminer.models.contaminer.Job.submit')
+    def test_release_submits_in_order_while_open(self, mock_submit):
+        running = Job.objects.create(name="running", status_submitted=True)
+        first = Job.objects.create(name="first")
+        second = Job.objects.create(name="second")
+        first_file = self.create_file("first.mtz")
+        model_file = self.create_file("model.pdb")
+        QueuedSubmission.hold(first, first_file, "P0ACJ8\n", [model_file])
+        QueuedSubmission.hold(second, self.create_file("second.mtz"),
+                              "P0ACJ8\n")
+
+        self.assertEqual(QueuedSubmission.release(), 0)
+
+        running.status_complete = True
+        running.save()
+
+        def submit(*args, **kwargs):
+            Job.objects.filter(id=first.id).update(status_submitted=True)
+        mock_submit.side_effect = submit
+        self.assertEqual(QueuedSubmission.release(), 1)
+        mock_submit.assert_called_once_with(
+            first_file,
+            "P0ACJ8\n",
+            custom_contaminants=[model_file])
+        self.assertEqual(QueuedSubmission.get_position(second), 1)
+
+    @mock.patch('contaminer.models.contaminer.Job.submit')
+    def test_release_keeps_failed_submission(self, mock_submit):
+        mock_submit.side_effect = ClusterUnavailable("Unreachable")
+        job = Job.objects.create(name="held")
+        other = Job.objects.create(name="other")
+        QueuedSubmission.hold(job, self.create_file("held.mtz"), "P0ACJ8\n")
+        QueuedSubmission.hold(other, self.create_file("other.mtz"),
+                              "P0ACJ8\n")
+        self.assertEqual(QueuedSubmission.release(), 0)
+        self.assertEqual(mock_submit.call_count, 1)
+        self.assertEqual(QueuedSubmission.get_position(job), 1)
+        self.assertEqual(QueuedSubmission.objects.get(job=job).attempts, 0)
+
+    @mock.patch('contaminer.models.contaminer.OutboxMail.queue_report')
+    @mock.patch('contaminer.models.contaminer.Job.submit')
+    def test_release_drops_submission_failing_repeatedly(self, mock_submit,
+            mock_report):
+        self.mock_config.max_jobs = 0
+        bad = Job.objects.create(name="bad")
+        good = Job.objects.create(name="good")
+        bad_file = self.create_file("bad.mtz")
+        QueuedSubmission.hold(bad, bad_file, "P0ACJ8\n")
+        QueuedSubmission.hold(good, self.create_file("good.mtz"),
+                              "P0ACJ8\n")
+
+        def submit(filepath, *args, **kwargs):
+            if filepath == bad_file:
+                raise RuntimeError("contaminer: bad file")
+        mock_submit.side_effect = submit
+        self.assertEqual(QueuedSubmission.release(), 1)
+        self.assertEqual(QueuedSubmission.get_position(bad), 1)
+        self.assertFalse(mock_report.called)
+
+        for _ in range(MAX_SUBMIT_ATTEMPTS - 1):
+            QueuedSubmission.release()
+        self.assertEqual(QueuedSubmission.get_position(bad), None)
+        self.assertTrue(Job.objects.get(id=bad.id).status_error)
+        self.assertEqual(mock_report.call_count, 1)
+
+    def test_release_drops_missing_file(self):
+        job = Job.objects.create(name="held")
+        QueuedSubmission.hold(job, "/missing/held.mtz", "P0ACJ8\n")
+        self.assertEqual(QueuedSubmission.release(), 0)
+        self.assertEqual(QueuedSubmission.get_position(job), None)
+        self.assertTrue(Job.objects.get(id=job.id).status_error)
+
+    def test_get_owner(self):
+        user = User.objects.create_user("alice")
+        self.assertEqual(
+            QueuedSubmission.get_owner(Job(author=user, email="a@b.c")),
+            "alice")
+        self.assertEqual(
+            QueuedSubmission.get_owner(Job(email="Bob@Example.com")),
+            "bob@example.com")
+        self.assertEqual(QueuedSubmission.get_owner(Job()), "anonymous")
+
+    def hold_jobs(self, email, number, interactive=False):
+        jobs = []
+        for index in range(number):
+            job = Job.objects.create(name=email + str(index), email=email)
+            QueuedSubmission.hold(
+                job,
+                "/local/file.mtz",
+                "P0ACJ8\n",
+                interactive=interactive)
+            jobs.append(job)
+        return jobs
+
+    def test_hold_shares_queue_between_owners(self):
+        pipeline = self.hold_jobs("pipeline@example.com", 3)
+        other = self.hold_jobs("other@example.com", 1)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[0]), 1)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[1]), 2)
+        self.assertEqual(QueuedSubmission.get_position(other[0]), 3)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[2]), 4)
+
+    def test_hold_uses_weights(self):
+        self.mock_config.queue_weights = {"pipeline@example.com": 0.5}
+        pipeline = self.hold_jobs("pipeline@example.com", 3)
+        other = self.hold_jobs("other@example.com", 2)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[0]), 1)
+        self.assertEqual(QueuedSubmission.get_position(other[0]), 2)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[1]), 3)
+        self.assertEqual(QueuedSubmission.get_position(other[1]), 4)
+        self.assertEqual(QueuedSubmission.get_position(pipeline[2]), 5)
+
+    def test_interactive_lane_goes_first(self):
+        api = self.hold_jobs("pipeline@example.com", 2)
+        interactive = self.hold_jobs("other@example.com", 1, True)
+        self.assertEqual(QueuedSubmission.get_position(interactive[0]), 1)
+        self.assertEqual(QueuedSubmission.get_position(api[0]), 2)
+
+        self.mock_config.queue_interactive_priority = False
+        self.assertEqual(QueuedSubmission.get_position(interactive[0]), 3)
+        self.assertEqual(QueuedSubmission.get_position(api[0]), 1)
+
+    @mock.patch('contaminer.models.contaminer.Job.submit')
+    def test_release_follows_fair_order(self, mock_submit):
+        self.mock_config.max_jobs = 0
+        self.mock_config.queue_weights = {"p@example.com": 1}
+        pipeline = Job.objects.create(name="pipeline", email="p@example.com")
+        other = Job.objects.create(name="other", email="o@example.com")
+        pipeline_file = self.create_file("pipeline.mtz")
+        other_file = self.create_file("other.mtz")
+        QueuedSubmission.hold(pipeline, pipeline_file, "P0ACJ8\n")
+        QueuedSubmission.hold(other, other_file, "P0ACJ8\n",
+                              interactive=True)
+
+        metrics.reset()
+        metrics.enable()
+        self.addCleanup(metrics.enable, False)
+        self.assertEqual(QueuedSubmission.release(), 2)
+        self.assertEqual(
+            [call[0][0] for call in mock_submit.call_args_list],
+            [other_file, pipeline_file])
+        self.assertEqual(
+            metrics.QUEUE_WAIT.get_count(owner="p@example.com", lane="api"),
+            1)
+        self.assertEqual(
+            metrics.QUEUE_WAIT.get_count(
+                owner="default",
+                lane="interactive"),
+            1)
+        self.assertEqual(
+            metrics.QUEUE_WAIT.get_count(
+                owner="o@example.com",
+                lane="interactive"),
+            0)
+
+
+class UploadSessionTestCase(TestCase):
+    """
+        Test the resumable uploads
+    """
+    def setUp(self):
+        patcher = mock.patch('contaminer.clusters.apps.get_app_config')
+        mock_CMConfig = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.mkdtemp()
+        mock_CMConfig.return_value.tmp_dir = self.directory
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_file(self, session):
+        with open(session.get_path(), 'rb') as partial_file:
+            return partial_file.read()
+
+    def test_start_creates_empty_file(self):
+        session = UploadSession.start("data.mtz", 10, "ABCDEF")
+        self.assertEqual(len(session.token), 32)
+        self.assertEqual(session.sha256, "abcdef")
+        self.assertEqual(self.read_file(session), b"")
+        self.assertFalse(session.is_complete())
+
+    def test_write_chunks(self):
+        session = UploadSession.start("data.mtz", 10)
+        session.write_chunk(0, 4, BytesIO(b"0123"))
+        session.write_chunk(4, 6, BytesIO(b"456789"))
+        session = UploadSession.objects.get(id=session.id)
+        self.assertEqual(session.received, 10)
+        self.assertTrue(session.is_complete())
+        self.assertEqual(self.read_file(session), b"0123456789")
+
+    def test_write_chunk_sent_again(self):
+        session = UploadSession.start("data.mtz", 10)
+        session.write_chunk(0, 6, BytesIO(b"012345"))
+        session.write_chunk(4, 4, BytesIO(b"4567"))
+        self.assertEqual(session.received, 8)
+        self.assertEqual(self.read_file(session), b"01234567")
+
+    def test_write_chunk_keeps_interrupted_chunk(self):
+        session = UploadSession.start("data.mtz", 10)
+        self.assertEqual(session.write_chunk(0, 8, BytesIO(b"012")), 3)
+        self.assertEqual(session.received, 3)
+
+    def test_write_chunk_refuses_gap_and_overflow(self):
+        session = UploadSession.start("data.mtz", 10)
+        with self.assertRaises(ValueError):
+            session.write_chunk(2, 2, BytesIO(b"23"))
+        with self.assertRaises(ValueError):
+            session.write_chunk(0, 11, BytesIO(b"0" * 11))
+        self.assertEqual(session.received, 0)
+
+    def test_get_sha256(self):
+        session = UploadSession.start("data.mtz", 4)
+        session.write_chunk(0, 4, BytesIO(b"data"))
+        self.assertEqual(
+            session.get_sha256(),
+            "3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7")
+
+    def test_take_file_closes_session(self):
+        session = UploadSession.start("data.mtz", 4)
+        session.write_chunk(0, 4, BytesIO(b"data"))
+        filepath = os.path.join(self.directory, "job.mtz")
+        session.take_file(filepath)
+        with open(filepath, 'rb') as data_file:
+            self.assertEqual(data_file.read(), b"data")
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_remove_expired(self):
+        old = UploadSession.start("old.mtz", 4)
+        recent = UploadSession.start("recent.mtz", 4)
+        UploadSession.objects.filter(id=old.id).update(
+            updated=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(
+            UploadSession.remove_expired(datetime.timedelta(days=1)),
+            1)
+        self.assertFalse(os.path.exists(old.get_path()))
+        self.assertTrue(os.path.exists(recent.get_path()))
+        self.assertEqual(
+            list(UploadSession.objects.all()),
+            [recent])
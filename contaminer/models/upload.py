@@ -0,0 +1,210 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Resumable uploads of the diffraction data files.
+
+A large file can be sent with several requests (see API.md): an upload
+session is created with the size of the file, then the chunks are sent with
+their offsets, and the session is finalized into a job submission. After a
+failed request, the client asks how many bytes have been received, and
+sends the rest.
+
+The chunks are written in place in a partial file of the tmp_dir directory
+of config.ini, so they are never buffered whole by Django. The file is sent
+to the cluster once the job is admitted, as the files of the other jobs: the
+cluster is only chosen at this time. Its SHA-256 is computed by chunks when
+the session is finalized.
+"""
+
+import os
+import uuid
+import errno
+import shutil
+import hashlib
+import logging
+
+from django.apps import apps
+from django.db import models
+from django.utils import timezone
+
+# Size of the blocks read from the requests and the partial files
+BLOCK_SIZE = 64 * 1024
+
+# Directory of the partial files, in tmp_dir
+UPLOAD_DIRECTORY = "contaminer_uploads"
+
+
+def new_token():
+    """Return a random identifier for a new upload session."""
+    return uuid.uuid4().hex
+
+
+class UploadSession(models.Model):
+    """
+    Diffraction data file uploaded by chunks.
+
+    :token: Random identifier of the session, given in the URLs.
+    :filename: Name of the file, giving its format.
+    :size: Size of the whole file (in bytes).
+    :sha256: Expected SHA-256 of the file (hexadecimal), or empty.
+    :received: Number of bytes received from the start of the file.
+    :created: When the session has been created.
+    :updated: When the last chunk has been received.
+    """
+
+    token = models.CharField(max_length=32, unique=True, default=new_token)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.BigIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """Write the file name and the progress."""
+        return unicode(self).encode('utf-8')
+
+    def __unicode__(self):
+        """Write the file name and the progress."""
+        return self.filename + " - " + str(self.received) + "/" \
+            + str(self.size)
+
+    @staticmethod
+    def get_directory():
+        """Return the directory of the partial files, created if missing."""
+        directory = os.path.join(
+            apps.get_app_config('contaminer').tmp_dir,
+            UPLOAD_DIRECTORY)
+        try:
+            os.makedirs(directory)
+        except OSError as excep:
+            if excep.errno != errno.EEXIST:
+                raise
+        return directory
+
+    def get_path(self):
+        """Return the path of the partial file."""
+        return os.path.join(self.get_directory(), self.token + ".part")
+
+    @classmethod
+    def start(cls, filename, size, sha256=""):
+        """Create a session for a file of size bytes, and its empty file."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filename) + " " + str(size))
+
+        session = cls.objects.create(
+            filename=filename,
+            size=size,
+            sha256=sha256.lower())
+        open(session.get_path(), 'wb').close()
+
+        log.debug("Exit with: " + str(session.token))
+        return session
+
+    def is_complete(self):
+        """Return True if the whole file has been received."""
+        return self.received == self.size
+
+    def write_chunk(self, offset, length, stream):
+        """
+        Write the length bytes read from stream at offset in the file.
+
+        A chunk may start before the end of the received bytes (a chunk sent
+        again), but not after. If the stream ends early, the bytes read are
+        kept, and the client resumes from the new end.
+        :raises ValueError: if the chunk leaves a gap, or goes beyond the size
+        of the file.
+        :returns: the number of bytes written.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(offset) + " " + str(length))
+
+        if offset > self.received:
+            raise ValueError("Chunk starts after the received bytes: " \
+                + str(self.received))
+        if offset + length > self.size:
+            raise ValueError("Chunk goes beyond the size of the file: " \
+                + str(self.size))
+
+        written = 0
+        with open(self.get_path(), 'r+b') as partial_file:
+            partial_file.seek(offset)
+            while written < length:
+                block = stream.read(min(BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                partial_file.write(block)
+                written += len(block)
+
+        if offset + written > self.received:
+            self.received = offset + written
+            self.save()
+        if written < length:
+            log.warning("Incomplete chunk for upload " + self.token + ": " \
+                + str(written) + "/" + str(length))
+
+        log.debug("Exit with: " + str(written))
+        return written
+
+    def get_sha256(self):
+        """Return the SHA-256 of the received file, read by blocks."""
+        digest = hashlib.sha256()
+        with open(self.get_path(), 'rb') as partial_file:
+            for block in iter(lambda: partial_file.read(BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def restart(self):
+        """Drop the received bytes, to upload the file again."""
+        open(self.get_path(), 'wb').close()
+        self.received = 0
+        self.save()
+
+    def take_file(self, filepath):
+        """Move the complete file to filepath, and close the session."""
+        shutil.move(self.get_path(), filepath)
+        self.delete()
+
+    def discard(self):
+        """Remove the partial file, and close the session."""
+        try:
+            os.remove(self.get_path())
+        except OSError:
+            pass
+        self.delete()
+
+    @classmethod
+    def remove_expired(cls, max_age):
+        """
+        Discard the sessions without chunk received for max_age.
+
+        :param max_age: timedelta.
+        :returns: the number of discarded sessions.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(max_age))
+
+        expired = cls.objects.filter(updated__lt=timezone.now() - max_age)
+        removed = 0
+        for session in expired:
+            session.discard()
+            removed += 1
+
+        log.debug("Exit with: " + str(removed))
+        return removed
@@ -18,7 +18,65 @@
 
 """Module to manage a PDB files."""
 
+import os
 import re
+import mmap
+
+# Statistics read in the REMARK 3 records, with the type of their value
+# See http://www.wwpdb.org/documentation/file-format
+REFINEMENT_STATISTICS = [
+    ('program', str, r'PROGRAM +: *(.+?) *$'),
+    ('resolution_high', float,
+     r'RESOLUTION RANGE HIGH \(ANGSTROMS\) +: *(\d+\.?\d*)'),
+    ('resolution_low', float,
+     r'RESOLUTION RANGE LOW +\(ANGSTROMS\) +: *(\d+\.?\d*)'),
+    ('completeness', float,
+     r'COMPLETENESS FOR RANGE +\(%\) +: *(\d+\.?\d*)'),
+    ('reflections', int, r'NUMBER OF REFLECTIONS +: *(\d+)'),
+    ('r_all', float,
+     r'R VALUE +\(WORKING \+ TEST SET\) +: *(\d+\.?\d*)'),
+    ('r_work', float, r'R VALUE +\(WORKING SET\) +: *(\d+\.?\d*)'),
+    ('r_free', float, r'FREE R VALUE +: *(\d+\.?\d*)'),
+    ('r_free_set_size', float,
+     r'FREE R VALUE TEST SET SIZE +\(%\) +: *(\d+\.?\d*)'),
+    ]
+REFINEMENT_REGEXES = [
+    (name, cast, re.compile(r'^ *' + pattern))
+    for name, cast, pattern in REFINEMENT_STATISTICS]
+COORDINATES_REGEX = re.compile(r'^(?:ATOM  |HETATM)', re.MULTILINE)
+
+# Statistics already read, by file name, with the mtime of the file
+STATISTICS_CACHE = {}
+STATISTICS_CACHE_SIZE = 1000
+
+
+def parse_refinement_remarks(header):
+    """
+    Give the refinement statistics written in the REMARK 3 records of header.
+
+    Only the first value of each statistic is kept, so the values of the
+    resolution shells are ignored. The statistics not found are not in the
+    dictionary.
+    :param header: text of the PDB header
+    :returns: a dictionary of the statistics in REFINEMENT_STATISTICS
+    """
+    statistics = {}
+    for line in header.splitlines():
+        if line[0:10] != "REMARK   3":
+            continue
+        description = line[11:].rstrip()
+        for name, cast, regex in REFINEMENT_REGEXES:
+            if name in statistics:
+                continue
+            match = regex.match(description)
+            if match:
+                try:
+                    statistics[name] = cast(match.group(1))
+                except ValueError:
+                    raise ValueError("Mal formed line: " + line)
+                break
+    return statistics
+
 
 class PDBHandler:
     """A class to extract information from a PDB file."""
@@ -26,33 +84,69 @@ class PDBHandler:
     def __init__(self, pdb_filename):
         self.pdb_filename = pdb_filename
 
-    # See http://www.wwpdb.org/documentation/file-format
+    def get_header(self):
+        """
+        Give the text of the file before the first ATOM or HETATM record.
+
+        The file is mapped in memory, so the coordinates section is not read.
+        """
+        with open(self.pdb_filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            pdb_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                match = COORDINATES_REGEX.search(pdb_map)
+                end = match.start() if match else len(pdb_map)
+                return pdb_map[0:end]
+            finally:
+                pdb_map.close()
+
+    def get_refinement_statistics(self):
+        """
+        Give the refinement statistics of the PDB file.
+
+        See parse_refinement_remarks. The result is cached until the file is
+        modified.
+        """
+        pdb_filename = os.path.abspath(self.pdb_filename)
+        mtime = os.path.getmtime(pdb_filename)
+        try:
+            cached_mtime, statistics = STATISTICS_CACHE[pdb_filename]
+        except KeyError:
+            pass
+        else:
+            if cached_mtime == mtime:
+                return dict(statistics)
+
+        statistics = parse_refinement_remarks(self.get_header())
+
+        if len(STATISTICS_CACHE) >= STATISTICS_CACHE_SIZE:
+            STATISTICS_CACHE.clear()
+        STATISTICS_CACHE[pdb_filename] = (mtime, statistics)
+        return dict(statistics)
+
     def get_r_free(self):
         """
         Give the R free value of the PDB file, or `None` if it is not found.
         Raise a `ValueError` if the given R free value is not a number
         """
-        r_free_lines = []
-        regex = re.compile(r'FREE R VALUE +: *(\d+\.?\d*)')
+        return self.get_refinement_statistics().get('r_free')
+
+    def get_coordinates(self):
+        """
+        Give the orthogonal coordinates (x, y, z) of the ATOM and HETATM
+        records, as a list of tuples of floats.
+        """
+        coordinates = []
         with open(self.pdb_filename) as f:
             for line in f:
-                try:
-                    command = line[0:6]
-                    number = line[7:10]
-                    description = line[11:]
-                except IndexError:
-                    # Line does not follow the full line format
-                    # Continue to next line
+                if line[0:6] not in ["ATOM  ", "HETATM"]:
                     continue
-
-                if "REMARK" in command:
-                    match = regex.search(description)
-                    if match:
-                        try:
-                            value = float(match.group(1))
-                        except ValueError:
-                            raise ValueError("Mal formed line: " + line)
-
-                        return value
-        # No R FREE line has been found
-        return None
+                try:
+                    coordinates.append((
+                        float(line[30:38]),
+                        float(line[38:46]),
+                        float(line[46:54])))
+                except ValueError:
+                    raise ValueError("Mal formed line: " + line)
+        return coordinates
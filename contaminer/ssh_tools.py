@@ -22,16 +22,602 @@ Communication with the cluster or supercomputer through a SSH connection.
 This module provides a layer to allow an easy communication between Django
 and the cluster or supercomputer where ContaMiner is.
 The configuration is done in apps.py
+
+When the agent is enabled in config.ini, the commands and the reading of the
+files go through a helper process started once on the cluster (see agent.py)
+instead of a new channel and login shell each time.
+
+The connections, the commands and the SFTP transfers are bounded by the
+connect_timeout, command_timeout and transfer_timeout of the cluster. A
+connection error or a timeout counts as a failure of the cluster, and the
+connections to a failing cluster are refused at once by its circuit breaker
+(see models/cluster.py). ClusterUnavailable is then raised.
+
+When pool_connections is set in config.ini, the commands and the transfers
+go through a ConnectionPool instead: a few connections kept open, each one
+carrying several channels at the same time, so that the threads updating
+the jobs do not open a connection each.
 """
 
 import os
+import time
+import select
+import socket
 import logging
+import pipes
+import threading
 import paramiko
 
 from django.apps import apps
 from django.conf import settings
 from shutil import copy2
 
+from . import agent
+from . import metrics
+from .clusters import DEFAULT_CLUSTER
+from .clusters import get_cluster
+
+# Written before the header of each file by get_pdb_headers
+PDB_HEADER_SEPARATOR = "==> "
+
+# Separates the name, the size and the mtime written by get_stat_command
+STAT_SEPARATOR = "|"
+
+# Size of the chunks read by exec_command_stream
+CHUNK_SIZE = 32 * 1024
+
+# Seconds to wait for new data before checking the status of the command
+POLL_INTERVAL = 0.1
+
+# Maximum size of stderr kept by exec_command_stream for the error
+MAX_STDERR_SIZE = 64 * 1024
+
+# Maximum number of characters of a command output written in the logs
+LOG_LIMIT = 1000
+
+
+def get_pdb_headers_command(remote_paths):
+    """Return the shell command writing the REMARK 3 records of the files."""
+    return "for f in " \
+        + " ".join([pipes.quote(path) for path in remote_paths]) \
+        + "; do echo \"" + PDB_HEADER_SEPARATOR + "$f\"; " \
+        + "sed -n -e '/^ATOM  /q' -e '/^HETATM/q' -e '/^REMARK   3/p' " \
+        + "\"$f\" 2>/dev/null; done"
+
+
+def parse_pdb_headers(stdout, remote_paths):
+    """Split the output of get_pdb_headers_command by file."""
+    headers = dict([(path, "") for path in remote_paths])
+    current_path = None
+    for line in stdout.split('\n'):
+        if line.startswith(PDB_HEADER_SEPARATOR):
+            current_path = line[len(PDB_HEADER_SEPARATOR):]
+        elif current_path in headers and line:
+            headers[current_path] += line + '\n'
+    return headers
+
+
+def get_stat_command(remote_paths):
+    """Return the shell command writing the size and mtime of the files."""
+    return "stat -c '%n" + STAT_SEPARATOR + "%s" + STAT_SEPARATOR + "%Y' " \
+        + " ".join([pipes.quote(path) for path in remote_paths]) \
+        + " 2>/dev/null; true"
+
+
+def parse_stats(stdout, remote_paths):
+    """
+    Return a dictionary giving (size, mtime) for each path.
+
+    A missing file gets None.
+    """
+    stats = dict([(path, None) for path in remote_paths])
+    for line in stdout.split('\n'):
+        fields = line.rsplit(STAT_SEPARATOR, 2)
+        if len(fields) == 3 and fields[0] in stats:
+            try:
+                stats[fields[0]] = (int(fields[1]), float(fields[2]))
+            except ValueError:
+                pass
+    return stats
+
+
+def shorten(text, limit=LOG_LIMIT):
+    """Return text, truncated to limit characters to be logged."""
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "... (" + str(len(text) - limit) \
+        + " more characters)"
+
+# Name of the agent script in the ContaMiner work directory
+AGENT_FILENAME = ".contaminer_agent.py"
+
+# Seconds to wait before starting the agent again after a failure
+AGENT_RETRY_DELAY = 60
+
+
+class AgentUnavailable(Exception):
+    """The request has not been sent to the agent, and can be sent again."""
+    pass
+
+
+class ClusterUnavailable(RuntimeError):
+    """The cluster is not reached: its circuit is open, or it timed out."""
+    pass
+
+
+def record_cluster_failure(cluster):
+    """Count a failure of cluster in its circuit breaker."""
+    # The models import this module
+    from .models.cluster import ClusterState
+    ClusterState.record_failure(cluster or DEFAULT_CLUSTER)
+
+
+class RemoteAgent(object):
+    """
+    Helper process on the cluster, reached through one SSH channel.
+
+    The agent is uploaded and started on the first request, then kept for the
+    next ones. The requests are sent one at a time. If the agent cannot be
+    started or reached, AgentUnavailable is raised and the caller falls back
+    on a new SSH channel. If the agent does not answer in command_timeout,
+    the failure is counted by the circuit breaker of the cluster, and
+    ClusterUnavailable is raised.
+    """
+
+    def __init__(self, cluster=None):
+        """Create an agent on cluster, started on the first request."""
+        self.cluster = cluster
+        self.client = None
+        self.stdin = None
+        self.stdout = None
+        self.failure_time = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Upload the agent script, and start it in a login shell."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        cluster_config = get_cluster(self.cluster)
+        remote_path = os.path.join(
+            cluster_config.ssh_work_directory,
+            AGENT_FILENAME)
+        with open(os.path.splitext(agent.__file__)[0] + ".py") as agent_file:
+            SFTPChannel(self.cluster).write_file(
+                remote_path,
+                agent_file.read())
+
+        self.client = SSHChannel(self.cluster)
+        self.client.__connect__()
+        command = "bash -lc 'exec " + cluster_config.agent_python + " -u " \
+            + pipes.quote(remote_path) + "'"
+        log.info("Start remote agent: " + command)
+        (self.stdin, self.stdout, _) = paramiko.SSHClient.exec_command(
+            self.client,
+            command,
+            timeout=float(cluster_config.command_timeout))
+        self.exchange({'op': 'ping'})
+
+        log.debug("Exit")
+
+    def stop(self):
+        """Stop the agent and close its connection."""
+        if self.client is None:
+            return
+        try:
+            agent.write_frame(self.stdin, {'op': 'quit'})
+        except (IOError, socket.error, paramiko.SSHException):
+            pass
+        self.client.close()
+        self.client = None
+        self.stdin = None
+        self.stdout = None
+
+    def exchange(self, message):
+        """Send message, and return the response of the agent."""
+        try:
+            agent.write_frame(self.stdin, message)
+        except (IOError, socket.error, paramiko.SSHException) as excep:
+            raise AgentUnavailable("Unable to send request: " + str(excep))
+        try:
+            return agent.read_frame(self.stdout)
+        except socket.timeout as excep:
+            log = logging.getLogger(__name__)
+            log.error("Timeout of the agent on cluster " \
+                + str(self.cluster or DEFAULT_CLUSTER) + ": " + str(excep))
+            record_cluster_failure(self.cluster)
+            raise ClusterUnavailable("Timeout: " + str(excep))
+        except (agent.ProtocolError, IOError, socket.error,
+                paramiko.SSHException) as excep:
+            raise RuntimeError("The agent stopped before answering: " \
+                + str(excep))
+
+    def request(self, op, **params):
+        """
+        Send a request to the agent and return the response.
+
+        :raises AgentUnavailable: if the request has not been sent.
+        :raises ClusterUnavailable: if the agent does not answer in time.
+        :raises RuntimeError: if the agent gives an error, or stops before
+        answering.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(op) + " " + str(params))
+
+        message = dict(params, op=op)
+        with self.lock, metrics.AGENT_REQUEST.time(op=op):
+            if self.client is None:
+                if self.failure_time is not None \
+                        and time.time() - self.failure_time \
+                        < AGENT_RETRY_DELAY:
+                    raise AgentUnavailable("Not started after a failure.")
+                try:
+                    self.start()
+                except (AgentUnavailable, RuntimeError, IOError,
+                        socket.error, paramiko.SSHException) as excep:
+                    log.error("Unable to start the remote agent: " \
+                        + str(excep))
+                    self.failure_time = time.time()
+                    self.stop()
+                    raise AgentUnavailable(str(excep))
+                self.failure_time = None
+            try:
+                response = self.exchange(message)
+            except (AgentUnavailable, RuntimeError):
+                self.stop()
+                raise
+
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        log.debug("Exit")
+        return response
+
+    def run(self, command, cwd=None):
+        """Run command in bash on the cluster, and return stdout."""
+        log = logging.getLogger(__name__)
+        log.info("Execute command through the agent: " + shorten(command))
+
+        return self.get_stdout(self.request('run', command=command, cwd=cwd))
+
+    def get_stdout(self, response):
+        """Return the stdout of a command, or raise RuntimeError on stderr."""
+        log = logging.getLogger(__name__)
+
+        stdout = response['stdout'].encode('utf-8')
+        stderr = response['stderr'].encode('utf-8')
+        if stderr != '':
+            metrics.SSH_COMMAND_ERRORS.inc()
+            log.error("Error when running command: " + shorten(stderr))
+            raise RuntimeError(stderr)
+
+        log.info("Stdout: " + shorten(stdout))
+        return stdout
+
+    def contaminer(self, op, **params):
+        """Run the ContaMiner operation op, and return stdout."""
+        log = logging.getLogger(__name__)
+        log.info("Execute ContaMiner operation through the agent: " + op \
+            + " " + shorten(str(params)))
+
+        contaminer_path = os.path.join(
+            get_cluster(self.cluster).ssh_contaminer_location,
+            "contaminer")
+        return self.get_stdout(
+            self.request(op, contaminer=contaminer_path, **params))
+
+    def solve(self, remote_directory, input_filename,
+              contaminants_filename):
+        """Submit a job to ContaMiner, from its files in remote_directory."""
+        return self.contaminer(
+            'solve',
+            cwd=remote_directory,
+            input=input_filename,
+            contaminants=contaminants_filename)
+
+    def job_status(self, remote_job_directory):
+        """Return the output of contaminer job_status for the job."""
+        return self.contaminer('status', job=remote_job_directory)
+
+    def cancel(self, remote_job_directory, task_names):
+        """Cancel the given tasks of the job."""
+        return self.contaminer(
+            'cancel',
+            job=remote_job_directory,
+            tasks=list(task_names))
+
+    def read_file(self, remote_path):
+        """Return the content of remote_path."""
+        response = self.request('read', path=remote_path)
+        return response['content'].encode('utf-8')
+
+    def stat_files(self, remote_paths):
+        """Return a dictionary giving (size, mtime) or None for each path."""
+        response = self.request('stat', paths=list(remote_paths))
+        return dict([
+            (path.encode('utf-8'), tuple(stat) if stat else None)
+            for path, stat in response['stats'].items()])
+
+
+# Agent shared by all the channels of the process to the default cluster
+AGENT = RemoteAgent()
+
+# Agents of the other clusters, created when first needed
+AGENTS = {}
+AGENTS_LOCK = threading.Lock()
+
+
+def get_agent(cluster=None):
+    """Return the agent of cluster."""
+    if not cluster or cluster == DEFAULT_CLUSTER:
+        return AGENT
+    with AGENTS_LOCK:
+        if cluster not in AGENTS:
+            AGENTS[cluster] = RemoteAgent(cluster)
+        return AGENTS[cluster]
+
+
+class ConnectionPool(object):
+    """
+    A few connections to a cluster, shared by the threads of the process.
+
+    Each operation opens its own channel (or SFTP session) on one of the
+    connections, taken in turn, so several threads can run commands and
+    transfers at the same time. A connection is opened when needed, up to
+    pool_connections, and dropped once closed or timed out. When the agent is
+    enabled, the commands and the reading of the files go through it first,
+    as for SSHChannel.
+    """
+
+    def __init__(self, cluster=None):
+        """Create an empty pool of connections to cluster."""
+        self.cluster = cluster
+        self.clients = []
+        self.next_client = 0
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        """Return a connected SSHChannel of the pool."""
+        log = logging.getLogger(__name__)
+
+        # The models import this module
+        from .models.cluster import ClusterState
+        from .models.cluster import OPEN
+        name = self.cluster or DEFAULT_CLUSTER
+        if ClusterState.get_circuit(name) == OPEN:
+            raise ClusterUnavailable(
+                "Cluster " + str(name) + " is unavailable after repeated " \
+                + "failures.")
+
+        with self.lock:
+            self.clients = [
+                client for client in self.clients
+                if client.get_transport() is not None
+                and client.get_transport().is_active()]
+            size = max(int(get_cluster(self.cluster).pool_connections), 1)
+            if len(self.clients) < size:
+                log.debug("Open pooled connection to " + str(name))
+                client = SSHChannel(self.cluster)
+                client.__connect__()
+                self.clients.append(client)
+                return client
+            self.next_client = (self.next_client + 1) % len(self.clients)
+            return self.clients[self.next_client]
+
+    def drop(self, client):
+        """Close client, and remove it from the pool."""
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        client.close()
+
+    def close(self):
+        """Close all the connections of the pool."""
+        with self.lock:
+            clients = self.clients
+            self.clients = []
+        for client in clients:
+            client.close()
+
+    def timed_out(self, client, excep):
+        """Drop client after a timeout, and raise ClusterUnavailable."""
+        log = logging.getLogger(__name__)
+        log.error("Timeout on cluster " \
+            + str(self.cluster or DEFAULT_CLUSTER) + ": " + str(excep))
+        self.drop(client)
+        record_cluster_failure(self.cluster)
+        raise ClusterUnavailable("Timeout: " + str(excep))
+
+    def exec_command(self, command):
+        """Run command on a pooled connection, and return its stdout."""
+        log = logging.getLogger(__name__)
+        log.info("Execute command (pooled): " + shorten(command))
+
+        client = self.get_client()
+        with metrics.SSH_COMMAND.time():
+            try:
+                channel = client.get_transport().open_session()
+                try:
+                    channel.settimeout(
+                        float(get_cluster(self.cluster).command_timeout))
+                    channel.exec_command(command)
+                    stdout = channel.makefile('rb').read()
+                    stderr = channel.makefile_stderr('rb').read()
+                finally:
+                    channel.close()
+            except socket.timeout as excep:
+                self.timed_out(client, excep)
+            except (socket.error, paramiko.SSHException) as excep:
+                self.drop(client)
+                raise ClusterUnavailable(
+                    "Pooled connection lost: " + str(excep))
+
+        if stderr != '':
+            metrics.SSH_COMMAND_ERRORS.inc()
+            log.error("Error when running command: " + shorten(stderr))
+            raise RuntimeError(stderr)
+
+        log.info("Stdout: " + shorten(stdout))
+        return stdout
+
+    def exec_command_in_shell(self, command):
+        """Execute the given command in a login shell to load the env."""
+        log = logging.getLogger(__name__)
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                return get_agent(self.cluster).run(command)
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new shell: " \
+                    + str(excep))
+
+        command = command.replace("'", "\'")
+        return self.exec_command("bash -lc '" + command + "'")
+
+    def get_pdb_headers(self, remote_paths):
+        """Read the REMARK 3 records of the remote PDB files."""
+        if not remote_paths:
+            return {}
+        stdout = self.exec_command(get_pdb_headers_command(remote_paths))
+        return parse_pdb_headers(stdout, remote_paths)
+
+    def run_sftp(self, operation, direction):
+        """
+        Call operation with an SFTP client on a pooled connection.
+
+        :param direction: 'put' or 'get', for the metrics.
+        """
+        client = self.get_client()
+        with metrics.SFTP_TRANSFER.time(direction=direction):
+            try:
+                sftp_client = client.open_sftp()
+                try:
+                    sftp_client.get_channel().settimeout(
+                        float(get_cluster(self.cluster).transfer_timeout))
+                    return operation(sftp_client)
+                finally:
+                    sftp_client.close()
+            except socket.timeout as excep:
+                self.timed_out(client, excep)
+            except paramiko.SSHException as excep:
+                self.drop(client)
+                raise ClusterUnavailable(
+                    "Pooled connection lost: " + str(excep))
+
+    def read_file(self, remote_path):
+        """Return the content of remote_path."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(remote_path))
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                content = get_agent(self.cluster).read_file(remote_path)
+                log.debug("Exit with arg: " + shorten(content))
+                return content
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new channel: " \
+                    + str(excep))
+
+        def read(sftp_client):
+            """Read the remote file."""
+            with sftp_client.open(remote_path, 'r') as remote_file:
+                return remote_file.read()
+        try:
+            content = self.run_sftp(read, 'get')
+        except IOError as excep:
+            # As SSHChannel.read_file, which gives the stderr of cat
+            raise RuntimeError(str(remote_path) + ": " + str(excep))
+        metrics.SFTP_BYTES.inc(len(content), direction='get')
+
+        log.debug("Exit with arg: " + shorten(content))
+        return content
+
+    def stat_files(self, remote_paths):
+        """Return a dictionary giving (size, mtime) or None for each path."""
+        log = logging.getLogger(__name__)
+
+        if not remote_paths:
+            return {}
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                return get_agent(self.cluster).stat_files(remote_paths)
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new channel: " \
+                    + str(excep))
+
+        stdout = self.exec_command(get_stat_command(remote_paths))
+        return parse_stats(stdout, remote_paths)
+
+    def send_files(self, filenames, remote_directory, contents=None):
+        """Send several files and contents in one SFTP session."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filenames) + " " \
+                + str(remote_directory))
+
+        def send(sftp_client):
+            """Put the files and write the contents."""
+            for filename in filenames:
+                remote_filename = os.path.join(
+                    remote_directory,
+                    os.path.basename(filename))
+                log.info("Send " + str(filename) + " to " \
+                        + str(remote_filename))
+                attributes = sftp_client.put(
+                    filename,
+                    remote_filename,
+                    confirm=True)
+                metrics.SFTP_BYTES.inc(attributes.st_size, direction='put')
+            for remote_filename, content in contents or []:
+                log.info("Write in remote file: " + str(remote_filename))
+                with sftp_client.open(remote_filename, 'w') as remote_file:
+                    remote_file.write(content)
+                metrics.SFTP_BYTES.inc(len(content), direction='put')
+        try:
+            self.run_sftp(send, 'put')
+        except IOError as exception:
+            log.error("Unable to upload file: " + str(exception))
+            log.error("Save files in media root.")
+            for local_filename in filenames:
+                copy2(local_filename, settings.MEDIA_ROOT)
+            raise
+
+        log.debug("Exit")
+
+    def get_file(self, remote_filename, local_filename):
+        """Get remote_filename to local_filename."""
+        log = logging.getLogger(__name__)
+        log.info("Get " + str(remote_filename) + " to " + str(local_filename))
+
+        try:
+            self.run_sftp(
+                lambda sftp_client: sftp_client.get(
+                    remote_filename,
+                    local_filename),
+                'get')
+        except IOError:
+            log.error("Missing: " + remote_filename)
+            raise
+        if metrics.is_enabled():
+            metrics.SFTP_BYTES.inc(
+                os.path.getsize(local_filename),
+                direction='get')
+
+
+# Connection pools of the clusters, created when first needed
+CONNECTION_POOLS = {}
+CONNECTION_POOLS_LOCK = threading.Lock()
+
+
+def get_connection_pool(cluster=None):
+    """Return the connection pool of cluster."""
+    name = cluster or DEFAULT_CLUSTER
+    with CONNECTION_POOLS_LOCK:
+        if name not in CONNECTION_POOLS:
+            CONNECTION_POOLS[name] = ConnectionPool(cluster)
+        return CONNECTION_POOLS[name]
+
+
 class SSHChannel(paramiko.SSHClient):
     """
     A connection to the cluster or supercomputer.
@@ -39,9 +625,10 @@ class SSHChannel(paramiko.SSHClient):
     This class should always be used with 'with' statement.
     """
 
-    def __init__(self, *args, **kwargs):
-        """Create a new channel."""
-        super(SSHChannel, self).__init__(*args, **kwargs)
+    def __init__(self, cluster=None):
+        """Create a new channel to cluster (the default one if None)."""
+        super(SSHChannel, self).__init__()
+        self.cluster = cluster
         self.sshconfig = {}
 
     def __enter__(self):
@@ -52,11 +639,21 @@ class SSHChannel(paramiko.SSHClient):
         log.debug("Exit")
         return self
 
-    def __exit__(self, *args):
-        """Implement 'with' statement."""
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """
+        Implement 'with' statement.
+
+        A timeout in the block counts as a failure of the cluster, and is
+        raised as ClusterUnavailable.
+        """
         log = logging.getLogger(__name__)
         log.debug("Enter")
         self.close()
+        if exc_type is not None and issubclass(exc_type, socket.timeout):
+            log.error("Timeout on cluster " \
+                + str(self.cluster or DEFAULT_CLUSTER) + ": " + str(exc_value))
+            record_cluster_failure(self.cluster)
+            raise ClusterUnavailable("Timeout: " + str(exc_value))
         log.debug("Exit")
 
     def __get_config__(self):
@@ -67,12 +664,14 @@ class SSHChannel(paramiko.SSHClient):
         if self.sshconfig == {}:
             log.debug("Configuring SSH connection")
             self.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            contaminer_config = apps.get_app_config('contaminer')
+            contaminer_config = get_cluster(self.cluster)
             self.sshconfig = {
                 'hostname': contaminer_config.ssh_hostname,
                 'port': contaminer_config.ssh_port,
                 'username': contaminer_config.ssh_username,
                 'password': contaminer_config.ssh_password,
+                'timeout': contaminer_config.connect_timeout,
+                'banner_timeout': contaminer_config.connect_timeout,
                 }
             if contaminer_config.ssh_identityfile \
                and contaminer_config.ssh_identityfile is not '':
@@ -83,36 +682,76 @@ class SSHChannel(paramiko.SSHClient):
         return self.sshconfig
 
     def __connect__(self):
-        """Open SSH connection to host."""
+        """
+        Open SSH connection to host.
+
+        :raises ClusterUnavailable: if the circuit of the cluster is open, or
+        if the connection fails.
+        """
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
+        # The models import this module
+        from .models.cluster import ClusterState
+        name = self.cluster or DEFAULT_CLUSTER
+        if not ClusterState.allow_request(name):
+            log.warning("Circuit open, do not connect to " + str(name))
+            raise ClusterUnavailable(
+                "Cluster " + str(name) + " is unavailable after repeated " \
+                + "failures.")
+
         ssh_config = self.__get_config__()
 
         log.debug("Open SSH connection")
-        super(SSHChannel, self).connect(**ssh_config)
+        try:
+            with metrics.SSH_CONNECT.time():
+                super(SSHChannel, self).connect(**ssh_config)
+        except (socket.error, paramiko.SSHException) as excep:
+            log.error("Unable to connect to " + str(name) + ": " + str(excep))
+            ClusterState.record_failure(name)
+            raise ClusterUnavailable(
+                "Unable to connect to " + str(name) + ": " + str(excep))
+        ClusterState.record_success(name)
 
         log.debug("Exit")
 
+    @staticmethod
+    def get_contabase_command(cluster=None):
+        """Return the command displaying the ContaBase of cluster."""
+        return "sh " + os.path.join(
+            get_cluster(cluster).ssh_contaminer_location,
+            "contaminer") \
+            + " display"
+
     def get_contabase(self):
         """Get the full ContaBase from the cluster."""
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
-        command = "sh " + os.path.join(
-            apps.get_app_config('contaminer').ssh_contaminer_location,
-            "contaminer") \
-            + " display"
-        stdout = self.exec_command(command)
+        stdout = self.exec_command(self.get_contabase_command(self.cluster))
 
         log.debug("Exit")
         return stdout
 
+    def iter_contabase(self):
+        """Yield the XML of the ContaBase by chunks, as it arrives."""
+        return self.exec_command_stream(
+            self.get_contabase_command(self.cluster))
+
     def exec_command_in_shell(self, command):
         """Execute the given command in a shell to load the env."""
         log = logging.getLogger(__name__)
         log.debug("Enter")
 
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                stdout = get_agent(self.cluster).run(command)
+                log.debug("Exit")
+                return stdout
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new shell: " \
+                    + str(excep))
+
         command = command.replace("'", "\'")
         stdout = self.exec_command("bash -lc '" + command + "'")
 
@@ -122,11 +761,14 @@ class SSHChannel(paramiko.SSHClient):
     def exec_command(self, *args, **kwargs):
         """Open a channel then execute command on remote destination."""
         log = logging.getLogger(__name__)
-        log.debug("Enter with args: " + str(args) + " " + str(kwargs))
+        log.debug("Enter")
 
-        log.info("Execute command: " + str(args[0]))
+        log.info("Execute command: " + shorten(args[0]))
 
-        with self as ssh_channel:
+        kwargs.setdefault(
+            'timeout',
+            float(get_cluster(self.cluster).command_timeout))
+        with metrics.SSH_COMMAND.time(), self as ssh_channel:
             (_, stdout, stderr) = super(SSHChannel, ssh_channel).exec_command(
                 *args,
                 **kwargs)
@@ -134,32 +776,162 @@ class SSHChannel(paramiko.SSHClient):
             stderr = stderr.read()
 
         if stderr is not '':
-            log.error("Error when running command: " + str(stderr))
+            metrics.SSH_COMMAND_ERRORS.inc()
+            log.error("Error when running command: " + shorten(stderr))
             raise RuntimeError(stderr)
 
-        log.info("Stdout: " + str(stdout))
-        log.debug("Exit with arg: " + str(stdout))
+        log.info("Stdout: " + shorten(stdout))
+        log.debug("Exit")
         return stdout
 
+    def exec_command_stream(self, command, chunk_size=CHUNK_SIZE):
+        """
+        Execute command on remote destination, and yield stdout by chunks.
+
+        The chunks are yielded as they arrive. The channel is read only when
+        the next chunk is asked: if the caller is slower than the command,
+        the SSH window fills up and the server pauses the command. stderr is
+        read and logged as soon as it arrives, and RuntimeError is raised with
+        its content once the command is done, as exec_command does. The
+        command times out if it writes nothing for command_timeout seconds.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        log.info("Execute command (streamed): " + shorten(command))
+        stderr = []
+        stderr_size = 0
+        stdout_size = 0
+        timeout = float(get_cluster(self.cluster).command_timeout)
+        with metrics.SSH_COMMAND.time(), self as ssh_channel:
+            channel = ssh_channel.get_transport().open_session()
+            try:
+                channel.exec_command(command)
+                last_data = time.time()
+                while True:
+                    while channel.recv_stderr_ready():
+                        last_data = time.time()
+                        data = channel.recv_stderr(chunk_size)
+                        log.warning("Stderr: " + shorten(data))
+                        if stderr_size < MAX_STDERR_SIZE:
+                            stderr.append(data)
+                        stderr_size += len(data)
+                    if channel.recv_ready():
+                        data = channel.recv(chunk_size)
+                        stdout_size += len(data)
+                        last_data = time.time()
+                        yield data
+                    elif channel.exit_status_ready():
+                        if not channel.recv_stderr_ready():
+                            break
+                    elif time.time() - last_data > timeout:
+                        raise socket.timeout(
+                            "No output for " + str(timeout) + " seconds")
+                    else:
+                        select.select([channel], [], [], POLL_INTERVAL)
+            finally:
+                channel.close()
+
+        if stderr:
+            metrics.SSH_COMMAND_ERRORS.inc()
+            log.error("Error when running command: " \
+                + shorten("".join(stderr)))
+            raise RuntimeError("".join(stderr))
+
+        log.info("Stdout: " + str(stdout_size) + " bytes streamed")
+        log.debug("Exit")
+
+    def exec_command_lines(self, command):
+        """Execute command on remote destination, and yield stdout by line."""
+        remainder = ""
+        for chunk in self.exec_command_stream(command):
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+        if remainder:
+            yield remainder
+
+    def get_pdb_headers(self, remote_paths):
+        """
+        Read the REMARK 3 records of the remote PDB files in one command.
+
+        Only the header of each file is read, up to the first ATOM or HETATM
+        record.
+        :param remote_paths: list of absolute paths of PDB files on the host
+        :returns: dictionary giving the REMARK 3 records of each file. A file
+        which cannot be read gets an empty string.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with arg: " + str(remote_paths))
+
+        if not remote_paths:
+            log.debug("Exit")
+            return {}
+
+        stdout = self.exec_command(get_pdb_headers_command(remote_paths))
+        headers = parse_pdb_headers(stdout, remote_paths)
+
+        log.debug("Exit")
+        return headers
+
+    def stat_files(self, remote_paths):
+        """
+        Return the size and the mtime of the remote files, in one command.
+
+        :returns: dictionary giving (size, mtime) for each path, or None if
+        the file does not exist.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with " + str(len(remote_paths)) + " paths")
+
+        if not remote_paths:
+            log.debug("Exit")
+            return {}
+
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                stats = get_agent(self.cluster).stat_files(remote_paths)
+                log.debug("Exit")
+                return stats
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new channel: " \
+                    + str(excep))
+
+        stdout = self.exec_command(get_stat_command(remote_paths))
+        stats = parse_stats(stdout, remote_paths)
+
+        log.debug("Exit")
+        return stats
+
     def read_file(self, remote_path):
         """Read a remote file and return the content as a string."""
         log = logging.getLogger(__name__)
         log.debug("Enter with arg: " + str(remote_path))
 
+        if get_cluster(self.cluster).agent_enabled:
+            try:
+                stdout = get_agent(self.cluster).read_file(remote_path)
+                log.debug("Exit with arg: " + shorten(stdout))
+                return stdout
+            except AgentUnavailable as excep:
+                log.warning("Agent unavailable, use a new channel: " \
+                    + str(excep))
+
         command = "cat " + str(remote_path)
         with self as ssh_channel:
             stdout = ssh_channel.exec_command(command)
 
-        log.debug("Exit with arg: " + str(stdout))
+        log.debug("Exit with arg: " + shorten(stdout))
         return stdout
 
 
 class SFTPChannel(SSHChannel):
     """An SFTP connection to the cluster or supercomputer."""
 
-    def __init__(self):
-        """Create a new SFTP connection."""
-        super(SFTPChannel, self).__init__()
+    def __init__(self, cluster=None):
+        """Create a new SFTP connection to cluster."""
+        super(SFTPChannel, self).__init__(cluster)
         self.sftpclient = None
 
     def __enter__(self):
@@ -175,8 +947,8 @@ class SFTPChannel(SSHChannel):
         log = logging.getLogger(__name__)
         log.debug("Enter")
         self.sftpclient.close()
-        super(SFTPChannel, self).__exit__(args)
         self.sftpclient = None
+        super(SFTPChannel, self).__exit__(*args)
         log.debug("Exit")
 
     def __connect__(self):
@@ -189,6 +961,8 @@ class SFTPChannel(SSHChannel):
 
         log.debug("Open SFTP connection")
         self.sftpclient = self.open_sftp()
+        self.sftpclient.get_channel().settimeout(
+            float(get_cluster(self.cluster).transfer_timeout))
 
         log.debug("Exit")
 
@@ -203,10 +977,15 @@ class SFTPChannel(SSHChannel):
             os.path.basename(filename)
             )
 
-        with self as sftp_client:
+        with metrics.SFTP_TRANSFER.time(direction='put'), \
+                self as sftp_client:
             log.info("Send " + str(filename) + " to " + str(remote_filename))
             try:
-                sftp_client.put(filename, remote_filename, confirm=True)
+                attributes = sftp_client.put(
+                    filename,
+                    remote_filename,
+                    confirm=True)
+                metrics.SFTP_BYTES.inc(attributes.st_size, direction='put')
             except IOError as exception:
                 log.error("Unable to upload file: " + str(e))
                 log.error("Save files in media root.")
@@ -215,12 +994,56 @@ class SFTPChannel(SSHChannel):
 
         log.debug("Exit")
 
+    def send_files(self, filenames, remote_directory, contents=None):
+        """
+        Send several files and contents to host in one SFTP session.
+
+        :param filenames: local files sent in remote_directory, keeping their
+        basename.
+        :param remote_directory: destination of the files on host.
+        :param contents: list of (remote_filename, content) to write on host.
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter with args: " + str(filenames) + " " \
+                + str(remote_directory))
+
+        with metrics.SFTP_TRANSFER.time(direction='put'), \
+                self as sftp_client:
+            for filename in filenames:
+                remote_filename = os.path.join(
+                    remote_directory,
+                    os.path.basename(filename))
+                log.info("Send " + str(filename) + " to " \
+                        + str(remote_filename))
+                try:
+                    attributes = sftp_client.put(
+                        filename,
+                        remote_filename,
+                        confirm=True)
+                    metrics.SFTP_BYTES.inc(
+                        attributes.st_size,
+                        direction='put')
+                except IOError as exception:
+                    log.error("Unable to upload file: " + str(exception))
+                    log.error("Save files in media root.")
+                    for local_filename in filenames:
+                        copy2(local_filename, settings.MEDIA_ROOT)
+                    raise exception
+
+            for remote_filename, content in contents or []:
+                log.info("Write in remote file: " + str(remote_filename))
+                with sftp_client.open(remote_filename, 'w') as remote_file:
+                    remote_file.write(content)
+                metrics.SFTP_BYTES.inc(len(content), direction='put')
+
+        log.debug("Exit")
+
     def upload_to_contaminer(self, filename):
         """Send filename to host and put it in ContaMiner work directory."""
         log = logging.getLogger(__name__)
         log.debug("Enter with arg: " + str(filename))
 
-        remote_directory = apps.get_app_config('contaminer').ssh_work_directory
+        remote_directory = get_cluster(self.cluster).ssh_work_directory
         self.send_file(filename, remote_directory)
 
         log.debug("Exit")
@@ -229,12 +1052,14 @@ class SFTPChannel(SSHChannel):
         """Write content in remote filename on host."""
         log = logging.getLogger(__name__)
         log.debug("Enter with args: " + str(remote_filename) + " " \
-                + str(content))
+                + shorten(content))
 
-        with self as sftp_client:
+        with metrics.SFTP_TRANSFER.time(direction='put'), \
+                self as sftp_client:
             log.info("Write in remote file: " + str(remote_filename))
             with sftp_client.open(remote_filename, 'w') as remote_file:
                 remote_file.write(content)
+            metrics.SFTP_BYTES.inc(len(content), direction='put')
 
         log.debug("Exit")
 
@@ -244,11 +1069,16 @@ class SFTPChannel(SSHChannel):
         log.debug("Enter with args: " + str(remote_filename) + " " \
                 + str(local_filename))
 
-        with self as sftp_client:
+        with metrics.SFTP_TRANSFER.time(direction='get'), \
+                self as sftp_client:
             log.info("Get " + str(remote_filename) \
                     + " to " + str(local_filename))
             try:
                 sftp_client.get(remote_filename, local_filename)
+                if metrics.is_enabled():
+                    metrics.SFTP_BYTES.inc(
+                        os.path.getsize(local_filename),
+                        direction='get')
             except IOError:
                 log.error("Missing: " + remote_filename)
                 raise
@@ -261,7 +1091,7 @@ class SFTPChannel(SSHChannel):
         log.debug("Enter with args: " + str(filename) + " " \
                 + str(local_filename))
 
-        remote_directory = apps.get_app_config('contaminer').ssh_work_directory
+        remote_directory = get_cluster(self.cluster).ssh_work_directory
         remote_filename = os.path.join(remote_directory, filename)
         self.get_file(remote_filename, local_filename)
 
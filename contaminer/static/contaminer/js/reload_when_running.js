@@ -15,6 +15,30 @@ function refreshIfReady(response) {
     if (job_status.match("Complete|Running")) {
         location.reload();
     }
+    if ('remaining_time' in response) {
+        showRemainingTime(response['remaining_time']);
+    }
+    showQueuePosition(response['queue_position']);
+}
+
+function showQueuePosition(position) {
+    var paragraph = document.getElementById("queue_position");
+    if (position === undefined) {
+        paragraph.hidden = true;
+        return;
+    }
+    document.getElementById("queue_rank").innerHTML = position;
+    paragraph.hidden = false;
+}
+
+function showRemainingTime(seconds) {
+    var minutes = Math.ceil(seconds / 60);
+    var text = minutes % 60 + " minutes";
+    if (minutes >= 60) {
+        text = Math.floor(minutes / 60) + " hours, " + text;
+    }
+    document.getElementById("remaining_time").innerHTML = text;
+    document.getElementById("estimated_end").hidden = false;
 }
 
 window.setInterval(function(){
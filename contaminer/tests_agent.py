@@ -0,0 +1,156 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for agent.py
+    ===========================
+
+    This module contains unitary tests for the framing and the operations of
+    the remote agent.
+"""
+
+from django.test import TestCase
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from . import agent
+
+
+class FramingTestCase(TestCase):
+    """
+        Test the encoding of the messages in frames
+    """
+    def test_frame_gives_same_message(self):
+        stream = io.BytesIO()
+        agent.write_frame(stream, {'op': 'run', 'command': "ls"})
+        agent.write_frame(stream, {'op': 'ping'})
+        stream.seek(0)
+        self.assertEqual(
+            agent.read_frame(stream),
+            {'op': 'run', 'command': "ls"})
+        self.assertEqual(agent.read_frame(stream), {'op': 'ping'})
+
+    def test_frame_starts_with_length(self):
+        stream = io.BytesIO()
+        agent.write_frame(stream, {})
+        self.assertEqual(stream.getvalue(), b'\x00\x00\x00\x02{}')
+
+    def test_read_frame_raises_on_truncated_frame(self):
+        stream = io.BytesIO(b'\x00\x00\x00\x10{"op"')
+        with self.assertRaises(agent.ProtocolError):
+            agent.read_frame(stream)
+
+    def test_read_frame_raises_on_invalid_json(self):
+        stream = io.BytesIO(b'\x00\x00\x00\x03{"o')
+        with self.assertRaises(agent.ProtocolError):
+            agent.read_frame(stream)
+
+
+class OperationsTestCase(TestCase):
+    """
+        Test the answers of the agent
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "results.txt")
+        with open(self.filename, 'w') as results_file:
+            results_file.write("P0ACJ8,1,P-1-2-1,new,0,0,0h 0m 0s\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_run_gives_outputs(self):
+        response = agent.answer({
+            'op': 'run',
+            'command': "cat results.txt && echo error >&2",
+            'cwd': self.directory})
+        self.assertEqual(
+            response['stdout'],
+            "P0ACJ8,1,P-1-2-1,new,0,0,0h 0m 0s\n")
+        self.assertEqual(response['stderr'], "error\n")
+        self.assertEqual(response['status'], 0)
+
+    def test_run_does_not_read_requests(self):
+        requests = io.BytesIO()
+        agent.write_frame(requests, {'op': 'run', 'command': "cat"})
+        agent.write_frame(requests, {'op': 'ping'})
+        process = subprocess.Popen(
+            [sys.executable, agent.__file__.replace('.pyc', '.py')],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        stdout, _ = process.communicate(requests.getvalue())
+        responses = io.BytesIO(stdout)
+        self.assertEqual(agent.read_frame(responses)['stdout'], "")
+        self.assertEqual(agent.read_frame(responses), {'pong': True})
+
+    def test_read_gives_content(self):
+        response = agent.answer({'op': 'read', 'path': self.filename})
+        self.assertEqual(
+            response['content'],
+            "P0ACJ8,1,P-1-2-1,new,0,0,0h 0m 0s\n")
+
+    def test_read_gives_error_on_missing_file(self):
+        response = agent.answer({
+            'op': 'read',
+            'path': os.path.join(self.directory, "missing")})
+        self.assertIn('error', response)
+
+    def test_stat_gives_size_or_none(self):
+        missing = os.path.join(self.directory, "missing")
+        response = agent.answer({
+            'op': 'stat',
+            'paths': [self.filename, missing]})
+        self.assertEqual(response['stats'][self.filename][0], 34)
+        self.assertEqual(response['stats'][missing], None)
+
+    def test_contaminer_operations_run_contaminer(self):
+        contaminer = os.path.join(self.directory, "contaminer")
+        with open(contaminer, 'w') as script:
+            script.write('#!/bin/sh\necho "$PWD" "$@"\n')
+        os.chmod(contaminer, 0o755)
+        response = agent.answer({
+            'op': 'solve',
+            'contaminer': contaminer,
+            'cwd': self.directory,
+            'input': "web_task_1.mtz",
+            'contaminants': "web_task_1.txt"})
+        self.assertEqual(
+            response['stdout'],
+            self.directory + " solve web_task_1.mtz web_task_1.txt\n")
+        response = agent.answer({
+            'op': 'status',
+            'contaminer': contaminer,
+            'job': "/work/web_task_1"})
+        self.assertTrue(
+            response['stdout'].endswith(" job_status /work/web_task_1\n"))
+        response = agent.answer({
+            'op': 'cancel',
+            'contaminer': contaminer,
+            'job': "/work/web_task_1",
+            'tasks': ["P0ACJ8_1_P-1-2-1", "a b"]})
+        self.assertTrue(response['stdout'].endswith(
+            " cancel /work/web_task_1 P0ACJ8_1_P-1-2-1 a b\n"))
+        self.assertEqual(response['status'], 0)
+
+    def test_unknown_operation_gives_error(self):
+        self.assertIn('error', agent.answer({'op': 'rm'}))
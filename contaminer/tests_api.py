@@ -29,6 +29,8 @@ from django.test import Client
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.http import Http404
+from django.utils import timezone
+from django.apps import apps
 import mock
 
 from .views_api import ContaBaseView
@@ -41,7 +43,9 @@ from .views_api import DetailedContaminantsView
 from .views_api import ContaminantView
 from .views_api import DetailedContaminantView
 from .views_api import JobView
+from .views_api import JobsView
 from .views_api import JobStatusView
+from .views_api import JobsStatusView
 from .views_api import SimpleResultsView
 from .views_api import DetailedResultsView
 from .views_api import GetFinalFilesView
@@ -54,8 +58,14 @@ from .models.contabase import Reference
 from .models.contabase import Suggestion
 from .models.contaminer import Job
 from .models.contaminer import Task
+from .models.admission import QueuedSubmission
+from .models.cluster import ClusterState
+from .models.cluster import MAX_FAILURES
+from .models.upload import UploadSession
 
 import json
+import datetime
+import hashlib
 import tempfile
 import time
 import shutil
@@ -1335,6 +1345,27 @@ class JobViewTestCase(TestCase):
         args, kwargs = self.mock_job_instance.submit.call_args
         self.assertEqual(args[1], "P0ACJ8\nP0AA25\n")
 
+    @mock.patch('contaminer.views_tools.QueuedSubmission')
+    @mock.patch('contaminer.views_tools.Job')
+    def test_post_holds_job_when_cluster_is_full(self, mock_Job, mock_queue):
+        mock_Job.create.return_value = self.mock_job_instance
+        mock_queue.admit.return_value = False
+        request = self.factory.post(
+                reverse('ContaMiner:API:job'),
+                self.post_data,
+                )
+        request.FILES['diffraction_data'] = self.test_file
+
+        response = JobView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        time.sleep(0.01)
+        self.mock_job_instance.submit.assert_not_called()
+        args, kwargs = mock_queue.hold.call_args
+        self.assertEqual(args[0], self.mock_job_instance)
+        self.assertEqual(args[2], "P0ACJ8\nP0AA25\n")
+        self.assertFalse(kwargs['interactive'])
+        shutil.rmtree(os.path.dirname(args[1]))
+
     @mock.patch('contaminer.views_tools.Job')
     def test_post_returns_job_id(self, mock_Job):
         mock_Job.create.return_value = self.mock_job_instance
@@ -1353,6 +1384,72 @@ class JobViewTestCase(TestCase):
                 )
 
 
+class JobsViewTestCase(TestCase):
+    """
+        Test the JobsView views
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.directory = tempfile.mkdtemp()
+        self.files = []
+        for name in ["data1.mtz", "data2.cif"]:
+            filename = os.path.join(self.directory, name)
+            with open(filename, 'w') as data_file:
+                data_file.write("data")
+            self.files.append(filename)
+        self.post_data = {
+                'email_address': 'you@example.com',
+                'contaminants': 'P0ACJ8,P0AA25',
+                'contaminants_1': 'P0AA25',
+                'name_0': 'First',
+                }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def post(self, filenames):
+        request = self.factory.post(
+                reverse('ContaMiner:API:jobs'),
+                self.post_data,
+                )
+        for filename in filenames:
+            request.FILES.appendlist(
+                'diffraction_data',
+                open(filename, 'rb'))
+        return JobsView.as_view()(request)
+
+    def test_post_returns_400_on_missing_file(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_returns_400_on_bad_extension(self):
+        bad_file = os.path.join(self.directory, "data.txt")
+        open(bad_file, 'w').close()
+        response = self.post(self.files + [bad_file])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Job.objects.count(), 0)
+
+    @mock.patch('contaminer.views_tools.Job.submit_batch')
+    def test_post_submits_all_jobs_together(self, mock_submit_batch):
+        response = self.post(self.files)
+        self.assertEqual(response.status_code, 200)
+        ids = json.loads(response.content)['ids']
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(Job.objects.get(id=ids[0]).name, "First")
+        self.assertEqual(Job.objects.get(id=ids[1]).name, "data2.cif")
+
+        # Add a delay to let the thread start
+        time.sleep(0.05)
+        mock_submit_batch.assert_called_once()
+        submissions = mock_submit_batch.call_args[0][0]
+        self.assertEqual(
+            [(job.id, os.path.basename(filepath), contaminants)
+             for (job, filepath, contaminants) in submissions],
+            [(ids[0], "web_task_" + str(ids[0]) + ".mtz", "P0ACJ8\nP0AA25\n"),
+             (ids[1], "web_task_" + str(ids[1]) + ".cif", "P0AA25\n")])
+        shutil.rmtree(os.path.dirname(submissions[0][1]))
+
+
 class JobStatusTestViewCase(TestCase):
     """
         Test the JobStatusView views
@@ -1416,6 +1513,34 @@ class JobStatusTestViewCase(TestCase):
                     'status': 'Error',
                 })
 
+    @mock.patch('contaminer.models.contaminer.Job.get_remaining_time')
+    def test_jobstatus_gives_remaining_time(self, mock_remaining):
+        mock_remaining.return_value = datetime.timedelta(seconds=600)
+        self.job.status_submitted = True
+        self.job.save()
+        request = self.factory.get(
+                reverse('ContaMiner:API:job_status', args = [self.job.id])
+                )
+        response = JobStatusView.as_view()(request, self.job.id)
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['remaining_time'], 600)
+        self.assertIn('estimated_end', response_data)
+
+    def test_jobstatus_gives_queue_position(self):
+        first = Job.objects.create(name = "First")
+        QueuedSubmission.hold(first, "/local/first.mtz", "P0ACJ8\n")
+        QueuedSubmission.hold(self.job, "/local/test.mtz", "P0ACJ8\n")
+        request = self.factory.get(
+                reverse('ContaMiner:API:job_status', args = [self.job.id])
+                )
+        response = JobStatusView.as_view()(request, self.job.id)
+        self.assertJSONEqual(response.content,
+                {
+                    'id': self.job.id,
+                    'status': 'New',
+                    'queue_position': 2,
+                })
+
     def test_jobstatus_do_not_display_confidential_job(self):
         request = self.factory.get(
                 reverse('ContaMiner:API:job_status', args = [self.job.id])
@@ -1440,6 +1565,149 @@ class JobStatusTestViewCase(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class JobsStatusViewTestCase(TestCase):
+    """
+        Test the JobsStatusView views
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.contabase = ContaBase.objects.create()
+        self.category = Category.objects.create(
+            contabase = self.contabase,
+            number = 1,
+            name = "Protein in E.Coli",
+            )
+        self.contaminant = Contaminant.objects.create(
+            uniprot_id = "P0ACJ8",
+            category = self.category,
+            short_name = "CRP_ECOLI",
+            long_name = "cAMP-activated global transcriptional regulator",
+            sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            organism = "Escherichia coli",
+            )
+        self.pack = Pack.objects.create(
+            contaminant = self.contaminant,
+            number = 1,
+            structure= '1-mer',
+            )
+        self.job1 = Job.objects.create(name = "Test1", status_submitted = True)
+        self.job2 = Job.objects.create(
+            name = "Test2",
+            status_submitted = True,
+            status_running = True)
+        self.job3 = Job.objects.create(name = "Test3", confidential = True)
+        Task.objects.create(
+            job = self.job2,
+            pack = self.pack,
+            space_group = "P-1-2-1",
+            percent = 50,
+            q_factor = 0.60,
+            status_complete = True,
+            )
+
+    def get(self, parameters):
+        request = self.factory.get(
+            reverse('ContaMiner:API:jobs_status') + parameters)
+        return JobsStatusView.as_view()(request)
+
+    def test_jobsstatus_returns_400_on_bad_ids(self):
+        response = self.get("?ids=1,abc")
+        self.assertEqual(response.status_code, 400)
+        response = self.get("")
+        self.assertEqual(response.status_code, 400)
+
+    def test_jobsstatus_returns_400_on_too_many_ids(self):
+        response = self.get(
+            "?ids=" + ",".join([str(i) for i in range(1, 102)]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_jobsstatus_returns_all_statuses_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.get("?ids=%d,%d,%d,999,%d" % (
+                self.job2.id, self.job1.id, self.job3.id, self.job1.id))
+        self.assertJSONEqual(response.content,
+            {
+                'error': False,
+                'jobs': [
+                    {'id': self.job2.id, 'status': 'Running'},
+                    {'id': self.job1.id, 'status': 'Submitted'},
+                    ],
+                'not_found': [999],
+                'forbidden': [self.job3.id],
+            })
+
+    def test_jobsstatus_gives_results(self):
+        with self.assertNumQueries(3):
+            response = self.get("?ids=%d,%d&results=true" % (
+                self.job1.id, self.job2.id))
+        jobs = json.loads(response.content)['jobs']
+        self.assertEqual(jobs[0]['results'], [])
+        self.assertEqual(jobs[1]['results'], [{
+            'uniprot_id': 'P0ACJ8',
+            'status': 'Complete',
+            'percent': 50,
+            'q_factor': 0.60,
+            'pack_number': 1,
+            'space_group': 'P-1-2-1',
+            'files_available': 'False',
+            }])
+
+    def test_jobsstatus_gives_positive_results_in_constant_queries(self):
+        for index in range(3):
+            contaminant = Contaminant.objects.create(
+                uniprot_id = "P0AA2" + str(index),
+                category = self.category,
+                short_name = "SHORT" + str(index),
+                long_name = "Positive contaminant",
+                sequence = "ABCDEFGHIJ",
+                organism = "Escherichia coli",
+                )
+            pack = Pack.objects.create(
+                contaminant = contaminant,
+                number = 1,
+                structure= '1-mer',
+                )
+            Model.objects.create(
+                pack = pack,
+                pdb_code = "1AB" + str(index),
+                chain = 'A',
+                nb_residues = 5,
+                identity = 50,
+                )
+            Task.objects.create(
+                job = self.job1,
+                pack = pack,
+                space_group = "P-1-2-1",
+                percent = 99,
+                q_factor = 0.60,
+                status_complete = True,
+                )
+        with self.assertNumQueries(3):
+            response = self.get("?ids=%d,%d&results=true" % (
+                self.job1.id, self.job2.id))
+        jobs = json.loads(response.content)['jobs']
+        self.assertEqual(len(jobs[0]['results']), 3)
+        self.assertIn('bad_model', jobs[0]['messages'])
+
+    def test_jobsstatus_gives_compact_output(self):
+        response = self.get("?ids=%d,%d&results=true&compact=true" % (
+            self.job1.id, self.job2.id))
+        self.assertJSONEqual(response.content,
+            {
+                'error': False,
+                'status': {
+                    str(self.job1.id): 'Submitted',
+                    str(self.job2.id): 'Running',
+                    },
+                'results': {
+                    str(self.job1.id): [],
+                    str(self.job2.id): [['P0ACJ8', 'Complete', 50, 0.60]],
+                    },
+                'not_found': [],
+                'forbidden': [],
+            })
+
+
 class SimpleResultsViewTestCase(TestCase):
     """
         Test the SimpleResultView views
@@ -1934,9 +2202,44 @@ class GetFinalFilesViewTestCase(TestCase):
         response = GetFinalFilesView.as_view()(request, 'PDB')
         self.assertEqual(response.status_code, 400)
 
-    @mock.patch('contaminer.views_api.os.path.isfile')
-    def test_return_good_url_redirect(self, mock_isfile):
-        mock_isfile.return_value = True
+    def write_final_file(self, media_root, content):
+        final_dir = os.path.join(media_root, "web_task_" + str(self.job.id))
+        os.makedirs(final_dir)
+        final_file = os.path.join(final_dir, "P0ACJ8_1_P-1-2-1.pdb")
+        with open(final_file, 'w') as pdb_file:
+            pdb_file.write(content)
+        return final_file
+
+    def test_return_file_content(self):
+        media_root = tempfile.mkdtemp()
+        self.write_final_file(media_root, "ATOM 1")
+        request = self.factory.get(
+                reverse('ContaMiner:API:get_final', args = ['PDB']),
+                {
+                    'id': self.job.id,
+                    'uniprot_id': 'P0ACJ8',
+                    'space_group': 'P-1-2-1',
+                    'pack_nb': 1,
+                },
+                follow = False,
+            )
+        with self.settings(MEDIA_ROOT=media_root):
+            response = GetFinalFilesView.as_view()(request, 'PDB')
+            content = b''.join(response.streaming_content)
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b"ATOM 1")
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue("P0ACJ8_1_P-1-2-1.pdb"
+            in response['Content-Disposition'])
+
+    @mock.patch('contaminer.views_api.Task.get_local_final_file')
+    def test_return_503_when_cluster_is_unavailable(self, mock_get_file):
+        mock_get_file.return_value = None
+        ClusterState.objects.create(
+            name="default",
+            consecutive_failures=MAX_FAILURES,
+            last_failure=timezone.now())
         request = self.factory.get(
                 reverse('ContaMiner:API:get_final', args = ['PDB']),
                 {
@@ -1948,9 +2251,72 @@ class GetFinalFilesViewTestCase(TestCase):
                 follow = False,
             )
         response = GetFinalFilesView.as_view()(request, 'PDB')
-        self.assertEqual(response.status_code, 302)
-        self.assertEqual(response.url,
-            "/media/web_task_" + str(self.job.id) + "/P0ACJ8_1_P-1-2-1.pdb")
+        self.assertEqual(response.status_code, 503)
+
+    def test_return_partial_content_on_range(self):
+        media_root = tempfile.mkdtemp()
+        self.write_final_file(media_root, "0123456789")
+        request = self.factory.get(
+                reverse('ContaMiner:API:get_final', args = ['PDB']),
+                {
+                    'id': self.job.id,
+                    'uniprot_id': 'P0ACJ8',
+                    'space_group': 'P-1-2-1',
+                    'pack_nb': 1,
+                },
+                follow = False,
+                HTTP_RANGE = 'bytes=2-5',
+            )
+        with self.settings(MEDIA_ROOT=media_root):
+            response = GetFinalFilesView.as_view()(request, 'PDB')
+            content = b''.join(response.streaming_content)
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, b"2345")
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+    def test_return_416_on_unsatisfiable_range(self):
+        media_root = tempfile.mkdtemp()
+        self.write_final_file(media_root, "0123456789")
+        request = self.factory.get(
+                reverse('ContaMiner:API:get_final', args = ['PDB']),
+                {
+                    'id': self.job.id,
+                    'uniprot_id': 'P0ACJ8',
+                    'space_group': 'P-1-2-1',
+                    'pack_nb': 1,
+                },
+                follow = False,
+                HTTP_RANGE = 'bytes=20-',
+            )
+        with self.settings(MEDIA_ROOT=media_root):
+            response = GetFinalFilesView.as_view()(request, 'PDB')
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 416)
+
+    @mock.patch('contaminer.views_tools.apps.get_app_config')
+    def test_hand_transfer_to_front_end_server(self, mock_config):
+        mock_config.return_value.sendfile = 'xaccel'
+        mock_config.return_value.sendfile_url = '/protected/'
+        media_root = tempfile.mkdtemp()
+        self.write_final_file(media_root, "ATOM 1")
+        request = self.factory.get(
+                reverse('ContaMiner:API:get_final', args = ['PDB']),
+                {
+                    'id': self.job.id,
+                    'uniprot_id': 'P0ACJ8',
+                    'space_group': 'P-1-2-1',
+                    'pack_nb': 1,
+                },
+                follow = False,
+            )
+        with self.settings(MEDIA_ROOT=media_root):
+            response = GetFinalFilesView.as_view()(request, 'PDB')
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response['X-Accel-Redirect'],
+            "/protected/web_task_" + str(self.job.id) + "/P0ACJ8_1_P-1-2-1.pdb")
 
     @mock.patch('contaminer.views_api.os.path.isfile')
     def test_return_404_on_missing_file(self, mock_isfile):
@@ -1994,6 +2360,29 @@ class GetFinalFilesViewTestCase(TestCase):
                 })
         self.assertEqual(response.status_code, 403)
 
+    def test_display_if_confidential_and_author(self):
+        user = User.objects.create_user(username="author")
+        self.job.confidential = True
+        self.job.author = user
+        self.job.save()
+        media_root = tempfile.mkdtemp()
+        self.write_final_file(media_root, "ATOM 1")
+        request = self.factory.get(
+                reverse('ContaMiner:API:get_final', args = ['PDB']),
+                {
+                    'id': self.job.id,
+                    'uniprot_id': 'P0ACJ8',
+                    'space_group': 'P-1-2-1',
+                    'pack_nb': 1,
+                },
+                follow = False,
+            )
+        request.user = user
+        with self.settings(MEDIA_ROOT=media_root):
+            response = GetFinalFilesView.as_view()(request, 'PDB')
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+
     def test_bad_request_gives_400_not_500(self):
         request = self.factory.get(
                 reverse('ContaMiner:API:get_final', args = ['PDB']),
@@ -2020,3 +2409,166 @@ class GetFinalFilesViewTestCase(TestCase):
             )
         response = GetFinalFilesView.as_view()(request, 'PDB')
         self.assertEqual(response.status_code, 400)
+
+
+class UploadViewTestCase(TestCase):
+    """
+        Test the resumable uploads through api/upload
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        app_config = apps.get_app_config('contaminer')
+        for name, value in [('tmp_dir', self.directory),
+                            ('upload_max_size', 100),
+                            ('upload_max_sessions', 10)]:
+            patcher = mock.patch.object(app_config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = Client()
+
+    def start(self, size=10, sha256=''):
+        response = self.client.post(
+            reverse('ContaMiner:API:uploads'),
+            {'filename': 'data.mtz', 'size': size, 'sha256': sha256})
+        return json.loads(response.content)['id']
+
+    def put(self, token, content, start, size=10):
+        return self.client.put(
+            reverse('ContaMiner:API:upload', args=[token]),
+            content,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes ' + str(start) + '-' \
+                + str(start + len(content) - 1) + '/' + str(size))
+
+    def finalize(self, token, data=None):
+        return self.client.post(
+            reverse('ContaMiner:API:upload_finalize', args=[token]),
+            data or {'contaminants': 'P0ACJ8,P0AA25'})
+
+    def test_post_creates_session(self):
+        response = self.client.post(
+            reverse('ContaMiner:API:uploads'),
+            {'filename': 'data.mtz', 'size': 10})
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        self.assertFalse(response_data['error'])
+        self.assertEqual(response_data['offset'], 0)
+        self.assertTrue(
+            UploadSession.objects.filter(token=response_data['id']).exists())
+
+    def test_post_refuses_bad_files(self):
+        response = self.client.post(
+            reverse('ContaMiner:API:uploads'),
+            {'filename': 'data.txt', 'size': 10})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            reverse('ContaMiner:API:uploads'),
+            {'filename': 'data.mtz'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            reverse('ContaMiner:API:uploads'),
+            {'filename': 'data.mtz', 'size': 101})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_post_refuses_too_many_sessions(self):
+        app_config = apps.get_app_config('contaminer')
+        with mock.patch.object(app_config, 'upload_max_sessions', 2):
+            self.start()
+            self.start()
+            response = self.client.post(
+                reverse('ContaMiner:API:uploads'),
+                {'filename': 'data.mtz', 'size': 10})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(UploadSession.objects.count(), 2)
+
+    def test_put_chunks_and_get_progress(self):
+        token = self.start()
+        response = self.put(token, b"0123", 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['offset'], 4)
+
+        response = self.client.get(
+            reverse('ContaMiner:API:upload', args=[token]))
+        self.assertJSONEqual(response.content, {
+            'error': False,
+            'id': token,
+            'filename': 'data.mtz',
+            'offset': 4,
+            'size': 10,
+            'complete': False,
+            })
+
+        response = self.put(token, b"456789", 4)
+        self.assertTrue(json.loads(response.content)['complete'])
+
+    def test_put_after_offset_gives_409(self):
+        token = self.start()
+        self.put(token, b"0123", 0)
+        response = self.put(token, b"6789", 6)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['offset'], 4)
+
+    def test_put_without_content_range_gives_400(self):
+        token = self.start()
+        response = self.client.put(
+            reverse('ContaMiner:API:upload', args=[token]),
+            b"0123",
+            content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_session_gives_404(self):
+        response = self.client.get(
+            reverse('ContaMiner:API:upload', args=['abc123']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_discards_session(self):
+        token = self.start()
+        response = self.client.delete(
+            reverse('ContaMiner:API:upload', args=[token]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_finalize_incomplete_upload_gives_409(self):
+        token = self.start()
+        self.put(token, b"0123", 0)
+        response = self.finalize(token)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['offset'], 4)
+
+    @mock.patch('contaminer.views_tools.start_job')
+    def test_finalize_starts_job(self, mock_start_job):
+        content = b"0123456789"
+        token = self.start(sha256=hashlib.sha256(content).hexdigest())
+        self.put(token, content[:5], 0)
+        self.put(token, content[5:], 5)
+        response = self.finalize(token, {
+            'contaminants': 'P0ACJ8,P0AA25',
+            'email_address': 'you@example.com'})
+
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        job = Job.objects.get(id=response_data['id'])
+        self.assertEqual(job.name, 'data.mtz')
+        self.assertEqual(job.email, 'you@example.com')
+        self.assertFalse(UploadSession.objects.exists())
+
+        args = mock_start_job.call_args[0]
+        self.assertEqual(args[0], job)
+        self.assertEqual(args[2], 'P0ACJ8\nP0AA25\n')
+        with open(args[1], 'rb') as data_file:
+            self.assertEqual(data_file.read(), content)
+        shutil.rmtree(os.path.dirname(args[1]))
+
+    @mock.patch('contaminer.views_tools.start_job')
+    def test_finalize_with_bad_sha256_restarts_upload(self, mock_start_job):
+        token = self.start(sha256=hashlib.sha256(b"other").hexdigest())
+        self.put(token, b"0123456789", 0)
+        response = self.finalize(token)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['offset'], 0)
+        self.assertEqual(UploadSession.objects.get(token=token).received, 0)
+        self.assertFalse(Job.objects.exists())
+        mock_start_job.assert_not_called()
@@ -0,0 +1,261 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for backends.py
+    ==============================
+
+    This module contains unitary tests for the selection of the backend, and
+    for the local backend, running a fake contaminer script in a temporary
+    directory.
+"""
+
+from django.test import TestCase
+
+import os
+import time
+import shutil
+import tempfile
+import mock
+
+from . import backends
+from .ssh_tools import AgentUnavailable
+
+FAKE_CONTAMINER = """#!/bin/bash
+case "$1" in
+    solve) sleep 0.2; echo "solved" > "$2.solved";;
+    job_status) echo "complete";;
+    display) echo "<contabase>"; echo "</contabase>";;
+    fail) echo "oops" >&2;;
+esac
+"""
+
+
+class GetBackendTestCase(TestCase):
+    """
+        Test the selection of the backend from the configuration
+    """
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    def test_default_is_ssh(self, mock_config):
+        mock_config.return_value.backend = 'ssh'
+        self.assertIsInstance(backends.get_backend(), backends.SSHBackend)
+
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    def test_local_backend(self, mock_config):
+        mock_config.return_value.backend = 'local'
+        self.assertIsInstance(backends.get_backend(), backends.LocalBackend)
+
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    @mock.patch('contaminer.backends.get_connection_pool')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_ssh_backend_uses_connection_pool(self, mock_ssh, mock_get_pool,
+            mock_config):
+        mock_config.return_value.pool_connections = 2
+        mock_get_pool.return_value.read_file.return_value = "content"
+        self.assertEqual(
+            backends.SSHBackend().read_file("/work/results.txt"),
+            "content")
+        mock_ssh.assert_not_called()
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_ssh_backend_runs_through_ssh(self, mock_ssh):
+        mock_ssh.return_value.exec_command_in_shell.return_value = "ok"
+        self.assertEqual(
+            backends.SSHBackend().launch("contaminer solve"),
+            "ok")
+        mock_ssh.return_value.exec_command_in_shell.assert_called_once_with(
+            "contaminer solve")
+
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_ssh_backend_launch_batch_gives_failed_commands(self, mock_ssh):
+        mock_ssh.return_value.exec_command_in_shell.return_value = \
+            "submitted\nbad file\nLaunch failed: 1\nsubmitted\n"
+        stdout, failed = backends.SSHBackend().launch_batch(
+            ["solve a", "solve b", "solve c"])
+        self.assertEqual(failed, set([1]))
+        self.assertIn("bad file", stdout)
+        mock_ssh.return_value.exec_command_in_shell.assert_called_once_with(
+            'solve a 2>&1 || echo "Launch failed: 0"; '
+            'solve b 2>&1 || echo "Launch failed: 1"; '
+            'solve c 2>&1 || echo "Launch failed: 2"')
+
+
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    @mock.patch('contaminer.backends.get_agent')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_ssh_backend_gives_contaminer_commands_to_agent(self, mock_ssh,
+            mock_get_agent, mock_config):
+        mock_config.return_value.agent_enabled = True
+        mock_config.return_value.pool_connections = 0
+        mock_get_agent.return_value.job_status.return_value = "running"
+        backend = backends.SSHBackend()
+        self.assertEqual(backend.job_status("/work/web_task_1"), "running")
+        backend.solve("/work", "web_task_1.mtz", "web_task_1.txt")
+        backend.cancel_tasks("/work/web_task_1", ["P0ACJ8_1_P-1-2-1"])
+        mock_get_agent.return_value.solve.assert_called_once_with(
+            "/work", "web_task_1.mtz", "web_task_1.txt")
+        mock_get_agent.return_value.cancel.assert_called_once_with(
+            "/work/web_task_1", ["P0ACJ8_1_P-1-2-1"])
+        mock_ssh.assert_not_called()
+
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    @mock.patch('contaminer.backends.get_agent')
+    @mock.patch('contaminer.backends.SSHChannel')
+    def test_ssh_backend_falls_back_on_shell_without_agent(self, mock_ssh,
+            mock_get_agent, mock_config):
+        mock_config.return_value.agent_enabled = True
+        mock_config.return_value.pool_connections = 0
+        mock_config.return_value.ssh_contaminer_location = "/CM"
+        mock_get_agent.return_value.cancel.side_effect = \
+            AgentUnavailable("Not started after a failure.")
+        backends.SSHBackend().cancel_tasks(
+            "/work/web_task_1",
+            ["P0ACJ8_1_P-1-2-1", "P0ACJ8_1_P-2-2-2"])
+        mock_ssh.return_value.exec_command_in_shell.assert_called_once_with(
+            '/CM/contaminer cancel /work/web_task_1 '
+            '"P0ACJ8_1_P-1-2-1" "P0ACJ8_1_P-2-2-2"')
+
+
+class LocalBackendTestCase(TestCase):
+    """
+        Test the local backend on a fake ContaMiner installation
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.work_directory = os.path.join(self.directory, "work")
+        os.mkdir(self.work_directory)
+        contaminer = os.path.join(self.directory, "contaminer")
+        with open(contaminer, 'w') as script:
+            script.write(FAKE_CONTAMINER)
+        os.chmod(contaminer, 0o755)
+
+        # The login shell does not read the profile of the user running the
+        # tests
+        patcher = mock.patch.dict(os.environ, {'HOME': self.directory})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('contaminer.clusters.apps.get_app_config')
+        mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_config.return_value.backend = 'local'
+        mock_config.return_value.local_workers = 2
+        mock_config.return_value.ssh_contaminer_location = self.directory
+        mock_config.return_value.ssh_work_directory = self.work_directory
+        self.backend = backends.LocalBackend()
+
+    def tearDown(self):
+        if backends.POOL is not None:
+            backends.POOL.shutdown()
+            backends.POOL = None
+        shutil.rmtree(self.directory)
+
+    def test_exec_command_returns_stdout(self):
+        stdout = self.backend.exec_command_in_shell(
+            os.path.join(self.directory, "contaminer") + " job_status")
+        self.assertEqual(stdout.strip(), b"complete")
+
+    def test_exec_command_raises_on_stderr(self):
+        with self.assertRaises(RuntimeError):
+            self.backend.exec_command_in_shell(
+                os.path.join(self.directory, "contaminer") + " fail")
+
+    def test_launch_does_not_wait(self):
+        command = 'cd "' + self.work_directory + '" && ' \
+            + os.path.join(self.directory, "contaminer") + " solve job"
+        self.backend.launch(command)
+        result = os.path.join(self.work_directory, "job.solved")
+        self.assertFalse(os.path.exists(result))
+        for _ in range(50):
+            if os.path.exists(result):
+                break
+            time.sleep(0.1)
+        self.assertTrue(os.path.exists(result))
+
+    def test_exec_command_does_not_wait_for_launched_jobs(self):
+        backends.POOL = None
+        with mock.patch('contaminer.clusters.apps.get_app_config') \
+                as mock_config:
+            mock_config.return_value.backend = 'local'
+            mock_config.return_value.local_workers = 1
+            command = 'cd "' + self.work_directory + '" && ' \
+                + os.path.join(self.directory, "contaminer") + " solve job"
+            self.backend.launch(command)
+            stdout = self.backend.exec_command_in_shell(
+                os.path.join(self.directory, "contaminer") + " job_status")
+        self.assertEqual(stdout.strip(), b"complete")
+        self.assertFalse(
+            os.path.exists(os.path.join(self.work_directory, "job.solved")))
+
+    def test_launch_batch_starts_each_command(self):
+        commands = [
+            'cd "' + self.work_directory + '" && ' \
+                + os.path.join(self.directory, "contaminer") + " solve " + name
+            for name in ["job1", "job2"]]
+        self.assertEqual(self.backend.launch_batch(commands), ("", set()))
+        for name in ["job1", "job2"]:
+            result = os.path.join(self.work_directory, name + ".solved")
+            for _ in range(50):
+                if os.path.exists(result):
+                    break
+                time.sleep(0.1)
+            self.assertTrue(os.path.exists(result))
+
+    def test_files_round_trip(self):
+        local_file = os.path.join(self.directory, "input.mtz")
+        with open(local_file, 'w') as input_file:
+            input_file.write("data")
+        self.backend.send_files(
+            [local_file],
+            self.work_directory,
+            [(os.path.join(self.work_directory, "input.txt"), "P1\n")])
+        self.assertEqual(
+            self.backend.read_file(
+                os.path.join(self.work_directory, "input.mtz")),
+            "data")
+        self.assertEqual(
+            self.backend.read_file(
+                os.path.join(self.work_directory, "input.txt")),
+            "P1\n")
+
+        downloaded = os.path.join(self.directory, "downloaded.txt")
+        self.backend.download_from_contaminer("input.txt", downloaded)
+        with open(downloaded, 'r') as downloaded_file:
+            self.assertEqual(downloaded_file.read(), "P1\n")
+
+    def test_read_missing_file_raises_runtime_error(self):
+        with self.assertRaises(RuntimeError):
+            self.backend.read_file(os.path.join(self.directory, "missing"))
+
+    def test_iter_contabase(self):
+        with mock.patch('contaminer.ssh_tools.apps.get_app_config') \
+                as mock_ssh_config:
+            mock_ssh_config.return_value.ssh_contaminer_location = \
+                self.directory
+            contabase = b"".join(self.backend.iter_contabase())
+        self.assertEqual(contabase, b"<contabase>\n</contabase>\n")
+
+    def test_get_pdb_headers(self):
+        pdb = os.path.join(self.directory, "final.pdb")
+        with open(pdb, 'w') as pdb_file:
+            pdb_file.write("REMARK   3   R VALUE            (WORKING SET) : "
+                           "0.2\nATOM      1  N   MET A   1\n")
+        headers = self.backend.get_pdb_headers([pdb])
+        self.assertEqual(
+            headers[pdb],
+            "REMARK   3   R VALUE            (WORKING SET) : 0.2\n")
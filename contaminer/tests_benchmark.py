@@ -0,0 +1,465 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Benchmarks of the API and page views
+    ====================================
+
+    This module measures the wall time, the number of queries and the peak
+    memory of every view, with a full ContaBase and a job with thousands of
+    tasks. The peak memory is measured with tracemalloc, so only on Python
+    3. The benchmarks are skipped unless CONTAMINER_BENCHMARK is set.
+
+    Environment variables:
+    CONTAMINER_BENCHMARK: run the benchmarks if set
+    CONTAMINER_BENCHMARK_OUTPUT: JSON file to write the results in
+    (default: contaminer_benchmark.json)
+    CONTAMINER_BENCHMARK_BASELINE: JSON file written by a previous run. A
+    view fails if it makes more queries than in the baseline, or if its time
+    or memory is higher than in the baseline by more than the threshold.
+    CONTAMINER_BENCHMARK_THRESHOLD: allowed relative increase of time and
+    memory (default: 0.25)
+    CONTAMINER_BENCHMARK_CATEGORIES, CONTAMINER_BENCHMARK_CONTAMINANTS,
+    CONTAMINER_BENCHMARK_PACKS, CONTAMINER_BENCHMARK_SPACE_GROUPS: size of
+    the generated data (contaminants per category, packs per contaminant,
+    space groups per pack)
+    CONTAMINER_BENCHMARK_REPEAT: number of requests per view (default: 3)
+"""
+
+from django.apps import apps
+from django.test import TestCase
+from django.test import Client
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+import mock
+
+from .models.contabase import ContaBase
+from .models.contabase import Category
+from .models.contabase import Contaminant
+from .models.contabase import Pack
+from .models.contabase import Model
+from .models.contabase import Reference
+from .models.contabase import Suggestion
+from .models.contaminer import Job
+from .models.contaminer import Task
+from .models.upload import UploadSession
+from . import metrics
+
+import collections
+import datetime
+import gc
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def get_setting(name, default):
+    """Return the environment variable CONTAMINER_BENCHMARK_name."""
+    return type(default)(
+        os.environ.get('CONTAMINER_BENCHMARK_' + name, default))
+
+
+SIZES = {
+    'categories': get_setting('CATEGORIES', 10),
+    'contaminants': get_setting('CONTAMINANTS', 20),
+    'packs': get_setting('PACKS', 5),
+    'space_groups': get_setting('SPACE_GROUPS', 2),
+    }
+REPEAT = get_setting('REPEAT', 3)
+THRESHOLD = get_setting('THRESHOLD', 0.25)
+# Absolute margins, to ignore the noise of the fast views
+TIME_MARGIN = 0.01
+MEMORY_MARGIN = 1024 * 1024
+OUTPUT = get_setting('OUTPUT', "contaminer_benchmark.json")
+BASELINE = get_setting('BASELINE', "")
+
+
+def measure(function):
+    """
+    Call function REPEAT times.
+
+    :returns: (result, measures) with the result of the last call, and a
+    dictionary giving the best wall time in seconds, the number of queries
+    and the peak memory in bytes. Without tracemalloc (Python 2), the memory
+    is not measured: the maximum resident set size of the process does not
+    give the memory of one call.
+    """
+    times = []
+    for _ in range(REPEAT):
+        gc.collect()
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+
+    # The query log is limited to 9000 queries
+    queries_log = connection.queries_log
+    connection.queries_log = collections.deque()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            function()
+        # The log is emptied by the next request
+        nb_queries = len(queries)
+    finally:
+        connection.queries_log = queries_log
+
+    measures = {
+        'time': min(times),
+        'queries': nb_queries,
+        }
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        function()
+        measures['memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (result, measures)
+
+
+@unittest.skipUnless(
+    os.environ.get('CONTAMINER_BENCHMARK'),
+    "Set CONTAMINER_BENCHMARK to run the benchmarks")
+class ViewsBenchmarkTestCase(TestCase):
+    """
+        Measure every view of urls.py and urls_api.py
+    """
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        contabase = ContaBase.objects.create()
+        Category.objects.bulk_create([
+            Category(
+                contabase=contabase,
+                number=category_number,
+                name="Category " + str(category_number),
+                selected_by_default=(category_number == 1),
+                )
+            for category_number in range(1, SIZES['categories'] + 1)])
+        Category.objects.create(
+            contabase=contabase,
+            number=SIZES['categories'] + 1,
+            name="User provided models",
+            )
+
+        contaminants = []
+        for category in Category.objects.filter(contabase=contabase):
+            contaminants += [
+                Contaminant(
+                    uniprot_id="P" + str(category.number) + "C" \
+                        + str(contaminant_number),
+                    category=category,
+                    short_name="CONT_" + str(contaminant_number),
+                    long_name="Benchmark contaminant",
+                    sequence="ABCDEFGHIJKLMNOPQRSTUVWXYZ" * 10,
+                    organism="Escherichia coli",
+                    )
+                for contaminant_number \
+                    in range(1, SIZES['contaminants'] + 1)]
+        Contaminant.objects.bulk_create(contaminants)
+        contaminants = list(Contaminant.objects.all())
+
+        Pack.objects.bulk_create([
+            Pack(
+                contaminant=contaminant,
+                number=pack_number,
+                structure="2-mer",
+                )
+            for contaminant in contaminants
+            for pack_number in range(1, SIZES['packs'] + 1)])
+        packs = list(Pack.objects.all())
+
+        Model.objects.bulk_create([
+            Model(
+                pdb_code="1ABC",
+                chain=chain,
+                domain=None,
+                nb_residues=130,
+                identity=98,
+                pack=pack,
+                )
+            for pack in packs
+            for chain in ["A", "B"]])
+        Reference.objects.bulk_create([
+            Reference(pubmed_id=1000, contaminant=contaminant)
+            for contaminant in contaminants])
+        Suggestion.objects.bulk_create([
+            Suggestion(name="Benchmark", contaminant=contaminant)
+            for contaminant in contaminants])
+
+        cls.job = Job.objects.create(
+            name="benchmark",
+            email="me@example.com",
+            status_submitted=True,
+            status_running=True,
+            )
+        space_groups = ["P-1-2-" + str(number)
+                        for number in range(1, SIZES['space_groups'] + 1)]
+        Task.objects.bulk_create([
+            Task(
+                job=cls.job,
+                pack=pack,
+                space_group=space_group,
+                status_complete=True,
+                percent=(99 if pack.number == 1 else 20),
+                q_factor=0.5,
+                r_free=0.25,
+                exec_time=datetime.timedelta(minutes=10),
+                )
+            for pack in packs
+            for space_group in space_groups])
+
+        cls.contaminant = contaminants[0]
+        cls.task = Task.objects.get(
+            job=cls.job,
+            pack__contaminant=cls.contaminant,
+            pack__number=1,
+            space_group=space_groups[0])
+
+    def setUp(self):
+        self.client = Client()
+        self.media_root = tempfile.mkdtemp()
+        for suffix in ["pdb", "mtz", "map", "diff.map"]:
+            final_file = os.path.join(
+                self.media_root,
+                self.task.get_final_filename(suffix=suffix))
+            try:
+                os.makedirs(os.path.dirname(final_file))
+            except OSError:
+                pass
+            with open(final_file, 'w') as local_file:
+                local_file.write("0" * 1024 * 1024)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    @classmethod
+    def tearDownClass(cls):
+        with open(OUTPUT, 'w') as output_file:
+            json.dump(
+                {'sizes': SIZES, 'tasks': Task.objects.count(),
+                 'views': cls.results},
+                output_file,
+                indent=4,
+                sort_keys=True)
+        super(ViewsBenchmarkTestCase, cls).tearDownClass()
+
+    def check_view(self, name, function, status_code=200):
+        """Measure the view, record the result and compare to the baseline."""
+        response, measures = measure(function)
+        self.assertEqual(response.status_code, status_code)
+        ViewsBenchmarkTestCase.results[name] = measures
+
+        if not BASELINE:
+            return
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.assertEqual(
+            baseline['sizes'], SIZES,
+            "The baseline has been measured with different data sizes")
+        if name not in baseline['views']:
+            return
+        reference = baseline['views'][name]
+        self.assertLessEqual(
+            measures['queries'], reference['queries'],
+            name + ": number of queries increased")
+        self.assertLessEqual(
+            measures['time'],
+            reference['time'] * (1 + THRESHOLD) + TIME_MARGIN,
+            name + ": time increased")
+        if 'memory' in measures and 'memory' in reference:
+            self.assertLessEqual(
+                measures['memory'],
+                reference['memory'] * (1 + THRESHOLD) + MEMORY_MARGIN,
+                name + ": memory increased")
+
+    def settings_upload(self):
+        """Return a context writing the uploaded files in MEDIA_ROOT."""
+        return mock.patch.object(
+            apps.get_app_config('contaminer'),
+            'tmp_dir',
+            self.media_root)
+
+    def get_view(self, name, args=None, data=None, status_code=200):
+        """Measure a GET request on the view with the given URL name."""
+        url = reverse(name, args=args)
+        self.check_view(
+            name,
+            lambda: self.client.get(url, data),
+            status_code)
+
+    def test_api_contabase(self):
+        self.get_view('ContaMiner:API:contabase')
+
+    def test_api_categories(self):
+        self.get_view('ContaMiner:API:categories')
+
+    def test_api_detailed_categories(self):
+        self.get_view('ContaMiner:API:detailed_categories')
+
+    def test_api_category(self):
+        self.get_view('ContaMiner:API:category', args=[1])
+
+    def test_api_detailed_category(self):
+        self.get_view('ContaMiner:API:detailed_category', args=[1])
+
+    def test_api_contaminants(self):
+        self.get_view('ContaMiner:API:contaminants')
+
+    def test_api_detailed_contaminants(self):
+        self.get_view('ContaMiner:API:detailed_contaminants')
+
+    def test_api_contaminant(self):
+        self.get_view(
+            'ContaMiner:API:contaminant',
+            args=[self.contaminant.uniprot_id])
+
+    def test_api_detailed_contaminant(self):
+        self.get_view(
+            'ContaMiner:API:detailed_contaminant',
+            args=[self.contaminant.uniprot_id])
+
+    @mock.patch('contaminer.views_tools.threading.Thread')
+    def test_api_job(self, _):
+        url = reverse('ContaMiner:API:job')
+        def post_job():
+            return self.client.post(url, {
+                'diffraction_data': SimpleUploadedFile(
+                    "data.mtz", "0" * 1024 * 1024),
+                'contaminants': self.contaminant.uniprot_id,
+                'email_address': "me@example.com",
+                })
+        self.check_view('ContaMiner:API:job', post_job)
+
+    @mock.patch('contaminer.views_tools.threading.Thread')
+    def test_api_jobs(self, _):
+        url = reverse('ContaMiner:API:jobs')
+        def post_jobs():
+            return self.client.post(url, {
+                'diffraction_data': [
+                    SimpleUploadedFile(
+                        "data" + str(index) + ".mtz",
+                        "0" * 1024 * 1024)
+                    for index in range(10)],
+                'contaminants': self.contaminant.uniprot_id,
+                'email_address': "me@example.com",
+                })
+        self.check_view('ContaMiner:API:jobs', post_jobs)
+
+    def test_api_uploads(self):
+        url = reverse('ContaMiner:API:uploads')
+        with self.settings_upload():
+            self.check_view(
+                'ContaMiner:API:uploads',
+                lambda: self.client.post(url, {
+                    'filename': "data.mtz",
+                    'size': 1024 * 1024}))
+
+    def test_api_upload_put(self):
+        with self.settings_upload():
+            session = UploadSession.start("data.mtz", 1024 * 1024)
+            url = reverse('ContaMiner:API:upload', args=[session.token])
+            self.check_view(
+                'ContaMiner:API:upload:PUT',
+                lambda: self.client.put(
+                    url,
+                    b"0" * 1024 * 1024,
+                    content_type='application/octet-stream',
+                    HTTP_CONTENT_RANGE='bytes 0-1048575/1048576'))
+
+    def test_api_upload_get(self):
+        with self.settings_upload():
+            session = UploadSession.start("data.mtz", 1024 * 1024)
+            self.get_view('ContaMiner:API:upload', args=[session.token])
+
+    def test_api_job_status(self):
+        self.get_view('ContaMiner:API:job_status', args=[self.job.id])
+
+    def test_api_jobs_status(self):
+        self.get_view(
+            'ContaMiner:API:jobs_status',
+            data={'ids': str(self.job.id), 'results': 'true'})
+
+    def test_api_result(self):
+        self.get_view('ContaMiner:API:result', args=[self.job.id])
+
+    def test_api_detailed_result(self):
+        self.get_view('ContaMiner:API:detailed_result', args=[self.job.id])
+
+    def test_api_get_final(self):
+        self.get_view(
+            'ContaMiner:API:get_final',
+            args=['pdb'],
+            data={
+                'id': self.job.id,
+                'uniprot_id': self.contaminant.uniprot_id,
+                'space_group': self.task.space_group,
+                'pack_nb': 1,
+                })
+
+    def test_api_404(self):
+        self.check_view(
+            'ContaMiner:API:404',
+            lambda: self.client.get(reverse('ContaMiner:API:job') + "/none"),
+            status_code=404)
+
+    def test_contabase_json(self):
+        self.get_view('ContaMiner:contabase.json')
+
+    def test_contabase(self):
+        self.get_view('ContaMiner:contabase')
+
+    def test_submit(self):
+        self.get_view('ContaMiner:submit')
+
+    def test_display(self):
+        self.get_view('ContaMiner:display', args=[self.job.id])
+
+    def test_download(self):
+        self.get_view('ContaMiner:download')
+
+    def test_uglymol(self):
+        self.get_view(
+            'ContaMiner:uglymol',
+            args=[self.job.id, self.task.name()])
+
+    def test_metrics(self):
+        metrics.enable()
+        self.addCleanup(metrics.enable, False)
+        self.addCleanup(metrics.reset)
+        self.client.get(reverse('ContaMiner:API:categories'))
+        self.get_view('ContaMiner:metrics')
+
+    def test_task_file(self):
+        self.get_view(
+            'ContaMiner:task_file',
+            args=[self.job.id, self.task.name(), 'pdb'])
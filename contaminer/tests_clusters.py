@@ -0,0 +1,101 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for clusters.py
+    ==============================
+
+    This module contains unitary tests for the configuration of several
+    clusters.
+"""
+
+from django.test import TestCase
+
+import io
+import ConfigParser
+import mock
+
+from . import clusters
+
+CONFIG = u"""
+[CLUSTER:second]
+hostname = second.example.com
+work_directory = /scratch/contaminer
+slots = 50
+agent = true
+
+[LOCAL]
+tmp_dir = /tmp
+"""
+
+
+class ReadClustersTestCase(TestCase):
+    """
+        Test the reading of the [CLUSTER:<name>] sections
+    """
+    def setUp(self):
+        self.config = ConfigParser.ConfigParser()
+        self.config.readfp(io.StringIO(CONFIG))
+        self.default = mock.MagicMock()
+        self.default.ssh_hostname = "cluster.example.com"
+        self.default.ssh_port = 22
+        self.default.ssh_username = "you"
+        self.default.ssh_contaminer_location = "/opt/ContaMiner"
+        self.default.ssh_work_directory = "/data/contaminer"
+        self.default.slots = 100
+        self.default.agent_enabled = False
+        self.default.backend = "ssh"
+        self.default.local_workers = 2
+        self.default.max_jobs = 0
+        self.default.max_tasks = 0
+
+    def test_read_clusters_gives_other_clusters(self):
+        result = clusters.read_clusters(self.config, self.default)
+        self.assertEqual(list(result), ["second"])
+
+    def test_cluster_options(self):
+        second = clusters.read_clusters(self.config, self.default)["second"]
+        self.assertEqual(second.cluster_name, "second")
+        self.assertEqual(second.ssh_hostname, "second.example.com")
+        self.assertEqual(second.ssh_work_directory, "/scratch/contaminer")
+        self.assertEqual(second.slots, 50)
+        self.assertTrue(second.agent_enabled)
+
+    def test_missing_options_are_default_ones(self):
+        second = clusters.read_clusters(self.config, self.default)["second"]
+        self.assertEqual(second.ssh_port, 22)
+        self.assertEqual(second.ssh_username, "you")
+        self.assertEqual(second.ssh_contaminer_location, "/opt/ContaMiner")
+        self.assertEqual(second.backend, "ssh")
+
+    @mock.patch('contaminer.clusters.apps.get_app_config')
+    def test_get_cluster(self, mock_CMConfig):
+        mock_CMConfig.return_value.clusters = \
+            clusters.read_clusters(self.config, self.default)
+        self.assertIs(clusters.get_cluster(), mock_CMConfig.return_value)
+        self.assertIs(
+            clusters.get_cluster("default"),
+            mock_CMConfig.return_value)
+        self.assertEqual(
+            clusters.get_cluster("second").ssh_hostname,
+            "second.example.com")
+        with self.assertRaises(RuntimeError):
+            clusters.get_cluster("third")
+        self.assertEqual(
+            clusters.get_cluster_names(),
+            ["default", "second"])
@@ -0,0 +1,292 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for fake_cluster.py
+    ==================================
+
+    This module runs the communication with the cluster end to end, through
+    a real SSH connection to the fake cluster.
+"""
+
+from django.test import TestCase
+from django.test import override_settings
+from django.apps import apps
+import mock
+
+import os
+import shutil
+import tempfile
+import time
+
+from .fake_cluster import FakeCluster
+from .ssh_tools import SSHChannel
+from . import ssh_tools
+from .models.contabase import ContaBase
+from .models.contabase import Contaminant
+from .models.contaminer import Job
+from .models.contaminer import Task
+
+
+class FakeClusterTestCase(TestCase):
+    """
+        Test the pipelines against the fake cluster
+    """
+    def setUp(self):
+        self.now = 1000.0
+        self.cluster = FakeCluster(
+            task_duration=10,
+            slots=2,
+            file_size=4096,
+            positive_ratio=0.5,
+            size=(1, 2, 1),
+            clock=lambda: self.now)
+        self.cluster.start()
+        self.config_patch = mock.patch.multiple(
+            apps.get_app_config('contaminer'),
+            **self.cluster.get_ssh_config())
+        self.config_patch.start()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        self.config_patch.stop()
+        self.cluster.stop()
+
+    def submit_job(self):
+        ContaBase.update()
+        job = Job.create(name="test", email="me@example.com")
+        input_file = os.path.join(self.media_root, "input.mtz")
+        with open(input_file, 'w') as mtz_file:
+            mtz_file.write("0" * 1024)
+        contaminants = "\n".join(
+            [contaminant.uniprot_id
+             for contaminant in Contaminant.objects.all()])
+        job.submit(input_file, contaminants)
+        return job
+
+    def test_exec_command_gives_unknown_command_error(self):
+        with self.assertRaises(RuntimeError):
+            SSHChannel().exec_command("rm -rf /")
+
+    def test_exec_command_stream_yields_chunks(self):
+        content = "".join([str(index) + "\n" for index in range(20000)])
+        with open(self.cluster.local_path("/data/contaminer/big.txt"), 'w') \
+                as big_file:
+            big_file.write(content)
+        chunks = list(SSHChannel().exec_command_stream(
+            "cat /data/contaminer/big.txt"))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual("".join(chunks), content)
+        lines = list(SSHChannel().exec_command_lines(
+            "cat /data/contaminer/big.txt"))
+        self.assertEqual(lines, [str(index) for index in range(20000)])
+
+    def test_exec_command_stream_raises_stderr_at_end(self):
+        with self.assertRaises(RuntimeError):
+            list(SSHChannel().exec_command_stream("rm -rf /"))
+
+    def test_update_contabase(self):
+        ContaBase.update()
+        self.assertEqual(Contaminant.objects.count(), 2)
+        self.assertEqual(
+            Contaminant.objects.get(uniprot_id="F1C1").pack_set.count(),
+            1)
+
+    def test_submit_writes_files_on_cluster(self):
+        job = self.submit_job()
+        self.assertTrue(job.status_submitted)
+        remote_directory = os.path.join(
+            self.cluster.work_directory,
+            job.get_filename())
+        self.assertTrue(os.path.isfile(self.cluster.local_path(
+            os.path.join(self.cluster.work_directory, "input.mtz"))))
+        self.assertEqual(
+            self.cluster.get_job_status(remote_directory),
+            "running\n")
+
+    def test_submit_batch_launches_all_jobs(self):
+        ContaBase.update()
+        submissions = []
+        for index in range(3):
+            job = Job.create(name="test", email="me@example.com")
+            input_file = os.path.join(
+                self.media_root,
+                job.get_filename(suffix=".mtz"))
+            with open(input_file, 'w') as mtz_file:
+                mtz_file.write("0" * 1024)
+            submissions.append((job, input_file, "F1C1\n"))
+        Job.submit_batch(submissions)
+        for job, _, _ in submissions:
+            self.assertTrue(Job.objects.get(id=job.id).status_submitted)
+            self.assertEqual(
+                self.cluster.get_job_status(os.path.join(
+                    self.cluster.work_directory,
+                    job.get_filename())),
+                "running\n")
+
+    def test_submit_batch_puts_failed_launch_in_error(self):
+        ContaBase.update()
+        submissions = []
+        for index in range(3):
+            job = Job.create(name="test", email="me@example.com")
+            input_file = os.path.join(
+                self.media_root,
+                job.get_filename(suffix=".mtz"))
+            with open(input_file, 'w') as mtz_file:
+                mtz_file.write("0" * 1024)
+            submissions.append((job, input_file, "F1C1\n"))
+        failing = submissions[1][0].get_filename()
+        solve = self.cluster.solve
+
+        def failing_solve(input_path, contaminants_path):
+            if failing in input_path:
+                raise IOError("No such file: " + input_path)
+            return solve(input_path, contaminants_path)
+
+        with mock.patch.object(self.cluster, 'solve',
+                               side_effect=failing_solve):
+            Job.submit_batch(submissions)
+        statuses = [
+            (Job.objects.get(id=job.id).status_submitted,
+             Job.objects.get(id=job.id).status_error)
+            for job, _, _ in submissions]
+        self.assertEqual(
+            statuses,
+            [(True, False), (False, True), (True, False)])
+
+    def test_update_follows_results(self):
+        job = self.submit_job()
+
+        job.update()
+        job = Job.objects.get(id=job.id)
+        self.assertTrue(job.status_running)
+        self.assertEqual(Task.objects.filter(job=job).count(), 4)
+        self.assertFalse(
+            Task.objects.filter(job=job, status_complete=True).exists())
+
+        self.now += 100
+        job.update()
+        job = Job.objects.get(id=job.id)
+        self.assertTrue(job.status_complete)
+        self.assertEqual(
+            Task.objects.filter(job=job, status_complete=True).count(),
+            4)
+        for task in Task.objects.filter(job=job, percent=99):
+            self.assertEqual(task.r_free, 0.25)
+
+    def test_update_all_skips_unchanged_jobs(self):
+        job = self.submit_job()
+        with mock.patch.object(Job, 'update_tasks', autospec=True,
+                               side_effect=Job.update_tasks) as mock_update:
+            Job.update_all()
+            self.assertEqual(mock_update.call_count, 1)
+            Job.update_all()
+            self.assertEqual(mock_update.call_count, 1)
+
+            self.now += 100
+            Job.update_all()
+            self.assertEqual(mock_update.call_count, 2)
+        self.assertTrue(Job.objects.get(id=job.id).status_complete)
+
+    def test_early_stop_cancels_tasks_of_found_contaminant(self):
+        self.cluster.slots = 1
+        self.cluster.positive_ratio = 1
+        job = self.submit_job()
+        self.now += 15
+        with mock.patch.object(
+                apps.get_app_config('contaminer'), 'early_stop', True):
+            job.update()
+            job.update()
+        statuses = dict([
+            (task.name(), task.get_status())
+            for task in Task.objects.filter(job=job)])
+        self.assertEqual(statuses["F1C1_1_P-1-2-1"], "Complete")
+        self.assertEqual(statuses["F1C1_1_P-1-21-1"], "Cancelled")
+        self.assertEqual(statuses["F1C2_1_P-1-2-1"], "New")
+        self.assertIn('saved_time', job.to_simple_dict())
+
+    def test_get_final_files_downloads_files(self):
+        self.cluster.positive_ratio = 1
+        job = self.submit_job()
+        self.now += 100
+        job.update()
+        task = Task.objects.filter(job=job, percent=99)[0]
+        local_pdb = task.get_local_final_file('pdb')
+        self.assertTrue(os.path.isfile(local_pdb))
+        self.assertTrue(os.path.isfile(
+            task.get_local_final_file('small.map')))
+
+    def test_agent_keeps_one_channel(self):
+        with mock.patch.object(
+                apps.get_app_config('contaminer'), 'agent_enabled', True):
+            job = self.submit_job()
+            nb_channels = self.cluster.nb_channels
+            self.now += 100
+            job.update()
+            job.update()
+            self.assertEqual(self.cluster.nb_channels, nb_channels)
+            with self.assertRaises(RuntimeError):
+                SSHChannel().read_file("/data/contaminer/missing.txt")
+            ssh_tools.AGENT.stop()
+        self.assertTrue(Job.objects.get(id=job.id).status_complete)
+        self.assertTrue(os.path.isfile(self.cluster.local_path(
+            os.path.join(self.cluster.work_directory,
+                         ssh_tools.AGENT_FILENAME))))
+
+    def test_agent_runs_contaminer_operations_of_pool(self):
+        operations = []
+        answer_agent = self.cluster.answer_agent
+        def record(request):
+            operations.append(request.get('op'))
+            return answer_agent(request)
+        with mock.patch.multiple(
+                apps.get_app_config('contaminer'),
+                agent_enabled=True,
+                pool_connections=2), \
+                mock.patch.object(self.cluster, 'answer_agent', record):
+            job = self.submit_job()
+            self.now += 100
+            job.update()
+            ssh_tools.AGENT.stop()
+            ssh_tools.get_connection_pool().close()
+        self.assertIn('solve', operations)
+        self.assertIn('status', operations)
+        self.assertTrue(Job.objects.get(id=job.id).status_complete)
+
+    @mock.patch('contaminer.ssh_tools.RemoteAgent.start')
+    def test_agent_falls_back_on_new_shell(self, mock_start):
+        mock_start.side_effect = IOError("python: command not found")
+        with mock.patch.object(
+                apps.get_app_config('contaminer'), 'agent_enabled', True):
+            job = self.submit_job()
+            self.assertTrue(job.status_submitted)
+            self.now += 100
+            job.update()
+        self.assertEqual(mock_start.call_count, 1)
+        self.assertTrue(Job.objects.get(id=job.id).status_complete)
+        ssh_tools.AGENT.failure_time = None
+
+    def test_latency_slows_down_commands(self):
+        self.cluster.latency = 0.2
+        start = time.time()
+        SSHChannel().exec_command("sh /opt/ContaMiner/contaminer display")
+        self.assertGreaterEqual(time.time() - start, 0.2)
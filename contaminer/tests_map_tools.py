@@ -0,0 +1,132 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for map_tools.py
+    ===============================
+
+    This module contains unitary tests for the CCP4 maps management.
+"""
+
+from django.test import TestCase
+
+import gzip
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .map_tools import CCP4Map
+from .map_tools import make_small_map
+from .map_tools import gzip_file
+
+
+def write_map(map_filename, data, cell, mode=2):
+    """Write a full cell CCP4 map with data indexed by (z, y, x)."""
+    int_header = np.zeros(256, dtype='<i4')
+    float_header = int_header.view('<f4')
+    n_sec, n_row, n_col = data.shape
+    int_header[0:3] = [n_col, n_row, n_sec]
+    int_header[3] = mode
+    int_header[7:10] = [n_col, n_row, n_sec]
+    float_header[10:16] = cell
+    int_header[16:19] = [1, 2, 3]
+    int_header[52] = 0x2050414d # 'MAP '
+    with open(map_filename, 'wb') as map_file:
+        map_file.write(int_header.tobytes())
+        map_file.write(data.astype('<f4').tobytes())
+
+
+class CCP4MapTestCase(TestCase):
+    """
+        Test the CCP4Map class
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.map_filename = os.path.join(self.directory, "final.map")
+        self.data = np.arange(20 * 20 * 20, dtype=float).reshape((20, 20, 20))
+        write_map(self.map_filename, self.data, [40, 40, 40, 90, 90, 90])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_gives_data_and_cell(self):
+        ccp4_map = CCP4Map(self.map_filename)
+        self.assertEqual(ccp4_map.data.shape, (20, 20, 20))
+        self.assertEqual(ccp4_map.data[1, 2, 3], self.data[1, 2, 3])
+        self.assertEqual(ccp4_map.cell, [40, 40, 40, 90, 90, 90])
+        self.assertEqual(ccp4_map.sampling, [20, 20, 20])
+
+    def test_read_raises_on_unsupported_mode(self):
+        write_map(self.map_filename, self.data, [40, 40, 40, 90, 90, 90],
+            mode=0)
+        with self.assertRaises(ValueError):
+            CCP4Map(self.map_filename)
+
+    def test_to_fractional_on_orthogonal_cell(self):
+        ccp4_map = CCP4Map(self.map_filename)
+        fractional = ccp4_map.to_fractional([(10, 20, 30)])
+        np.testing.assert_allclose(fractional, [[0.25, 0.5, 0.75]])
+
+    def test_crop_keeps_region_around_model(self):
+        ccp4_map = CCP4Map(self.map_filename)
+        # Grid point (x=5, y=6, z=7), margin of 1 grid point
+        ccp4_map.crop([(10, 12, 14)], margin=2)
+        self.assertEqual(ccp4_map.data.shape, (3, 3, 3))
+        self.assertEqual(ccp4_map.get_data_start(), [6, 5, 4])
+        self.assertEqual(ccp4_map.data[1, 1, 1], self.data[7, 6, 5])
+
+    def test_crop_wraps_around_cell_edges(self):
+        ccp4_map = CCP4Map(self.map_filename)
+        ccp4_map.crop([(0, 0, 0)], margin=2)
+        self.assertEqual(ccp4_map.get_data_start(), [-1, -1, -1])
+        self.assertEqual(ccp4_map.data[0, 0, 0], self.data[19, 19, 19])
+
+    def test_downsample_halves_grid(self):
+        ccp4_map = CCP4Map(self.map_filename)
+        self.assertTrue(ccp4_map.downsample())
+        self.assertEqual(ccp4_map.data.shape, (10, 10, 10))
+        self.assertEqual(ccp4_map.sampling, [10, 10, 10])
+
+    def test_downsample_keeps_odd_grid(self):
+        write_map(self.map_filename, np.zeros((5, 5, 5)),
+            [40, 40, 40, 90, 90, 90])
+        ccp4_map = CCP4Map(self.map_filename)
+        self.assertFalse(ccp4_map.downsample())
+        self.assertEqual(ccp4_map.data.shape, (5, 5, 5))
+
+    def test_write_gives_readable_map(self):
+        small_filename = os.path.join(self.directory, "small.map")
+        make_small_map(self.map_filename, [(10, 12, 14)], small_filename)
+        small_map = CCP4Map(small_filename)
+        self.assertEqual(small_map.sampling, [10, 10, 10])
+        # Grid points 4 to 10 (z), 3 to 9 (y) and 2 to 8 (x), every 2 points
+        self.assertEqual(small_map.data.shape, (4, 3, 4))
+        self.assertEqual(small_map.get_data_start(), [2, 2, 1])
+        self.assertAlmostEqual(
+            float(small_map.float_header[20]),
+            float(small_map.data.max()))
+
+    def test_gzip_file_gives_same_content(self):
+        gzip_filename = gzip_file(self.map_filename)
+        gzip_file_obj = gzip.open(gzip_filename, 'rb')
+        content = gzip_file_obj.read()
+        gzip_file_obj.close()
+        with open(self.map_filename, 'rb') as map_file:
+            self.assertEqual(content, map_file.read())
@@ -0,0 +1,205 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for metrics.py
+    =============================
+
+    This module contains unitary tests for the counters and timers, and for
+    their export.
+"""
+
+from django.test import TestCase
+from django.test import Client
+from django.urls import reverse
+import mock
+
+import os
+import shutil
+import tempfile
+
+from . import metrics
+from .ssh_tools import SSHChannel
+from .models.contaminer import Job
+from .models.contabase import ContaBase
+from .models.contabase import Category
+from .models.contabase import Contaminant
+from .models.contabase import Pack
+
+
+class MetricsTestCase(TestCase):
+    """
+        Test the counters, histograms and their rendering
+    """
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+        self.counter = metrics.Counter("test_total", "Test counter.")
+        self.histogram = metrics.Histogram(
+            "test_seconds",
+            "Test histogram.",
+            buckets=(0.1, 1))
+
+    def tearDown(self):
+        metrics.REGISTRY.remove(self.counter)
+        metrics.REGISTRY.remove(self.histogram)
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics.enable(False)
+        self.counter.inc()
+        self.histogram.observe(0.5)
+        with self.histogram.time():
+            pass
+        self.assertEqual(self.counter.get(), 0)
+        self.assertEqual(self.histogram.get_count(), 0)
+
+    def test_counter_adds_by_labels(self):
+        self.counter.inc(direction='get')
+        self.counter.inc(10, direction='get')
+        self.counter.inc(direction='put')
+        self.assertEqual(self.counter.get(direction='get'), 11)
+        self.assertEqual(self.counter.get(direction='put'), 1)
+
+    def test_timed_observes_each_call(self):
+        @self.histogram.timed
+        def function(value):
+            return value * 2
+        self.assertEqual(function(2), 4)
+        self.assertEqual(function(3), 6)
+        self.assertEqual(self.histogram.get_count(), 2)
+
+    def test_timer_observes_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.histogram.time(view="JobView"):
+                raise ValueError
+        self.assertEqual(self.histogram.get_count(view="JobView"), 1)
+
+    def test_render_gives_prometheus_text(self):
+        self.counter.inc(3, direction='get')
+        self.histogram.observe(0.05)
+        self.histogram.observe(0.5)
+        self.histogram.observe(5)
+        lines = metrics.render().split("\n")
+        self.assertIn("# TYPE test_total counter", lines)
+        self.assertIn('test_total{direction="get"} 3.0', lines)
+        self.assertIn("# TYPE test_seconds histogram", lines)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum 5.55', lines)
+        self.assertIn('test_seconds_count 3', lines)
+
+    def test_write_command_metrics_writes_prom_file(self):
+        directory = tempfile.mkdtemp()
+        self.counter.inc()
+        with mock.patch('django.apps.apps.get_app_config') as mock_config:
+            mock_config.return_value.metrics_directory = directory
+            metrics.write_command_metrics("update_jobs")
+        filename = os.path.join(directory, "contaminer_update_jobs.prom")
+        with open(filename) as prom_file:
+            self.assertIn("test_total 1.0", prom_file.read())
+        self.assertEqual(os.listdir(directory), ["contaminer_update_jobs.prom"])
+        shutil.rmtree(directory)
+
+    @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.exec_command')
+    @mock.patch('contaminer.ssh_tools.SSHChannel.__exit__')
+    @mock.patch('contaminer.ssh_tools.SSHChannel.__enter__')
+    def test_exec_command_is_timed(self, mock_enter, mock_exit, mock_exec):
+        mock_enter.return_value = SSHChannel()
+        mock_exit.return_value = False
+        stdout = mock.MagicMock()
+        stdout.read.return_value = "out"
+        stderr = mock.MagicMock()
+        stderr.read.return_value = "error"
+        mock_exec.return_value = (None, stdout, stderr)
+        with self.assertRaises(RuntimeError):
+            SSHChannel().exec_command("ls")
+        self.assertEqual(metrics.SSH_COMMAND.get_count(), 1)
+        self.assertEqual(metrics.SSH_COMMAND_ERRORS.get(), 1)
+
+
+    @mock.patch('contaminer.models.contaminer.get_backend')
+    def test_update_tasks_is_timed(self, mock_backend):
+        mock_backend.return_value.read_file.return_value = ""
+        job = Job.create(name="test", email="me@example.com")
+        job.status_submitted = True
+        job.get_results_path()
+        self.assertEqual(metrics.JOB_UPDATE_TASKS.get_count(), 0)
+        job.update_tasks()
+        self.assertEqual(metrics.JOB_UPDATE_TASKS.get_count(), 1)
+
+    @mock.patch('contaminer.models.contaminer.get_backend')
+    def test_task_update_is_timed_for_each_line(self, mock_backend):
+        category = Category.objects.create(
+            contabase=ContaBase.objects.create(),
+            number=1,
+            name="Test category")
+        contaminant = Contaminant.objects.create(
+            category=category,
+            uniprot_id="P0ACJ8",
+            short_name="CRP_ECOLI",
+            long_name="regulator",
+            sequence="ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            organism="Mario")
+        for number in [1, 2]:
+            Pack.objects.create(
+                contaminant=contaminant,
+                number=number,
+                structure="1-mer")
+        mock_backend.return_value.read_file.return_value = \
+            "P0ACJ8,1,P-1-2-1,running,0,0,0h 1m 0s\n" \
+            + "P0ACJ8,2,P-1-2-1,new,0,0,0h 0m 0s\n"
+        job = Job.create(name="test", email="me@example.com")
+        job.status_submitted = True
+        job.update_tasks()
+        self.assertEqual(metrics.TASK_UPDATE.get_count(), 2)
+
+
+    @mock.patch('contaminer.models.contaminer.Job.update_status')
+    @mock.patch('contaminer.models.contaminer.Job.update_tasks')
+    def test_job_update_is_timed(self, mock_tasks, mock_status):
+        job = Job.create(name="test", email="me@example.com")
+        job.get_remaining_time()
+        self.assertEqual(metrics.JOB_UPDATE.get_count(), 0)
+        job.update()
+        self.assertEqual(metrics.JOB_UPDATE.get_count(), 1)
+
+
+class MetricsViewTestCase(TestCase):
+    """
+        Test the metrics endpoint
+    """
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_get_gives_404_when_disabled(self):
+        response = Client().get(reverse('ContaMiner:metrics'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_gives_view_timings(self):
+        metrics.enable()
+        Client().get(reverse('ContaMiner:API:categories'))
+        response = Client().get(reverse('ContaMiner:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith("text/plain"))
+        self.assertIn(
+            'contaminer_view_seconds_count{view="CategoriesView"} 1',
+            response.content)
@@ -0,0 +1,151 @@
+# -*- coding : utf-8 -*-
+
+##    Copyright (C) 2017 King Abdullah University of Science and Technology
+##
+##    This program is free software; you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation; either version 2 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License along
+##    with this program; if not, write to the Free Software Foundation, Inc.,
+##    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+    Testing module for pdb_tools.py
+    ===============================
+
+    This module contains unitary tests for the PDB files management.
+"""
+
+from django.test import TestCase
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from .pdb_tools import PDBHandler
+from .pdb_tools import parse_refinement_remarks
+from . import pdb_tools
+
+
+HEADER = """HEADER    HYDROLASE                               01-JAN-17   XXXX
+REMARK   3
+REMARK   3 REFINEMENT.
+REMARK   3   PROGRAM     : REFMAC 5.8.0158
+REMARK   3
+REMARK   3  DATA USED IN REFINEMENT.
+REMARK   3   RESOLUTION RANGE HIGH (ANGSTROMS) : 1.80
+REMARK   3   RESOLUTION RANGE LOW  (ANGSTROMS) : 39.14
+REMARK   3   COMPLETENESS FOR RANGE        (%) : 99.52
+REMARK   3   NUMBER OF REFLECTIONS             : 20512
+REMARK   3
+REMARK   3  FIT TO DATA USED IN REFINEMENT.
+REMARK   3   R VALUE     (WORKING + TEST SET) : 0.19321
+REMARK   3   R VALUE            (WORKING SET) : 0.19102
+REMARK   3   FREE R VALUE                     : 0.23355
+REMARK   3   FREE R VALUE TEST SET SIZE   (%) : 5.1
+REMARK   3
+REMARK   3  FIT IN THE HIGHEST RESOLUTION BIN.
+REMARK   3   BIN R VALUE           (WORKING SET) : 0.298
+REMARK   3   BIN FREE R VALUE                    : 0.341
+REMARK 200 FREE R VALUE                     : 0.99
+CRYST1   10.000   10.000   10.000  90.00  90.00  90.00 P 1           1
+"""
+
+ATOMS = """ATOM      1  N   ALA A   1       1.000   2.000   3.000  1.00 10.00           N
+HETATM    2  O   HOH A   2       4.000   5.000   6.000  1.00 10.00           O
+REMARK   3   FREE R VALUE                     : 0.50
+END
+"""
+
+
+class ParseRefinementRemarksTestCase(TestCase):
+    """
+        Test the parse_refinement_remarks function
+    """
+    def test_parse_refinement_remarks_gives_statistics(self):
+        statistics = parse_refinement_remarks(HEADER)
+        self.assertEqual(statistics, {
+            'program': "REFMAC 5.8.0158",
+            'resolution_high': 1.80,
+            'resolution_low': 39.14,
+            'completeness': 99.52,
+            'reflections': 20512,
+            'r_all': 0.19321,
+            'r_work': 0.19102,
+            'r_free': 0.23355,
+            'r_free_set_size': 5.1,
+            })
+
+    def test_parse_refinement_remarks_ignores_missing(self):
+        statistics = parse_refinement_remarks(
+            "REMARK   3   FREE R VALUE                     : NULL\n")
+        self.assertEqual(statistics, {})
+
+
+class PDBHandlerTestCase(TestCase):
+    """
+        Test the PDBHandler class
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pdb_filename = os.path.join(self.directory, "final.pdb")
+        with open(self.pdb_filename, 'w') as pdb_file:
+            pdb_file.write(HEADER + ATOMS)
+        pdb_tools.STATISTICS_CACHE.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        pdb_tools.STATISTICS_CACHE.clear()
+
+    def test_get_header_stops_at_coordinates(self):
+        handler = PDBHandler(self.pdb_filename)
+        self.assertEqual(handler.get_header(), HEADER)
+
+    def test_get_header_empty_file(self):
+        open(self.pdb_filename, 'w').close()
+        handler = PDBHandler(self.pdb_filename)
+        self.assertEqual(handler.get_header(), "")
+
+    def test_get_r_free_gives_first_value(self):
+        handler = PDBHandler(self.pdb_filename)
+        self.assertEqual(handler.get_r_free(), 0.23355)
+
+    def test_get_r_free_gives_none_if_not_found(self):
+        with open(self.pdb_filename, 'w') as pdb_file:
+            pdb_file.write(ATOMS)
+        handler = PDBHandler(self.pdb_filename)
+        self.assertEqual(handler.get_r_free(), None)
+
+    def test_get_refinement_statistics_uses_cache(self):
+        handler = PDBHandler(self.pdb_filename)
+        handler.get_refinement_statistics()
+        with mock.patch('contaminer.pdb_tools.parse_refinement_remarks') \
+                as mock_parse:
+            statistics = handler.get_refinement_statistics()
+            self.assertFalse(mock_parse.called)
+        self.assertEqual(statistics['r_work'], 0.19102)
+
+    def test_get_refinement_statistics_reads_modified_file(self):
+        handler = PDBHandler(self.pdb_filename)
+        handler.get_refinement_statistics()
+        with open(self.pdb_filename, 'w') as pdb_file:
+            pdb_file.write(
+                "REMARK   3   FREE R VALUE                     : 0.3\n")
+        mtime = os.path.getmtime(self.pdb_filename)
+        os.utime(self.pdb_filename, (mtime + 10, mtime + 10))
+        self.assertEqual(handler.get_r_free(), 0.3)
+
+    def test_get_coordinates_gives_all_records(self):
+        handler = PDBHandler(self.pdb_filename)
+        self.assertEqual(
+            handler.get_coordinates(),
+            [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0)])
@@ -25,10 +25,20 @@
 """
 
 from django.test import TestCase
+from django.utils import timezone
+import io
 import mock
+import socket
 
 from .ssh_tools import SSHChannel
 from .ssh_tools import SFTPChannel
+from .ssh_tools import ClusterUnavailable
+from .ssh_tools import ConnectionPool
+from .ssh_tools import AgentUnavailable
+from .ssh_tools import RemoteAgent
+from .ssh_tools import shorten
+from .models.cluster import ClusterState
+from .models.cluster import MAX_FAILURES
 
 
 class SSHChannelTestCase(TestCase):
@@ -115,6 +125,7 @@ class SSHChannelTestCase(TestCase):
         return_value.ssh_username = 'username'
         return_value.ssh_password = 'password'
         return_value.ssh_identityfile = 'identityfile'
+        return_value.connect_timeout = 10
         mock_config.return_value = return_value
         sshChannel.__connect__()
         mock_paramiko.assert_called_once_with(
@@ -123,8 +134,42 @@ class SSHChannelTestCase(TestCase):
                 username = 'username',
                 password = 'password',
                 key_filename = 'identityfile',
+                timeout = 10,
+                banner_timeout = 10,
                 )
 
+    @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.connect')
+    def test_connect_failure_is_recorded(self, mock_paramiko):
+        mock_paramiko.side_effect = socket.error("Connection refused")
+        sshChannel = SSHChannel()
+        with self.assertRaises(ClusterUnavailable):
+            sshChannel.__connect__()
+        state = ClusterState.objects.get(name="default")
+        self.assertEqual(state.consecutive_failures, 1)
+
+    @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.connect')
+    def test_connect_fails_fast_when_circuit_is_open(self, mock_paramiko):
+        ClusterState.objects.create(
+            name="default",
+            consecutive_failures=MAX_FAILURES,
+            last_failure=timezone.now())
+        sshChannel = SSHChannel()
+        with self.assertRaises(ClusterUnavailable):
+            sshChannel.__connect__()
+        mock_paramiko.assert_not_called()
+
+    @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.connect')
+    @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.close')
+    def test_timeout_is_raised_as_unavailable_cluster(self, mock_close,
+            mock_connect):
+        sshChannel = SSHChannel()
+        with self.assertRaises(ClusterUnavailable):
+            with sshChannel:
+                raise socket.timeout("timed out")
+        self.assertTrue(mock_close.called)
+        state = ClusterState.objects.get(name="default")
+        self.assertEqual(state.consecutive_failures, 1)
+
     @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.connect')
     def test___enter___returns_self(self, mock_paramiko):
         sshChannel = SSHChannel()
@@ -179,6 +224,7 @@ class SSHChannelTestCase(TestCase):
         sshChannel = SSHChannel()
         config = mock.MagicMock()
         config.ssh_contaminer_location = "/home/user/ContaMiner"
+        config.command_timeout = 60
         mock_config.return_value = config
         stdout = mock.MagicMock()
         stdout.read.return_value = "2"
@@ -187,7 +233,8 @@ class SSHChannelTestCase(TestCase):
         mock_command.return_value = (0, stdout, stderr)
         sshChannel.get_contabase()
         mock_command.assert_called_once_with(
-            "sh /home/user/ContaMiner/contaminer display")
+            "sh /home/user/ContaMiner/contaminer display",
+            timeout=60.0)
 
     @mock.patch('contaminer.ssh_tools.apps.get_app_config')
     @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.exec_command')
@@ -273,6 +320,56 @@ class SSHChannelTestCase(TestCase):
         out = sshChannel.read_file("/home/foo/bar.txt")
         self.assertEqual(out, "2")
 
+    @mock.patch('contaminer.ssh_tools.apps.get_app_config')
+    @mock.patch('contaminer.ssh_tools.SSHChannel.exec_command')
+    def test_stat_files_sends_one_command(self, mock_exec, mock_config):
+        mock_config.return_value.agent_enabled = False
+        mock_exec.return_value = "/home/foo/a.txt|120|1500000000\n"
+        stats = SSHChannel().stat_files(["/home/foo/a.txt", "/home/foo/b.txt"])
+        self.assertEqual(mock_exec.call_count, 1)
+        self.assertEqual(stats, {
+            "/home/foo/a.txt": (120, 1500000000),
+            "/home/foo/b.txt": None,
+            })
+
+    @mock.patch('contaminer.ssh_tools.SSHChannel.exec_command')
+    def test_get_pdb_headers_sends_one_command(self, mock_exec):
+        mock_exec.return_value = ""
+        sshChannel = SSHChannel()
+        sshChannel.get_pdb_headers(["/home/foo/a.pdb", "/home/foo/b c.pdb"])
+        self.assertEqual(mock_exec.call_count, 1)
+        command = mock_exec.call_args[0][0]
+        self.assertIn("/home/foo/a.pdb '/home/foo/b c.pdb'", command)
+
+    @mock.patch('contaminer.ssh_tools.SSHChannel.exec_command')
+    def test_get_pdb_headers_gives_header_per_file(self, mock_exec):
+        mock_exec.return_value = \
+            "==> /home/foo/a.pdb\n" \
+            + "REMARK   3   FREE R VALUE                     : 0.23\n" \
+            + "REMARK   3   R VALUE            (WORKING SET) : 0.19\n" \
+            + "==> /home/foo/b.pdb\n"
+        sshChannel = SSHChannel()
+        headers = sshChannel.get_pdb_headers(
+            ["/home/foo/a.pdb", "/home/foo/b.pdb"])
+        self.assertEqual(headers, {
+            "/home/foo/a.pdb":
+                "REMARK   3   FREE R VALUE                     : 0.23\n" \
+                + "REMARK   3   R VALUE            (WORKING SET) : 0.19\n",
+            "/home/foo/b.pdb": "",
+            })
+
+    @mock.patch('contaminer.ssh_tools.SSHChannel.exec_command')
+    def test_get_pdb_headers_does_nothing_without_files(self, mock_exec):
+        sshChannel = SSHChannel()
+        self.assertEqual(sshChannel.get_pdb_headers([]), {})
+        self.assertFalse(mock_exec.called)
+
+    def test_shorten_truncates_long_outputs(self):
+        self.assertEqual(shorten("short", 10), "short")
+        self.assertEqual(
+            shorten("0123456789abc", 10),
+            "0123456789... (3 more characters)")
+
 
 class SFTPChannelTestCase(TestCase):
     """
@@ -295,10 +392,12 @@ class SFTPChannelTestCase(TestCase):
     @mock.patch('contaminer.ssh_tools.SSHChannel.__connect__')
     @mock.patch('contaminer.ssh_tools.SSHChannel.open_sftp')
     def test_connect_changes_sftpclient_attribute(self, mock_sftp, mock_connect):
-        mock_sftp.return_value = "sftp_client"
+        sftp_client = mock.MagicMock()
+        mock_sftp.return_value = sftp_client
         sftpChannel = SFTPChannel()
         sftpChannel.__connect__()
-        self.assertEqual(sftpChannel.sftpclient, "sftp_client")
+        self.assertEqual(sftpChannel.sftpclient, sftp_client)
+        self.assertTrue(sftp_client.get_channel.return_value.settimeout.called)
 
     @mock.patch('contaminer.ssh_tools.SSHChannel.__connect__')
     @mock.patch('contaminer.ssh_tools.paramiko.SSHClient.open_sftp')
@@ -415,3 +514,131 @@ class SFTPChannelTestCase(TestCase):
         SFTPChannel().download_from_contaminer("subdir/foo.txt", "/local/dir/bar.txt")
         mock_get.assert_called_once_with("/work/dir/subdir/foo.txt",
                 "/local/dir/bar.txt")
+
+
+class ConnectionPoolTestCase(TestCase):
+    """
+        Test the connections shared by the threads
+    """
+    def setUp(self):
+        patcher = mock.patch('contaminer.ssh_tools.apps.get_app_config')
+        mock_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_config.return_value.pool_connections = 2
+        mock_config.return_value.command_timeout = 60
+        mock_config.return_value.transfer_timeout = 60
+        mock_config.return_value.agent_enabled = False
+        self.mock_config = mock_config
+
+        patcher = mock.patch('contaminer.ssh_tools.SSHChannel.__connect__')
+        self.mock_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('contaminer.ssh_tools.SSHChannel.get_transport')
+        self.mock_transport = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = self.mock_transport.return_value.open_session\
+            .return_value
+        self.channel.makefile.return_value.read.return_value = "out"
+        self.channel.makefile_stderr.return_value.read.return_value = ""
+        self.pool = ConnectionPool()
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.assertEqual(self.pool.exec_command("ls"), "out")
+        self.assertEqual(self.mock_connect.call_count, 2)
+        self.assertEqual(len(self.pool.clients), 2)
+        self.assertEqual(self.channel.exec_command.call_count, 5)
+        self.assertEqual(self.channel.close.call_count, 5)
+
+    def test_closed_connection_is_replaced(self):
+        self.pool.exec_command("ls")
+        self.mock_transport.return_value.is_active.return_value = False
+        self.pool.exec_command("ls")
+        self.assertEqual(self.mock_connect.call_count, 2)
+        self.assertEqual(len(self.pool.clients), 1)
+
+    def test_exec_command_raises_on_stderr(self):
+        self.channel.makefile_stderr.return_value.read.return_value = "err"
+        with self.assertRaisesMessage(RuntimeError, "err"):
+            self.pool.exec_command("ls")
+
+    def test_timeout_drops_connection(self):
+        self.channel.makefile.return_value.read.side_effect = \
+            socket.timeout("timed out")
+        with self.assertRaises(ClusterUnavailable):
+            self.pool.exec_command("ls")
+        self.assertEqual(self.pool.clients, [])
+        self.assertEqual(
+            ClusterState.objects.get(name="default").consecutive_failures,
+            1)
+
+    def test_open_circuit_fails_fast(self):
+        ClusterState.objects.create(
+            name="default",
+            consecutive_failures=MAX_FAILURES,
+            last_failure=timezone.now())
+        with self.assertRaises(ClusterUnavailable):
+            self.pool.exec_command("ls")
+        self.mock_connect.assert_not_called()
+
+    def test_stat_files_in_one_command(self):
+        self.channel.makefile.return_value.read.return_value = \
+            "/work/a.txt|10|1000\n"
+        stats = self.pool.stat_files(["/work/a.txt", "/work/b c.txt"])
+        self.assertEqual(stats, {"/work/a.txt": (10, 1000),
+                                 "/work/b c.txt": None})
+        self.assertEqual(self.channel.exec_command.call_count, 1)
+        self.assertIn("/work/a.txt '/work/b c.txt'",
+                      self.channel.exec_command.call_args[0][0])
+
+    @mock.patch('contaminer.ssh_tools.get_agent')
+    def test_agent_runs_pooled_commands_when_enabled(self, mock_get_agent):
+        self.mock_config.return_value.agent_enabled = True
+        mock_agent = mock_get_agent.return_value
+        mock_agent.run.return_value = "agent out"
+        mock_agent.read_file.return_value = "content"
+        mock_agent.stat_files.return_value = {"/work/a.txt": (10, 1000)}
+        self.assertEqual(self.pool.exec_command_in_shell("ls"), "agent out")
+        self.assertEqual(self.pool.read_file("/work/a.txt"), "content")
+        self.assertEqual(
+            self.pool.stat_files(["/work/a.txt"]),
+            {"/work/a.txt": (10, 1000)})
+        mock_agent.run.assert_called_once_with("ls")
+        self.mock_connect.assert_not_called()
+
+    @mock.patch('contaminer.ssh_tools.get_agent')
+    def test_unavailable_agent_falls_back_on_pool(self, mock_get_agent):
+        self.mock_config.return_value.agent_enabled = True
+        mock_get_agent.return_value.run.side_effect = \
+            AgentUnavailable("Not started after a failure.")
+        self.assertEqual(self.pool.exec_command_in_shell("ls"), "out")
+        self.assertEqual(self.channel.exec_command.call_count, 1)
+
+
+class RemoteAgentTestCase(TestCase):
+    """
+        Test the requests sent to the remote agent
+    """
+    def setUp(self):
+        self.agent = RemoteAgent()
+        self.client = mock.MagicMock()
+        self.agent.client = self.client
+        self.agent.stdin = io.BytesIO()
+        self.agent.stdout = mock.MagicMock()
+
+    def test_timeout_is_recorded_by_circuit_breaker(self):
+        self.agent.stdout.read.side_effect = socket.timeout("timed out")
+        with self.assertRaises(ClusterUnavailable):
+            self.agent.request('status', job="/work/web_task_1")
+        self.assertEqual(
+            ClusterState.objects.get(name="default").consecutive_failures,
+            1)
+        self.assertIsNone(self.agent.client)
+        self.client.close.assert_called_once_with()
+
+    def test_stopped_agent_is_not_a_timeout(self):
+        self.agent.stdout.read.return_value = b''
+        with self.assertRaises(RuntimeError) as context:
+            self.agent.request('status', job="/work/web_task_1")
+        self.assertNotIsInstance(context.exception, ClusterUnavailable)
+        self.assertFalse(ClusterState.objects.exists())
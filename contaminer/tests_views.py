@@ -973,3 +973,140 @@ class UglymolViewTestCase(TestCase):
                 reverse('ContaMiner:uglymol',
                     args = [self.job.id, self.task.name() + '1']))
         self.assertEqual(response.status_code, 404)
+
+    def test_return_403_if_confidential(self):
+        self.job.status_complete = True
+        self.job.confidential = True
+        self.job.save()
+        response = self.client.get(
+                reverse('ContaMiner:uglymol',
+                    args = [self.job.id, self.task.name()]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_gives_protected_urls(self):
+        self.job.status_complete = True
+        self.job.save()
+        response = self.client.get(
+                reverse('ContaMiner:uglymol',
+                    args = [self.job.id, self.task.name()]))
+        self.assertContains(response,
+            reverse('ContaMiner:task_file',
+                args = [self.job.id, self.task.name(), 'diff.map']))
+        self.assertNotContains(response, "/media/")
+
+
+class TaskFileViewTestCase(TestCase):
+    """Test the view sending the final files of a task"""
+    def setUp(self):
+        self.client = Client()
+        self.factory = RequestFactory()
+
+        self.contabase = ContaBase.objects.create()
+        self.category = Category.objects.create(
+                contabase = self.contabase,
+                number = 1,
+                name = "Protein in E.Coli",
+                )
+        self.contaminant = Contaminant.objects.create(
+                uniprot_id = "P0ACJ8",
+                category = self.category,
+                short_name = "CRP_ECOLI",
+                long_name = "cAMP-activated global transcriptional regulator",
+                sequence = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+                organism = "Escherichia coli",
+                )
+        self.pack = Pack.objects.create(
+                contaminant = self.contaminant,
+                number = 5,
+                structure= '5-mer',
+                )
+        self.model = Model.objects.create(
+                pdb_code = "ACBD",
+                chain = "A",
+                domain = "1",
+                nb_residues = 1,
+                identity = 2,
+                pack = self.pack,
+                )
+        self.job = Job.create(
+                name = "test",
+                email = "me@example.com",
+                )
+        self.task = Task.objects.create(
+                job = self.job,
+                pack = self.pack,
+                space_group = "P-1-2-1",
+                status_complete = True,
+                percent = 40,
+                q_factor = 0.53,
+                )
+
+    def test_serve_file(self):
+        media_root = tempfile.mkdtemp()
+        final_dir = os.path.join(media_root, "web_task_" + str(self.job.id))
+        os.makedirs(final_dir)
+        with open(os.path.join(final_dir, "P0ACJ8_5_P-1-2-1.map"), 'w') \
+                as map_file:
+            map_file.write("MAP")
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.get(
+                    reverse('ContaMiner:task_file',
+                        args = [self.job.id, self.task.name(), 'map']))
+            content = b''.join(response.streaming_content)
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, b"MAP")
+
+    def test_return_404_on_missing_file(self):
+        response = self.client.get(
+                reverse('ContaMiner:task_file',
+                    args = [self.job.id, self.task.name(), 'map']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_return_403_if_confidential(self):
+        self.job.confidential = True
+        self.job.save()
+        response = self.client.get(
+                reverse('ContaMiner:task_file',
+                    args = [self.job.id, self.task.name(), 'map']))
+        self.assertEqual(response.status_code, 403)
+
+    def test_serve_small_gzip_map(self):
+        media_root = tempfile.mkdtemp()
+        final_dir = os.path.join(media_root, "web_task_" + str(self.job.id))
+        os.makedirs(final_dir)
+        for filename in ["P0ACJ8_5_P-1-2-1.map",
+                         "P0ACJ8_5_P-1-2-1.small.map",
+                         "P0ACJ8_5_P-1-2-1.small.map.gz"]:
+            with open(os.path.join(final_dir, filename), 'w') as map_file:
+                map_file.write(filename)
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.get(
+                    reverse('ContaMiner:task_file',
+                        args = [self.job.id, self.task.name(), 'map']),
+                    {'variant': 'small'},
+                    HTTP_ACCEPT_ENCODING = 'gzip, deflate')
+            content = b''.join(response.streaming_content)
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(content, b"P0ACJ8_5_P-1-2-1.small.map.gz")
+
+    def test_serve_map_when_gzip_refused(self):
+        media_root = tempfile.mkdtemp()
+        final_dir = os.path.join(media_root, "web_task_" + str(self.job.id))
+        os.makedirs(final_dir)
+        for filename in ["P0ACJ8_5_P-1-2-1.map",
+                         "P0ACJ8_5_P-1-2-1.map.gz"]:
+            with open(os.path.join(final_dir, filename), 'w') as map_file:
+                map_file.write(filename)
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.get(
+                    reverse('ContaMiner:task_file',
+                        args = [self.job.id, self.task.name(), 'map']),
+                    HTTP_ACCEPT_ENCODING = 'gzip;q=0, deflate')
+            content = b''.join(response.streaming_content)
+        shutil.rmtree(media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(content, b"P0ACJ8_5_P-1-2-1.map")
@@ -48,4 +48,10 @@ urlpatterns = [
     url(r'^uglymol/(?P<job_id>\d+)/(?P<task_desc>.*)$',
         views.UglymolView.as_view(),
         name='uglymol'),
+    url(r'^file/(?P<job_id>\d+)/(?P<task_desc>[^/.]+)\.'\
+        + r'(?P<file_format>pdb|mtz|map|diff\.map)$',
+        views.TaskFileView.as_view(),
+        name='task_file'),
+    url(r'^metrics$', views.MetricsView.as_view(),
+        name='metrics'),
 ]
@@ -52,9 +52,24 @@ urlpatterns = [
     url(r'^job$',
         views_api.JobView.as_view(),
         name='job'),
+    url(r'^upload$',
+        views_api.UploadsView.as_view(),
+        name='uploads'),
+    url(r'^upload/(?P<token>[0-9a-f]+)$',
+        views_api.UploadView.as_view(),
+        name='upload'),
+    url(r'^upload/(?P<token>[0-9a-f]+)/finalize$',
+        views_api.UploadFinalizeView.as_view(),
+        name='upload_finalize'),
     url(r'^job/status/(?P<job_id>[0-9]*)$',
         views_api.JobStatusView.as_view(),
         name='job_status'),
+    url(r'^jobs$',
+        views_api.JobsView.as_view(),
+        name='jobs'),
+    url(r'^jobs/status$',
+        views_api.JobsStatusView.as_view(),
+        name='jobs_status'),
     url(r'^job/result/(?P<job_id>[0-9]*)$',
         views_api.SimpleResultsView.as_view(),
         name='result'),
@@ -25,12 +25,15 @@ from django.views.generic import View
 from django.shortcuts import render
 from django.http import HttpResponseRedirect
 from django.http import Http404
+from django.http import HttpResponse
 from django.core.urlresolvers import reverse
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import PermissionDenied
 from django.apps import apps
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 
 from .forms import SubmitJobForm
 
@@ -39,12 +42,20 @@ from .models.contabase import Contaminant
 from .models.contabase import Category
 from .models.contaminer import Job
 from .models.contaminer import Task
+from .models.admission import QueuedSubmission
+from .models.cluster import ClusterState
+from .models.cluster import CLOSED
 
 from .views_tools import newjob_handler
+from .views_tools import is_allowed
+from .views_tools import serve_file
+from .views_tools import accepts_gzip
+from .views_tools import TimedView
+from . import metrics
 from . import views_api
 
 
-class SubmitJobView(View):
+class SubmitJobView(TimedView):
     """Views to process the submitting form."""
 
     @staticmethod
@@ -95,7 +106,7 @@ class SubmitJobView(View):
 
         if form.is_valid():
             log.debug("Valid form")
-            response_data = newjob_handler(request)
+            response_data = newjob_handler(request, interactive=True)
             if response_data['error']:
                 messages.error(request, response_data['message'])
                 response = self.render_page(request, form)
@@ -114,7 +125,7 @@ class SubmitJobView(View):
         return response
 
 
-class DisplayJobView(View):
+class DisplayJobView(TimedView):
     """Views to see the results of a job."""
 
     def get(self, request, job_id):
@@ -165,11 +176,17 @@ class DisplayJobView(View):
             # Provide buffering page, waiting for the job to be running
             messages.info(request, "This job is not yet running. Please "\
                 + "wait, this page will automatically reload.")
+            remaining_time = job.get_remaining_time()
+            estimated_end = None
+            if remaining_time is not None:
+                estimated_end = timezone.now() + remaining_time
             result = render(
                 request,
                 'ContaMiner/buffer.html',
                 {
                     'job': job,
+                    'estimated_end': estimated_end,
+                    'queue_position': QueuedSubmission.get_position(job),
                     'api_url_status': reverse(
                         'ContaMiner:API:job_status', args=[job.id]),
                 })
@@ -178,27 +195,44 @@ class DisplayJobView(View):
         return result
 
 
-class UglymolView(View):
+class UglymolView(TimedView):
     """Views to display the morda output in Uglymol"""
 
     def get(self, request, job_id, task_desc):
         # Find corresponding task
-        job = Job.objects.get(pk = job_id)
         try:
+            job = Job.objects.get(pk=job_id)
             task = Task.from_name(job, task_desc)
-        except ObjectDoesNotExist:
+        except (ObjectDoesNotExist, ValueError):
             raise Http404()
 
-        task.pdb_filename = settings.MEDIA_URL \
-            + task.get_final_filename(suffix='pdb')
-        task.map_filename = settings.MEDIA_URL \
-            + task.get_final_filename(suffix='map')
-        task.diff_map_filename = settings.MEDIA_URL \
-            + task.get_final_filename(suffix='diff.map')
+        if not is_allowed(request, job):
+            messages.error(request, "This job is confidential. You are not "\
+                + "allowed to see the results.")
+            result = SubmitJobView().get(request)
+            result.status_code = 403
+            return result
+
+        # Download again the files if they have been evicted from MEDIA_ROOT
+        task.get_local_final_file('pdb')
+
+        # The cropped maps are loaded unless the full maps are asked
+        full_maps = 'full' in request.GET
+        map_query = '' if full_maps else '?variant=small'
+
+        task.pdb_filename = reverse(
+            'ContaMiner:task_file', args=[job.id, task_desc, 'pdb'])
+        task.map_filename = reverse(
+            'ContaMiner:task_file', args=[job.id, task_desc, 'map']) \
+            + map_query
+        task.diff_map_filename = reverse(
+            'ContaMiner:task_file', args=[job.id, task_desc, 'diff.map']) \
+            + map_query
 
         context = {
             'job_id': job_id,
-            'task': task
+            'task': task,
+            'full_maps': full_maps,
             }
         result = render(
             request,
@@ -208,7 +242,58 @@ class UglymolView(View):
         return result
 
 
-class ContaBaseView(View):
+class TaskFileView(TimedView):
+    """Views to get the final files of a task."""
+
+    def get(self, request, job_id, task_desc, file_format):
+        """Send the final file after checking the access to the job."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        try:
+            job = Job.objects.get(pk=job_id)
+            task = Task.from_name(job, task_desc)
+        except (ObjectDoesNotExist, ValueError):
+            raise Http404()
+
+        if not is_allowed(request, job):
+            log.debug("Permission denied")
+            raise PermissionDenied()
+
+        file_location = task.get_local_final_file(file_format)
+        if file_location is None:
+            # Do not wait for a failing cluster, and ask to come back later
+            if ClusterState.get_circuit(job.cluster) != CLOSED:
+                log.debug("Exit with unavailable cluster")
+                return HttpResponse(
+                    "The cluster is unavailable, please try again later.",
+                    status=503)
+            raise Http404()
+
+        # Use the cropped map if asked and available
+        if request.GET.get('variant') == 'small' \
+                and file_format in ['map', 'diff.map']:
+            small_location = file_location[:-len(file_format)] \
+                + 'small.' + file_format
+            if os.path.isfile(small_location):
+                file_location = small_location
+
+        # Send the compressed copy if accepted
+        if accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING')) \
+                and os.path.isfile(file_location + '.gz'):
+            log.debug("Exit with gzip")
+            return serve_file(
+                request,
+                file_location + '.gz',
+                as_attachment=False,
+                content_type='application/octet-stream',
+                content_encoding='gzip')
+
+        log.debug("Exit")
+        return serve_file(request, file_location, as_attachment=False)
+
+
+class ContaBaseView(TimedView):
     """Views accessible through contabase."""
 
     def get(self, request):
@@ -231,9 +316,28 @@ class ContaBaseView(View):
         return result
 
 
-class ContaBaseJSONView(View):
+class ContaBaseJSONView(TimedView):
     """Views accessible through contabase.json."""
 
     def get(self, request):
         """Return the contabase in JSON format."""
         return views_api.ContaBaseView.as_view()(request)
+
+
+class MetricsView(View):
+    """Views accessible through metrics."""
+
+    def get(self, request):
+        """Return the metrics in the Prometheus text format."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        if not metrics.is_enabled():
+            raise Http404("Metrics are disabled.")
+
+        response = HttpResponse(
+            metrics.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8")
+
+        log.debug("Exit")
+        return response
@@ -21,25 +21,38 @@
 import logging
 import os
 
+from django.apps import apps
 from django.http import JsonResponse
-from django.http import HttpResponseRedirect
 from django.http import Http404
-from django.views.generic import View
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.utils import timezone
 
 from .models.contabase import ContaBase
 from .models.contabase import Category
 from .models.contabase import Contaminant
 from .models.contaminer import Job
 from .models.contaminer import Task
+from .models.admission import QueuedSubmission
+from .models.cluster import ClusterState
+from .models.cluster import CLOSED
+from .models.upload import UploadSession
 
 from .views_tools import newjob_handler
+from .views_tools import newjobs_handler
+from .views_tools import uploadjob_handler
+from .views_tools import parse_content_range
+from .views_tools import is_allowed
+from .views_tools import serve_file
+from .views_tools import TimedView
 
+# Maximum number of jobs asked in one request to api/jobs/status
+MAX_BATCH_JOBS = 100
 
-class ContaBaseView(View):
+
+class ContaBaseView(TimedView):
     """Views accessible through api/contabase."""
 
     def get(self, request):
@@ -47,7 +60,7 @@ class ContaBaseView(View):
         return DetailedCategoriesView().get(request)
 
 
-class CategoriesView(View):
+class CategoriesView(TimedView):
     """Views accessible through api/categories."""
 
     def get(self, request):
@@ -70,7 +83,7 @@ class CategoriesView(View):
         return JsonResponse(response_data)
 
 
-class DetailedCategoriesView(View):
+class DetailedCategoriesView(TimedView):
     """Views accessible through api/categories."""
 
     def get(self, request):
@@ -93,7 +106,7 @@ class DetailedCategoriesView(View):
         return JsonResponse(response_data)
 
 
-class CategoryView(View):
+class CategoryView(TimedView):
     """Views accessible through api/category."""
 
     def get(self, request, category_id):
@@ -115,7 +128,7 @@ class CategoryView(View):
         return JsonResponse(response_data)
 
 
-class DetailedCategoryView(View):
+class DetailedCategoryView(TimedView):
     """Views accessible thourgh api/category."""
 
     def get(self, request, category_id):
@@ -137,7 +150,7 @@ class DetailedCategoryView(View):
         return JsonResponse(response_data)
 
 
-class ContaminantsView(View):
+class ContaminantsView(TimedView):
     """Views accessible through api/contaminants."""
 
     def get(self, request):
@@ -161,7 +174,7 @@ class ContaminantsView(View):
         return JsonResponse(response_data)
 
 
-class DetailedContaminantsView(View):
+class DetailedContaminantsView(TimedView):
     """Views accessible through api/contaminants."""
 
     def get(self, request):
@@ -185,7 +198,7 @@ class DetailedContaminantsView(View):
         return JsonResponse(response_data)
 
 
-class ContaminantView(View):
+class ContaminantView(TimedView):
     """Views accessible through api/contaminant."""
 
     def get(self, request, uniprot_id):
@@ -207,7 +220,7 @@ class ContaminantView(View):
         return JsonResponse(response_data)
 
 
-class DetailedContaminantView(View):
+class DetailedContaminantView(TimedView):
     """Views accessible through api/detailed_contaminant."""
 
     def get(self, request, uniprot_id):
@@ -230,7 +243,7 @@ class DetailedContaminantView(View):
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-class JobView(View):
+class JobView(TimedView):
     """Views accessible through api/job."""
 
     def post(self, request):
@@ -249,7 +262,181 @@ class JobView(View):
         return JsonResponse(response_data, status=status)
 
 
-class JobStatusView(View):
+@method_decorator(csrf_exempt, name="dispatch")
+class JobsView(TimedView):
+    """Views accessible through api/jobs."""
+
+    def post(self, request):
+        """Create several jobs, submit them together and return their IDs."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        response_data = newjobs_handler(request)
+
+        if response_data['error']:
+            status = 400
+        else:
+            status = 200
+
+        log.debug("Exit")
+        return JsonResponse(response_data, status=status)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadsView(TimedView):
+    """Views accessible through api/upload."""
+
+    def post(self, request):
+        """Create an upload session for a file, and return its ID."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        filename = os.path.basename(request.POST.get('filename', ''))
+        if os.path.splitext(filename)[1].lower() not in ['.mtz', '.cif']:
+            response_data = {
+                'error': True,
+                'message': 'File format is not CIF or MTZ.'}
+            return JsonResponse(response_data, status=400)
+
+        try:
+            size = int(request.POST['size'])
+        except (KeyError, ValueError):
+            size = 0
+        if size <= 0:
+            response_data = {
+                'error': True,
+                'message': 'Missing size of the file.'}
+            return JsonResponse(response_data, status=400)
+
+        max_size = apps.get_app_config('contaminer').upload_max_size
+        if max_size and size > max_size:
+            response_data = {
+                'error': True,
+                'message': 'File is too large. At most ' + str(max_size) \
+                    + ' bytes can be uploaded.'}
+            return JsonResponse(response_data, status=413)
+
+        max_sessions = apps.get_app_config('contaminer').upload_max_sessions
+        if max_sessions and UploadSession.objects.count() >= max_sessions:
+            log.warning("Too many unfinished uploads: " + str(max_sessions))
+            response_data = {
+                'error': True,
+                'message': 'Too many uploads in progress. Try again later.'}
+            return JsonResponse(response_data, status=503)
+
+        session = UploadSession.start(
+            filename,
+            size,
+            request.POST.get('sha256', ''))
+
+        response_data = {
+            'error': False,
+            'id': session.token,
+            'offset': 0,
+            'size': size}
+        log.debug("Exit")
+        return JsonResponse(response_data)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadView(TimedView):
+    """Views accessible through api/upload/<id>."""
+
+    @staticmethod
+    def get_progress(session):
+        """Return the response data giving the progress of session."""
+        return {
+            'error': False,
+            'id': session.token,
+            'filename': session.filename,
+            'offset': session.received,
+            'size': session.size,
+            'complete': session.is_complete()}
+
+    def get(self, request, token):
+        """Return the number of bytes received."""
+        try:
+            session = UploadSession.objects.get(token=token)
+        except ObjectDoesNotExist:
+            raise Http404()
+        return JsonResponse(self.get_progress(session))
+
+    def put(self, request, token):
+        """Write the chunk given in the body at its Content-Range."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        try:
+            session = UploadSession.objects.get(token=token)
+        except ObjectDoesNotExist:
+            raise Http404()
+
+        try:
+            start, end = parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE'))
+        except ValueError as excep:
+            response_data = {
+                'error': True,
+                'message': str(excep)}
+            return JsonResponse(response_data, status=400)
+
+        if start > session.received:
+            response_data = self.get_progress(session)
+            response_data['error'] = True
+            response_data['message'] = 'Chunk starts after the received ' \
+                'bytes.'
+            log.debug("Chunk after offset " + str(session.received))
+            return JsonResponse(response_data, status=409)
+
+        try:
+            session.write_chunk(start, end - start + 1, request)
+        except ValueError as excep:
+            response_data = {
+                'error': True,
+                'message': str(excep)}
+            return JsonResponse(response_data, status=400)
+
+        log.debug("Exit")
+        return JsonResponse(self.get_progress(session))
+
+    def delete(self, request, token):
+        """Abandon the upload, and remove the received bytes."""
+        try:
+            session = UploadSession.objects.get(token=token)
+        except ObjectDoesNotExist:
+            raise Http404()
+        session.discard()
+        return JsonResponse({'error': False})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class UploadFinalizeView(TimedView):
+    """Views accessible through api/upload/<id>/finalize."""
+
+    def post(self, request, token):
+        """Create the job of the uploaded file, and return job.id."""
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        try:
+            session = UploadSession.objects.get(token=token)
+        except ObjectDoesNotExist:
+            raise Http404()
+
+        response_data = uploadjob_handler(request, session)
+
+        if not response_data['error']:
+            status = 200
+        elif 'offset' in response_data:
+            status = 409
+        else:
+            status = 400
+
+        log.debug("Exit")
+        return JsonResponse(response_data, status=status)
+
+
+class JobStatusView(TimedView):
     """Views accessbiel through api/job/status."""
 
     def get(self, request, job_id):
@@ -273,11 +460,129 @@ class JobStatusView(View):
             'id': job.id,
             'status': job.get_status()}
 
+        if not job.status_submitted:
+            queue_position = QueuedSubmission.get_position(job)
+            if queue_position is not None:
+                response_data['queue_position'] = queue_position
+
+        remaining_time = job.get_remaining_time()
+        if remaining_time is not None and not job.status_complete:
+            response_data['remaining_time'] = \
+                int(remaining_time.total_seconds())
+            response_data['estimated_end'] = \
+                (timezone.now() + remaining_time).isoformat()
+
         log.debug("Exit")
         return JsonResponse(response_data)
 
 
-class SimpleResultsView(View):
+class JobsStatusView(TimedView):
+    """Views accessible through api/jobs/status."""
+
+    def get(self, request):
+        """
+        Return the status of several jobs, and optionally their results.
+
+        The IDs are given as a comma separated list in the "ids" parameter,
+        up to MAX_BATCH_JOBS. "results=true" adds the simple results of each
+        job, and "compact=true" gives a shorter response (see API.md).
+        """
+        log = logging.getLogger(__name__)
+        log.debug("Enter")
+
+        try:
+            job_ids = [int(job_id)
+                       for job_id in request.GET.get('ids', '').split(',')
+                       if job_id.strip()]
+        except ValueError:
+            response_data = {
+                'error': True,
+                'message': 'ids should be a comma separated list of IDs.'}
+            return JsonResponse(response_data, status=400)
+        # Remove the duplicates, keeping the order
+        job_ids = [job_id for index, job_id in enumerate(job_ids)
+                   if job_id not in job_ids[:index]]
+
+        if not job_ids or len(job_ids) > MAX_BATCH_JOBS:
+            response_data = {
+                'error': True,
+                'message': 'Give between 1 and ' + str(MAX_BATCH_JOBS) \
+                    + ' job IDs.'}
+            return JsonResponse(response_data, status=400)
+
+        with_results = request.GET.get('results', '').lower() == 'true'
+        compact = request.GET.get('compact', '').lower() == 'true'
+
+        jobs = dict([(job.id, job) for job in
+                     Job.objects.filter(id__in=job_ids)\
+                     .select_related('author')])
+        allowed_jobs = [jobs[job_id] for job_id in job_ids
+                        if job_id in jobs and is_allowed(request, jobs[job_id])]
+
+        tasks_per_job = {}
+        if with_results:
+            # The models give the coverage and identity of the positive packs
+            tasks = Task.objects.filter(
+                job__in=[job.id for job in allowed_jobs
+                         if not job.status_error])\
+                .select_related('pack__contaminant')\
+                .prefetch_related('pack__model_set')
+            for task in tasks:
+                task.job = jobs[task.job_id]
+                tasks_per_job.setdefault(task.job_id, []).append(task)
+
+        statuses = []
+        for job in allowed_jobs:
+            job_data = {
+                'id': job.id,
+                'status': job.get_status()}
+            if with_results and not job.status_error:
+                results_data = job.to_simple_dict(
+                    tasks=tasks_per_job.get(job.id, []))
+                job_data['results'] = results_data['results']
+                if 'messages' in results_data:
+                    job_data['messages'] = results_data['messages']
+            statuses.append(job_data)
+
+        allowed_ids = set([job.id for job in allowed_jobs])
+        not_found = [job_id for job_id in job_ids if job_id not in jobs]
+        forbidden = [job_id for job_id in job_ids
+                     if job_id in jobs and job_id not in allowed_ids]
+
+        if compact:
+            response_data = self.compact(statuses, with_results)
+        else:
+            response_data = {'jobs': statuses}
+        response_data['error'] = False
+        response_data['not_found'] = not_found
+        response_data['forbidden'] = forbidden
+
+        log.debug("Exit")
+        return JsonResponse(response_data)
+
+    @staticmethod
+    def compact(statuses, with_results):
+        """
+        Return the statuses with one entry per job, indexed by job ID.
+
+        A result is compacted as [uniprot_id, status, percent, q_factor].
+        """
+        response_data = {'status': dict(
+            [(str(job_data['id']), job_data['status'])
+             for job_data in statuses])}
+        if with_results:
+            response_data['results'] = dict(
+                [(str(job_data['id']),
+                  [[result['uniprot_id'],
+                    result['status'],
+                    result.get('percent'),
+                    result.get('q_factor')]
+                   for result in job_data.get('results', [])])
+                 for job_data in statuses])
+        return response_data
+
+
+class SimpleResultsView(TimedView):
     """Views accessible through api/job/result."""
 
     def get(self, request, job_id):
@@ -310,7 +615,7 @@ class SimpleResultsView(View):
         return JsonResponse(response_data)
 
 
-class DetailedResultsView(View):
+class DetailedResultsView(TimedView):
     """Views accessible through api/job/detailed_result."""
 
     def get(self, request, job_id):
@@ -336,7 +641,7 @@ class DetailedResultsView(View):
         return JsonResponse(response_data)
 
 
-class GetFinalFilesView(View):
+class GetFinalFilesView(TimedView):
     """Views accessible through api/job/final{pdb,mtz}."""
 
     # pylint: disable=too-many-return-statements
@@ -375,7 +680,7 @@ class GetFinalFilesView(View):
             log.debug("Job does not exist")
             return JsonResponse(response_data, status=404)
 
-        if job.confidential:
+        if not is_allowed(request, job):
             response_data = {
                 'error': True,
                 'message': 'You are not allowed to see this job'}
@@ -395,20 +700,25 @@ class GetFinalFilesView(View):
             log.debug("Task does not exist")
             return JsonResponse(response_data, status=404)
 
-        filename = task.get_final_filename(suffix=file_format)
-        file_location = settings.MEDIA_ROOT + filename
+        file_location = task.get_local_final_file(file_format)
 
-        if not os.path.isfile(file_location):
+        if file_location is None \
+                and ClusterState.get_circuit(job.cluster) != CLOSED:
+            response_data = {
+                'error': True,
+                'message': 'The cluster is unavailable, try again later'}
+            log.debug("Cluster is unavailable")
+            return JsonResponse(response_data, status=503)
+
+        if file_location is None:
             response_data = {
                 'error': True,
                 'message': 'File is not available'}
             log.debug("File is not available")
             return JsonResponse(response_data, status=404)
 
-        url = settings.MEDIA_URL + filename
-
-        log.debug("Exit with: " + str(url))
-        return HttpResponseRedirect(url)
+        log.debug("Exit with: " + str(file_location))
+        return serve_file(request, file_location)
 
 
 """Custom 404 result for API"""
@@ -19,15 +19,31 @@
 """Tools for API and browser views."""
 
 import logging
+import mimetypes
 import os
+import re
 import tempfile
 import threading
 
+from django.apps import apps
+from django.conf import settings
+from django.http import FileResponse
+from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.utils.datastructures import MultiValueDictKeyError
+from django.views.generic import View
 
 from .models.contabase import ContaBase
 from .models.contabase import Contaminant
 from .models.contaminer import Job
+from .models.admission import QueuedSubmission
+from . import metrics
+
+FILE_CHUNK_SIZE = 64 * 1024
+RANGE_REGEX = re.compile(r'^bytes=(\d*)-(\d*)$')
+CONTENT_RANGE_REGEX = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+# Maximum number of files submitted in one request to api/jobs
+MAX_BATCH_SUBMISSIONS = 100
 
 
 def get_custom_contaminants(request):
@@ -68,8 +84,64 @@ def get_contaminants(request):
     log.debug("Exit with: " + str(contaminants))
     return contaminants
 
-def newjob_handler(request):
-    """Interface between the request and the Job model."""
+def get_author(request):
+    """Return the logged in user of the request, or None."""
+    try:
+        user = request.user
+        if not user.is_authenticated():
+            user = None
+    except AttributeError:
+        user = None
+    return user
+
+def is_confidential(request):
+    """Return True if the confidentiality is asked in the request."""
+    confidential = False
+    try:
+        confidential = (request.POST['confidential'] == 'on')
+    except MultiValueDictKeyError, KeyError:
+        pass
+    return confidential
+
+def get_email(request):
+    """Return the email address given in the request."""
+    try:
+        email = request.POST['email_address']
+    except AttributeError:
+        email = None
+    return email
+
+def save_uploaded_file(uploaded_file, filepath):
+    """Write the content of uploaded_file in filepath."""
+    with open(filepath, 'wb') as destination:
+        for chunk in uploaded_file:
+            destination.write(chunk)
+
+def save_custom_models(request, directory):
+    """Save the custom models of the request and return their paths."""
+    log = logging.getLogger(__name__)
+
+    tmp_custom_model_files = []
+    for custom_model_file in request.FILES.getlist('custom_models'):
+        filename = custom_model_file.name
+        tmp_custom_model_file = os.path.join(directory, filename)
+        save_uploaded_file(custom_model_file, tmp_custom_model_file)
+        tmp_custom_model_files.append(tmp_custom_model_file)
+
+        log.debug("Custom model saved: " + str(custom_model_file.name))
+    return tmp_custom_model_files
+
+def has_bad_custom_models(request):
+    """Return True if a custom model is not a PDB file."""
+    return any([os.path.splitext(model_file.name)[1].lower() != '.pdb'
+                for model_file in request.FILES.getlist('custom_models')])
+
+def newjob_handler(request, interactive=False):
+    """
+    Interface between the request and the Job model.
+
+    :param interactive: True if the job is submitted with the web form.
+    """
     log = logging.getLogger(__name__)
     log.debug("Enter")
 
@@ -89,26 +161,15 @@ def newjob_handler(request):
         return response_data
 
     # Check custom PDB files extensions
-    if any([os.path.splitext(model_file.name)[1].lower() != '.pdb'
-            for model_file in request.FILES.getlist('custom_models')]):
+    if has_bad_custom_models(request):
         response_data = {
             'error': True,
             'message': 'Wrong file type given as a custom model.'}
         return response_data
 
     # Define user and confidentiality
-    try:
-        user = request.user
-        if not user.is_authenticated():
-            user = None
-    except AttributeError:
-        user = None
-    # If choosen, define confidential
-    confidential = False
-    try:
-        confidential = (request.POST['confidential'] == 'on')
-    except MultiValueDictKeyError, KeyError:
-        pass
+    user = get_author(request)
+    confidential = is_confidential(request)
     log.debug("User : " + str(user))
     log.debug("Conf : " + str(confidential))
 
@@ -120,10 +181,7 @@ def newjob_handler(request):
     log.debug("Job name : " + str(name))
 
     # Define email
-    try:
-        email = request.POST['email_address']
-    except AttributeError:
-        email = None
+    email = get_email(request)
     log.debug("Email : " + str(email))
 
     # Define list of contaminants
@@ -147,32 +205,382 @@ def newjob_handler(request):
     filename = job.get_filename(suffix=extension)
     tmp_diff_data_file = os.path.join(temp_directory, filename)
 
-    with open(tmp_diff_data_file, 'wb') as destination:
-        for chunk in request.FILES['diffraction_data']:
-            destination.write(chunk)
+    save_uploaded_file(request.FILES['diffraction_data'], tmp_diff_data_file)
     log.debug("Diffraction data file saved")
 
-    tmp_custom_model_files = []
-    for custom_model_file in request.FILES.getlist('custom_models'):
-        filename = custom_model_file.name
-        tmp_custom_model_file = os.path.join(temp_directory, filename)
+    tmp_custom_model_files = save_custom_models(request, temp_directory)
 
-        with open(tmp_custom_model_file, 'wb') as destination:
-            for chunk in custom_model_file:
-                destination.write(chunk)
+    start_job(
+        job,
+        tmp_diff_data_file,
+        contaminants,
+        tmp_custom_model_files,
+        interactive=interactive)
 
-        tmp_custom_model_files.append(tmp_custom_model_file)
-        
-        log.debug("Custom model saved: " + str(custom_model_file.name))
+    response_data = {
+        'error': False,
+        'id': job.id}
+    return response_data
+
+def start_job(job, filepath, contaminants, custom_contaminants,
+              interactive=False):
+    """Submit job in a thread, or hold it until a cluster can take it."""
+    if not QueuedSubmission.admit([job]):
+        QueuedSubmission.hold(
+            job,
+            filepath,
+            contaminants,
+            custom_contaminants,
+            interactive=interactive)
+    else:
+        threading.Thread(
+            target=job.submit,
+            args=(filepath, contaminants),
+            kwargs={'custom_contaminants':  custom_contaminants}
+            ).start()
+
+def parse_content_range(content_range):
+    """
+    Return the (start, end) byte positions given in the Content-Range header.
+
+    :param content_range: value of the header, as "bytes start-end/size" or
+    "bytes start-end/*"
+    :return: (start, end), end included
+    :raise ValueError: if the header is missing or malformed
+    """
+    match = CONTENT_RANGE_REGEX.match((content_range or '').strip())
+    if not match:
+        raise ValueError("Bad Content-Range: " + str(content_range))
+    start, end = int(match.group(1)), int(match.group(2))
+    if start > end:
+        raise ValueError("Bad Content-Range: " + str(content_range))
+    return (start, end)
+
+def uploadjob_handler(request, session):
+    """
+    Interface between the request finalizing an upload and the Job model.
+
+    The file received by session is checked against its SHA-256, given when
+    creating the session or in the "sha256" field. The other fields are the
+    ones of newjob_handler. A file not matching its SHA-256 is dropped, to be
+    uploaded again.
+    """
+    log = logging.getLogger(__name__)
+    log.debug("Enter with arg: " + str(session))
+
+    if not session.is_complete():
+        response_data = {
+            'error': True,
+            'message': 'Upload is not complete.',
+            'offset': session.received}
+        return response_data
+
+    if has_bad_custom_models(request):
+        response_data = {
+            'error': True,
+            'message': 'Wrong file type given as a custom model.'}
+        return response_data
+
+    contaminants = get_contaminants(request)
+    if not contaminants or contaminants == '\n':
+        response_data = {
+            'error': True,
+            'message': 'Missing list of contaminants'}
+        return response_data
 
-    # Submit job
-    threading.Thread(
-        target=job.submit,
-        args=(tmp_diff_data_file, contaminants),
-        kwargs={'custom_contaminants':  tmp_custom_model_files}
-        ).start()
+    expected_sha256 = request.POST.get('sha256', session.sha256).lower()
+    sha256 = session.get_sha256()
+    if expected_sha256 and expected_sha256 != sha256:
+        log.warning("Checksum mismatch for upload " + session.token)
+        session.restart()
+        response_data = {
+            'error': True,
+            'message': 'SHA-256 does not match, upload the file again.',
+            'sha256': sha256,
+            'offset': 0}
+        return response_data
+
+    name = request.POST.get('name') or session.filename
+    job = Job.create(
+        name=name,
+        author=get_author(request),
+        email=get_email(request),
+        confidential=is_confidential(request))
+    log.debug("Job created")
+
+    temp_directory = tempfile.mkdtemp()
+    extension = os.path.splitext(session.filename)[1]
+    tmp_diff_data_file = os.path.join(
+        temp_directory,
+        job.get_filename(suffix=extension))
+    session.take_file(tmp_diff_data_file)
+    tmp_custom_model_files = save_custom_models(request, temp_directory)
+
+    start_job(job, tmp_diff_data_file, contaminants, tmp_custom_model_files)
 
     response_data = {
         'error': False,
-        'id': job.id}
+        'id': job.id,
+        'sha256': sha256}
+    log.debug("Exit")
     return response_data
+
+def newjobs_handler(request):
+    """
+    Interface between a request submitting several files and the Job model.
+
+    Each file of the "diffraction_data" list gives a job. The list of
+    contaminants of the file with index i is given by "contaminants_i", or
+    by "contaminants" (or the checkboxes) for all the files. The name of the
+    job is given by "name_i", or is the file name. The custom models, the
+    confidentiality and the email address are shared by all the jobs.
+    """
+    log = logging.getLogger(__name__)
+    log.debug("Enter")
+
+    diffraction_files = request.FILES.getlist('diffraction_data')
+    if not diffraction_files:
+        response_data = {
+            'error': True,
+            'message': 'Missing diffraction data file.'}
+        return response_data
+
+    if len(diffraction_files) > MAX_BATCH_SUBMISSIONS:
+        response_data = {
+            'error': True,
+            'message': 'Too many files. At most ' \
+                + str(MAX_BATCH_SUBMISSIONS) + ' files can be submitted.'}
+        return response_data
+
+    # Check the files extensions
+    extensions = [os.path.splitext(diffraction_file.name)[1].lower()
+                  for diffraction_file in diffraction_files]
+    if any([extension not in ['.mtz', '.cif'] for extension in extensions]):
+        response_data = {
+            'error': True,
+            'message': 'File format is not CIF or MTZ.'}
+        return response_data
+
+    if has_bad_custom_models(request):
+        response_data = {
+            'error': True,
+            'message': 'Wrong file type given as a custom model.'}
+        return response_data
+
+    user = get_author(request)
+    confidential = is_confidential(request)
+    email = get_email(request)
+
+    # Define the lists of contaminants
+    custom_contaminants = get_custom_contaminants(request)
+    all_contaminants = []
+    for index in range(len(diffraction_files)):
+        key = 'contaminants_' + str(index)
+        if key in request.POST:
+            contaminants = '\n'.join([
+                request.POST[key].replace(',', '\n'),
+                custom_contaminants])
+        else:
+            contaminants = get_contaminants(request)
+        if not contaminants or contaminants == '\n':
+            response_data = {
+                'error': True,
+                'message': 'Missing list of contaminants for file ' \
+                    + str(index)}
+            return response_data
+        all_contaminants.append(contaminants)
+
+    # Create jobs and locally save files
+    temp_directory = tempfile.mkdtemp()
+    submissions = []
+    for index, diffraction_file in enumerate(diffraction_files):
+        name = request.POST.get('name_' + str(index)) \
+            or os.path.basename(diffraction_file.name)
+        job = Job.create(
+            name=name,
+            author=user,
+            email=email,
+            confidential=confidential)
+        tmp_diff_data_file = os.path.join(
+            temp_directory,
+            job.get_filename(suffix=extensions[index]))
+        save_uploaded_file(diffraction_file, tmp_diff_data_file)
+        submissions.append((job, tmp_diff_data_file, all_contaminants[index]))
+    log.debug(str(len(submissions)) + " jobs created")
+
+    tmp_custom_model_files = save_custom_models(request, temp_directory)
+
+    # Submit jobs, or hold them until a cluster can take them
+    if not QueuedSubmission.admit([job for (job, _, _) in submissions]):
+        for (job, tmp_diff_data_file, contaminants) in submissions:
+            QueuedSubmission.hold(
+                job,
+                tmp_diff_data_file,
+                contaminants,
+                tmp_custom_model_files)
+    else:
+        threading.Thread(
+            target=Job.submit_batch,
+            args=(submissions,),
+            kwargs={'custom_contaminants': tmp_custom_model_files}
+            ).start()
+
+    response_data = {
+        'error': False,
+        'ids': [job.id for (job, _, _) in submissions]}
+    log.debug("Exit")
+    return response_data
+
+def is_allowed(request, job):
+    """Return True if the user of the request can see the job."""
+    if not job.confidential:
+        return True
+    return hasattr(request, 'user') and request.user == job.author
+
+def accepts_gzip(accept_encoding):
+    """
+    Return True if the Accept-Encoding header accepts gzip.
+
+    gzip is accepted if it is listed, or matched by "*", with a quality above
+    0: "gzip;q=0" refuses it.
+    :param accept_encoding: value of the Accept-Encoding header
+    """
+    qualities = {}
+    for item in (accept_encoding or '').split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    for coding in ['gzip', 'x-gzip', '*']:
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+def parse_range(range_header, size):
+    """
+    Return the (start, end) byte positions asked in the Range header.
+
+    :param range_header: value of the Range header
+    :param size: size of the requested file
+    :return: (start, end), end included, or None if the header is missing or
+    asks for several ranges (the whole file is then sent)
+    :raise ValueError: if the range cannot be satisfied
+    """
+    if not range_header:
+        return None
+
+    match = RANGE_REGEX.match(range_header.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last bytes of the file
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable: " + str(range_header))
+
+    return (start, end)
+
+def read_range(file_location, start, length):
+    """Yield the length bytes of file_location from start."""
+    with open(file_location, 'rb') as file_obj:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def serve_file(request, file_location, as_attachment=True,
+               content_type=None, content_encoding=None):
+    """
+    Return a response sending file_location, located in MEDIA_ROOT.
+
+    The authorization has to be checked by the caller. If configured, the
+    transfer is handed to the front-end server with X-Sendfile or
+    X-Accel-Redirect. Otherwise, the file is streamed by Django, with support
+    of the Range header.
+    content_encoding is given when sending a compressed copy of the file.
+    """
+    log = logging.getLogger(__name__)
+    log.debug("Enter with arg: " + str(file_location))
+
+    app_config = apps.get_app_config('contaminer')
+    if content_type is None:
+        content_type = mimetypes.guess_type(file_location)[0] \
+            or 'application/octet-stream'
+
+    if app_config.sendfile == 'xsendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = file_location
+    elif app_config.sendfile == 'xaccel':
+        relative_location = os.path.relpath(
+            file_location,
+            settings.MEDIA_ROOT)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = \
+            app_config.sendfile_url + relative_location
+    else:
+        size = os.path.getsize(file_location)
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            log.debug("Range not satisfiable")
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */' + str(size)
+            return response
+
+        if byte_range is None:
+            response = FileResponse(
+                open(file_location, 'rb'),
+                content_type=content_type)
+            response['Content-Length'] = str(size)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                read_range(file_location, start, length),
+                status=206,
+                content_type=content_type)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = 'bytes ' + str(start) + '-' \
+                + str(end) + '/' + str(size)
+        response['Accept-Ranges'] = 'bytes'
+
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+        response['Vary'] = 'Accept-Encoding'
+
+    if as_attachment:
+        response['Content-Disposition'] = 'attachment; filename="' \
+            + os.path.basename(file_location) + '"'
+
+    log.debug("Exit")
+    return response
+
+
+class TimedView(View):
+    """View recording the time to answer each request in the metrics."""
+
+    def dispatch(self, request, *args, **kwargs):
+        """Answer the request, and observe the time spent."""
+        with metrics.VIEW.time(view=self.__class__.__name__):
+            return super(TimedView, self).dispatch(request, *args, **kwargs)